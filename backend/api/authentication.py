@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from api.helpers.cache import token_user_key
+
+# поля пользователя в кеше токенов: без пароля и прочих данных профиля
+TOKEN_USER_FIELDS = [
+    "id",
+    "username",
+    "email",
+    "is_active",
+    "is_staff",
+    "is_superuser",
+]
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication с кешем token => user на AUTH_CACHE_TTL
+
+    В кеше хранятся только TOKEN_USER_FIELDS, пользователь собирается из них
+    без запроса в БД. Кеш сбрасывается сигналами сохранения и удаления токена
+    и пользователя.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = token_user_key(key)
+        fields = cache.get(cache_key)
+        if fields is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related("user").get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_("Invalid token."))
+            fields = {f: getattr(token.user, f) for f in TOKEN_USER_FIELDS}
+            cache.set(cache_key, fields, settings.AUTH_CACHE_TTL)
+        # остальные поля отложены (deferred): загрузятся при обращении,
+        # save() сохранит только поля из кеша
+        model = get_user_model()
+        names = [f.attname for f in model._meta.concrete_fields if f.attname in fields]
+        user = model.from_db(None, names, [fields[name] for name in names])
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+
+        return user, key
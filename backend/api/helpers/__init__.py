@@ -1,2 +1,6 @@
 from .db import fetch_raw_sql, dict_fetchall, execute_sql
 from .update_daily import Update_Daily
+from .update_parsed import Update_Parsed
+from .update_ledger import Update_Ledger
+from .update_rollup import Update_Rollup
+from .update_sku_offer import Update_SkuOffer
@@ -0,0 +1,94 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from mp.models import Shop
+
+
+def user_shops_key(user_id):
+    return f"api_user_shops_{user_id}"
+
+
+def token_user_key(key):
+    return f"api_token_user_{key}"
+
+
+def shop_version_key(shop_id):
+    return f"api_shop_version_{shop_id}"
+
+
+def get_user_shops(user):
+    """Магазины пользователя с названиями, кешируются на AUTH_CACHE_TTL
+
+    Кеш сбрасывается сигналами сохранения и удаления магазинов и ключей API.
+
+    :param user:
+    :return: список словарей id, name, is_active в порядке Shop.Meta.ordering
+    """
+    key = user_shops_key(user.pk)
+    shops = cache.get(key)
+    if shops is None:
+        shops = [
+            {"id": shop.pk, "name": str(shop), "is_active": shop.is_active}
+            for shop in Shop.objects.filter(user=user)
+        ]
+        cache.set(key, shops, settings.AUTH_CACHE_TTL)
+    return shops
+
+
+def get_shop_names(user, shop_ids):
+    """Названия магазинов по ID без отдельного запроса в БД
+
+    Магазины других пользователей (запрос суперпользователя) читаются из БД.
+
+    :param user:
+    :param shop_ids:
+    :return:
+    """
+    names = {shop["id"]: shop["name"] for shop in get_user_shops(user)}
+    missing = [shop_id for shop_id in shop_ids if shop_id not in names]
+    if missing:
+        names.update(
+            {shop.pk: str(shop) for shop in Shop.objects.filter(id__in=missing)}
+        )
+    return [names[shop_id] for shop_id in shop_ids if shop_id in names]
+
+
+def invalidate_user_shops(user_id):
+    if user_id is not None:
+        cache.delete(user_shops_key(user_id))
+
+
+def invalidate_token(key):
+    cache.delete(token_user_key(key))
+
+
+def get_shop_versions(shop_ids):
+    """Версии данных магазинов для ETag отчетов
+
+    Версия - время последнего обновления данных в наносекундах. Если версии
+    нет в кеше (новый магазин, кеш очищен), записывается текущее время, чтобы
+    ETag не совпал с выданным раньше.
+
+    :param shop_ids:
+    :return: список версий в порядке shop_ids
+    """
+    keys = [shop_version_key(shop_id) for shop_id in shop_ids]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        version = time.time_ns()
+        for key in missing:
+            cache.add(key, version, None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+def bump_shop_version(shop_id):
+    """Данные магазина изменились: новая версия, ETag отчетов магазина меняются
+
+    :param shop_id:
+    :return:
+    """
+    cache.set(shop_version_key(shop_id), time.time_ns(), None)
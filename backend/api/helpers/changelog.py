@@ -0,0 +1,64 @@
+from api.models import ChangeLog
+from .db import execute_sql
+
+
+def log_changes_sql(sql, report, date_column, shop_column="shop_id"):
+    """Запрос изменения данных с записью измененных дней в api_changelog
+
+    Запрос выполняется в CTE, дни берутся из RETURNING: для INSERT ... ON
+    CONFLICT DO UPDATE - только вставленные и измененные строки (неизмененные
+    нужно отсечь условием WHERE ... IS DISTINCT FROM), для DELETE - удаленные.
+
+    :param sql: INSERT, UPDATE или DELETE без RETURNING
+    :param report: analytics, transactions
+    :param date_column: колонка дня в таблице запроса
+    :param shop_column: колонка магазина
+    :return: запрос, возвращает измененные дни
+    """
+    sql = sql.strip().rstrip(";")
+    return f"""
+    WITH changed AS (
+        {sql}
+        RETURNING {shop_column} as shop_id, {date_column} as date
+    )
+    INSERT INTO {ChangeLog._meta.db_table} (shop_id, report, date, changed_at)
+    (
+        SELECT shop_id, '{report}', date, clock_timestamp()
+        FROM (
+            SELECT DISTINCT shop_id, date::date as date FROM changed
+            WHERE shop_id IS NOT NULL AND date IS NOT NULL
+        ) d
+        ORDER BY shop_id, date
+    ) ON CONFLICT (shop_id, report, date) DO UPDATE SET
+        changed_at = excluded.changed_at
+    RETURNING date;
+    """
+
+
+def log_changes(shop_id, report, dates):
+    """Запись измененных дней, если данные обновлены не SQL-запросом (ORM)
+
+    :param shop_id:
+    :param report: analytics, transactions
+    :param dates: дни (date или строки YYYY-MM-DD)
+    :return:
+    """
+    if not dates:
+        return
+    sql = f"""
+    INSERT INTO {ChangeLog._meta.db_table} (shop_id, report, date, changed_at)
+    (
+        SELECT %(shop_id)s, %(report)s, d, clock_timestamp()
+        FROM unnest(%(dates)s::date[]) d
+        ORDER BY d
+    ) ON CONFLICT (shop_id, report, date) DO UPDATE SET
+        changed_at = excluded.changed_at;
+    """
+    return execute_sql(
+        sql,
+        params={
+            "shop_id": shop_id,
+            "report": report,
+            "dates": sorted({str(d) for d in dates}),
+        },
+    )
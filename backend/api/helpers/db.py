@@ -1,7 +1,10 @@
 import logging
 
+from django.conf import settings
 from django.db import connection
 
+from ka_space.helpers import SAMPLED, sample_debug
+
 logger = logging.getLogger(__name__)
 
 
@@ -9,7 +12,7 @@ def fetch_raw_sql(sql, params=None, as_dict=True):
     params = params or []
     with connection.cursor() as cursor:
         cursor.execute(sql, params)
-        logger.debug(cursor.query.decode())
+        log_query(cursor)
         if as_dict:
             return dict_fetchall(cursor)
         else:
@@ -26,5 +29,15 @@ def execute_sql(sql, params=None):
     params = params or []
     with connection.cursor() as cursor:
         result = cursor.execute(sql, params)
-        logger.debug(cursor.query.decode())
+        log_query(cursor)
         return result
+
+
+def log_query(cursor):
+    """Пишем в лог выполненный запрос, выборочно и только при уровне DEBUG
+
+    :param cursor:
+    :return:
+    """
+    if sample_debug(logger, settings.LOGGING_DEBUG_SAMPLE_RATE):
+        logger.debug("%s", cursor.query.decode(), extra=SAMPLED)
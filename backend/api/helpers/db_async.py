@@ -0,0 +1,122 @@
+import asyncio
+from functools import lru_cache
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from ka_space.helpers import SAMPLED, sample_debug
+from .db import fetch_raw_sql
+
+logger = logging.getLogger(__name__)
+
+# пул соединений на event loop ASGI-сервера, см. long_lived_loop
+_pools = {}
+
+
+def conninfo():
+    """Строка подключения для psycopg из настроек Django
+
+    :return:
+    """
+    db = settings.DATABASES["default"]
+    parts = {
+        "dbname": db.get("NAME"),
+        "user": db.get("USER"),
+        "password": db.get("PASSWORD"),
+        "host": db.get("HOST"),
+        "port": db.get("PORT"),
+        **db.get("OPTIONS", {}),
+    }
+    return " ".join(f"{k}='{v}'" for k, v in parts.items() if v not in (None, ""))
+
+
+@lru_cache(maxsize=None)
+def psycopg_pool():
+    """Импорт psycopg 3 при первом запросе к пулу, а не при запуске процесса:
+    worker и команды manage.py загружают api.views, но пул не используют
+
+    :return: (AsyncConnectionPool, dict_row) или None, если psycopg 3 не установлен
+    """
+    try:
+        from psycopg.rows import dict_row
+        from psycopg_pool import AsyncConnectionPool
+    except ImportError:
+        return None
+    return AsyncConnectionPool, dict_row
+
+
+def long_lived_loop():
+    """Текущий event loop работает все время жизни процесса
+
+    uvicorn (и gunicorn с uvicorn-worker) выполняет loop в главном потоке
+    процесса. Под WSGI (API_ASYNC=0, runserver) async-view выполняется через
+    async_to_sync: новый loop на каждый запрос в отдельном потоке, пул такого
+    loop оставил бы открытые соединения после запроса.
+
+    :return:
+    """
+    return settings.API_ASYNC and threading.current_thread() is threading.main_thread()
+
+
+async def get_pool():
+    """Пул асинхронных соединений для текущего event loop
+
+    :return: AsyncConnectionPool или None, если psycopg 3 не установлен или
+        loop живет один запрос
+    """
+    if (
+        not settings.API_ASYNC_DB_POOL_SIZE
+        or not long_lived_loop()
+        or psycopg_pool() is None
+    ):
+        return None
+
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        for old_loop in [lp for lp in _pools if lp.is_closed()]:
+            del _pools[old_loop]
+        AsyncConnectionPool, dict_row = psycopg_pool()
+        pool = AsyncConnectionPool(
+            conninfo(),
+            min_size=1,
+            max_size=settings.API_ASYNC_DB_POOL_SIZE,
+            kwargs={"row_factory": dict_row, "autocommit": True},
+            open=False,
+        )
+        await pool.open()
+        _pools[loop] = pool
+    return pool
+
+
+async def async_fetch_raw_sql(sql, params=None):
+    """Асинхронный аналог fetch_raw_sql, строки возвращаются словарями
+
+    Запросы разных пользователей выполняются параллельно на своих соединениях
+    и не блокируют event loop. Параметры передаются на сервер отдельно
+    (server-side binding), поэтому списки сравниваются через = ANY(...),
+    а даты и интервалы приводятся явно: %(before)s::date.
+    Без psycopg 3 и без постоянного loop (WSGI) запрос выполняется через
+    fetch_raw_sql в отдельном потоке.
+
+    :param sql:
+    :param params:
+    :return:
+    """
+    params = params or {}
+    pool = await get_pool()
+    if pool is None:
+        # под WSGI - в потоке запроса: его соединение Django освобождается
+        # по окончании запроса, потоки loop запроса остались бы с соединениями
+        thread_sensitive = not long_lived_loop()
+        return await sync_to_async(fetch_raw_sql, thread_sensitive=thread_sensitive)(
+            sql, params
+        )
+
+    async with pool.connection() as conn:
+        cursor = await conn.execute(sql, params)
+        if sample_debug(logger, settings.LOGGING_DEBUG_SAMPLE_RATE):
+            logger.debug("%s %s", sql, params, extra=SAMPLED)
+        return await cursor.fetchall()
@@ -0,0 +1,167 @@
+import logging
+import re
+import tempfile
+
+from django.db import connection, ProgrammingError
+
+logger = logging.getLogger(__name__)
+
+# pyarrow (вместе с numpy ~100 мс) импортируется при первой выгрузке,
+# а не при запуске web и worker, см. load_pyarrow
+pa = None
+pq = None
+
+EXPORT_BATCH_ROWS = 50000
+# выгрузка собирается во временном файле: в памяти до 32 Мб, дальше на диске
+EXPORT_SPOOL_SIZE = 32 * 1024 * 1024
+
+EXPORT_FORMATS = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+COLUMN_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+# OID типов PostgreSQL, остальные типы выгружаются строками
+PG_INT = {20, 21, 23}
+PG_FLOAT = {700, 701, 1700}
+PG_BOOL = 16
+PG_DATE = 1082
+PG_TIMESTAMP = 1114
+PG_TIMESTAMPTZ = 1184
+
+
+class ErrorExport(Exception):
+    pass
+
+
+def load_pyarrow():
+    """Импорт pyarrow при первой выгрузке
+
+    :return: False, если pyarrow не установлен
+    """
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+
+def arrow_type(type_code):
+    if type_code in PG_INT:
+        return pa.int64()
+    if type_code in PG_FLOAT:
+        return pa.float64()
+    if type_code == PG_BOOL:
+        return pa.bool_()
+    if type_code == PG_DATE:
+        return pa.date32()
+    if type_code == PG_TIMESTAMP:
+        return pa.timestamp("us")
+    if type_code == PG_TIMESTAMPTZ:
+        return pa.timestamp("us", tz="UTC")
+    return pa.string()
+
+
+def arrow_array(values, type_):
+    if pa.types.is_floating(type_):
+        values = [None if v is None else float(v) for v in values]
+    elif pa.types.is_string(type_):
+        values = [None if v is None else str(v) for v in values]
+    return pa.array(values, type=type_)
+
+
+def select_columns(sql, columns=None):
+    """Только выбранные колонки запроса отчета
+
+    Запрос оборачивается подзапросом, неиспользуемые выражения PostgreSQL
+    из подзапроса убирает сам.
+
+    :param sql: запрос отчета
+    :param columns: названия колонок результата
+    :return: запрос
+    """
+    if not columns:
+        return sql
+    for column in columns:
+        if not COLUMN_RE.match(column):
+            raise ErrorExport(f"Неверное название колонки: {column}")
+    sql = sql.strip().rstrip(";")
+    return (
+        f"SELECT {', '.join(connection.ops.quote_name(c) for c in columns)} "
+        f"FROM ({sql}) q"
+    )
+
+
+def write_export(file, sql, params=None, fmt="parquet", batch_rows=EXPORT_BATCH_ROWS):
+    """Результат запроса в Parquet или Arrow IPC stream пачками по batch_rows строк
+
+    Строки читаются курсором на стороне сервера, в памяти только одна пачка.
+    Типы колонок берутся из описания результата, numeric - float64.
+
+    :param file: файл для записи
+    :param sql:
+    :param params:
+    :param fmt: parquet, arrow
+    :param batch_rows:
+    :return: число строк
+    """
+    if not load_pyarrow():
+        raise ErrorExport("Для выгрузки Parquet/Arrow нужен пакет pyarrow")
+    if fmt not in EXPORT_FORMATS:
+        raise ErrorExport(f"Неизвестный формат: {fmt}")
+
+    total_rows = 0
+    with connection.chunked_cursor() as cursor:
+        try:
+            cursor.execute(sql, params or {})
+            # у курсора на стороне сервера описание колонок есть после первой пачки
+            rows = cursor.fetchmany(batch_rows)
+        except ProgrammingError as e:
+            # например, неизвестная колонка в columns
+            raise ErrorExport(str(e).splitlines()[0])
+        schema = pa.schema(
+            [(col.name, arrow_type(col.type_code)) for col in cursor.description]
+        )
+        if fmt == "parquet":
+            writer = pq.ParquetWriter(file, schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_stream(file, schema)
+        try:
+            while rows:
+                columns = list(zip(*rows))
+                batch = pa.RecordBatch.from_arrays(
+                    [
+                        arrow_array(values, field.type)
+                        for values, field in zip(columns, schema)
+                    ],
+                    schema=schema,
+                )
+                writer.write_batch(batch)
+                total_rows += len(rows)
+                rows = cursor.fetchmany(batch_rows)
+        finally:
+            writer.close()
+    return total_rows
+
+
+def export_file(sql, params=None, fmt="parquet"):
+    """Выгрузка во временный файл
+
+    :param sql:
+    :param params:
+    :param fmt: parquet, arrow
+    :return: файл, открытый с начала, и число строк
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    try:
+        rows = write_export(file, sql, params, fmt)
+    except Exception:
+        file.close()
+        raise
+    file.seek(0)
+    return file, rows
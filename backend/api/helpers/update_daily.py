@@ -1,13 +1,22 @@
 from api.models import Daily
-from . import execute_sql
+from . import fetch_raw_sql
+from .changelog import log_changes_sql
+
+DAILY = Daily._meta.db_table
 
 
 class Update_Daily(object):
+    """Пересчет api_daily из данных магазина
+
+    Обновляются только изменившиеся строки, их дни записываются в api_changelog
+    (отчет analytics) и возвращаются, по ним пересчитываются итоги Update_Rollup.
+    """
+
     @staticmethod
     def stocks(params=None):
         params = params or []
         sql = f"""
-        INSERT INTO {Daily.objects.model._meta.db_table}
+        INSERT INTO {DAILY}
         (date, sku, stocks, shop_id)
         (
             SELECT 
@@ -22,16 +31,17 @@ class Update_Daily(object):
                 AND moso.sku > 0
             WHERE mos.shop_id = %(shop_id)s
         ) ON CONFLICT (shop_id, date, sku) DO UPDATE SET 
-            stocks = excluded.stocks;
+            stocks = excluded.stocks
+        WHERE {DAILY}.stocks IS DISTINCT FROM excluded.stocks;
         """
 
-        return execute_sql(sql, params=params)
+        return changed_dates(sql, params)
 
     @staticmethod
     def transactions(params=None):
         params = params or []
         sql = f"""
-        INSERT INTO {Daily.objects.model._meta.db_table}
+        INSERT INTO {DAILY}
         (date, sku, premium, rassrochka, shop_id)
         (
             SELECT 
@@ -46,41 +56,65 @@ class Update_Daily(object):
             GROUP BY mot.operation_date, mot.sku, mot.shop_id
         ) ON CONFLICT (shop_id, date, sku) DO UPDATE SET 
             premium = excluded.premium,
-            rassrochka = excluded.rassrochka;
+            rassrochka = excluded.rassrochka
+        WHERE ({DAILY}.premium, {DAILY}.rassrochka)
+            IS DISTINCT FROM (excluded.premium, excluded.rassrochka);
         """
 
-        return execute_sql(sql, params=params)
+        return changed_dates(sql, params)
 
     @staticmethod
     def orders(params=None):
+        """Самовыкупы по дням из найденных отправлений
+
+        Дни и SKU без самовыкупов (самовыкуп удален или найден другой заказ)
+        обнуляются.
+
+        :param params: shop_id, dates - только эти дни
+        :return: измененные дни
+        """
         params = params or []
         sql = f"""
-        INSERT INTO {Daily.objects.model._meta.db_table}
+        INSERT INTO {DAILY}
         (date, sku, selfbuy_cnt, selfbuy_amount, shop_id)
         (
-            SELECT 
-                date(mof.created_at) as order_at,
-                mofp.sku,  
-                SUM(mofp.quantity) as selfbuy_cnt, 
-                SUM(mofp.quantity * mofp.price) as selfbuy_amount,
-                mof.shop_id
-            FROM mp_ozon_fbo mof
-            INNER JOIN mp_ozon_fbo_product mofp ON mof.id = mofp.order_id
-            INNER JOIN mp_selfbuy ms ON ms.shop_id = mof.shop_id AND (mof.order_number = ms.order OR mof.posting_number = ms.order)
-            WHERE mof.shop_id = %(shop_id)s
-            GROUP BY date(mof.created_at), mofp.sku, mof.shop_id
+            WITH selfbuys AS (
+                SELECT 
+                    msm.order_date as order_at,
+                    mofp.sku,  
+                    SUM(mofp.quantity) as selfbuy_cnt, 
+                    SUM(mofp.quantity * mofp.price) as selfbuy_amount,
+                    msm.shop_id
+                FROM mp_selfbuymatch msm
+                INNER JOIN mp_ozon_fbo_product mofp ON msm.fbo_id = mofp.order_id
+                WHERE msm.shop_id = %(shop_id)s
+                    {'AND msm.order_date = ANY(%(dates)s)' if 'dates' in params else ''}
+                GROUP BY msm.order_date, mofp.sku, msm.shop_id
+            )
+            SELECT * FROM selfbuys
+            UNION ALL
+            SELECT ad.date, ad.sku, 0, 0, ad.shop_id
+            FROM {DAILY} ad
+            WHERE ad.shop_id = %(shop_id)s
+                {'AND ad.date = ANY(%(dates)s)' if 'dates' in params else ''}
+                AND (ad.selfbuy_cnt <> 0 OR ad.selfbuy_amount <> 0)
+                AND NOT EXISTS (
+                    SELECT 1 FROM selfbuys s WHERE s.order_at = ad.date AND s.sku = ad.sku
+                )
         ) ON CONFLICT (shop_id, date, sku) DO UPDATE SET 
             selfbuy_cnt = excluded.selfbuy_cnt,
-            selfbuy_amount = excluded.selfbuy_amount;
+            selfbuy_amount = excluded.selfbuy_amount
+        WHERE ({DAILY}.selfbuy_cnt, {DAILY}.selfbuy_amount)
+            IS DISTINCT FROM (excluded.selfbuy_cnt, excluded.selfbuy_amount);
         """
 
-        return execute_sql(sql, params=params)
+        return changed_dates(sql, params)
 
     @staticmethod
     def campaigns(params=None):
         params = params or []
         sql = f"""
-            INSERT INTO {Daily.objects.model._meta.db_table}
+            INSERT INTO {DAILY}
             (date, sku, adv_promo_bid, adv_promo_visibility, shop_id)
             (
                 SELECT 
@@ -96,7 +130,22 @@ class Update_Daily(object):
                 GROUP BY date, moso.sku, moc.shop_id
             ) ON CONFLICT (shop_id, date, sku) DO UPDATE SET 
                 adv_promo_bid = excluded.adv_promo_bid,
-                adv_promo_visibility = excluded.adv_promo_visibility;
+                adv_promo_visibility = excluded.adv_promo_visibility
+            WHERE ({DAILY}.adv_promo_bid, {DAILY}.adv_promo_visibility)
+                IS DISTINCT FROM (excluded.adv_promo_bid, excluded.adv_promo_visibility);
         """
 
-        return execute_sql(sql, params=params)
+        return changed_dates(sql, params)
+
+
+def changed_dates(sql, params):
+    """Выполнение запроса пересчета с записью измененных дней в api_changelog
+
+    :param sql:
+    :param params:
+    :return: измененные дни
+    """
+    rows = fetch_raw_sql(
+        log_changes_sql(sql, "analytics", "date"), params=params, as_dict=False
+    )
+    return sorted(row[0] for row in rows)
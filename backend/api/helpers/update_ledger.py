@@ -0,0 +1,248 @@
+from api.models import Ledger, ParsedFBO, ParsedFBOProduct, ParsedTransaction
+from . import execute_sql
+from .changelog import log_changes_sql
+
+LEDGER_FIELDS = [
+    "shop_id",
+    "transaction_id",
+    "fbo_id",
+    "product_id",
+    "posting_number",
+    "sku",
+    "offer_id",
+    "operation_type",
+    "operation_type_name",
+    "type",
+    "basis",
+    "status",
+    "order_date",
+    "operation_date",
+    "quantity",
+    "price",
+    "comission",
+    "fulfillment",
+    "direct_flow_trans",
+    "deliv_to_customer",
+    "calc_revenue",
+    "calc_payment",
+    "sale_commission",
+    "services_amount",
+    "delivery_type",
+    "warehouse",
+    "region",
+    "city",
+    "filter_date",
+    "sort_date",
+    "query",
+]
+
+
+class Update_Ledger(object):
+    """Пересчет строк api_ledger для отчета по транзакциям
+
+    Строки пересчитываются целиком по затронутым отправлениям и транзакциям:
+    удаляем старые и вставляем заново. Разобранные JSON-поля должны быть
+    обновлены до вызова (Update_Parsed). Дни измененных строк магазина
+    записываются в api_changelog (отчет transactions).
+    """
+
+    @staticmethod
+    def postings(params=None):
+        """Пересчет строк по отправлениям и транзакциям
+
+        Без списков пересчитываются все строки магазина (или все строки
+        вообще, если нет и shop_id) - так заполняется таблица командой
+        manage.py update_ledger.
+
+        :param params: shop_id, posting_numbers, operation_ids
+        :return:
+        """
+        params = params or {}
+        keyed = "posting_numbers" in params or "operation_ids" in params
+        params = {"posting_numbers": [], "operation_ids": [], **params}
+
+        shop = "{alias}.shop_id = %(shop_id)s" if params.get("shop_id") else "TRUE"
+        ledger_where = shop.format(alias="l")
+        transaction_where = shop.format(alias="mot")
+        fbo_where = shop.format(alias="mof")
+        if keyed:
+            ledger_where += f"""
+                AND (l.posting_number = ANY(%(posting_numbers)s) OR l.transaction_id = ANY(ARRAY(
+                    SELECT mot.id FROM mp_ozon_transaction mot
+                    WHERE {transaction_where} AND mot.operation_id = ANY(%(operation_ids)s)
+                )))
+            """
+            transaction_where += """
+                AND (mot.posting_number = ANY(%(posting_numbers)s)
+                    OR mot.operation_id = ANY(%(operation_ids)s))
+            """
+            fbo_where += " AND mof.posting_number = ANY(%(posting_numbers)s)"
+
+        delete_sql = f"""
+        DELETE FROM {Ledger._meta.db_table} l WHERE {ledger_where}
+        """
+
+        transactions_sql = f"""
+        INSERT INTO {Ledger._meta.db_table}
+        ({', '.join(LEDGER_FIELDS)})
+        (
+            SELECT
+                mot.shop_id,
+                mot.id,
+                mof.id,
+                COALESCE(mop.id, mops.id),
+                CASE WHEN mot.posting_number is not null THEN mot.posting_number ELSE mof.posting_number END,
+                CASE WHEN mofp.sku is not null THEN mofp.sku ELSE mot.sku END,
+                COALESCE(mop.offer_id, mops.offer_id),
+                mot.operation_type,
+                mot.operation_type_name,
+                mot.type,
+                CASE WHEN mof.posting_number is null THEN pt.item_name ELSE mot.operation_type_name END,
+                mof.status,
+                mof.created_at,
+                mot.operation_date,
+                CASE WHEN mofp.quantity is not null THEN mofp.quantity
+                    WHEN mot.type = 'compensation' THEN pt.items_cnt END,
+                mofp.price,
+                mofp.quantity * mofp.commission_amount,
+                CASE WHEN pfp.fulfillment = 0 AND mot.sku_cnt = 1
+                    THEN (mot.services_amount - pfp.deliv_to_customer)
+                    ELSE pfp.fulfillment END,
+                pfp.direct_flow_trans,
+                pfp.deliv_to_customer,
+                CASE WHEN mot.sku_cnt > 1 AND mot.operation_type = 'OperationAgentDeliveredToCustomer'
+                    THEN mofp.quantity * mofp.price ELSE mot.accruals_for_sale END,
+                CASE WHEN mot.sku_cnt > 1 AND mot.operation_type = 'OperationAgentDeliveredToCustomer'
+                    THEN mofp.quantity * mofp.price - mofp.quantity * mofp.commission_amount
+                        + pfp.fulfillment + pfp.direct_flow_trans + pfp.deliv_to_customer
+                    ELSE mot.amount END,
+                mot.sale_commission,
+                mot.services_amount,
+                pf.delivery_type,
+                pf.warehouse,
+                pf.region,
+                pf.city,
+                DATE(mot.operation_date),
+                CASE WHEN mof.created_at IS NOT NULL THEN mof.created_at ELSE mot.operation_date END,
+                1
+            FROM mp_ozon_transaction mot
+            LEFT JOIN mp_ozon_fbo mof ON mot.shop_id = mof.shop_id AND mot.type = 'orders'
+                AND mot.posting_number = mof.posting_number
+            LEFT JOIN mp_ozon_fbo_product mofp ON mofp.order_id = mof.id
+            LEFT JOIN mp_ozon_product mop ON mop.id = mofp.product_id
+            LEFT JOIN mp_ozon_product mops ON mop.id IS NULL AND mot.sku > 0 AND mops.fbo_sku = mot.sku
+            LEFT JOIN {ParsedTransaction._meta.db_table} pt ON pt.transaction_id = mot.id
+            LEFT JOIN {ParsedFBO._meta.db_table} pf ON pf.fbo_id = mof.id
+            LEFT JOIN {ParsedFBOProduct._meta.db_table} pfp ON pfp.fbo_product_id = mofp.id
+            WHERE {transaction_where}
+        )
+        """
+
+        fbo_sql = f"""
+        INSERT INTO {Ledger._meta.db_table}
+        ({', '.join(LEDGER_FIELDS)})
+        (
+            SELECT
+                mof.shop_id,
+                null,
+                mof.id,
+                mop.id,
+                mof.posting_number,
+                mofp.sku,
+                mop.offer_id,
+                null,
+                null,
+                null,
+                null,
+                mof.status,
+                mof.created_at,
+                null,
+                mofp.quantity,
+                mofp.price,
+                mofp.quantity * mofp.commission_amount,
+                pfp.fulfillment,
+                pfp.direct_flow_trans,
+                pfp.deliv_to_customer,
+                null,
+                null,
+                null,
+                null,
+                null,
+                null,
+                null,
+                null,
+                DATE(mof.created_at),
+                mof.created_at,
+                2
+            FROM mp_ozon_fbo mof
+            LEFT JOIN mp_ozon_fbo_product mofp ON mofp.order_id = mof.id
+            LEFT JOIN mp_ozon_product mop ON mop.id = mofp.product_id
+            LEFT JOIN {ParsedFBOProduct._meta.db_table} pfp ON pfp.fbo_product_id = mofp.id
+            WHERE {fbo_where}
+                AND NOT EXISTS (
+                    SELECT 1 FROM mp_ozon_transaction mot
+                    WHERE mot.shop_id = mof.shop_id AND mot.posting_number = mof.posting_number
+                )
+        )
+        """
+
+        statements = [delete_sql, transactions_sql, fbo_sql]
+        if params.get("shop_id"):
+            # дни удаленных и вставленных строк - в api_changelog
+            statements = [
+                log_changes_sql(sql, "transactions", "filter_date")
+                for sql in statements
+            ]
+        sql = ";\n".join(sql.strip().rstrip(";") for sql in statements) + ";"
+
+        return execute_sql(sql, params=params)
+
+    @staticmethod
+    def offers(params=None):
+        """Товары и артикулы в строках после изменения товаров
+
+        У связанных строк обновляется артикул. Строки без товара (записаны до
+        загрузки товара) связываются с товаром позиции отправления, а
+        транзакции без позиции - с товаром по FBO SKU, как в postings.
+
+        :param params: shop_id, product_ids
+        :return:
+        """
+        params = params or {}
+        sql = f"""
+        UPDATE {Ledger._meta.db_table} l SET
+            product_id = c.product_id,
+            offer_id = c.offer_id
+        FROM (
+            SELECT DISTINCT ON (c.ledger_id) c.ledger_id, c.product_id, c.offer_id
+            FROM (
+                SELECT lp.id as ledger_id, mop.id as product_id, mop.offer_id, 1 as priority
+                FROM {Ledger._meta.db_table} lp
+                INNER JOIN mp_ozon_product mop ON mop.id = lp.product_id
+                WHERE lp.shop_id = %(shop_id)s AND mop.id = ANY(%(product_ids)s)
+                UNION ALL
+                SELECT lp.id, mop.id, mop.offer_id, 2
+                FROM {Ledger._meta.db_table} lp
+                INNER JOIN mp_ozon_fbo_product mofp
+                    ON mofp.order_id = lp.fbo_id AND mofp.sku = lp.sku
+                INNER JOIN mp_ozon_product mop ON mop.id = mofp.product_id
+                WHERE lp.shop_id = %(shop_id)s AND lp.product_id IS NULL
+                    AND mop.id = ANY(%(product_ids)s)
+                UNION ALL
+                SELECT lp.id, mop.id, mop.offer_id, 3
+                FROM {Ledger._meta.db_table} lp
+                INNER JOIN mp_ozon_product mop ON mop.fbo_sku = lp.sku
+                WHERE lp.shop_id = %(shop_id)s AND lp.product_id IS NULL
+                    AND lp.transaction_id IS NOT NULL AND lp.sku > 0
+                    AND mop.id = ANY(%(product_ids)s)
+            ) c
+            ORDER BY c.ledger_id, c.priority, c.product_id
+        ) c
+        WHERE l.id = c.ledger_id
+            AND (l.product_id, l.offer_id) IS DISTINCT FROM (c.product_id, c.offer_id)
+        """
+
+        return execute_sql(
+            log_changes_sql(sql, "transactions", "l.filter_date", "l.shop_id"),
+            params=params,
+        )
@@ -0,0 +1,184 @@
+from api.models import ParsedFBO, ParsedFBOProduct, ParsedTransaction, ParsedProduct
+from . import execute_sql
+
+
+def parsed_where(alias, params, keys):
+    """Условия отбора строк для разбора
+
+    Без shop_id разбираются строки всех магазинов, без списка ключей - все
+    строки магазина (manage.py update_parsed).
+
+    :param alias: псевдоним исходной таблицы
+    :param params: shop_id и необязательный список ключей
+    :param keys: словарь параметр => поле исходной таблицы
+    :return:
+    """
+    where = ["TRUE"]
+    if params.get("shop_id"):
+        where.append(f"{alias}.shop_id = %(shop_id)s")
+    for param, field in keys.items():
+        if params.get(param) is not None:
+            where.append(f"{alias}.{field} = ANY(%({param})s)")
+    return " AND ".join(where)
+
+
+class Update_Parsed(object):
+    """Разбор текстовых JSON-полей mp_ozon в типизированные колонки
+
+    Вызывается задачами синхронизации сразу после записи данных, чтобы
+    запросы API не разбирали JSON в каждой строке.
+    """
+
+    @staticmethod
+    def orders(params=None):
+        params = params or {}
+        where = parsed_where("mof", params, {"posting_numbers": "posting_number"})
+        sql = f"""
+        INSERT INTO {ParsedFBO._meta.db_table}
+        (fbo_id, delivery_type, warehouse, region, city, shop_id)
+        (
+            SELECT
+                mof.id,
+                d.data->>'delivery_type',
+                d.data->>'warehouse_name',
+                d.data->>'region',
+                d.data->>'city',
+                mof.shop_id
+            FROM mp_ozon_fbo mof,
+            LATERAL (SELECT NULLIF(mof.analytics_data, '')::jsonb as data) d
+            WHERE {where}
+        ) ON CONFLICT (fbo_id) DO UPDATE SET
+            delivery_type = excluded.delivery_type,
+            warehouse = excluded.warehouse,
+            region = excluded.region,
+            city = excluded.city,
+            shop_id = excluded.shop_id;
+
+        INSERT INTO {ParsedFBOProduct._meta.db_table}
+        (fbo_product_id, fulfillment, direct_flow_trans, deliv_to_customer, shop_id)
+        (
+            SELECT
+                mofp.id,
+                (s.data->>'marketplace_service_item_fulfillment')::numeric,
+                (s.data->>'marketplace_service_item_direct_flow_trans')::numeric,
+                (s.data->>'marketplace_service_item_deliv_to_customer')::numeric,
+                mof.shop_id
+            FROM mp_ozon_fbo mof
+            INNER JOIN mp_ozon_fbo_product mofp ON mofp.order_id = mof.id,
+            LATERAL (SELECT NULLIF(mofp.item_services, '')::jsonb as data) s
+            WHERE {where}
+        ) ON CONFLICT (fbo_product_id) DO UPDATE SET
+            fulfillment = excluded.fulfillment,
+            direct_flow_trans = excluded.direct_flow_trans,
+            deliv_to_customer = excluded.deliv_to_customer,
+            shop_id = excluded.shop_id;
+        """
+
+        return execute_sql(sql, params=params)
+
+    @staticmethod
+    def transactions(params=None):
+        params = params or {}
+        where = parsed_where("mot", params, {"operation_ids": "operation_id"})
+        sql = f"""
+        INSERT INTO {ParsedTransaction._meta.db_table}
+        (transaction_id, items_cnt, item_name, shop_id)
+        (
+            SELECT
+                mot.id,
+                jsonb_array_length(i.data),
+                i.data->0->>'name',
+                mot.shop_id
+            FROM mp_ozon_transaction mot,
+            LATERAL (SELECT NULLIF(mot.items, '')::jsonb as data) i
+            WHERE {where}
+        ) ON CONFLICT (transaction_id) DO UPDATE SET
+            items_cnt = excluded.items_cnt,
+            item_name = excluded.item_name,
+            shop_id = excluded.shop_id;
+        """
+
+        return execute_sql(sql, params=params)
+
+    @staticmethod
+    def products(params=None):
+        params = params or {}
+        where = parsed_where("mop", params, {"product_ids": "id"})
+        sql = f"""
+        INSERT INTO {ParsedProduct._meta.db_table}
+        (
+            product_id, images_cnt, images360_cnt, action_cnt, sales_percent,
+            fbo_amount, fbo_return_amount, fbs_amount, fbs_return_amount, shop_id
+        )
+        (
+            SELECT
+                mop.id,
+                json_array_length(mop.images::json),
+                json_array_length(mop.images360::json),
+                json_array_length(mop.marketing_actions::json->'actions'),
+                (c.data->>'sales_percent')::float,
+                (c.data->>'fbo_fulfillment_amount')::float
+                + (c.data->>'fbo_direct_flow_trans_max_amount')::float
+                + (c.data->>'fbo_deliv_to_customer_amount')::float,
+                (c.data->>'fbo_return_flow_amount')::float
+                + (c.data->>'fbo_return_flow_trans_max_amount')::float,
+                (c.data->>'fbs_first_mile_max_amount')::float
+                + (c.data->>'fbs_direct_flow_trans_max_amount')::float
+                + (c.data->>'fbs_deliv_to_customer_amount')::float,
+                (c.data->>'fbs_return_flow_amount')::float
+                + (c.data->>'fbs_return_flow_trans_max_amount')::float,
+                mop.shop_id
+            FROM mp_ozon_product mop,
+            LATERAL (SELECT NULLIF(mop.commissions, '')::jsonb as data) c
+            WHERE {where}
+        ) ON CONFLICT (product_id) DO UPDATE SET
+            images_cnt = excluded.images_cnt,
+            images360_cnt = excluded.images360_cnt,
+            action_cnt = excluded.action_cnt,
+            sales_percent = excluded.sales_percent,
+            fbo_amount = excluded.fbo_amount,
+            fbo_return_amount = excluded.fbo_return_amount,
+            fbs_amount = excluded.fbs_amount,
+            fbs_return_amount = excluded.fbs_return_amount,
+            shop_id = excluded.shop_id;
+        """
+
+        return execute_sql(sql, params=params)
+
+    @staticmethod
+    def remove(params=None):
+        """Удаляем разобранные строки удаленных товаров и товаров заказов
+
+        Вызывается там же, где удаляются исходные строки. Товар может быть
+        удален вместе с товарами заказов (каскадом), поэтому при удалении
+        товаров проверяются все разобранные товары заказов магазина.
+
+        :param params: shop_id, product_ids - удаленные товары,
+            fbo_product_ids - удаленные товары заказов FBO
+        :return:
+        """
+        params = params or {}
+        sql = []
+        if params.get("product_ids"):
+            sql.append(
+                f"""
+                DELETE FROM {ParsedProduct._meta.db_table}
+                WHERE product_id = ANY(%(product_ids)s);
+
+                DELETE FROM {ParsedFBOProduct._meta.db_table} p
+                WHERE p.shop_id = %(shop_id)s AND NOT EXISTS (
+                    SELECT 1 FROM mp_ozon_fbo_product mofp WHERE mofp.id = p.fbo_product_id
+                );
+                """
+            )
+        if params.get("fbo_product_ids"):
+            sql.append(
+                f"""
+                DELETE FROM {ParsedFBOProduct._meta.db_table}
+                WHERE fbo_product_id = ANY(%(fbo_product_ids)s);
+                """
+            )
+        if not sql:
+            return
+
+        return execute_sql("".join(sql), params=params)
@@ -0,0 +1,215 @@
+from django.db import transaction
+
+from api.models import AnalyticsRollup, DailyRollup, AdvertizingRollup, Daily
+from . import execute_sql
+
+ROLLUP_PERIODS = "(VALUES ('week'), ('month')) g(granularity)"
+
+ANALYTICS_SUMS = [
+    "session_view",
+    "session_view_pdp",
+    "session_view_search",
+    "hits_tocart",
+    "hits_tocart_pdp",
+    "hits_tocart_search",
+    "hits_view",
+    "hits_view_pdp",
+    "hits_view_search",
+    "returns",
+    "cancellations",
+    "delivered_units",
+    "ordered_units",
+    "revenue",
+    "adv_sum_all",
+    "adv_view_all",
+    "adv_view_pdp",
+    "adv_view_search_category",
+    "postings",
+    "postings_premium",
+]
+
+
+def period_sql(column):
+    return f"date_trunc(g.granularity, {column}::timestamp)::date"
+
+
+def period_filter(column, params):
+    """Только недели и месяцы, в которые попал период date_from..date_to
+
+    Без date_from пересчитывается вся история магазина.
+
+    :param column: колонка даты
+    :param params:
+    :return: условие WHERE
+    """
+    if not params.get("date_from"):
+        return ""
+    date_from = "%(date_from)s::timestamp"
+    date_to = "COALESCE(%(date_to)s, CURRENT_DATE)::timestamp"
+    return f"""
+        AND {column} >= LEAST(date_trunc('week', {date_from}), date_trunc('month', {date_from}))
+        AND {column} < GREATEST(date_trunc('week', {date_to}) + interval '1 week',
+                                date_trunc('month', {date_to}) + interval '1 month')
+        AND {period_sql(column)} BETWEEN date_trunc(g.granularity, {date_from})::date
+            AND date_trunc(g.granularity, {date_to})::date
+    """
+
+
+def delete_periods_sql(model, params):
+    """Удаление итогов пересчитываемых периодов
+
+    Итоги вставляются с обновлением, без удаления в периоде остались бы
+    строки SKU и кампаний, данных которых в нем больше нет.
+
+    :param model: модель итогов
+    :param params:
+    :return: запрос
+    """
+    sql = f"DELETE FROM {model._meta.db_table} r WHERE r.shop_id = %(shop_id)s"
+    if not params.get("date_from"):
+        return sql
+    return f"""{sql}
+        AND r.period BETWEEN date_trunc(r.granularity, %(date_from)s::timestamp)::date
+            AND date_trunc(r.granularity, COALESCE(%(date_to)s, CURRENT_DATE)::timestamp)::date
+    """
+
+
+def execute_rollup(model, sql, params):
+    """Пересчет итогов периодов в одной транзакции: удаление и вставка
+
+    :param model: модель итогов
+    :param sql: запрос вставки итогов
+    :param params:
+    :return:
+    """
+    with transaction.atomic():
+        execute_sql(delete_periods_sql(model, params), params=params)
+        return execute_sql(sql, params=params)
+
+
+def rollup_params(params):
+    params = dict(params or {})
+    params.setdefault("date_from", None)
+    params.setdefault("date_to", None)
+    return params
+
+
+class Update_Rollup(object):
+    """Недельные и месячные итоги аналитики, api_daily и статистики рекламы
+
+    params: shop_id, date_from и date_to - загруженные дни, пересчитываются
+    только периоды с ними. Итоги периодов удаляются и вставляются заново.
+    """
+
+    @staticmethod
+    def analytics(params=None):
+        params = rollup_params(params)
+        sql = f"""
+        INSERT INTO {AnalyticsRollup._meta.db_table}
+        (granularity, period, sku, days, {', '.join(ANALYTICS_SUMS)}, position_category, shop_id)
+        (
+            SELECT
+                g.granularity,
+                {period_sql('moa.date')} as period,
+                moa.sku,
+                COUNT(*) as days,
+                {', '.join(f'COALESCE(SUM(moa.{f}), 0)' for f in ANALYTICS_SUMS)},
+                AVG(NULLIF(moa.position_category, 0)),
+                moa.shop_id
+            FROM mp_ozon_analytics moa
+            CROSS JOIN {ROLLUP_PERIODS}
+            WHERE moa.shop_id = %(shop_id)s {period_filter('moa.date', params)}
+            GROUP BY g.granularity, period, moa.sku, moa.shop_id
+        ) ON CONFLICT (shop_id, granularity, period, sku) DO UPDATE SET
+            days = excluded.days,
+            {', '.join(f'{f} = excluded.{f}' for f in ANALYTICS_SUMS)},
+            position_category = excluded.position_category;
+        """
+
+        return execute_rollup(AnalyticsRollup, sql, params)
+
+    @staticmethod
+    def daily(params=None):
+        params = rollup_params(params)
+        sql = f"""
+        INSERT INTO {DailyRollup._meta.db_table}
+        (granularity, period, sku, stocks, selfbuy_cnt, selfbuy_amount, premium, rassrochka,
+         adv_promo_bid, adv_promo_visibility, shop_id)
+        (
+            SELECT
+                g.granularity,
+                {period_sql('ad.date')} as period,
+                ad.sku,
+                (ARRAY_AGG(ad.stocks ORDER BY ad.date DESC) FILTER (WHERE ad.stocks IS NOT NULL))[1],
+                COALESCE(SUM(ad.selfbuy_cnt), 0),
+                COALESCE(SUM(ad.selfbuy_amount), 0),
+                COALESCE(SUM(ad.premium), 0),
+                COALESCE(SUM(ad.rassrochka), 0),
+                AVG(NULLIF(ad.adv_promo_bid, 0)),
+                ROUND(AVG(NULLIF(ad.adv_promo_visibility, 0))),
+                ad.shop_id
+            FROM {Daily._meta.db_table} ad
+            CROSS JOIN {ROLLUP_PERIODS}
+            WHERE ad.shop_id = %(shop_id)s AND ad.sku IS NOT NULL
+                {period_filter('ad.date', params)}
+            GROUP BY g.granularity, period, ad.sku, ad.shop_id
+        ) ON CONFLICT (shop_id, granularity, period, sku) DO UPDATE SET
+            stocks = excluded.stocks,
+            selfbuy_cnt = excluded.selfbuy_cnt,
+            selfbuy_amount = excluded.selfbuy_amount,
+            premium = excluded.premium,
+            rassrochka = excluded.rassrochka,
+            adv_promo_bid = excluded.adv_promo_bid,
+            adv_promo_visibility = excluded.adv_promo_visibility;
+        """
+
+        return execute_rollup(DailyRollup, sql, params)
+
+    @staticmethod
+    def daily_changed(shop_id, dates):
+        """Итоги api_daily только за периоды измененных дней
+
+        :param shop_id:
+        :param dates: дни, измененные Update_Daily
+        :return:
+        """
+        if not dates:
+            return
+        return Update_Rollup.daily(
+            params={"shop_id": shop_id, "date_from": min(dates), "date_to": max(dates)}
+        )
+
+    @staticmethod
+    def advertizing(params=None):
+        params = rollup_params(params)
+        sql = f"""
+        INSERT INTO {AdvertizingRollup._meta.db_table}
+        (granularity, period, campaign_id, sku, page, views, clicks, expense, orders, revenue, shop_id)
+        (
+            SELECT
+                g.granularity,
+                {period_sql('mos.dt')} as period,
+                mos.campaign_id,
+                mos.sku,
+                COALESCE(mos.page, '') as page,
+                COALESCE(SUM(mos.views), 0),
+                COALESCE(SUM(mos.clicks), 0),
+                COALESCE(SUM(mos.expense), 0),
+                COALESCE(SUM(mos.orders), 0),
+                COALESCE(SUM(mos.revenue), 0),
+                moc.shop_id
+            FROM mp_ozon_statisticscampaignproduct mos
+            INNER JOIN mp_ozon_campaign moc ON moc.id = mos.campaign_id
+            CROSS JOIN {ROLLUP_PERIODS}
+            WHERE moc.shop_id = %(shop_id)s AND mos.sku IS NOT NULL
+                {period_filter('mos.dt', params)}
+            GROUP BY g.granularity, period, mos.campaign_id, mos.sku, COALESCE(mos.page, ''), moc.shop_id
+        ) ON CONFLICT (shop_id, granularity, period, campaign_id, sku, page) DO UPDATE SET
+            views = excluded.views,
+            clicks = excluded.clicks,
+            expense = excluded.expense,
+            orders = excluded.orders,
+            revenue = excluded.revenue;
+        """
+
+        return execute_rollup(AdvertizingRollup, sql, params)
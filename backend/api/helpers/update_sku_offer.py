@@ -0,0 +1,120 @@
+from . import execute_sql
+
+
+def sku_offer_filters(params):
+    """Условия отбора товаров и уцененных артикулов для пересчета
+
+    Без product_ids и offer_ids пересчитываются все товары магазина.
+
+    :param params: shop_id, product_ids, offer_ids
+    :return: условия для mp_ozon_product (mop) и артикула уцененного товара
+    """
+    product_ids = params.get("product_ids")
+    offer_ids = params.get("offer_ids")
+    if product_ids is None and offer_ids is None:
+        return "TRUE", "FALSE"
+    products = "mop.id = ANY(%(product_ids)s)" if product_ids is not None else "FALSE"
+    offers = (
+        "{alias}.offer_id = ANY(%(offer_ids)s)" if offer_ids is not None else "FALSE"
+    )
+    return products, offers
+
+
+class Update_SkuOffer(object):
+    """Таблица SKU х Артикул (mp_ozon_sku_offer) для сопоставления товаров
+
+    Вызывается задачами синхронизации с изменениями, найденными при записи:
+    product_ids - созданные и измененные товары, offer_ids - артикулы
+    новых и измененных строк уцененных остатков. lost - после каждой
+    загрузки остатков.
+    """
+
+    @staticmethod
+    def products(params=None):
+        """SKU FBO, FBS и уцененных товаров одним запросом
+
+        Строки-кандидаты: fbo_sku и fbs_sku товаров, SKU уцененных остатков
+        по артикулу и уже существующие строки товаров со старым артикулом.
+        Для пары (sku, product_id) берется одна строка: fbs, fbo, уцененный,
+        существующая - как при прежнем последовательном обновлении. Тип
+        уцененного SKU не меняется, если строка уже есть. Из отсутствующих на
+        Озоне товаров магазина удаляются найденные SKU.
+
+        :param params: shop_id, product_ids, offer_ids
+        :return:
+        """
+        params = dict(params or {})
+        products, offers = sku_offer_filters(params)
+        sql = f"""
+        WITH upserted AS (
+            INSERT INTO mp_ozon_sku_offer AS moso
+            (sku, type, offer_id, product_id)
+            (
+                SELECT DISTINCT ON (s.sku, s.product_id) s.sku, s.type, s.offer_id, s.product_id
+                FROM (
+                    SELECT mop.fbs_sku as sku, 'fbs' as type, mop.offer_id, mop.id as product_id, 1 as priority
+                    FROM mp_ozon_product mop
+                    WHERE mop.shop_id = %(shop_id)s AND {products}
+                    UNION ALL
+                    SELECT mop.fbo_sku, 'fbo', mop.offer_id, mop.id, 2
+                    FROM mp_ozon_product mop
+                    WHERE mop.shop_id = %(shop_id)s AND {products}
+                    UNION ALL
+                    SELECT mow.sku, 'discounted', mow.offer_id, mop.id, 3
+                    FROM mp_ozon_warehousestock mow
+                    INNER JOIN mp_ozon_product mop
+                        ON mow.offer_id = mop.offer_id AND mop.shop_id = mow.shop_id
+                    WHERE mow.discounted = true AND mow.shop_id = %(shop_id)s
+                        AND ({products} OR {offers.format(alias='mow')})
+                    UNION ALL
+                    SELECT e.sku, e.type, mop.offer_id, mop.id, 4
+                    FROM mp_ozon_sku_offer e
+                    INNER JOIN mp_ozon_product mop ON mop.id = e.product_id
+                    WHERE mop.shop_id = %(shop_id)s AND {products}
+                        AND e.offer_id IS DISTINCT FROM mop.offer_id
+                ) s
+                ORDER BY s.sku, s.product_id, s.priority
+            ) ON CONFLICT (sku, product_id) DO UPDATE SET
+                type = CASE WHEN excluded.type = 'discounted' THEN moso.type ELSE excluded.type END,
+                offer_id = excluded.offer_id
+            WHERE (moso.type, moso.offer_id) IS DISTINCT FROM (
+                CASE WHEN excluded.type = 'discounted' THEN moso.type ELSE excluded.type END,
+                excluded.offer_id
+            )
+            RETURNING moso.sku
+        )
+        DELETE FROM mp_ozon_productlost mopl
+        WHERE mopl.shop_id = %(shop_id)s AND (
+            mopl.sku IN (SELECT sku FROM upserted)
+            OR mopl.sku IN (
+                SELECT moso.sku FROM mp_ozon_sku_offer moso
+                INNER JOIN mp_ozon_product mop ON mop.id = moso.product_id
+                WHERE mop.shop_id = %(shop_id)s
+                    AND ({products} OR {offers.format(alias='moso')})
+            )
+        );
+        """
+
+        return execute_sql(sql, params=params)
+
+    @staticmethod
+    def lost(params=None):
+        """Удаление из отсутствующих на Озоне товаров магазина всех его SKU
+
+        products удаляет только SKU измененных товаров, а строки отсутствующих
+        товаров появляются и без изменений в каталоге, поэтому после каждой
+        загрузки остатков проверяется весь магазин.
+
+        :param params: shop_id
+        :return:
+        """
+        sql = """
+        DELETE FROM mp_ozon_productlost mopl
+        WHERE mopl.shop_id = %(shop_id)s AND mopl.sku IN (
+            SELECT moso.sku FROM mp_ozon_sku_offer moso
+            INNER JOIN mp_ozon_product mop ON mop.id = moso.product_id
+            WHERE mop.shop_id = %(shop_id)s
+        );
+        """
+
+        return execute_sql(sql, params=params)
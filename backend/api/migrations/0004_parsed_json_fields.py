@@ -0,0 +1,105 @@
+# Generated by Django 4.1.2 on 2026-10-19 12:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_remove_daily_created_at_remove_daily_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ParsedTransaction",
+            fields=[
+                (
+                    "transaction_id",
+                    models.BigIntegerField(primary_key=True, serialize=False),
+                ),
+                ("items_cnt", models.IntegerField(null=True)),
+                ("item_name", models.TextField(null=True)),
+                (
+                    "shop",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="mp.shop",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ParsedProduct",
+            fields=[
+                (
+                    "product_id",
+                    models.BigIntegerField(primary_key=True, serialize=False),
+                ),
+                ("images_cnt", models.IntegerField(null=True)),
+                ("images360_cnt", models.IntegerField(null=True)),
+                ("action_cnt", models.IntegerField(null=True)),
+                ("sales_percent", models.FloatField(null=True)),
+                ("fbo_amount", models.FloatField(null=True)),
+                ("fbo_return_amount", models.FloatField(null=True)),
+                ("fbs_amount", models.FloatField(null=True)),
+                ("fbs_return_amount", models.FloatField(null=True)),
+                (
+                    "shop",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="mp.shop",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ParsedFBOProduct",
+            fields=[
+                (
+                    "fbo_product_id",
+                    models.BigIntegerField(primary_key=True, serialize=False),
+                ),
+                (
+                    "fulfillment",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                (
+                    "direct_flow_trans",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                (
+                    "deliv_to_customer",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                (
+                    "shop",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="mp.shop",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ParsedFBO",
+            fields=[
+                ("fbo_id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("delivery_type", models.CharField(max_length=255, null=True)),
+                ("warehouse", models.CharField(max_length=255, null=True)),
+                ("region", models.CharField(max_length=255, null=True)),
+                ("city", models.CharField(max_length=255, null=True)),
+                (
+                    "shop",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="mp.shop",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,118 @@
+# Generated by Django 4.1.2 on 2026-10-19 13:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_parsed_json_fields"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Ledger",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("transaction_id", models.BigIntegerField(null=True)),
+                ("fbo_id", models.BigIntegerField(null=True)),
+                ("product_id", models.BigIntegerField(null=True)),
+                ("posting_number", models.CharField(max_length=64, null=True)),
+                ("sku", models.BigIntegerField(null=True)),
+                ("offer_id", models.CharField(max_length=255, null=True)),
+                ("operation_type", models.CharField(max_length=255, null=True)),
+                ("operation_type_name", models.CharField(max_length=255, null=True)),
+                ("type", models.CharField(max_length=64, null=True)),
+                ("basis", models.TextField(null=True)),
+                ("status", models.CharField(max_length=64, null=True)),
+                ("order_date", models.DateTimeField(null=True)),
+                ("operation_date", models.DateTimeField(null=True)),
+                ("quantity", models.IntegerField(null=True)),
+                (
+                    "price",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                (
+                    "comission",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                (
+                    "fulfillment",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                (
+                    "direct_flow_trans",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                (
+                    "deliv_to_customer",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                (
+                    "calc_revenue",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                (
+                    "calc_payment",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                (
+                    "sale_commission",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                (
+                    "services_amount",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                ("delivery_type", models.CharField(max_length=255, null=True)),
+                ("warehouse", models.CharField(max_length=255, null=True)),
+                ("region", models.CharField(max_length=255, null=True)),
+                ("city", models.CharField(max_length=255, null=True)),
+                ("filter_date", models.DateField(null=True)),
+                ("sort_date", models.DateTimeField(null=True)),
+                ("query", models.SmallIntegerField(default=1)),
+                (
+                    "shop",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="mp.shop",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="ledger",
+            index=models.Index(
+                fields=["shop", "posting_number", "sku"],
+                name="api_ledger_shop_id_66c1f3_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ledger",
+            index=models.Index(
+                fields=["shop", "filter_date"], name="api_ledger_shop_id_a67b77_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ledger",
+            index=models.Index(
+                fields=["shop", "-sort_date"], name="api_ledger_shop_id_0b27ee_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ledger",
+            index=models.Index(
+                fields=["shop", "transaction_id"], name="api_ledger_shop_id_d54ba6_idx"
+            ),
+        ),
+    ]
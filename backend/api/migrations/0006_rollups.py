@@ -0,0 +1,173 @@
+# Generated by Django 4.1.2 on 2026-10-19 13:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mp", "0015_backfill"),
+        ("api", "0005_ledger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "granularity",
+                    models.CharField(
+                        choices=[("week", "Week"), ("month", "Month")], max_length=8
+                    ),
+                ),
+                ("period", models.DateField()),
+                ("sku", models.BigIntegerField()),
+                ("stocks", models.IntegerField(null=True)),
+                ("selfbuy_cnt", models.IntegerField(default=0)),
+                (
+                    "selfbuy_amount",
+                    models.DecimalField(decimal_places=4, default=0, max_digits=20),
+                ),
+                (
+                    "premium",
+                    models.DecimalField(decimal_places=4, default=0, max_digits=20),
+                ),
+                (
+                    "rassrochka",
+                    models.DecimalField(decimal_places=4, default=0, max_digits=20),
+                ),
+                (
+                    "adv_promo_bid",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                ("adv_promo_visibility", models.IntegerField(null=True)),
+                (
+                    "shop",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="mp.shop"
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("shop", "granularity", "period", "sku")},
+            },
+        ),
+        migrations.CreateModel(
+            name="AnalyticsRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "granularity",
+                    models.CharField(
+                        choices=[("week", "Week"), ("month", "Month")], max_length=8
+                    ),
+                ),
+                ("period", models.DateField()),
+                ("sku", models.BigIntegerField()),
+                ("days", models.SmallIntegerField(default=0)),
+                ("session_view", models.BigIntegerField(default=0)),
+                ("session_view_pdp", models.BigIntegerField(default=0)),
+                ("session_view_search", models.BigIntegerField(default=0)),
+                ("hits_tocart", models.BigIntegerField(default=0)),
+                ("hits_tocart_pdp", models.BigIntegerField(default=0)),
+                ("hits_tocart_search", models.BigIntegerField(default=0)),
+                ("hits_view", models.BigIntegerField(default=0)),
+                ("hits_view_pdp", models.BigIntegerField(default=0)),
+                ("hits_view_search", models.BigIntegerField(default=0)),
+                ("returns", models.BigIntegerField(default=0)),
+                ("cancellations", models.BigIntegerField(default=0)),
+                ("delivered_units", models.BigIntegerField(default=0)),
+                ("ordered_units", models.BigIntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=4, default=0, max_digits=20),
+                ),
+                (
+                    "adv_sum_all",
+                    models.DecimalField(decimal_places=4, default=0, max_digits=20),
+                ),
+                ("adv_view_all", models.BigIntegerField(default=0)),
+                ("adv_view_pdp", models.BigIntegerField(default=0)),
+                ("adv_view_search_category", models.BigIntegerField(default=0)),
+                ("postings", models.BigIntegerField(default=0)),
+                ("postings_premium", models.BigIntegerField(default=0)),
+                (
+                    "position_category",
+                    models.DecimalField(decimal_places=4, max_digits=20, null=True),
+                ),
+                (
+                    "shop",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="mp.shop"
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("shop", "granularity", "period", "sku")},
+            },
+        ),
+        migrations.CreateModel(
+            name="AdvertizingRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "granularity",
+                    models.CharField(
+                        choices=[("week", "Week"), ("month", "Month")], max_length=8
+                    ),
+                ),
+                ("period", models.DateField()),
+                ("campaign_id", models.BigIntegerField()),
+                ("sku", models.BigIntegerField()),
+                ("page", models.CharField(default="", max_length=128)),
+                ("views", models.BigIntegerField(default=0)),
+                ("clicks", models.BigIntegerField(default=0)),
+                (
+                    "expense",
+                    models.DecimalField(decimal_places=4, default=0, max_digits=20),
+                ),
+                ("orders", models.BigIntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=4, default=0, max_digits=20),
+                ),
+                (
+                    "shop",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="mp.shop"
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {
+                    ("shop", "granularity", "period", "campaign_id", "sku", "page")
+                },
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.1.2 on 2026-10-19 14:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mp", "0015_backfill"),
+        ("api", "0006_rollups"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangeLog",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "report",
+                    models.CharField(
+                        choices=[
+                            ("analytics", "Analytics"),
+                            ("transactions", "Transactions"),
+                        ],
+                        max_length=16,
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("changed_at", models.DateTimeField()),
+                (
+                    "shop",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="mp.shop"
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="changelog",
+            index=models.Index(
+                fields=["shop", "report", "changed_at"],
+                name="api_changel_shop_id_f2c5ed_idx",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="changelog",
+            unique_together={("shop", "report", "date")},
+        ),
+    ]
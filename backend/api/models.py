@@ -32,3 +32,257 @@ class Daily(models.Model):
 
     def __str__(self):
         return f"{self.date} / {self.sku}  / {self.shop}"
+
+
+class ParsedFBO(models.Model):
+    """Поля analytics_data заказа FBO, разобранные при загрузке"""
+
+    fbo_id = models.BigIntegerField(primary_key=True)
+    delivery_type = models.CharField(max_length=255, null=True)
+    warehouse = models.CharField(max_length=255, null=True)
+    region = models.CharField(max_length=255, null=True)
+    city = models.CharField(max_length=255, null=True)
+
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, null=True)
+
+    def __str__(self):
+        return f"{self.fbo_id} / {self.shop}"
+
+
+class ParsedFBOProduct(models.Model):
+    """Услуги item_services товара заказа FBO, разобранные при загрузке"""
+
+    fbo_product_id = models.BigIntegerField(primary_key=True)
+    fulfillment = models.DecimalField(max_digits=20, decimal_places=4, null=True)
+    direct_flow_trans = models.DecimalField(max_digits=20, decimal_places=4, null=True)
+    deliv_to_customer = models.DecimalField(max_digits=20, decimal_places=4, null=True)
+
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, null=True)
+
+    def __str__(self):
+        return f"{self.fbo_product_id} / {self.shop}"
+
+
+class ParsedTransaction(models.Model):
+    """Поля items транзакции, разобранные при загрузке"""
+
+    transaction_id = models.BigIntegerField(primary_key=True)
+    items_cnt = models.IntegerField(null=True)
+    item_name = models.TextField(null=True)
+
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, null=True)
+
+    def __str__(self):
+        return f"{self.transaction_id} / {self.shop}"
+
+
+class ParsedProduct(models.Model):
+    """Картинки, акции и комиссии товара, разобранные при загрузке"""
+
+    product_id = models.BigIntegerField(primary_key=True)
+    images_cnt = models.IntegerField(null=True)
+    images360_cnt = models.IntegerField(null=True)
+    action_cnt = models.IntegerField(null=True)
+    sales_percent = models.FloatField(null=True)
+    fbo_amount = models.FloatField(null=True)
+    fbo_return_amount = models.FloatField(null=True)
+    fbs_amount = models.FloatField(null=True)
+    fbs_return_amount = models.FloatField(null=True)
+
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, null=True)
+
+    def __str__(self):
+        return f"{self.product_id} / {self.shop}"
+
+
+class Ledger(models.Model):
+    """Строки отчета по транзакциям, связанные с отправлениями FBO
+
+    Транзакция без отправления или отправление без транзакции (неоплаченный
+    заказ) тоже дают строку, пустая сторона остается NULL.
+    """
+
+    transaction_id = models.BigIntegerField(null=True)
+    fbo_id = models.BigIntegerField(null=True)
+    product_id = models.BigIntegerField(null=True)
+
+    posting_number = models.CharField(max_length=64, null=True)
+    sku = models.BigIntegerField(null=True)
+    offer_id = models.CharField(max_length=255, null=True)
+
+    operation_type = models.CharField(max_length=255, null=True)
+    operation_type_name = models.CharField(max_length=255, null=True)
+    type = models.CharField(max_length=64, null=True)
+    basis = models.TextField(null=True)
+    status = models.CharField(max_length=64, null=True)
+
+    order_date = models.DateTimeField(null=True)
+    operation_date = models.DateTimeField(null=True)
+
+    quantity = models.IntegerField(null=True)
+    price = models.DecimalField(max_digits=20, decimal_places=4, null=True)
+    comission = models.DecimalField(max_digits=20, decimal_places=4, null=True)
+    fulfillment = models.DecimalField(max_digits=20, decimal_places=4, null=True)
+    direct_flow_trans = models.DecimalField(max_digits=20, decimal_places=4, null=True)
+    deliv_to_customer = models.DecimalField(max_digits=20, decimal_places=4, null=True)
+    calc_revenue = models.DecimalField(max_digits=20, decimal_places=4, null=True)
+    calc_payment = models.DecimalField(max_digits=20, decimal_places=4, null=True)
+    sale_commission = models.DecimalField(max_digits=20, decimal_places=4, null=True)
+    services_amount = models.DecimalField(max_digits=20, decimal_places=4, null=True)
+
+    delivery_type = models.CharField(max_length=255, null=True)
+    warehouse = models.CharField(max_length=255, null=True)
+    region = models.CharField(max_length=255, null=True)
+    city = models.CharField(max_length=255, null=True)
+
+    filter_date = models.DateField(null=True)  # дата операции или заказа
+    sort_date = models.DateTimeField(null=True)
+    query = models.SmallIntegerField(default=1)  # 1 - транзакция, 2 - без оплаты
+
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["shop", "posting_number", "sku"]),
+            models.Index(fields=["shop", "filter_date"]),
+            models.Index(fields=["shop", "-sort_date"]),
+            models.Index(fields=["shop", "transaction_id"]),
+        ]
+
+    def __str__(self):
+        return f"{self.posting_number} / {self.sku} / {self.shop}"
+
+
+ROLLUP_GRANULARITIES = (
+    ("week", "Week"),
+    ("month", "Month"),
+)
+
+
+class AnalyticsRollup(models.Model):
+    """Аналитика SKU за неделю или месяц, period - понедельник или первое число
+
+    Обновляется Update_Rollup.analytics по периодам, в которые попали новые дни.
+    """
+
+    granularity = models.CharField(max_length=8, choices=ROLLUP_GRANULARITIES)
+    period = models.DateField()
+    sku = models.BigIntegerField()
+    days = models.SmallIntegerField(default=0)  # дней с данными
+
+    session_view = models.BigIntegerField(default=0)
+    session_view_pdp = models.BigIntegerField(default=0)
+    session_view_search = models.BigIntegerField(default=0)
+    hits_tocart = models.BigIntegerField(default=0)
+    hits_tocart_pdp = models.BigIntegerField(default=0)
+    hits_tocart_search = models.BigIntegerField(default=0)
+    hits_view = models.BigIntegerField(default=0)
+    hits_view_pdp = models.BigIntegerField(default=0)
+    hits_view_search = models.BigIntegerField(default=0)
+    returns = models.BigIntegerField(default=0)
+    cancellations = models.BigIntegerField(default=0)
+    delivered_units = models.BigIntegerField(default=0)
+    ordered_units = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    adv_sum_all = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    adv_view_all = models.BigIntegerField(default=0)
+    adv_view_pdp = models.BigIntegerField(default=0)
+    adv_view_search_category = models.BigIntegerField(default=0)
+    postings = models.BigIntegerField(default=0)
+    postings_premium = models.BigIntegerField(default=0)
+    # средняя позиция по дням, где товар был в категории
+    position_category = models.DecimalField(max_digits=20, decimal_places=4, null=True)
+
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ["shop", "granularity", "period", "sku"]
+
+    def __str__(self):
+        return f"{self.granularity} {self.period} / {self.sku} / {self.shop_id}"
+
+
+class DailyRollup(models.Model):
+    """api_daily за неделю или месяц, остатки - на последний день периода"""
+
+    granularity = models.CharField(max_length=8, choices=ROLLUP_GRANULARITIES)
+    period = models.DateField()
+    sku = models.BigIntegerField()
+
+    stocks = models.IntegerField(null=True)
+    selfbuy_cnt = models.IntegerField(default=0)
+    selfbuy_amount = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    premium = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    rassrochka = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    adv_promo_bid = models.DecimalField(
+        max_digits=20, decimal_places=4, null=True
+    )  # средняя
+    adv_promo_visibility = models.IntegerField(null=True)  # средняя
+
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ["shop", "granularity", "period", "sku"]
+
+    def __str__(self):
+        return f"{self.granularity} {self.period} / {self.sku} / {self.shop_id}"
+
+
+class AdvertizingRollup(models.Model):
+    """Статистика рекламных кампаний по SKU и странице за неделю или месяц"""
+
+    granularity = models.CharField(max_length=8, choices=ROLLUP_GRANULARITIES)
+    period = models.DateField()
+    campaign_id = models.BigIntegerField()
+    sku = models.BigIntegerField()
+    page = models.CharField(max_length=128, default="")
+
+    views = models.BigIntegerField(default=0)
+    clicks = models.BigIntegerField(default=0)
+    expense = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    orders = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = [
+            "shop",
+            "granularity",
+            "period",
+            "campaign_id",
+            "sku",
+            "page",
+        ]
+
+    def __str__(self):
+        return f"{self.granularity} {self.period} / {self.campaign_id} / {self.sku}"
+
+
+CHANGE_REPORTS = (
+    ("analytics", "Analytics"),  # mp_ozon_analytics и api_daily
+    ("transactions", "Transactions"),  # api_ledger
+)
+
+
+class ChangeLog(models.Model):
+    """Дни отчетов, строки которых добавлены, изменены или удалены
+
+    Пишется запросами обновления данных (см. api.helpers.changelog), по нему
+    отчеты с since= отдают только измененные дни.
+    """
+
+    report = models.CharField(max_length=16, choices=CHANGE_REPORTS)
+    date = models.DateField()
+    changed_at = models.DateTimeField()
+
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ["shop", "report", "date"]
+        indexes = [
+            models.Index(fields=["shop", "report", "changed_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.report} {self.date} / {self.shop_id} / {self.changed_at}"
@@ -0,0 +1,56 @@
+import logging
+from decimal import Decimal
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    logger.warning("orjson not available, API responses use the stdlib encoder")
+
+_encoder = JSONEncoder()
+
+
+def decimal_comma(obj):
+    if isinstance(obj, Decimal):
+        return str(obj).replace(".", ",")
+    # прочие типы (ленивые строки, UUID, timedelta, ...) - как в DRF
+    return _encoder.default(obj)
+
+
+class DecimalCommaEncoder(JSONEncoder):
+    def default(self, obj):
+        return decimal_comma(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSON через orjson, без отдельного прохода по строкам перед ответом
+
+    date и datetime orjson кодирует сам, Decimal - числом, как в DRF. Если у
+    представления decimal_comma = True (convert_values, Google Sheets), Decimal
+    кодируется строкой с запятой вместо точки: отчет отдает numeric только в
+    полях для Google Sheets, см. ReadAPIView.comma_columns.
+    Без orjson - стандартный JSONRenderer с той же заменой.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        renderer_context = renderer_context or {}
+        comma = getattr(renderer_context.get("view"), "decimal_comma", False)
+        if orjson is None:
+            if comma:
+                self.encoder_class = DecimalCommaEncoder
+            return super().render(data, accepted_media_type, renderer_context)
+
+        option = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type, renderer_context):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(
+            data, default=decimal_comma if comma else _encoder.default, option=option
+        )
@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.helpers.cache import invalidate_user_shops, invalidate_token
+from mp.models import Shop, APIKey
+
+
+@receiver(pre_save, sender=Shop)
+def shop_saving(sender, instance, **kwargs):
+    # при смене владельца сбрасываем и кеш магазинов прежнего пользователя
+    instance._previous_user_id = (
+        Shop.objects.filter(pk=instance.pk).values_list("user_id", flat=True).first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver([post_save, post_delete], sender=Shop)
+def shop_changed(sender, instance, **kwargs):
+    invalidate_user_shops(instance.user_id)
+    previous_user_id = getattr(instance, "_previous_user_id", None)
+    if previous_user_id != instance.user_id:
+        invalidate_user_shops(previous_user_id)
+
+
+@receiver([post_save, post_delete], sender=APIKey)
+def apikey_changed(sender, instance, **kwargs):
+    invalidate_user_shops(
+        Shop.objects.filter(pk=instance.shop_id)
+        .values_list("user_id", flat=True)
+        .first()
+    )
+
+
+@receiver([post_save, post_delete], sender=Token)
+def token_changed(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def user_changed(sender, instance, **kwargs):
+    # в кеше токенов хранятся поля пользователя (is_active и права)
+    for key in Token.objects.filter(user_id=instance.pk).values_list("key", flat=True):
+        invalidate_token(key)
+    invalidate_user_shops(instance.pk)
@@ -1,3 +1,330 @@
+from datetime import date, timedelta
+from decimal import Decimal
+import io
+import json
+from types import SimpleNamespace
+
+from django.http import QueryDict
+from django.db import transaction
 from django.test import TestCase
 
-# Create your tests here.
+from api.helpers import Update_Rollup, Update_SkuOffer, execute_sql, fetch_raw_sql
+from api.helpers.export import ErrorExport, load_pyarrow, select_columns, write_export
+from api.models import AnalyticsRollup, Daily, DailyRollup
+from api.renderers import FastJSONRenderer
+from mp.bench.schema import OZON_SCHEMA
+from mp.models import Shop
+from api.views import ReadAPIView, TransactionsListView, export_query, zero_null
+
+REPORT_SQL = """
+    SELECT v.date::date AS date, v.sku, v.revenue::numeric(12, 2) AS revenue
+    FROM (VALUES ('2022-10-01', 1, '10.50'), ('2022-10-02', 2, NULL))
+        AS v(date, sku, revenue);
+"""
+
+
+def request(query=""):
+    return SimpleNamespace(GET=QueryDict(query))
+
+
+class ExportTest(TestCase):
+    def test_select_columns(self):
+        self.assertEqual(select_columns(REPORT_SQL), REPORT_SQL)
+        sql = select_columns(REPORT_SQL, ["sku", "revenue"])
+        self.assertTrue(sql.startswith('SELECT "sku", "revenue" FROM ('))
+        self.assertNotIn(";", sql)
+        with self.assertRaises(ErrorExport):
+            select_columns(REPORT_SQL, ["sku; DROP TABLE mp_shop"])
+        with self.assertRaises(ErrorExport):
+            select_columns(REPORT_SQL, ['"Sku"'])
+
+    def test_write_export(self):
+        if not load_pyarrow():
+            self.skipTest("pyarrow не установлен")
+        from api.helpers import export
+
+        for fmt in ("parquet", "arrow"):
+            file = io.BytesIO()
+            sql = select_columns(REPORT_SQL, ["sku", "revenue"])
+            self.assertEqual(write_export(file, sql, fmt=fmt, batch_rows=1), 2)
+            file.seek(0)
+            if fmt == "parquet":
+                table = export.pq.read_table(file)
+            else:
+                table = export.pa.ipc.open_stream(file).read_all()
+            self.assertEqual(table.column_names, ["sku", "revenue"])
+            self.assertEqual(table.column("revenue").to_pylist(), [10.5, None])
+
+        with self.assertRaises(ErrorExport):
+            write_export(io.BytesIO(), select_columns(REPORT_SQL, ["price"]))
+
+    def test_export_query(self):
+        # выгрузка без замены NULL на 0 для Google Sheets
+        sql, params = export_query(TransactionsListView, QueryDict(), [1])
+        self.assertNotIn("COALESCE", sql)
+        self.assertIn("COALESCE", TransactionsListView().query(request(), [1])[0])
+
+
+class CommaView(ReadAPIView):
+    comma_fields = ["selfbuy_amount", "commission", "premium"]
+
+    def __init__(self, convert=True):
+        super().__init__()
+        self.convert = convert
+
+    def convert_values(self, request):
+        return self.convert
+
+
+class DecimalCommaTest(TestCase):
+    FIELDS = [
+        "v.sku",
+        "v.selfbuy_amount",
+        "v.commission::numeric as commission",
+        "-v.premium as premium",
+    ]
+
+    def test_zero_null(self):
+        names = {"selfbuy_amount", "premium"}
+        self.assertEqual(
+            zero_null("v.selfbuy_amount", names),
+            "COALESCE(v.selfbuy_amount, 0) as selfbuy_amount",
+        )
+        self.assertEqual(
+            zero_null("-v.premium as premium", names),
+            "COALESCE(-v.premium, 0) as premium",
+        )
+        self.assertEqual(zero_null("ms.name as shop", names), "ms.name as shop")
+
+    def render(self, view):
+        # numeric-поля и float-поле commission
+        fields = view.comma_columns(request(), self.FIELDS)
+        rows = fetch_raw_sql(
+            f"""
+            SELECT {', '.join(fields)}
+            FROM (VALUES (1, 10.50::numeric, 12.5::float8, NULL::numeric))
+                AS v(sku, selfbuy_amount, commission, premium)
+            """
+        )
+        body = FastJSONRenderer().render(
+            {"result": {"items": rows}}, renderer_context={"view": view}
+        )
+        return json.loads(body)["result"]["items"][0]
+
+    def test_render(self):
+        view = CommaView()
+        self.assertEqual(
+            self.render(view),
+            {"sku": 1, "selfbuy_amount": "10,50", "commission": "12,5", "premium": "0"},
+        )
+        self.assertTrue(view.decimal_comma)
+
+        view = CommaView(convert=False)
+        self.assertEqual(
+            self.render(view),
+            {"sku": 1, "selfbuy_amount": 10.5, "commission": 12.5, "premium": None},
+        )
+        self.assertFalse(view.decimal_comma)
+
+
+# прежнее последовательное обновление SKU х Артикул в update_stocks
+OLD_SKU_OFFER_SQL = [
+    """
+    INSERT INTO mp_ozon_sku_offer (sku, type, offer_id, product_id)
+    (
+        SELECT DISTINCT mow.sku, 'discounted' AS type, mow.offer_id, mop.id AS product_id
+        FROM mp_ozon_warehousestock mow
+        INNER JOIN mp_ozon_product mop ON mow.offer_id = mop.offer_id
+        WHERE mow.discounted = true AND mow.shop_id = %(shop_id)s
+        ORDER BY mow.offer_id
+    ) ON CONFLICT (sku, product_id) DO NOTHING;
+    """,
+    """
+    INSERT INTO mp_ozon_sku_offer (sku, type, offer_id, product_id)
+    (
+        SELECT DISTINCT fbo_sku, 'fbo' as type, mop.offer_id, mop.id as product_id
+        FROM mp_ozon_product mop
+        WHERE mop.shop_id = %(shop_id)s
+        ORDER BY mop.offer_id
+    ) ON CONFLICT (sku, product_id) DO UPDATE SET type = excluded.type;
+    """,
+    """
+    INSERT INTO mp_ozon_sku_offer (sku, type, offer_id, product_id)
+    (
+        SELECT DISTINCT fbs_sku, 'fbs' as type, mop.offer_id, mop.id as product_id
+        FROM mp_ozon_product mop
+        WHERE mop.shop_id = %(shop_id)s
+        ORDER BY mop.offer_id
+    ) ON CONFLICT (sku, product_id) DO UPDATE SET type = excluded.type;
+    """,
+    """
+    UPDATE mp_ozon_sku_offer moso SET offer_id = mop.offer_id
+    FROM mp_ozon_product mop
+    WHERE mop.id = moso.product_id AND mop.shop_id = %(shop_id)s
+        AND moso.offer_id != mop.offer_id;
+    """,
+    """
+    DELETE FROM mp_ozon_productlost
+    WHERE sku IN (SELECT sku FROM mp_ozon_sku_offer WHERE shop_id = %(shop_id)s);
+    """,
+]
+
+
+class SkuOfferTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # таблицы mp_ozon без пакета mp_ozon, откатываются вместе с тестом
+        execute_sql(OZON_SCHEMA)
+        cls.shop = Shop.objects.create(name="sku offer")
+        execute_sql(
+            """
+            INSERT INTO mp_ozon_product (id, shop_id, offer_id, fbo_sku, fbs_sku)
+            VALUES (910001, %(shop_id)s, 'A', 101, 102),
+                   (910002, %(shop_id)s, 'B', 201, 201),
+                   (910003, %(shop_id)s, 'C', 301, 302);
+            INSERT INTO mp_ozon_warehousestock
+                (shop_id, sku, offer_id, date, warehouse, discounted, for_sale)
+            VALUES (%(shop_id)s, 111, 'A', '2022-10-01', 'kzn', true, 1),
+                   (%(shop_id)s, 201, 'B', '2022-10-01', 'kzn', true, 1),
+                   (%(shop_id)s, 302, 'C', '2022-10-01', 'kzn', true, 1),
+                   (%(shop_id)s, 999, 'A', '2022-10-01', 'kzn', false, 1);
+            -- прежний артикул, уцененный SKU, ставший SKU FBO, и уцененный SKU
+            INSERT INTO mp_ozon_sku_offer (sku, type, offer_id, product_id)
+            VALUES (401, 'discounted', 'OLD', 910001),
+                   (101, 'discounted', 'A', 910001),
+                   (111, 'fbo', 'A', 910001);
+            INSERT INTO mp_ozon_productlost (sku, offer_id, shop_id, type)
+            VALUES (101, 'A', %(shop_id)s, 'fbo'), (555, 'X', %(shop_id)s, 'fbo');
+            """,
+            {"shop_id": cls.shop.pk},
+        )
+
+    def state(self):
+        sku_offer = fetch_raw_sql(
+            """
+            SELECT sku, type, offer_id, product_id FROM mp_ozon_sku_offer
+            ORDER BY sku, product_id
+            """,
+            as_dict=False,
+        )
+        lost = fetch_raw_sql(
+            "SELECT sku FROM mp_ozon_productlost ORDER BY sku", as_dict=False
+        )
+        return sku_offer, lost
+
+    def test_priority(self):
+        params = {"shop_id": self.shop.pk}
+        with transaction.atomic():
+            for sql in OLD_SKU_OFFER_SQL:
+                execute_sql(sql, params)
+            expected = self.state()
+            transaction.set_rollback(True)
+
+        Update_SkuOffer.products(params=params)
+        self.assertEqual(self.state(), expected)
+        # fbs перед fbo, fbo перед уцененным, тип уцененного SKU не меняется
+        self.assertIn((201, "fbs", "B", 910002), expected[0])
+        self.assertIn((101, "fbo", "A", 910001), expected[0])
+        self.assertIn((111, "fbo", "A", 910001), expected[0])
+        self.assertIn((302, "fbs", "C", 910003), expected[0])
+        self.assertIn((401, "discounted", "A", 910001), expected[0])
+        self.assertEqual(expected[1], [(555,)])
+
+    def test_lost(self):
+        # изменений товаров нет, отсутствующий товар удаляется по всему магазину
+        Update_SkuOffer.products(params={"shop_id": self.shop.pk, "product_ids": []})
+        self.assertEqual(self.state()[1], [(101,), (555,)])
+        Update_SkuOffer.lost(params={"shop_id": self.shop.pk})
+        self.assertEqual(self.state()[1], [(555,)])
+
+
+class RollupTest(TestCase):
+    # неделя 31.10-06.11.2022 попадает в октябрь и ноябрь
+    days = [date(2022, 10, 28) + timedelta(days=i) for i in range(12)]
+
+    @classmethod
+    def setUpTestData(cls):
+        execute_sql(OZON_SCHEMA)
+        cls.shop = Shop.objects.create(name="rollup")
+        for i, day in enumerate(cls.days):
+            execute_sql(
+                """
+                INSERT INTO mp_ozon_analytics (shop_id, sku, date, ordered_units, revenue)
+                VALUES (%(shop_id)s, 101, %(date)s, %(units)s, %(revenue)s)
+                """,
+                {
+                    "shop_id": cls.shop.pk,
+                    "date": day,
+                    "units": i + 1,
+                    "revenue": Decimal(f"{i + 1}.25"),
+                },
+            )
+            Daily.objects.create(
+                shop=cls.shop, sku=101, date=day, selfbuy_cnt=1, premium=i
+            )
+
+    def sums(self, granularity, period, field):
+        rows = fetch_raw_sql(
+            f"""
+            SELECT COALESCE(SUM({field}), 0) FROM mp_ozon_analytics
+            WHERE shop_id = %(shop_id)s AND sku = 101
+                AND date_trunc(%(granularity)s, date::timestamp)::date = %(period)s
+            """,
+            {"shop_id": self.shop.pk, "granularity": granularity, "period": period},
+            as_dict=False,
+        )
+        return rows[0][0]
+
+    def assert_sums(self):
+        rollups = AnalyticsRollup.objects.filter(shop=self.shop)
+        self.assertEqual(
+            sorted(rollups.values_list("granularity", "period")),
+            [
+                ("month", date(2022, 10, 1)),
+                ("month", date(2022, 11, 1)),
+                ("week", date(2022, 10, 24)),
+                ("week", date(2022, 10, 31)),
+                ("week", date(2022, 11, 7)),
+            ],
+        )
+        for rollup in rollups:
+            for field in ("ordered_units", "revenue"):
+                self.assertEqual(
+                    getattr(rollup, field),
+                    self.sums(rollup.granularity, rollup.period, field),
+                    (rollup.granularity, rollup.period, field),
+                )
+        return rollups
+
+    def test_week_across_months(self):
+        Update_Rollup.analytics(params={"shop_id": self.shop.pk})
+        week = self.assert_sums().get(granularity="week", period=date(2022, 10, 31))
+        self.assertEqual((week.days, week.ordered_units), (7, sum(range(4, 11))))
+
+        # перезагружен 01.11 - неделя пересчитывается и с октябрьскими днями
+        execute_sql(
+            """
+            UPDATE mp_ozon_analytics SET ordered_units = 100, revenue = 100.5
+            WHERE shop_id = %(shop_id)s AND date = '2022-11-01'
+            """,
+            {"shop_id": self.shop.pk},
+        )
+        Update_Rollup.analytics(
+            params={
+                "shop_id": self.shop.pk,
+                "date_from": date(2022, 11, 1),
+                "date_to": date(2022, 11, 1),
+            }
+        )
+        self.assert_sums()
+
+        Update_Rollup.daily_changed(self.shop.pk, [date(2022, 11, 1)])
+        daily = DailyRollup.objects.get(
+            shop=self.shop, granularity="week", period=date(2022, 10, 31)
+        )
+        self.assertEqual((daily.selfbuy_cnt, daily.premium), (7, sum(range(3, 10))))
+        self.assertFalse(
+            DailyRollup.objects.filter(
+                shop=self.shop, granularity="month", period=date(2022, 10, 1)
+            ).exists()
+        )
@@ -5,19 +5,28 @@ from django.views.decorators.cache import cache_page
 
 from . import views as api_views
 
+
+def read_view(view_class):
+    """Отчет асинхронным представлением под ASGI или обычным APIView под WSGI"""
+    if settings.API_ASYNC:
+        return view_class.as_async_view()
+    return view_class.as_view()
+
+
 urlpatterns = [
     # api
     path(
         "analytics/",
-        api_views.AnalyticsListView.as_view(),
+        read_view(api_views.AnalyticsListView),
     ),
-    path("advertizing/", api_views.AdvertizingStatisticsListView.as_view()),
+    path("advertizing/", read_view(api_views.AdvertizingStatisticsListView)),
     path("profile/", api_views.ProfileView.as_view()),
-    path("products/", api_views.ProductsListView.as_view()),
+    path("products/", read_view(api_views.ProductsListView)),
     path(
         "transactions/",
-        api_views.TransactionsListView.as_view(),
+        read_view(api_views.TransactionsListView),
     ),
+    path("export/<str:report>/", api_views.ExportView.as_view()),
     re_path(
         r"^img/(?P<offer_id>[\w\d\s\/\\.\\,\\*|\(\)+-]+)",
         api_views.product_image,
@@ -1,19 +1,37 @@
+import hashlib
+import json
 import logging
-from datetime import date, datetime
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 from io import BytesIO
+from types import SimpleNamespace
 
 from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.http import HttpResponse
+from django.db import close_old_connections
+from django.http import FileResponse, HttpResponse
 from django.templatetags.static import static
-from rest_framework.authentication import TokenAuthentication, SessionAuthentication
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views import View
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.authentication import JWTAuthentication
-import httpx
 
+from api.authentication import CachedTokenAuthentication
 from api.helpers import fetch_raw_sql
+from api.helpers.db_async import async_fetch_raw_sql
+from api.helpers.cache import get_user_shops, get_shop_names, get_shop_versions
+from api.helpers.export import (
+    EXPORT_FORMATS,
+    ErrorExport,
+    export_file,
+    select_columns,
+)
+from api.helpers.update_rollup import ANALYTICS_SUMS
+from api.models import ChangeLog, Ledger, ParsedProduct, ROLLUP_GRANULARITIES
 from mp.models import Shop
 from ka_space.helpers import FileLogger
 
@@ -23,15 +41,230 @@ DEFAULT_CONVERT_DECIMAL = True
 RETURN_MAX_ROWS = 9999
 DAYS_DEFAULT = 180
 TRANSACTION_DAYS_DEFAULT = 180
+EXPORT_MAX_ROWS = 10**9
+CHANGES_OVERLAP = timedelta(minutes=15)
+ETAG_VERSION = 2  # увеличить при изменении формата ответов отчетов
 
 EMPTY_OFFER_ID = "lost_discounted"
+SHOPS_NOT_FOUND = {"Error": "Shops not found."}
 
+# общий буфер на процесс, пишется на диск пачками
+image_not_found_logger = FileLogger(settings.TMP_DIR / "primary_image_not_found.log")
 
-class AnalyticsListView(APIView):
-    authentication_classes = [TokenAuthentication, SessionAuthentication]
-    permission_classes = [IsAuthenticated]
+
+class ReadAPIView(APIView):
+    """Базовое представление отчетов только для чтения
+
+    Отчет описывается двумя методами: query строит запрос по доступным
+    магазинам, result готовит строки к ответу. Так один и тот же отчет
+    отдается синхронно (get) и асинхронно (as_async_view).
+    """
+
+    # выгрузка изменений (since=): отчет в api_changelog и параметры запроса
+    changes = None
+    # Google Sheets: поля comma_fields отдаются строками с запятой вместо точки
+    # (FastJSONRenderer, если decimal_comma), NULL в них - 0
+    comma_fields = []
+    decimal_comma = False
+    # выгрузка (export_query): значения как в БД, NULL остается NULL
+    raw_values = False
 
     def get(self, request, *args, **kwargs):
+        shop_ids = get_shop_ids(request.user, request.GET)
+        if not shop_ids:
+            return Response(SHOPS_NOT_FOUND)
+        etag = self.etag(request, shop_ids)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            sql, params = self.query(request, shop_ids)
+            response = Response(
+                self.result(request, shop_ids, fetch_raw_sql(sql, params))
+            )
+        return set_etag(response, etag)
+
+    def prepare(self, request):
+        """Аутентификация, проверка прав и выбор магазинов
+
+        :param request:
+        :return: ID магазинов
+        """
+        self.initial(request)
+        return get_shop_ids(request.user, request.GET)
+
+    def query(self, request, shop_ids):
+        raise NotImplementedError
+
+    def result(self, request, shop_ids, rows):
+        raise NotImplementedError
+
+    def etag(self, request, shop_ids):
+        return report_etag(request, shop_ids, type(self).__name__)
+
+    def convert_values(self, request):
+        """Конвертировать значения для Google Sheets
+
+        :param request:
+        :return: bool
+        """
+        return not self.raw_values and (
+            DEFAULT_CONVERT_DECIMAL or "convert_values" in request.GET
+        )
+
+    def comma_columns(self, request, fields):
+        """Колонки запроса для Google Sheets: 0 вместо NULL в comma_fields
+
+        Запятую ставит FastJSONRenderer при кодировании любого Decimal,
+        отдельного прохода по строкам нет. Поэтому numeric в запросе - ровно
+        comma_fields (decimal-поля модели и перечисленные поля), float-поля
+        из них приводятся к numeric в самом запросе.
+
+        :param request:
+        :param fields: колонки SELECT, "выражение as имя" или "таблица.имя"
+        :return: fields
+        """
+        self.decimal_comma = self.convert_values(request)
+        if not self.decimal_comma:
+            return fields
+        return [zero_null(f, self.comma_fields) for f in fields]
+
+    def changes_result(self, result):
+        """Измененные дни и следующая метка since для запроса с since=
+
+        Дни без строк (строки удалены) тоже в changed: клиент заменяет
+        строки этих дней целиком.
+
+        :param result: ответ отчета
+        :return: result
+        """
+        if self.changes is None:
+            return result
+        report, params = self.changes
+        sql = f"""
+        {changes_cte(report)}
+        SELECT shop_id, date FROM changed ORDER BY date DESC, shop_id
+        """
+        result["result"]["since"] = params["till"]
+        result["result"]["changed"] = fetch_raw_sql(sql, params)
+        return result
+
+    @classmethod
+    def as_async_view(cls):
+        return AsyncReadView.as_view(view_class=cls)
+
+
+class AsyncReadView(View):
+    """Асинхронное представление для ReadAPIView
+
+    Тяжелый запрос выполняется асинхронным драйвером, поэтому отчеты разных
+    пользователей перекрываются в одном процессе ASGI-сервера. Аутентификация,
+    выбор магазинов и подготовка ответа синхронные (DRF, кеш, ORM) и
+    выполняются в пуле потоков, не блокируя event loop.
+    """
+
+    view_class = None
+
+    async def get(self, request, *args, **kwargs):
+        view = self.view_class(args=args, kwargs=kwargs, headers={})
+        drf_request = view.initialize_request(request, *args, **kwargs)
+        view.request = drf_request
+        try:
+            view.format_kwarg = view.get_format_suffix(**kwargs)
+            shop_ids = await run_in_thread(view.prepare, drf_request)
+            if not shop_ids:
+                response = Response(SHOPS_NOT_FOUND)
+            else:
+                etag = await run_in_thread(view.etag, drf_request, shop_ids)
+                response = get_conditional_response(drf_request, etag=etag)
+                if response is None:
+                    sql, params = view.query(drf_request, shop_ids)
+                    rows = await async_fetch_raw_sql(sql, params)
+                    response = Response(
+                        await run_in_thread(view.result, drf_request, shop_ids, rows)
+                    )
+                set_etag(response, etag)
+        except Exception as exc:
+            response = view.handle_exception(exc)
+
+        response = view.finalize_response(drf_request, response, *args, **kwargs)
+        if isinstance(response, Response):
+            response.render()
+        return response
+
+
+def report_etag(request, shop_ids, name):
+    """ETag отчета без выполнения запроса
+
+    Строится из версий данных магазинов (меняются после задач загрузки),
+    названий магазинов, параметров GET, Accept и текущей даты (before по
+    умолчанию). Повторный запрос с If-None-Match получает 304 до запроса к БД.
+
+    :param request:
+    :param shop_ids:
+    :param name: название отчета
+    :return: ETag в кавычках
+    """
+    key = [
+        ETAG_VERSION,
+        name,
+        list(shop_ids),
+        get_shop_versions(shop_ids),
+        get_shop_names(request.user, shop_ids),
+        sorted(request.GET.lists()),
+        request.META.get("HTTP_ACCEPT", ""),
+        date.today().isoformat(),
+    ]
+    return f'"{hashlib.md5(json.dumps(key).encode()).hexdigest()}"'
+
+
+def set_etag(response, etag):
+    """ETag ответа, клиент проверяет его при каждом запросе
+
+    :param response: ответ или 304
+    :param etag:
+    :return: response
+    """
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def run_in_thread(func, *args):
+    """Синхронный вызов в пуле потоков
+
+    Соединения с БД у каждого потока свои, закрываем их по тем же правилам,
+    что и в конце синхронного запроса (CONN_MAX_AGE).
+
+    :param func:
+    :param args:
+    :return: awaitable с результатом func
+    """
+
+    def call():
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(call, thread_sensitive=False)()
+
+
+class AnalyticsListView(ReadAPIView):
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+    comma_fields = [
+        "revenue",
+        "adv_sum_all",
+        "position_category",
+        "ma7_ordered_units",
+        "avg_price",
+        "selfbuy_amount",
+        "premium",
+        "rassrochka",
+        "adv_promo_bid",
+        "ma30_avg_price",
+    ]
+
+    def query(self, request, shop_ids):
         """
         Возвращает данные аналитики для таблицы Статистика за X дней до Y даты
 
@@ -39,21 +272,26 @@ class AnalyticsListView(APIView):
         * shop_id - фильтр по магазину (по умолчанию отсутствуют)
         * days - кол-во дней статистики (по умолчанию 60)
         * before - дата, до которой выводить данные (по умолчанию текущая дата)
+        * granularity - day (по умолчанию), week или month: итоги за неделю или месяц,
+          date - первый день периода
+        * since - только дни, измененные после метки since из прошлого ответа
         * convert_values - конвертировать данные для Google.Sheets (заменяет . на ,)
 
         Наличие товара в справочнике необязательно, так как в аналитике присуствуют уцененные товары.
 
         :param request:
-        :param args:
-        :param kwargs:
-        :return:
+        :param shop_ids:
+        :return: запрос и параметры
         """
         # print(args, kwargs, "convert_values" in request.GET)
-        shop_ids = get_shop_ids(request.user, request.GET)
-        if not shop_ids:
-            return Response({"Error": f"Shops not found."})
         page = int(request.GET.get("page", 0))
         limit = int(request.GET.get("limit", RETURN_MAX_ROWS))
+        granularity = get_granularity(request.GET)
+        since = get_since(request.GET)
+        if granularity != "day":
+            if since is not None:
+                raise ValidationError({"Error": "since is only for granularity=day"})
+            return self.rollup_query(request, shop_ids, granularity, page, limit)
 
         fields = [
             "ms.name as shop",
@@ -96,7 +334,14 @@ class AnalyticsListView(APIView):
             "as ma30_avg_price",
             "moso.type",
         ]
-
+        date_from = "(%(before)s::date - %(days)s::interval)"
+        if since is not None:
+            fields.append("moa.shop_id")
+            # скользящим средним нужны 30 дней до первого измененного дня
+            date_from = f"""GREATEST({date_from},
+                COALESCE((SELECT MIN(date) FROM changed) - 29, %(before)s::date + 1))"""
+
+        fields = self.comma_columns(request, fields)
         sql = f"""
         SELECT 
             {', '.join(fields)}
@@ -104,43 +349,104 @@ class AnalyticsListView(APIView):
         INNER JOIN mp_shop ms ON moa.shop_id = ms.id
         LEFT JOIN mp_ozon_sku_offer moso ON moa.sku = moso.sku
         LEFT JOIN api_daily ad ON moa.shop_id = ad.shop_id AND moa.date = ad.date AND moa.sku = ad.sku 
-        WHERE moa.shop_id IN %(shop_ids)s AND moa.date BETWEEN (DATE(%(before)s) - INTERVAL %(days)s) AND %(before)s
+        WHERE moa.shop_id = ANY(%(shop_ids)s) AND moa.date BETWEEN {date_from} AND %(before)s::date
         WINDOW w_popular AS (PARTITION BY moso.offer_id, moa.date ORDER BY moa.session_view DESC),
                w_sma30 AS (PARTITION BY moa.sku ORDER BY moa.date ROWS BETWEEN 29 PRECEDING AND CURRENT ROW),       
                w_sma7 AS (PARTITION BY moa.sku ORDER BY moa.date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW),
                w_sma3 AS (PARTITION BY moa.sku ORDER BY moa.date ROWS BETWEEN 2 PRECEDING AND CURRENT ROW)
+        """
+        if since is None:
+            sql += """
         ORDER BY 
             moa.date DESC, 
             moso.offer_id ASC
-        LIMIT {limit} OFFSET {page * limit}; 
+            """
+        else:
+            # измененные дни отбираются после расчета окон
+            sql = f"""
+            {changes_cte("analytics")}
+            SELECT * FROM ({sql}) q
+            WHERE (q.shop_id, q.date) IN (SELECT shop_id, date FROM changed)
+            ORDER BY q.date DESC, q.offer_id ASC
+            """
+        sql += f"LIMIT {limit} OFFSET {page * limit};"
+
+        params = {
+            "shop_ids": list(shop_ids),
+            "before": request.GET.get("before", date.today().strftime("%Y-%m-%d")),
+            "days": f"{request.GET.get('days', DAYS_DEFAULT)} day",
+        }
+        if since is not None:
+            params.update(changes_params(since))
+            self.changes = ("analytics", params)
+        return sql, params
+
+    def rollup_query(self, request, shop_ids, granularity, page, limit):
+        """Аналитика по неделям или месяцам из api_analyticsrollup
+
+        Скользящих средних нет, вместо ma30_avg_price - avg_price за период.
+
+        :param request:
+        :param shop_ids:
+        :param granularity: week, month
+        :param page:
+        :param limit:
+        :return: запрос и параметры
         """
-        rows = fetch_raw_sql(
-            sql,
-            {
-                "shop_ids": shop_ids,
-                "before": request.GET.get("before", date.today().strftime("%Y-%m-%d")),
-                "days": f"{request.GET.get('days', DAYS_DEFAULT)} day",
-            },
-        )
+        sums = [f"ar.{f}" for f in ANALYTICS_SUMS]
+        fields = [
+            "ms.name as shop",
+            f"CASE WHEN moso.offer_id IS NULL THEN '{EMPTY_OFFER_ID}' ELSE moso.offer_id END as offer_id",
+            "CASE WHEN moso.type = 'discounted' and dr.stocks > 1 THEN 1 ELSE dr.stocks END as stocks",
+            "ar.sku",
+            "ar.period as date",
+            "ar.days",
+            *sums,
+            "CASE WHEN ROW_NUMBER() OVER w_popular = 1 "
+            "THEN -ROUND(ar.position_category, 2) ELSE 0 END as position_category",
+            "dr.selfbuy_cnt",
+            "dr.selfbuy_amount",
+            "-dr.premium as premium",
+            "-dr.rassrochka as rassrochka",
+            "CASE WHEN ROW_NUMBER() OVER w_popular = 1 THEN ROUND(dr.adv_promo_bid/100, 2) ELSE 0 END "
+            "as adv_promo_bid",
+            "CASE WHEN ROW_NUMBER() OVER w_popular = 1 THEN dr.adv_promo_visibility ELSE 0 END "
+            "as adv_promo_visibility",
+            "ROUND(ar.revenue / NULLIF(ar.ordered_units, 0), 2) as avg_price",
+            "moso.type",
+        ]
 
-        if DEFAULT_CONVERT_DECIMAL or "convert_values" in request.GET:
-            rows = convert_float(
-                rows,
-                Analytics,
-                fields=[
-                    "ma7_ordered_units",
-                    "selfbuy_amount",
-                    "premium",
-                    "rassrochka",
-                    "adv_promo_bid",
-                    "ma30_avg_price",
-                ],
-            )
+        fields = self.comma_columns(request, fields)
+        sql = f"""
+        SELECT 
+            {', '.join(fields)}
+        FROM api_analyticsrollup ar
+        INNER JOIN mp_shop ms ON ar.shop_id = ms.id
+        LEFT JOIN mp_ozon_sku_offer moso ON ar.sku = moso.sku
+        LEFT JOIN api_dailyrollup dr ON ar.shop_id = dr.shop_id AND ar.granularity = dr.granularity
+            AND ar.period = dr.period AND ar.sku = dr.sku
+        WHERE ar.shop_id = ANY(%(shop_ids)s) AND ar.granularity = %(granularity)s
+            AND ar.period BETWEEN date_trunc(%(granularity)s, %(before)s::date - %(days)s::interval)::date
+            AND %(before)s::date
+        WINDOW w_popular AS (PARTITION BY moso.offer_id, ar.period ORDER BY ar.session_view DESC)
+        ORDER BY 
+            ar.period DESC, 
+            moso.offer_id ASC
+        LIMIT {limit} OFFSET {page * limit}; 
+        """
+        return sql, {
+            "shop_ids": list(shop_ids),
+            "granularity": granularity,
+            "before": request.GET.get("before", date.today().strftime("%Y-%m-%d")),
+            "days": f"{request.GET.get('days', DAYS_DEFAULT)} day",
+        }
 
-        return Response(
+    def result(self, request, shop_ids, rows):
+        page = int(request.GET.get("page", 0))
+        return self.changes_result(
             {
                 "result": {
-                    "shop": [str(s) for s in Shop.objects.filter(id__in=shop_ids)],
+                    "shop": get_shop_names(request.user, shop_ids),
                     "page": page,
                     "count": len(rows),
                     "items": rows,
@@ -149,11 +455,12 @@ class AnalyticsListView(APIView):
         )
 
 
-class AdvertizingStatisticsListView(APIView):
-    authentication_classes = [TokenAuthentication, SessionAuthentication]
+class AdvertizingStatisticsListView(ReadAPIView):
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
+    comma_fields = ["expense", "price", "revenue"]
 
-    def get(self, request, *args, **kwargs):
+    def query(self, request, shop_ids):
         """
         Возвращает данные статистики по рекламным кампаниям
 
@@ -161,18 +468,19 @@ class AdvertizingStatisticsListView(APIView):
         * shop_id - фильтр по магазину (по умолчанию отсутствуют)
         * days - кол-во дней статистики (по умолчанию 60)
         * before - дата, до которой выводить данные (по умолчанию текущая дата)
+        * granularity - day (по умолчанию), week или month: итоги за неделю или месяц,
+          dt - первый день периода
         * convert_values - конвертировать данные для Google.Sheets (заменяет . на ,)
 
         :param request:
-        :param args:
-        :param kwargs:
-        :return:
+        :param shop_ids:
+        :return: запрос и параметры
         """
-        shop_ids = get_shop_ids(request.user, request.GET)
-        if not shop_ids:
-            return Response({"Error": f"Shops not found."})
         page = int(request.GET.get("page", 0))
         limit = int(request.GET.get("limit", RETURN_MAX_ROWS))
+        granularity = get_granularity(request.GET)
+        if granularity != "day":
+            return self.rollup_query(request, shop_ids, granularity, page, limit)
 
         fields = [
             f"CASE WHEN moso.offer_id IS NULL THEN '{EMPTY_OFFER_ID}' ELSE moso.offer_id END as offer_id",
@@ -189,6 +497,7 @@ class AdvertizingStatisticsListView(APIView):
             "ms.name as shop",
         ]
 
+        fields = self.comma_columns(request, fields)
         sql = f"""
         SELECT 
             {', '.join(fields)}
@@ -196,41 +505,96 @@ class AdvertizingStatisticsListView(APIView):
         LEFT JOIN mp_ozon_sku_offer moso ON mos.sku = moso.sku
         INNER JOIN mp_ozon_campaign moc ON moc.id = mos.campaign_id
         INNER JOIN mp_shop ms ON moc.shop_id = ms.id
-        WHERE moc.shop_id IN %(shop_ids)s AND mos.dt BETWEEN (DATE(%(before)s) - INTERVAL %(days)s) 
-            AND %(before)s
+        WHERE moc.shop_id = ANY(%(shop_ids)s) AND mos.dt BETWEEN (%(before)s::date - %(days)s::interval) 
+            AND %(before)s::date
         GROUP BY moso.offer_id, mos.sku, moc.id, mos.page, mos.dt, ms.id 
         ORDER BY dt DESC, campaign_id, offer_id
         LIMIT {limit} OFFSET {page * limit}; 
         """
-        rows = fetch_raw_sql(
-            sql,
-            {
-                "shop_ids": shop_ids,
-                "before": request.GET.get("before", date.today().strftime("%Y-%m-%d")),
-                "days": f"{request.GET.get('days', DAYS_DEFAULT)} day",
-            },
-        )
+        return sql, {
+            "shop_ids": list(shop_ids),
+            "before": request.GET.get("before", date.today().strftime("%Y-%m-%d")),
+            "days": f"{request.GET.get('days', DAYS_DEFAULT)} day",
+        }
 
-        if DEFAULT_CONVERT_DECIMAL or "convert_values" in request.GET:
-            rows = convert_float(rows, StatisticsCampaignProduct)
+    def rollup_query(self, request, shop_ids, granularity, page, limit):
+        """Статистика рекламы по неделям или месяцам из api_advertizingrollup
 
-        return Response(
-            {
-                "result": {
-                    "shop": [str(s) for s in Shop.objects.filter(id__in=shop_ids)],
-                    "page": page,
-                    "count": len(rows),
-                    "items": rows,
-                }
+        :param request:
+        :param shop_ids:
+        :param granularity: week, month
+        :param page:
+        :param limit:
+        :return: запрос и параметры
+        """
+        fields = [
+            f"CASE WHEN moso.offer_id IS NULL THEN '{EMPTY_OFFER_ID}' ELSE moso.offer_id END as offer_id",
+            "moc.id as campaign_id",
+            "moc.adv_type",
+            "NULLIF(ar.page, '') as page",
+            "ar.period as dt",
+            "ar.views",
+            "ar.clicks",
+            "ar.expense",
+            "ar.orders",
+            "ar.revenue",
+            "(moc.state = 'CAMPAIGN_STATE_RUNNING')::int as is_active",
+            "ms.name as shop",
+        ]
+
+        fields = self.comma_columns(request, fields)
+        sql = f"""
+        SELECT 
+            {', '.join(fields)}
+        FROM api_advertizingrollup ar
+        LEFT JOIN mp_ozon_sku_offer moso ON ar.sku = moso.sku
+        INNER JOIN mp_ozon_campaign moc ON moc.id = ar.campaign_id
+        INNER JOIN mp_shop ms ON ar.shop_id = ms.id
+        WHERE ar.shop_id = ANY(%(shop_ids)s) AND ar.granularity = %(granularity)s
+            AND ar.period BETWEEN date_trunc(%(granularity)s, %(before)s::date - %(days)s::interval)::date
+            AND %(before)s::date
+        ORDER BY dt DESC, campaign_id, offer_id
+        LIMIT {limit} OFFSET {page * limit}; 
+        """
+        return sql, {
+            "shop_ids": list(shop_ids),
+            "granularity": granularity,
+            "before": request.GET.get("before", date.today().strftime("%Y-%m-%d")),
+            "days": f"{request.GET.get('days', DAYS_DEFAULT)} day",
+        }
+
+    def result(self, request, shop_ids, rows):
+        page = int(request.GET.get("page", 0))
+        return {
+            "result": {
+                "shop": get_shop_names(request.user, shop_ids),
+                "page": page,
+                "count": len(rows),
+                "items": rows,
             }
-        )
+        }
 
 
-class TransactionsListView(APIView):
-    authentication_classes = [TokenAuthentication, SessionAuthentication]
+class TransactionsListView(ReadAPIView):
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
+    comma_fields = [
+        "accruals_for_sale",
+        "amount",
+        "sale_commission",
+        "services_amount",
+        "price",
+        "calc_accruals_for_sale",
+        "calc_amount",
+        "comission",
+        "fulfillment",
+        "direct_flow_trans",
+        "deliv_to_customer",
+        "calc_revenue",
+        "calc_payment",
+    ]
 
-    def get(self, request, *args, **kwargs):
+    def query(self, request, shop_ids):
         """
         Возвращает список транзакций
 
@@ -238,6 +602,7 @@ class TransactionsListView(APIView):
         * shop_id - фильтр по магазину (по умолчанию отсутствуют)
         * days - кол-во дней статистики (по умолчанию 60)
         * before - дата, до которой выводить данные (по умолчанию текущая дата)
+        * since - только дни, измененные после метки since из прошлого ответа
         * convert_values - конвертировать данные для Google.Sheets (заменяет . на ,)
 
         Errors:
@@ -245,154 +610,81 @@ class TransactionsListView(APIView):
         что не возвращается fbo-сборка и магистраль. Например, 35674785-0102-2.
 
         :param request:
-        :param args:
-        :param kwargs:
-        :return:
+        :param shop_ids:
+        :return: запрос и параметры
         """
-        shop_ids = get_shop_ids(request.user, request.GET)
-        if not shop_ids:
-            return Response({"Error": f"Shops not found."})
         page = int(request.GET.get("page", 0))
         limit = int(request.GET.get("limit", RETURN_MAX_ROWS))
 
-        fields_01 = [
-            "ms.name as shop",
-            "mot.operation_type_name",
-            "CASE WHEN mot.posting_number is not null THEN mot.posting_number ELSE mof.posting_number END "
-            "as posting_number",
-            "to_char(mof.created_at, 'YYYY-MM-DD HH24:MI:SS') as order_date",
-            "to_char(mot.operation_date, 'YYYY-MM-DD HH24:MI:SS') as operation_date",
-            "mof.status",
-            "CASE WHEN mofp.sku is not null THEN mofp.sku ELSE mot.sku END as sku",
-            "mop.offer_id",
-            "CASE WHEN mofp.quantity is not null THEN mofp.quantity "
-            "WHEN mot.type = 'compensation' THEN json_array_length(mot.items::json) END "
-            "as quantity",
-            "mofp.price",
-            "mofp.quantity * mofp.commission_amount as comission",
-            "CASE WHEN (mofp.item_services::json->>'marketplace_service_item_fulfillment')::numeric = 0 AND mot.sku_cnt = 1 "
-            "THEN (mot.services_amount - (mofp.item_services::json->>'marketplace_service_item_deliv_to_customer')::numeric)  "
-            "ELSE (mofp.item_services::json->>'marketplace_service_item_fulfillment')::numeric END "
-            "as fulfillment",
-            "(mofp.item_services::json->>'marketplace_service_item_direct_flow_trans')::numeric as direct_flow_trans",
-            "(mofp.item_services::json->>'marketplace_service_item_deliv_to_customer')::numeric as deliv_to_customer",
-            "CASE WHEN mot.sku_cnt > 1 AND mot.operation_type = 'OperationAgentDeliveredToCustomer' THEN "
-            "mofp.quantity * mofp.price ELSE mot.accruals_for_sale END "
-            "as calc_revenue",
-            "CASE WHEN mot.sku_cnt > 1 AND mot.operation_type = 'OperationAgentDeliveredToCustomer' THEN "
-            "mofp.quantity * mofp.price - mofp.quantity * mofp.commission_amount "
-            "+ (mofp.item_services::json->>'marketplace_service_item_fulfillment')::numeric "
-            "+ (mofp.item_services::json->>'marketplace_service_item_direct_flow_trans')::numeric "
-            "+ (mofp.item_services::json->>'marketplace_service_item_deliv_to_customer')::numeric "
-            "ELSE mot.amount END "
-            "as calc_payment",
-            "mot.sale_commission",
-            "mot.services_amount",
-            "mot.operation_type",
-            "mot.type",
-            "CASE WHEN mof.posting_number is null THEN mot.items::json->0->>'name' "
-            "ELSE mot.operation_type_name END "
-            "as basis",
-            "(mof.analytics_data::json->>'delivery_type') as delivery_type",
-            "(mof.analytics_data::json->>'warehouse_name') as warehouse",
-            "(mof.analytics_data::json->>'region') as region",
-            "(mof.analytics_data::json->>'city') as city",
-            "mof.id as fbo_id",
-            "mot.id as transaction_id",
-            "CASE WHEN mof.created_at IS NOT NULL THEN mof.created_at ELSE operation_date END as sort_date",
-            "1 as query",
-        ]
-
-        fields_02 = [
+        fields = [
             "ms.name as shop",
-            "null as operation_type_name",
-            "mof.posting_number",
-            "to_char(mof.created_at, 'YYYY-MM-DD HH24:MI:SS') as order_date",
-            "null as operation_date",
-            "mof.status",
-            "mofp.sku",
-            "mop.offer_id",
-            "mofp.quantity",
-            "mofp.price",
-            "mofp.quantity * mofp.commission_amount as comission",
-            "(mofp.item_services::json->>'marketplace_service_item_fulfillment')::numeric as fulfillment",
-            "(mofp.item_services::json->>'marketplace_service_item_direct_flow_trans')::numeric as direct_flow_trans",
-            "(mofp.item_services::json->>'marketplace_service_item_deliv_to_customer')::numeric as deliv_to_customer",
-            "null as calc_revenue",
-            "null as calc_payment",
-            "null as sale_commission",
-            "null as services_amount",
-            "null as operation_type",
-            "null as type",
-            "null as basis",
-            "null as delivery_type",
-            "null as warehouse",
-            "null as region",
-            "null as city",
-            "mof.id as fbo_id",
-            "null as transaction_id",
-            "mof.created_at as sort_date",
-            "2 as query",
+            "l.operation_type_name",
+            "l.posting_number",
+            "to_char(l.order_date, 'YYYY-MM-DD HH24:MI:SS') as order_date",
+            "to_char(l.operation_date, 'YYYY-MM-DD HH24:MI:SS') as operation_date",
+            "l.status",
+            "l.sku",
+            "l.offer_id",
+            "l.quantity",
+            "l.price",
+            "l.comission",
+            "l.fulfillment",
+            "l.direct_flow_trans",
+            "l.deliv_to_customer",
+            "l.calc_revenue",
+            "l.calc_payment",
+            "l.sale_commission",
+            "l.services_amount",
+            "l.operation_type",
+            "l.type",
+            "l.basis",
+            "l.delivery_type",
+            "l.warehouse",
+            "l.region",
+            "l.city",
+            "l.fbo_id",
+            "l.transaction_id",
+            "l.sort_date",
+            "l.query",
         ]
+        since = get_since(request.GET)
+        changed = ""
+        if since is not None:
+            fields.append("l.shop_id")
+            changed = (
+                "AND (l.shop_id, l.filter_date) IN (SELECT shop_id, date FROM changed)"
+            )
 
+        # строки связаны с отправлениями при загрузке, см. Update_Ledger
+        fields = self.comma_columns(request, fields)
         sql = f"""
-        (
-        SELECT 
-            {', '.join(fields_01)}
-        FROM mp_ozon_transaction mot
-        INNER JOIN mp_shop ms ON mot.shop_id = ms.id
-        LEFT JOIN mp_ozon_fbo mof ON mot.shop_id = mof.shop_id AND mot.type = 'orders' AND mot.posting_number = mof.posting_number
-        LEFT JOIN mp_ozon_fbo_product mofp ON mofp.order_id = mof.id
-        LEFT JOIN mp_ozon_product mop ON mop.id = mofp.product_id OR (mot.sku > 0 AND mop.fbo_sku = mot.sku)
-        WHERE mot.shop_id IN %(shop_ids)s 
-            AND DATE(mot.operation_date) BETWEEN (DATE(%(before)s) - INTERVAL %(days)s) AND %(before)s        
-        
-        ) UNION (
-        
+        {changes_cte("transactions") if since is not None else ""}
         SELECT 
-            {', '.join(fields_02)}
-        FROM mp_ozon_fbo mof
-        INNER JOIN mp_shop ms ON mof.shop_id = ms.id
-        LEFT JOIN mp_ozon_fbo_product mofp ON mofp.order_id = mof.id
-        LEFT JOIN mp_ozon_product mop ON mop.id = mofp.product_id
-        WHERE 
-            mof.posting_number not in (SELECT posting_number FROM mp_ozon_transaction mot WHERE posting_number is not null AND shop_id IN %(shop_ids)s) 
-            AND mof.shop_id IN %(shop_ids)s 
-            AND DATE(mof.created_at) BETWEEN (DATE(%(before)s) - INTERVAL %(days)s) AND %(before)s     
-        )
-        ORDER BY sort_date DESC
+            {', '.join(fields)}
+        FROM {Ledger._meta.db_table} l
+        INNER JOIN mp_shop ms ON l.shop_id = ms.id
+        WHERE l.shop_id = ANY(%(shop_ids)s) 
+            AND l.filter_date BETWEEN (%(before)s::date - %(days)s::interval) AND %(before)s::date
+            {changed}
+        ORDER BY l.sort_date DESC
         LIMIT {limit} OFFSET {page * limit}; 
         """
-        rows = fetch_raw_sql(
-            sql,
-            {
-                "shop_ids": shop_ids,
-                "before": request.GET.get("before", date.today().strftime("%Y-%m-%d")),
-                "days": f"{request.GET.get('days', TRANSACTION_DAYS_DEFAULT)} day",
-            },
-        )
-
-        if DEFAULT_CONVERT_DECIMAL or "convert_values" in request.GET:
-            rows = convert_float(
-                rows,
-                Transaction,
-                fields=[
-                    "price",
-                    "calc_accruals_for_sale",
-                    "calc_amount",
-                    "comission",
-                    "fulfillment",
-                    "direct_flow_trans",
-                    "deliv_to_customer",
-                    "calc_revenue",
-                    "calc_payment",
-                ],
-            )
+        params = {
+            "shop_ids": list(shop_ids),
+            "before": request.GET.get("before", date.today().strftime("%Y-%m-%d")),
+            "days": f"{request.GET.get('days', TRANSACTION_DAYS_DEFAULT)} day",
+        }
+        if since is not None:
+            params.update(changes_params(since))
+            self.changes = ("transactions", params)
+        return sql, params
 
-        return Response(
+    def result(self, request, shop_ids, rows):
+        page = int(request.GET.get("page", 0))
+        return self.changes_result(
             {
                 "result": {
-                    "shop": [str(s) for s in Shop.objects.filter(id__in=shop_ids)],
+                    "shop": get_shop_names(request.user, shop_ids),
                     "page": page,
                     "count": len(rows),
                     "items": rows,
@@ -402,7 +694,7 @@ class TransactionsListView(APIView):
 
 
 class ProfileView(APIView):
-    authentication_classes = [TokenAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request, format=None):
@@ -413,15 +705,28 @@ class ProfileView(APIView):
         return Response(content)
 
 
-class ProductsListView(APIView):
+class ProductsListView(ReadAPIView):
     authentication_classes = [
-        TokenAuthentication,
+        CachedTokenAuthentication,
         SessionAuthentication,
         JWTAuthentication,
     ]
     permission_classes = [IsAuthenticated]
+    comma_fields = [
+        "price_index",
+        "min_price",
+        "marketing_price",
+        "volume_weight",
+        # float-поля, в запросе приводятся к numeric
+        "commission",
+        "commission_amount",
+        "fbo_amount",
+        "fbo_return_amount",
+        "fbs_amount",
+        "fbs_return_amount",
+    ]
 
-    def get(self, request, *args, **kwargs):
+    def query(self, request, shop_ids):
         """
         Возвращает список товаров с полезными данными
 
@@ -432,13 +737,9 @@ class ProductsListView(APIView):
         * convert_values - конвертировать данные для Google.Sheets (заменяет . на ,)
 
         :param request:
-        :param args:
-        :param kwargs:
-        :return:
+        :param shop_ids:
+        :return: запрос и параметры
         """
-        shop_ids = get_shop_ids(request.user, request.GET)
-        if not shop_ids:
-            return Response({"Error": f"Shops not found."})
 
         fields = [
             "mop.id",
@@ -447,8 +748,8 @@ class ProductsListView(APIView):
             "price_index",
             "min_price",
             "marketing_price",
-            "json_array_length(images::json) as images_cnt",
-            "json_array_length(images360::json) as images360_cnt",
+            "mopp.images_cnt",
+            "mopp.images360_cnt",
             "fbo.present as fbo_present",
             "fbo.reserved as fbo_reserved",
             "coalesce(mow_horug.for_sale, 0) as horug",
@@ -470,8 +771,8 @@ class ProductsListView(APIView):
             "fbs.present as fbs_present",
             "fbs.reserved as fbs_reserved",
             "mocp.campaign_cnt",
-            "json_array_length(marketing_actions::json->'actions') as action_cnt",
-            "(commissions::json->>'sales_percent')::float / 100 as commission",
+            "mopp.action_cnt",
+            "(mopp.sales_percent / 100)::numeric as commission",
             "volume_weight",
             "mop.shop_id",
             "ms.name as shop",
@@ -480,27 +781,23 @@ class ProductsListView(APIView):
             "mop.youtube",
             "mop.video_review",
             # comissions
-            "marketing_price * (commissions::json->>'sales_percent')::float / 100 as commission_amount",
+            "(marketing_price * mopp.sales_percent / 100)::numeric as commission_amount",
             # fbo
-            "(commissions::json->>'fbo_fulfillment_amount')::float "
-            "+ (commissions::json->>'fbo_direct_flow_trans_max_amount')::float "
-            "+ (commissions::json->>'fbo_deliv_to_customer_amount')::float as fbo_amount",
-            "(commissions::json->>'fbo_return_flow_amount')::float "
-            "+ (commissions::json->>'fbo_return_flow_trans_max_amount')::float as fbo_return_amount",
+            "mopp.fbo_amount::numeric as fbo_amount",
+            "mopp.fbo_return_amount::numeric as fbo_return_amount",
             # fbs
-            "(commissions::json->>'fbs_first_mile_max_amount')::float "
-            "+ (commissions::json->>'fbs_direct_flow_trans_max_amount')::float "
-            "+ (commissions::json->>'fbs_deliv_to_customer_amount')::float as fbs_amount",
-            "(commissions::json->>'fbs_return_flow_amount')::float "
-            "+ (commissions::json->>'fbs_return_flow_trans_max_amount')::float as fbs_return_amount",
+            "mopp.fbs_amount::numeric as fbs_amount",
+            "mopp.fbs_return_amount::numeric as fbs_return_amount",
             "mop.primary_image",
         ]
 
+        fields = self.comma_columns(request, fields)
         sql = f"""
         SELECT 
             {', '.join(fields)}        
         FROM mp_ozon_product mop 
         INNER JOIN mp_shop ms ON mop.shop_id = ms.id
+        LEFT JOIN {ParsedProduct._meta.db_table} mopp ON mopp.product_id = mop.id
         LEFT JOIN mp_ozon_stock fbo ON 
                 fbo.type = 'fbo' AND mop.id = fbo.product_id AND fbo."date" = (select max("date") from mp_ozon_stock)
         LEFT JOIN mp_ozon_stock fbs ON
@@ -572,45 +869,165 @@ class ProductsListView(APIView):
             WHERE moc.state = 'CAMPAIGN_STATE_RUNNING'
             GROUP BY product_id
         ) mocp ON mocp.product_id =  mop.id
-        WHERE mop.shop_id IN %(shop_ids)s AND (mop.state NOT IN %(state_not)s OR fbo.present > 0)
+        WHERE mop.shop_id = ANY(%(shop_ids)s) AND (mop.state <> ALL(%(state_not)s) OR fbo.present > 0)
         ORDER BY (fbo.present IS NOT NULL AND fbo.present > 0 AND mop.visible) DESC, ms.name, mop.offer_id
         """
-        rows = fetch_raw_sql(
-            sql,
-            {
-                "shop_ids": shop_ids,
-                "state_not": tuple(
-                    [
-                        "ARCHIVED",
-                    ]
-                ),
-            },
+        return sql, {
+            "shop_ids": list(shop_ids),
+            "state_not": [
+                "ARCHIVED",
+            ],
+        }
+
+    def convert_values(self, request):
+        return "no_convert_decimal" not in request.GET and super().convert_values(
+            request
         )
 
-        if "no_convert_decimal" not in request.GET:
-            if DEFAULT_CONVERT_DECIMAL or "convert_values" in request.GET:
-                rows = convert_float(
-                    rows,
-                    Product,
-                    fields=[
-                        "commission",
-                        "commission_amount",
-                        "fbo_amount",
-                        "fbo_return_amount",
-                        "fbs_amount",
-                        "fbs_return_amount",
-                    ],
-                )
-
-        return Response(
-            {
-                "result": {
-                    "shop": [str(s) for s in Shop.objects.filter(id__in=shop_ids)],
-                    "count": len(rows),
-                    "items": rows,
-                }
+    def result(self, request, shop_ids, rows):
+        return {
+            "result": {
+                "shop": get_shop_names(request.user, shop_ids),
+                "count": len(rows),
+                "items": rows,
             }
+        }
+
+
+class ExportView(APIView):
+    """Выгрузка отчета в Parquet или Arrow IPC stream
+
+    Параметры GET:
+    * output - parquet (по умолчанию) или arrow, format занят DRF
+    * columns - колонки через запятую (по умолчанию все)
+    * date_from, date_to - период (вместо days и before)
+    * shop_id, exclude_shop_id - магазины, как в отчетах
+
+    Все строки без page/limit, числа без замены . на ,
+    """
+
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, report=None):
+        view_class = EXPORT_VIEWS.get(report)
+        fmt = request.GET.get("output", "parquet")
+        if view_class is None or fmt not in EXPORT_FORMATS:
+            return Response({"Error": "Unknown report or format."}, status=400)
+
+        shop_ids = get_shop_ids(request.user, request.GET)
+        if not shop_ids:
+            return Response(SHOPS_NOT_FOUND)
+
+        etag = report_etag(request, shop_ids, f"export_{report}_{fmt}")
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return set_etag(not_modified, etag)
+
+        try:
+            sql, params = export_query(view_class, request.GET, shop_ids)
+            file, rows = export_file(sql, params, fmt)
+        except (ErrorExport, ValueError) as e:
+            return Response({"Error": f"{e}"}, status=400)
+
+        response = FileResponse(
+            file,
+            as_attachment=True,
+            filename=f"{report}.{fmt}",
+            content_type=EXPORT_FORMATS[fmt],
         )
+        response["X-Rows"] = rows
+        return set_etag(response, etag)
+
+
+def get_granularity(get_data):
+    """Период строк отчета из GET-параметра granularity
+
+    :param get_data:
+    :return: day, week, month
+    """
+    granularity = get_data.get("granularity", "day")
+    if granularity != "day" and granularity not in dict(ROLLUP_GRANULARITIES):
+        raise ValidationError({"Error": f"Unknown granularity: {granularity}"})
+    return granularity
+
+
+def get_since(get_data):
+    """Метка since= выгрузки изменений
+
+    :param get_data:
+    :return: datetime или None
+    """
+    since = get_data.get("since")
+    if not since:
+        return None
+    try:
+        since = datetime.fromisoformat(since)
+    except ValueError:
+        raise ValidationError({"Error": f"Wrong since: {since}"})
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since, dt_timezone.utc)
+    return since
+
+
+def changes_params(since):
+    """Параметры запроса изменений
+
+    Изменения ищутся с запасом CHANGES_OVERLAP до since: транзакция загрузки
+    может зафиксироваться позже времени изменения. Дни из запаса отдаются
+    повторно, клиент заменяет их строки целиком.
+
+    :param since: метка из прошлого ответа
+    :return: since и till - следующая метка
+    """
+    return {
+        "since": since - CHANGES_OVERLAP,
+        "till": timezone.now().strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+    }
+
+
+def changes_cte(report):
+    """Измененные дни отчета после since, в периоде отчета
+
+    :param report: analytics, transactions
+    :return: WITH changed AS (...)
+    """
+    return f"""
+    WITH changed AS (
+        SELECT shop_id, date FROM {ChangeLog._meta.db_table}
+        WHERE report = '{report}' AND shop_id = ANY(%(shop_ids)s) AND changed_at > %(since)s
+            AND date BETWEEN (%(before)s::date - %(days)s::interval) AND %(before)s::date
+    )"""
+
+
+def export_query(view_class, get_data, shop_ids):
+    """Запрос отчета для выгрузки: все строки, выбранные колонки, период
+
+    :param view_class: отчет из EXPORT_VIEWS
+    :param get_data: параметры GET, см. ExportView
+    :param shop_ids:
+    :return: запрос и параметры
+    """
+    data = get_data.copy()
+    data["page"] = 0
+    data["limit"] = EXPORT_MAX_ROWS
+    if data.get("date_to"):
+        data["before"] = date.fromisoformat(data["date_to"]).isoformat()
+    if data.get("date_from"):
+        before = date.fromisoformat(data.get("before", date.today().isoformat()))
+        data["days"] = (before - date.fromisoformat(data["date_from"])).days
+
+    view = view_class(raw_values=True)
+    sql, params = view.query(SimpleNamespace(GET=data), shop_ids)
+    columns = [c.strip() for c in data.get("columns", "").split(",") if c.strip()]
+    return select_columns(sql, columns), params
+
+
+EXPORT_VIEWS = {
+    "analytics": AnalyticsListView,
+    "advertizing": AdvertizingStatisticsListView,
+    "transactions": TransactionsListView,
+}
 
 
 async def product_image(request, *args, **kwargs):
@@ -621,19 +1038,22 @@ async def product_image(request, *args, **kwargs):
     if request.GET.get("s"):
         params["shop"] = request.GET.get("s")
 
-    try:
-        p = await sync_to_async(Product.objects.get, thread_sensitive=True)(**params)
-        url = p.primary_image
-    except Product.MultipleObjectsReturned:
-        url = ""
-    except Product.DoesNotExist:
-        url = ""
+    sql = f"""
+    SELECT primary_image FROM mp_ozon_product
+    WHERE offer_id = %(offer_id)s AND state = %(state)s
+        {'AND shop_id = %(shop)s::bigint' if "shop" in params else ''}
+    LIMIT 2
+    """
+    rows = await async_fetch_raw_sql(sql, params)
+    # несколько товаров с одним артикулом - картинку не выбираем
+    url = (rows[0]["primary_image"] or "") if len(rows) == 1 else ""
 
     if "http" not in url:
-        filelogger = FileLogger(settings.TMP_DIR / "primary_image_not_found.log")
-        filelogger.append(f"{datetime.now()} \tParams: {params}")
+        image_not_found_logger.append(f"{datetime.now()} \tParams: {params}")
         url = f"{request.scheme}://{request.get_host()}" + static("no-image.png")
 
+    import httpx
+
     async with httpx.AsyncClient(timeout=15) as client:
         r = await client.get(url)
         headers = r.headers
@@ -656,35 +1076,37 @@ def get_shop_ids(user, get_data):
     :param get_data:
     :return:
     """
-    params = {"user": user, "is_active": True}
-    exclude = {}
-    if get_data.get("shop_id"):
-        params["id__in"] = get_data.getlist("shop_id")
-        if user.is_superuser:
-            # remove user condition for superuser
-            del params["user"]
-    if get_data.get("exclude_shop_id"):
-        exclude["id__in"] = get_data.getlist("exclude_shop_id")
-    try:
-        shop_ids = tuple(
-            Shop.objects.filter(**params).exclude(**exclude).values_list(flat=True)
+    shop_ids = [int(i) for i in get_data.getlist("shop_id") if str(i).isdigit()]
+    exclude_ids = [
+        int(i) for i in get_data.getlist("exclude_shop_id") if str(i).isdigit()
+    ]
+    if get_data.get("shop_id") and user.is_superuser:
+        # remove user condition for superuser
+        return tuple(
+            Shop.objects.filter(id__in=shop_ids, is_active=True)
+            .exclude(id__in=exclude_ids)
+            .values_list(flat=True)
         )
-    except Shop.DoesNotExist:
-        return
-
-    return shop_ids
 
+    return tuple(
+        shop["id"]
+        for shop in get_user_shops(user)
+        if shop["is_active"]
+        and (not get_data.get("shop_id") or shop["id"] in shop_ids)
+        and shop["id"] not in exclude_ids
+    )
 
-def convert_float(rows, model, fields=[]):
-    FIELD_FLOAT = [
-        str(f).split(".")[-1]
-        for f in model._meta.get_fields()
-        if type(f).__name__ == "DecimalField"
-    ] + fields
 
-    for r in rows:
-        for f in FIELD_FLOAT:
-            if f in r:
-                r[f] = 0 if f not in r or r[f] is None else str(r[f]).replace(".", ",")
+def zero_null(field, names):
+    """0 вместо NULL в колонке SELECT, если ее имя в names
 
-    return rows
+    :param field: "выражение as имя" или "таблица.имя"
+    :param names: имена колонок
+    :return: колонка
+    """
+    expr, _, name = field.rpartition(" as ")
+    if not expr:
+        expr, name = field, field.split(".")[-1]
+    if name not in names:
+        return field
+    return f"COALESCE({expr}, 0) as {name}"
@@ -1,10 +1,12 @@
 import os
-import django
 from celery import Celery
 from django.conf import settings
 
+from mp.tasks import TASK_MODULES
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ka_space.settings")
-django.setup()
-app = Celery("ka_space")
+# django.setup() в worker вызывает fixup Celery при импорте модулей задач,
+# web и manage.py настраивают Django сами до импорта задач
+app = Celery("ka_space", include=["ka_space.tasks", *TASK_MODULES])
 app.config_from_object("django.conf:settings")
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
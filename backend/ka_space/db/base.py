@@ -0,0 +1,66 @@
+import functools
+import os
+
+import psycopg2.extras
+from django.db.backends.postgresql import base, creation
+
+from .pool import get_pool, close_pools
+
+
+def connect(conn_params, options):
+    """Новое соединение с теми же настройками, что у postgresql-бэкенда Django"""
+    connection = psycopg2.connect(**conn_params)
+    isolation_level = options.get("isolation_level")
+    if isolation_level is not None and isolation_level != connection.isolation_level:
+        connection.set_session(isolation_level=isolation_level)
+    psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+    return connection
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # свободные соединения пула не дадут удалить тестовую базу
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с пулом соединений процесса
+
+    Django закрывает соединение в конце запроса (CONN_MAX_AGE = 0) и после
+    каждой задачи Celery - соединение при этом возвращается в пул, а не
+    закрывается. Параметры пула в DATABASES[...]["POOL"]: MAX_SIZE, TIMEOUT,
+    CHECK_INTERVAL, MAX_LIFETIME (см. ka_space.db.pool.ConnectionPool).
+    """
+
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+
+    def get_new_connection(self, conn_params):
+        pool_settings = self.settings_dict.get("POOL") or {}
+        options = self.settings_dict["OPTIONS"]
+        self.pool = get_pool(
+            (self.alias, repr(sorted(conn_params.items()))),
+            functools.partial(connect, conn_params, options),
+            alias=self.alias,
+            max_size=pool_settings.get("MAX_SIZE", 10),
+            timeout=pool_settings.get("TIMEOUT", 30),
+            check_interval=pool_settings.get("CHECK_INTERVAL", 30),
+            max_lifetime=pool_settings.get("MAX_LIFETIME", 1800),
+        )
+        connection = self.pool.getconn()
+        self.isolation_level = options.get(
+            "isolation_level", connection.isolation_level
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                # соединение, открытое до fork, в пул дочернего процесса не кладем
+                if self.pool is not None and self.pool.pid == os.getpid():
+                    return self.pool.putconn(self.connection)
+                return self.connection.close()
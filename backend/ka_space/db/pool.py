@@ -0,0 +1,201 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from psycopg2 import extensions, OperationalError
+
+from ka_space.metrics import metric
+
+logger = logging.getLogger(__name__)
+
+POOL_WAIT = metric(
+    "Histogram",
+    "ka_db_pool_wait_seconds",
+    "Время получения соединения из пула",
+    ["alias"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+POOL_CONNECTIONS = metric(
+    "Gauge",
+    "ka_db_pool_connections",
+    "Соединения пула: занятые и свободные",
+    ["alias", "state"],
+    multiprocess_mode="livesum",
+)
+POOL_EVENTS = metric(
+    "Counter",
+    "ka_db_pool_events",
+    "Новые, закрытые и неполученные по таймауту соединения",
+    ["alias", "event"],
+)
+
+_pools = {}
+_pools_lock = threading.Lock()
+# пулы родителя после fork: соединения общие с родителем, закрывать их нельзя
+_inherited = []
+
+
+class ConnectionPool(object):
+    """Ограниченный пул соединений psycopg2 одного процесса
+
+    Соединений не больше max_size: когда все заняты, getconn ждет освобождения
+    до timeout секунд. Перед выдачей соединение проверяется: закрытые и старше
+    max_lifetime заменяются новыми, простоявшие дольше check_interval
+    проверяются запросом SELECT 1.
+    """
+
+    def __init__(
+        self,
+        connect,
+        alias="default",
+        max_size=10,
+        timeout=30,
+        check_interval=30,
+        max_lifetime=1800,
+    ):
+        self.connect = connect
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.max_lifetime = max_lifetime
+        self.pid = os.getpid()
+
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle = deque()  # (conn, released_at), последнее возвращенное - справа
+        self._created = {}  # id(conn) => created_at
+
+    def getconn(self):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            POOL_EVENTS.labels(self.alias, "timeout").inc()
+            raise ErrorPoolTimeout(
+                f"{self.alias}: нет свободного соединения за {self.timeout}s "
+                f"(max_size={self.max_size})"
+            )
+        try:
+            conn = self._take_idle() or self._new()
+        except Exception:
+            self._slots.release()
+            raise
+
+        POOL_WAIT.labels(self.alias).observe(time.monotonic() - start)
+        POOL_CONNECTIONS.labels(self.alias, "in_use").inc()
+        return conn
+
+    def putconn(self, conn):
+        """Возвращаем соединение, незавершенная транзакция откатывается
+
+        :param conn:
+        :return:
+        """
+        try:
+            status = None if conn.closed else conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_IDLE:
+                pass
+            elif status in (None, extensions.TRANSACTION_STATUS_UNKNOWN):
+                self._discard(conn, "broken")
+                return
+            else:
+                conn.rollback()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+            POOL_CONNECTIONS.labels(self.alias, "idle").inc()
+        except Exception:
+            self._discard(conn, "broken")
+        finally:
+            POOL_CONNECTIONS.labels(self.alias, "in_use").dec()
+            self._slots.release()
+
+    def close(self):
+        """Закрываем свободные соединения, занятые закроются при возврате"""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            POOL_CONNECTIONS.labels(self.alias, "idle").dec()
+            self._discard(conn, "closed")
+
+    def _take_idle(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn, released_at = self._idle.pop()
+            POOL_CONNECTIONS.labels(self.alias, "idle").dec()
+
+            now = time.monotonic()
+            if conn.closed:
+                self._discard(conn, "broken")
+            elif now - self._created.get(id(conn), now) > self.max_lifetime:
+                self._discard(conn, "expired")
+            elif now - released_at > self.check_interval and not self._check(conn):
+                self._discard(conn, "broken")
+            else:
+                return conn
+
+    def _new(self):
+        conn = self.connect()
+        self._created[id(conn)] = time.monotonic()
+        POOL_EVENTS.labels(self.alias, "connect").inc()
+        return conn
+
+    def _check(self, conn):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if not conn.autocommit:
+                conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning("%s: соединение не прошло проверку: %s", self.alias, e)
+            return False
+
+    def _discard(self, conn, reason):
+        self._created.pop(id(conn), None)
+        POOL_EVENTS.labels(self.alias, reason).inc()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def get_pool(key, connect, **options):
+    """Пул текущего процесса для ключа (псевдоним и параметры подключения)
+
+    :param key:
+    :param connect: функция нового соединения
+    :param options: параметры ConnectionPool
+    :return:
+    """
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(connect, **options)
+    return pool
+
+
+def close_pools():
+    """Закрываем свободные соединения всех пулов процесса"""
+    for pool in list(_pools.values()):
+        pool.close()
+
+
+def _reset_in_child():
+    # сокеты соединений родителя общие с дочерним процессом (gunicorn, celery prefork):
+    # не закрываем их и не даем сборщику мусора закрыть, в дочернем процессе пулы новые
+    global _pools_lock
+    _inherited.extend(_pools.values())
+    _pools.clear()
+    _pools_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_in_child)
+
+
+class ErrorPoolTimeout(OperationalError):
+    pass
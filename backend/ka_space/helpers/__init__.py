@@ -1,3 +1,4 @@
 from .locking import Locking, ErrorIsLocked
 from .filelogger import FileLogger
 from .singleton import Singleton
+from .logqueue import SAMPLED, QueueListenerHandler, SampledDebugFilter, sample_debug
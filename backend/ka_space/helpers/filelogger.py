@@ -1,10 +1,47 @@
-import os
+import atexit
+import threading
+import time
 
 
 class FileLogger:
-    def __init__(self, file):
+    """Буферизованная запись строк в файл
+
+    Строки копятся в памяти и сбрасываются на диск пачкой, когда буфер заполнен
+    или с последней записи прошло больше flush_interval секунд.
+    """
+
+    def __init__(self, file, buffer_size=100, flush_interval=5):
         self.file = file
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+        atexit.register(self.flush)
 
     def append(self, data):
-        with open(self.file, "a") as f:
-            f.write(f"{data}\n")
+        with self._lock:
+            self._buffer.append(f"{data}\n")
+            if (
+                len(self._buffer) < self.buffer_size
+                and time.monotonic() - self._flushed_at < self.flush_interval
+            ):
+                return
+            lines, self._buffer = self._buffer, []
+            self._flushed_at = time.monotonic()
+
+        self._write(lines)
+
+    def flush(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            self._flushed_at = time.monotonic()
+
+        self._write(lines)
+
+    def _write(self, lines):
+        if lines:
+            with open(self.file, "a") as f:
+                f.writelines(lines)
@@ -1,6 +1,6 @@
 import logging
 import time
-from datetime import datetime, timedelta
+import uuid
 
 import redis
 
@@ -8,11 +8,47 @@ from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
+# запасная проверка на случай, если блокировка истекла сама, без публикации
+WAKEUP_INTERVAL = 1.0
+
+_pool = None
+
+# снимаем блокировку, только если она наша; держим ее до минимального времени жизни
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+local hold = tonumber(ARGV[2])
+if hold > 0 then
+    redis.call("pexpire", KEYS[1], hold)
+else
+    redis.call("del", KEYS[1])
+    redis.call("publish", KEYS[2], ARGV[1])
+end
+return 1
+"""
+
+EXTEND_SCRIPT = """
+if redis.call("get", KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+return redis.call("pexpire", KEYS[1], ARGV[2])
+"""
+
+
+def get_redis():
+    """Клиент Redis на общем пуле соединений процесса"""
+    global _pool
+    if _pool is None:
+        _pool = redis.ConnectionPool.from_url(
+            settings.BROKER_URL, decode_responses=True
+        )
+    return redis.Redis(connection_pool=_pool)
+
 
 class Locking(object):
     def __init__(self, key, timeout=60, expire=60 * 5, minimum_life=0):
-        self.redis = redis.from_url(settings.BROKER_URL, decode_responses=True)
-        assert self.redis.ping(), "No connection to Redis Server"
+        self.redis = get_redis()
 
         self.key = key
         self.timeout = timeout
@@ -21,49 +57,117 @@ class Locking(object):
 
         self.flag_locked = f"flag_{self.key}_locked"
         self.flag_state = f"flag_{self.key}_state"
+        self.channel = f"flag_{self.key}_released"
 
+        self.token = None
         self.release_at = time.time()
 
     def is_locked(self):
-        value = self.redis.get(self.flag_locked)
-        return value is not None and float(value) + self.expire > time.time()
+        return bool(self.redis.exists(self.flag_locked))
 
     def acquire(self, timeout=None, expire=None):
-        timeout = timeout or self.timeout
+        timeout = self.timeout if timeout is None else timeout
         expire = expire or self.expire
         wait = time.time() + timeout
-        sleep = 0.1
+        token = f"{time.time():.6f}:{uuid.uuid4().hex}"
 
-        while self.is_locked() and wait > time.time():
-            time.sleep(sleep)
+        if self._try_acquire(token, expire):
+            return True
 
-        if self.is_locked():
+        if timeout <= 0:
             raise ErrorIsLocked(f"Locked: {self.flag_locked}")
 
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        try:
+            while wait > time.time():
+                # после подписки пробуем еще раз, чтобы не пропустить освобождение
+                if self._try_acquire(token, expire):
+                    return True
+                pubsub.get_message(
+                    timeout=min(WAKEUP_INTERVAL, max(wait - time.time(), 0))
+                )
+        finally:
+            pubsub.close()
+
+        if self._try_acquire(token, expire):
+            return True
+
+        raise ErrorIsLocked(f"Locked: {self.flag_locked}")
+
+    def _try_acquire(self, token, expire):
+        if not self.redis.set(self.flag_locked, token, nx=True, px=int(expire * 1000)):
+            return False
+
+        self.token = token
         self.release_at = time.time() + self.minimum_life
-        return self.redis.set(
-            self.flag_locked,
-            time.time(),
-            ex=expire,
+        return True
+
+    def extend(self, expire=None):
+        """Продлеваем удерживаемую блокировку
+
+        :param expire: новое время жизни, сек
+        :return: False, если блокировка уже не наша
+        """
+        if self.token is None:
+            return False
+        expire = expire or self.expire
+        return bool(
+            self.redis.eval(
+                EXTEND_SCRIPT, 1, self.flag_locked, self.token, int(expire * 1000)
+            )
         )
 
     def release(self):
-        # if self.is_locked():
-        #    raise ErrorNotLocked(f"Not Locked: {self.flag_locked}")
-        if (self.release_at - time.time()) > 0:
-            # ждем, чтобы отпустить с задержкой
-            time.sleep(self.release_at - time.time())
+        """Снимаем блокировку
+
+        Если минимальное время удержания еще не прошло, блокировка не удаляется,
+        а доживает его через expire, не задерживая текущий процесс.
+        """
+        if self.token is None:
+            return False
 
-        return self.redis.delete(self.flag_locked)
+        hold = max(int((self.release_at - time.time()) * 1000), 0)
+        result = self.redis.eval(
+            RELEASE_SCRIPT, 2, self.flag_locked, self.channel, self.token, hold
+        )
+        self.token = None
+        return bool(result)
 
     def set_state(self, value):
         return self.redis.set(self.flag_state, value, ex=self.expire)
 
     def state(self):
+        locked, state = self.redis.mget(self.flag_locked, self.flag_state)
+        return {
+            "is_locked": locked is not None,
+            "locked": locked,
+            "state": state,
+        }
+
+    @classmethod
+    def states(cls, keys):
+        """Состояния блокировок для нескольких ключей одним запросом MGET
+
+        :param keys:
+        :return: словарь key => state()
+        """
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+
+        flags = []
+        for key in keys:
+            flags += [f"flag_{key}_locked", f"flag_{key}_state"]
+        values = get_redis().mget(flags)
+
         return {
-            "is_locked": self.is_locked(),
-            "locked": self.redis.get(self.flag_locked),
-            "state": self.redis.get(self.flag_state),
+            key: {
+                "is_locked": values[i * 2] is not None,
+                "locked": values[i * 2],
+                "state": values[i * 2 + 1],
+            }
+            for i, key in enumerate(keys)
         }
 
 
@@ -0,0 +1,106 @@
+import atexit
+import copy
+import logging
+import os
+import random
+from logging.config import ConvertingList
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
+
+
+class QueueListenerHandler(QueueHandler):
+    """Неблокирующий обработчик логов
+
+    Записи складываются в очередь, а вывод в консоль и файлы выполняет фоновый поток
+    QueueListener. Целевые обработчики указываются ссылками на уже настроенные:
+    ```
+    "handlers": ["cfg://handlers.console", "cfg://handlers.logfile"]
+    ```
+    """
+
+    def __init__(self, handlers, respect_handler_level=True, queue_size=-1):
+        super().__init__(Queue(queue_size))
+        self.queue_size = queue_size
+        self.respect_handler_level = respect_handler_level
+        self.handlers = _resolve_handlers(handlers)
+        self._listener = None
+
+        self.start()
+        atexit.register(self.stop)
+        # поток не переживает fork (gunicorn, celery prefork), поднимаем его заново
+        os.register_at_fork(after_in_child=self._restart_in_child)
+
+    def start(self):
+        self._listener = QueueListener(
+            self.queue,
+            *self.handlers,
+            respect_handler_level=self.respect_handler_level,
+        )
+        self._listener.start()
+
+    def stop(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def _restart_in_child(self):
+        # очередь родителя могла остаться заблокированной потоком, которого больше нет
+        self.queue = Queue(self.queue_size)
+        self._listener = None
+        self.start()
+
+    def prepare(self, record):
+        """Подготовка записи без форматирования
+
+        Очередь живет в том же процессе, поэтому запись не нужно сериализовать:
+        собираем только текст сообщения, форматтеры целевых обработчиков
+        отработают в фоновом потоке. Запись копируется: остальные обработчики
+        логгера получают исходные msg и args.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+# extra для DEBUG-записи, уже отобранной sample_debug: фильтр ее пропускает
+SAMPLED = {"sampled": True}
+
+
+class SampledDebugFilter(logging.Filter):
+    """Пропускает только часть DEBUG-записей, остальные уровни без изменений
+
+    Записи с extra=SAMPLED уже отобраны sample_debug и не отбираются повторно.
+    """
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        if getattr(record, "sampled", False):
+            return True
+        return random.random() < self.rate
+
+
+def sample_debug(logger, rate):
+    """Проверяет, нужно ли формировать дорогое DEBUG-сообщение
+
+    Сообщение пишется с extra=SAMPLED, иначе SampledDebugFilter отберет его
+    второй раз и в лог попадет доля rate².
+
+    :param logger:
+    :param rate: доля сообщений, которые попадут в лог (0..1)
+    :return:
+    """
+    return logger.isEnabledFor(logging.DEBUG) and (rate >= 1 or random.random() < rate)
+
+
+def _resolve_handlers(handlers):
+    if not isinstance(handlers, ConvertingList):
+        return list(handlers)
+
+    # обращение к элементу ConvertingList подставляет настроенный обработчик
+    return [handlers[i] for i in range(len(handlers))]
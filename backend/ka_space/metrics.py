@@ -0,0 +1,116 @@
+import logging
+import os
+import socket
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+
+class _NoMetric(object):
+    """Заглушка метрики, когда prometheus_client не установлен"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, *args, **kwargs):
+        pass
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def dec(self, *args, **kwargs):
+        pass
+
+    def set(self, *args, **kwargs):
+        pass
+
+
+def metric(kind, name, documentation, labelnames=(), **kwargs):
+    """Метрика Prometheus или заглушка
+
+    В многопроцессном режиме (PROMETHEUS_MULTIPROC_DIR) значения процессов
+    gunicorn и celery складываются в общий каталог и собираются в metrics_view,
+    для Gauge нужно указать multiprocess_mode.
+
+    :param kind: Counter, Gauge, Histogram
+    :param name:
+    :param documentation:
+    :param labelnames:
+    :param kwargs: параметры конструктора метрики
+    :return:
+    """
+    if prometheus_client is None:
+        return _NoMetric()
+    if kind != "Gauge":
+        kwargs.pop("multiprocess_mode", None)
+    return getattr(prometheus_client, kind)(name, documentation, labelnames, **kwargs)
+
+
+def metrics_view(request):
+    """Метрики для Prometheus
+
+    Доступны администраторам или по токену METRICS_TOKEN в заголовке
+    Authorization: Bearer <token>.
+
+    :param request:
+    :return:
+    """
+    token = settings.METRICS_TOKEN
+    if not request.user.is_staff and (
+        not token or request.headers.get("Authorization") != f"Bearer {token}"
+    ):
+        return HttpResponseForbidden()
+    if prometheus_client is None:
+        return HttpResponse("prometheus_client not installed", status=501)
+
+    return HttpResponse(
+        prometheus_client.generate_latest(_registry()),
+        content_type=prometheus_client.CONTENT_TYPE_LATEST,
+    )
+
+
+def _registry():
+    """Метрики всех процессов из PROMETHEUS_MULTIPROC_DIR или текущего процесса"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return prometheus_client.REGISTRY
+
+
+def push_metrics(job="celery"):
+    """Отправка метрик в Pushgateway (PROMETHEUS_PUSHGATEWAY)
+
+    /metrics/ отдает только процессы web: PROMETHEUS_MULTIPROC_DIR собирает
+    процессы одного хоста, а до worker-дино Prometheus не достучаться.
+    Worker после каждой задачи заменяет в Pushgateway группу своего хоста
+    (DYNO на Heroku), без общего каталога - группу процесса.
+    Ошибки отправки только логируются.
+
+    :param job:
+    :return:
+    """
+    gateway = settings.PROMETHEUS_PUSHGATEWAY
+    if prometheus_client is None or not gateway:
+        return
+    instance = os.environ.get("DYNO") or socket.gethostname()
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        instance = f"{instance}-{os.getpid()}"
+    try:
+        prometheus_client.push_to_gateway(
+            gateway,
+            job=job,
+            registry=_registry(),
+            grouping_key={"instance": instance},
+            timeout=5,
+        )
+    except Exception as e:
+        logger.warning("метрики не отправлены в %s: %s", gateway, e)
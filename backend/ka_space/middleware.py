@@ -0,0 +1,52 @@
+import logging
+
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+re_accepts_brotli = _lazy_re_compile(r"\bbr\b")
+
+COMPRESS_MIN_LENGTH = 200
+BROTLI_QUALITY = 5  # компромисс размера и времени сжатия для ответов API
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Сжатие ответов: brotli, если клиент принимает br и установлен пакет brotli, иначе gzip
+
+    Потоковые ответы (выгрузки, статика WhiteNoise) не сжимаются: Parquet уже
+    сжат zstd, статику WhiteNoise отдает сжатой заранее.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming:
+            return response
+        ae = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if brotli is None or not re_accepts_brotli.search(ae):
+            return super().process_response(request, response)
+
+        if len(response.content) < COMPRESS_MIN_LENGTH or response.has_header(
+            "Content-Encoding"
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        compressed_content = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers["Content-Length"] = str(len(response.content))
+
+        # сжатый ответ - слабый ETag, If-None-Match сравнивает слабые ETag
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "br"
+
+        return response
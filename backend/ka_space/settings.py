@@ -67,6 +67,9 @@ AUTH_USER_MODEL = "ka_space_user.User"
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    # сжатие gzip/brotli, ETag по содержимому для ответов без своего ETag
+    "ka_space.middleware.CompressionMiddleware",
+    "django.middleware.http.ConditionalGetMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -122,6 +125,22 @@ db_url = dj_database_url.config(conn_max_age=600)
 if db_url:
     DATABASES["default"] = db_url
 
+# пул соединений в каждом процессе gunicorn и celery, см. ka_space.db
+if os.environ.get("DB_POOL", "1") == "1":
+    DATABASES["default"].update(
+        {
+            "ENGINE": "ka_space.db",
+            # в конце запроса и задачи соединение возвращается в пул
+            "CONN_MAX_AGE": 0,
+            "POOL": {
+                "MAX_SIZE": int(os.environ.get("DB_POOL_MAX_SIZE", 10)),
+                "TIMEOUT": float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+                "CHECK_INTERVAL": float(os.environ.get("DB_POOL_CHECK_INTERVAL", 30)),
+                "MAX_LIFETIME": float(os.environ.get("DB_POOL_MAX_LIFETIME", 1800)),
+            },
+        }
+    )
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -146,7 +165,10 @@ REST_FRAMEWORK = {
         # "rest_framework.authentication.TokenAuthentication",
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
-    # "DEFAULT_RENDERER_CLASSES": ("rest_framework.renderers.JSONRenderer",),
+    "DEFAULT_RENDERER_CLASSES": (
+        "api.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
 }
 
 
@@ -177,9 +199,26 @@ EMAIL_FILE_PATH = str(TMP_DIR / "emails")  # change this to a proper location
 # Celery Broker
 BROKER_URL = "redis://127.0.0.1:6379/0"
 BROKER_TRANSPORT = "redis"
+# обновления по расписанию идут в очередь sync, загрузка истории (Backfill) - в backfill,
+# каждую очередь обслуживает свой worker со своим --concurrency
+CELERY_DEFAULT_QUEUE = "sync"
+CELERY_BACKFILL_QUEUE = "backfill"
+CELERY_ROUTES = {"mp.tasks.backfill.run_backfill": {"queue": CELERY_BACKFILL_QUEUE}}
+# долгие задачи не забираются worker'ом заранее
+CELERYD_PREFETCH_MULTIPLIER = 1
 
 # Cache time to live is 1 minute.
 CACHE_TTL = 60 * 0.5
+# кеш токенов и магазинов пользователей для API, сбрасывается сигналами
+AUTH_CACHE_TTL = int(os.environ.get("AUTH_CACHE_TTL", 60))
+# отчеты API отдаются асинхронными представлениями (ASGI-сервер, см. Procfile)
+API_ASYNC = os.environ.get("API_ASYNC", "1") == "1"
+# соединений psycopg 3 на процесс для асинхронных отчетов, 0 - запросы в пуле потоков
+API_ASYNC_DB_POOL_SIZE = int(os.environ.get("API_ASYNC_DB_POOL_SIZE", 10))
+# доступ к /metrics/ без входа администратора: Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+# Pushgateway для метрик worker (host:port), пусто - не отправлять
+PROMETHEUS_PUSHGATEWAY = os.environ.get("PROMETHEUS_PUSHGATEWAY", "")
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
@@ -190,15 +229,23 @@ CACHES = {
 }
 
 
-LOGGING_LEVEL = "DEBUG"
+LOGGING_LEVEL = os.environ.get("LOGGING_LEVEL", "DEBUG")
+# доля DEBUG-записей, попадающих в лог (SQL-запросы, построчные изменения)
+LOGGING_DEBUG_SAMPLE_RATE = float(os.environ.get("LOGGING_DEBUG_SAMPLE_RATE", 0.05))
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
-    "root": {"level": LOGGING_LEVEL, "handlers": ["console", "logfile"]},
+    "root": {"level": LOGGING_LEVEL, "handlers": ["queue"]},
     "formatters": {
         "verbose": {"format": "%(levelname)-8s %(asctime).19s %(name)s\t%(message)s"},
         "simple": {"format": "%(levelname)-8s %(module)s\t%(message)s"},
     },
+    "filters": {
+        "sample_debug": {
+            "()": "ka_space.helpers.logqueue.SampledDebugFilter",
+            "rate": LOGGING_DEBUG_SAMPLE_RATE,
+        },
+    },
     "handlers": {
         "console": {"class": "logging.StreamHandler", "formatter": "simple"},
         "logfile": {
@@ -222,30 +269,51 @@ LOGGING = {
         "null": {
             "class": "logging.NullHandler",
         },
+        # запись в консоль и файлы выполняется фоновыми потоками
+        "queue": {
+            "class": "ka_space.helpers.logqueue.QueueListenerHandler",
+            "handlers": ["cfg://handlers.console", "cfg://handlers.logfile"],
+            "filters": ["sample_debug"],
+        },
+        "queue_api": {
+            "class": "ka_space.helpers.logqueue.QueueListenerHandler",
+            "handlers": ["cfg://handlers.console", "cfg://handlers.api"],
+            "filters": ["sample_debug"],
+        },
+        "queue_console": {
+            "class": "ka_space.helpers.logqueue.QueueListenerHandler",
+            "handlers": ["cfg://handlers.console"],
+            "filters": ["sample_debug"],
+        },
+        "queue_celery": {
+            "class": "ka_space.helpers.logqueue.QueueListenerHandler",
+            "handlers": ["cfg://handlers.celery", "cfg://handlers.console"],
+            "filters": ["sample_debug"],
+        },
     },
     "loggers": {
         "django": {
-            "handlers": ["console"],
+            "handlers": ["queue_console"],
             "level": "ERROR",
             "propagate": False,
         },
         "mp.tasks": {
-            "handlers": ["celery", "console"],
+            "handlers": ["queue_celery"],
             "level": LOGGING_LEVEL,
             "propagate": False,
         },
         "api": {
-            "handlers": ["console", "api"],
+            "handlers": ["queue_api"],
             "level": LOGGING_LEVEL,
             "propagate": False,
         },
         "": {
-            "handlers": ["console", "logfile"],
+            "handlers": ["queue"],
             "level": LOGGING_LEVEL,
             "propagate": False,
         },
         "httpx": {
-            "handlers": ["console"],
+            "handlers": ["queue_console"],
             "level": "ERROR",
             "propagate": False,
         },
@@ -19,6 +19,7 @@ from django.contrib.auth.decorators import login_required
 from django.views.decorators.cache import cache_page
 from django.urls import path, re_path, include
 
+from .metrics import metrics_view
 from .views import register, ProfileView, DashboardView
 from pages import views as pviews
 from api import views as api_views
@@ -28,5 +29,7 @@ from ka_space.viewsets import MainView
 urlpatterns = [
     path("", MainView.as_view()),
     path("api/", include(("ka_space.routers", "core"), namespace="core-api")),
+    path("api/", include("api.urls")),
     path("admin/", admin.site.urls),
+    path("metrics/", metrics_view),
 ]
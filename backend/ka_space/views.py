@@ -4,6 +4,7 @@ from django.views import View
 from django.shortcuts import render, redirect, HttpResponseRedirect, reverse
 from django.contrib.auth import login
 from django.contrib import messages
+from django.db.models import Sum
 
 from rest_framework.authentication import TokenAuthentication, SessionAuthentication
 from rest_framework.permissions import IsAuthenticated
@@ -12,7 +13,9 @@ from rest_framework.authtoken.models import Token
 from api.helpers import fetch_raw_sql
 from ka_space.forms import RegistrationForm
 from ka_space.helpers import Locking, ErrorIsLocked
-from mp.models import Shop, APIKey
+from mp.helpers import estimate_shop_stats, shop_stats_estimate
+from mp.helpers.shop_stats import SHOP_STATS_ESTIMATE_TABLES
+from mp.models import Shop, APIKey, ShopStats
 
 logger = logging.getLogger(__name__)
 
@@ -29,24 +32,19 @@ class ProfileView(View):
         shops_count = Shop.objects.filter(user=user).count()
         keys_result = APIKey.objects.filter(shop__user=user)
         keys_count = keys_result.count()
+        lock_states = Locking.states([key.client_id for key in keys_result])
         keys = []
         for key in keys_result:
-            lock = Locking(key.client_id)
-            keys.append(f"{key.shop}/{key.name}:<br/> {lock.state().get('state')}")
+            state = lock_states[key.client_id].get("state")
+            keys.append(f"{key.shop}/{key.name}:<br/> {state}")
 
         # ozon
-
-        try:
-            products_count = Product.objects.filter(shop__user=user).count()
-            analytics_count = Analytics.objects.filter(shop__user=user).count()
-            advertizing_count = StatisticsCampaignProduct.objects.filter(
-                campaign__shop__user=user
-            ).count()
-            transactions_count = Transaction.objects.filter(shop__user=user).count()
-        except:
-            products_count = (
-                analytics_count
-            ) = advertizing_count = transactions_count = 0
+        stats = ShopStats.objects.filter(shop__user=user).aggregate(
+            products=Sum("products"),
+            analytics=Sum("analytics"),
+            advert=Sum("advert"),
+            transactions=Sum("transactions"),
+        )
 
         # locking_test = {}
         # lock = Locking("test", timeout=5, expire=15)
@@ -72,10 +70,10 @@ class ProfileView(View):
                 "statistics": {
                     "shops": shops_count,
                     "keys": keys_count,
-                    "ozon_products": products_count,
-                    "ozon_analytics": analytics_count,
-                    "ozon_advertizing": advertizing_count,
-                    "ozon_transactions": transactions_count,
+                    "ozon_products": stats["products"] or 0,
+                    "ozon_analytics": stats["analytics"] or 0,
+                    "ozon_advertizing": stats["advert"] or 0,
+                    "ozon_transactions": stats["transactions"] or 0,
                 },
             },
         )
@@ -143,14 +141,14 @@ class DashboardView(View):
         ms.name, 
         ma.client_ids as keys_titles,
         ma.cnt as keys,
-        mop.cnt as products,
-        moa.cnt as analytics,
-        moc.cnt as campaigns,
-        moscp.cnt as advert,
-        mor.report_cnt as reports,
-        mot.cnt as transactions,
-        mofbo.cnt as fbo,
-        mofbs.cnt as fbs
+        mss.products,
+        mss.analytics,
+        mss.campaigns,
+        mss.advert,
+        mss.reports,
+        mss.transactions,
+        mss.fbo,
+        mss.fbs
         FROM mp_shop ms
         INNER JOIN auth_user au ON au.id = ms.user_id
         LEFT JOIN (
@@ -159,41 +157,34 @@ class DashboardView(View):
             WHERE is_active and disabled_till < NOW()
             GROUP BY shop_id
         ) ma ON ma.shop_id = ms.id
-        LEFT JOIN (SELECT COUNT(*) as cnt, shop_id FROM mp_ozon_product GROUP BY shop_id) mop ON mop.shop_id = ms.id
-        LEFT JOIN (SELECT COUNT(*) as cnt, shop_id FROM mp_ozon_analytics GROUP BY shop_id) moa ON moa.shop_id = ms.id
-        LEFT JOIN (SELECT COUNT(*) as cnt, shop_id FROM mp_ozon_campaign GROUP BY shop_id) moc ON moc.shop_id = ms.id
-        LEFT JOIN (
-            SELECT COUNT(mos.*) as cnt, moc.shop_id 
-            FROM mp_ozon_statisticscampaignproduct mos, mp_ozon_campaign moc 
-            WHERE mos.campaign_id = moc.id 
-            GROUP BY shop_id
-        ) moscp ON moscp.shop_id = ms.id
-        LEFT JOIN (
-            SELECT
-                jsonb_object_agg(r.state, r.cnt) as report_cnt,
-                r.shop_id
-            FROM (
-                SELECT state, COUNT(*) as cnt, shop_id 
-                FROM mp_ozon_report 
-                GROUP BY state, shop_id
-            ) r
-            GROUP BY r.shop_id
-        ) mor ON mor.shop_id = ms.id
-        LEFT JOIN (SELECT COUNT(*) as cnt, shop_id FROM mp_ozon_transaction GROUP BY shop_id) mot ON mot.shop_id = ms.id
-        LEFT JOIN (SELECT COUNT(*) as cnt, shop_id FROM mp_ozon_fbo GROUP BY shop_id) mofbo ON mofbo.shop_id = ms.id
-        LEFT JOIN (SELECT COUNT(*) as cnt, shop_id FROM mp_ozon_fbs GROUP BY shop_id) mofbs ON mofbs.shop_id = ms.id
+        LEFT JOIN mp_shopstats mss ON mss.shop_id = ms.id
         ORDER BY
         ms.is_active DESC, ms.id
         """
         rows = fetch_raw_sql(sql)
+
+        # быстрый приблизительный режим: оценки по статистике PostgreSQL
+        approx = "approx" in request.GET
+        estimates = {}
+        if approx or any(
+            row[f] is None for row in rows for f in SHOP_STATS_ESTIMATE_TABLES
+        ):
+            estimates = estimate_shop_stats()
+        for row in rows:
+            for f in SHOP_STATS_ESTIMATE_TABLES:
+                if approx or row[f] is None:
+                    row[f] = shop_stats_estimate(estimates, row["id"], f)
+
+        lock_states = Locking.states(
+            [key for row in rows for key in row["keys_titles"] or []]
+        )
         shops = []
         for row in rows:
             keys = []
             if row["keys_titles"]:
                 for key in row["keys_titles"]:
-                    lock = Locking(key)
                     keys.append(
-                        f"{key}:<br/> {lock.state().get('state')}".replace(
+                        f"{key}:<br/> {lock_states[key].get('state')}".replace(
                             '"', "&quot;"
                         )
                     )
@@ -221,5 +212,6 @@ class DashboardView(View):
             {
                 "title": "Admin Dashboard",
                 "shops": shops,
+                "approx": approx,
             },
         )
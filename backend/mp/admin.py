@@ -1,11 +1,26 @@
 from django.contrib import admin
-from .models import Shop, APIKey
+from .models import Shop, APIKey, TaskRun
 
 
 class ShopAdmin(admin.ModelAdmin):
     list_display = (str, "user")
 
 
+class TaskRunAdmin(admin.ModelAdmin):
+    list_display = (
+        "task",
+        "shop",
+        "status",
+        "started_at",
+        "duration",
+        "api_time",
+        "db_time",
+        "rows",
+    )
+    list_filter = ("task", "status")
+
+
 # Register your models here.
 admin.site.register(Shop, ShopAdmin)
 admin.site.register(APIKey)
+admin.site.register(TaskRun, TaskRunAdmin)
@@ -0,0 +1 @@
+from .generator import DatasetGenerator, SCALES, load_dataset, is_production_db
@@ -0,0 +1,1260 @@
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+from .generator import (
+    CAMPAIGN_SIZE,
+    ORDERS_PER_SKU,
+    REGIONS,
+    WAREHOUSES,
+    id_bases,
+)
+
+logger = logging.getLogger(__name__)
+
+SELLER_URL = "https://api-seller.ozon.ru"
+PERFORMANCE_URL = "https://api-performance.ozon.ru"
+
+# максимальные размеры страниц, как в API Ozon
+LIMIT_PRODUCTS = 1000
+LIMIT_POSTINGS = 1000
+LIMIT_TRANSACTIONS = 1000
+LIMIT_ANALYTICS = 1000
+LIMIT_WAREHOUSE_STOCKS = 1000
+
+# значения метрик аналитики: доля просмотров, максимум на SKU в день
+ANALYTICS_METRICS = {
+    "hits_view": 3.0,
+    "hits_view_pdp": 2.0,
+    "hits_view_search": 1.0,
+    "session_view": 1.0,
+    "session_view_pdp": 0.6,
+    "session_view_search": 0.4,
+    "hits_tocart": 0.2,
+    "hits_tocart_pdp": 0.1,
+    "hits_tocart_search": 0.1,
+    "conv_tocart": 0.01,
+    "conv_tocart_pdp": 0.01,
+    "conv_tocart_search": 0.01,
+    "ordered_units": 0.02,
+    "delivered_units": 0.018,
+    "returns": 0.002,
+    "cancellations": 0.002,
+    "adv_view_all": 0.2,
+    "adv_view_pdp": 0.1,
+    "adv_view_search_category": 0.1,
+    "adv_sum_all": 0.05,
+    "postings": 0.02,
+    "postings_premium": 0.001,
+    "position_category": 0.5,
+}
+
+
+def rnd(seed, *key):
+    """Псевдослучайное число [0, 1) от ключа, одинаковое между запусками"""
+    digest = hashlib.blake2b(repr((seed,) + key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2**64
+
+
+class FakeOzon(object):
+    """Поддельные Seller API и Performance API Ozon
+
+    Ответы синтетические, в форматах публичной документации Ozon, с теми же ID
+    товаров, SKU, заказов и кампаний, что и у bench_generate: магазин
+    определяется по числу в начале Client-Id (Performance: client_id токена),
+    поэтому задачи обновляют уже сгенерированные строки.
+
+    Режимы:
+    - record: запросы проксируются в настоящий API, ответы пишутся в каталог;
+    - replay: ответы из каталога, при промахе - синтетические (fallback) или 404;
+    - по умолчанию только синтетические ответы.
+
+    Задержка ответа latency + latency_per_item на строку ответа (мс), доли ответов
+    429 (throttle_rate) и 5xx (error_rate), лимит запросов в секунду на клиента (rps),
+    отчеты рекламы готовятся report_delay секунд.
+    """
+
+    def __init__(
+        self,
+        skus=100,
+        days=30,
+        seed=1,
+        end_date=None,
+        page_size=None,
+        latency=0,
+        latency_per_item=0,
+        jitter=0,
+        error_rate=0,
+        throttle_rate=0,
+        rps=0,
+        report_delay=2,
+        record_dir=None,
+        replay_dir=None,
+        fallback=True,
+    ):
+        self.skus = skus
+        self.days = days
+        self.seed = seed
+        self.end_date = end_date or date.today()
+        self.page_size = page_size
+        self.latency = latency
+        self.latency_per_item = latency_per_item
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rps = rps
+        self.report_delay = report_delay
+        self.record_dir = Path(record_dir) if record_dir else None
+        self.replay_dir = Path(replay_dir) if replay_dir else None
+        self.fallback = fallback
+
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._requests = {}  # client => время запросов за последнюю секунду
+        self._orders = {}  # (shop_id, type) => заказы
+        self._reports = {}  # UUID => отчет
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0, "items": 0}
+
+        self.routes = [
+            ("POST", r"/v[23]/product/list", self.product_list),
+            ("POST", r"/v2/product/info/list", self.product_info),
+            ("POST", r"/v4/product/info/prices", self.product_prices),
+            ("POST", r"/v3/products/info/attributes", self.product_attributes),
+            ("POST", r"/v3/product/info/stocks", self.product_stocks),
+            ("POST", r"/v2/analytics/stock_on_warehouses", self.warehouse_stocks),
+            ("POST", r"/v1/analytics/data", self.analytics),
+            ("POST", r"/v3/finance/transaction/list", self.transactions),
+            ("POST", r"/v2/posting/fbo/list", self.fbo_list),
+            ("POST", r"/v3/posting/fbs/list", self.fbs_list),
+            ("POST", r"/api/client/token", self.token),
+            ("GET", r"/api/client/campaign", self.campaigns),
+            ("GET", r"/api/client/campaign/(\d+)/objects", self.campaign_objects),
+            ("GET", r"/api/client/campaign/(\d+)/v2/products", self.campaign_products),
+            (
+                "POST",
+                r"/api/client/campaign/search_promo/v2/products",
+                self.search_promo_products,
+            ),
+            ("GET", r"/api/client/statistics/daily/json", self.campaign_daily),
+            ("POST", r"/api/client/statistics(?:/json)?", self.report_request),
+            ("GET", r"/api/client/statistics/report", self.report_download),
+            ("GET", r"/api/client/statistics/list", self.report_list),
+            ("GET", r"/api/client/statistics/([0-9a-f-]{36})", self.report_check),
+        ]
+
+    def handle(self, method, url, headers, body):
+        """Ответ на запрос
+
+        :param method:
+        :param url: путь с параметрами
+        :param headers:
+        :param body: тело запроса, bytes
+        :return: статус, заголовки, тело ответа bytes
+        """
+        parts = urlsplit(url)
+        query = dict(parse_qsl(parts.query))
+        with self._lock:
+            self.stats["requests"] += 1
+
+        if self.record_dir is not None:
+            return self.record(method, parts.path, parts.query, headers, body)
+
+        client = headers.get("Client-Id") or headers.get("Authorization") or ""
+        status, data = self.inject_errors(client)
+        if status is None and self.replay_dir is not None:
+            recorded = self.replay(method, parts.path, parts.query, body)
+            if recorded is not None:
+                return self.respond(*recorded)
+            if not self.fallback:
+                status, data = 404, {"code": 5, "message": "Запрос не записан"}
+        if status is None:
+            status, data = self.dispatch(method, parts.path, query, headers, body)
+        return self.respond(status, data)
+
+    def dispatch(self, method, path, query, headers, body):
+        for route_method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                break
+        else:
+            return 404, {"code": 5, "message": f"Not found: {method} {path}"}
+
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {"code": 3, "message": "Invalid JSON"}
+
+        if path.startswith("/api/client/"):
+            shop_id = self.performance_shop(path, headers, data)
+            if shop_id is None:
+                return 401, {"error": "Unauthorized"}
+        else:
+            shop_id = self.seller_shop(headers)
+            if shop_id is None:
+                return 401, {
+                    "code": 16,
+                    "message": "Client-Id and Api-Key are required",
+                }
+            if headers.get("Api-Key") == "invalid":
+                return 403, {"code": 7, "message": "Invalid Api-Key"}
+
+        result = handler(shop_id, query, data, *match.groups())
+        return result if isinstance(result, tuple) else (200, result)
+
+    def respond(self, status, data, content_type="application/json"):
+        if isinstance(data, (bytes, str)):
+            payload = data.encode() if isinstance(data, str) else data
+        else:
+            payload = json.dumps(data, ensure_ascii=False, default=str).encode()
+            items = count_items(data)
+            with self._lock:
+                self.stats["items"] += items
+            self.sleep(items)
+        return status, {"Content-Type": content_type}, payload
+
+    def sleep(self, items=0):
+        delay = self.latency + self.latency_per_item * items
+        if self.jitter:
+            with self._lock:
+                delay += self._random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay / 1000)
+
+    def inject_errors(self, client):
+        """Лимит запросов в секунду и случайные 429/5xx
+
+        :param client:
+        :return: статус и тело ошибки или (None, None)
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.rps:
+                recent = [t for t in self._requests.get(client, []) if now - t < 1]
+                self._requests[client] = recent + [now]
+                if len(recent) >= self.rps:
+                    self.stats["throttled"] += 1
+                    return 429, {
+                        "code": 8,
+                        "message": "You have reached request rate limit per second",
+                    }
+            dice = self._random.random()
+            if dice < self.throttle_rate:
+                self.stats["throttled"] += 1
+                return 429, {
+                    "code": 8,
+                    "message": "You have reached request rate limit per second",
+                }
+            if dice < self.throttle_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return self._random.choice([500, 502, 503]), {
+                    "code": 13,
+                    "message": "internal error",
+                }
+        return None, None
+
+    # Запись и воспроизведение
+
+    def cassette(self, directory, method, path, query, body):
+        key = json.dumps(
+            [method, path, sorted(parse_qsl(query)), canonical_body(body)],
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return directory / path.strip("/").replace("/", "_") / f"{name}.json"
+
+    def record(self, method, path, query, headers, body):
+        base = PERFORMANCE_URL if path.startswith("/api/client/") else SELLER_URL
+        forward = {
+            k: v
+            for k, v in headers.items()
+            if k in ("Client-Id", "Api-Key", "Authorization", "Content-Type", "Accept")
+        }
+        r = requests.request(
+            method,
+            f"{base}{path}{'?' + query if query else ''}",
+            headers=forward,
+            data=body or None,
+            timeout=300,
+        )
+        content_type = r.headers.get("Content-Type", "application/json")
+        content = r.content
+        if path == "/api/client/token" and r.ok:
+            # токен не сохраняем
+            content = json.dumps({**r.json(), "access_token": "recorded"}).encode()
+
+        file = self.cassette(self.record_dir, method, path, query, body)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(
+            json.dumps(
+                {
+                    "request": {
+                        "method": method,
+                        "path": path,
+                        "query": query,
+                        "body": redact(canonical_body(body)),
+                    },
+                    "status": r.status_code,
+                    "content_type": content_type,
+                    "body": content.decode("utf-8", errors="replace"),
+                    "recorded_at": datetime.now().isoformat(timespec="seconds"),
+                },
+                ensure_ascii=False,
+            )
+        )
+        logger.debug("Записан ответ %s %s: %s", method, path, r.status_code)
+        return r.status_code, {"Content-Type": content_type}, content
+
+    def replay(self, method, path, query, body):
+        file = self.cassette(self.replay_dir, method, path, query, body)
+        if not file.exists():
+            logger.debug("Нет записи %s %s", method, path)
+            return None
+        recorded = json.loads(file.read_text())
+        content_type = recorded["content_type"]
+        if content_type.startswith("application/json"):
+            try:
+                return recorded["status"], json.loads(recorded["body"]), content_type
+            except ValueError:
+                pass
+        return recorded["status"], recorded["body"], content_type
+
+    # Магазин и справочники
+
+    def seller_shop(self, headers):
+        return leading_int(headers.get("Client-Id"))
+
+    def performance_shop(self, path, headers, data):
+        if path == "/api/client/token":
+            return leading_int(data.get("client_id"))
+        auth = headers.get("Authorization", "")
+        return leading_int(auth.rsplit("fake-", 1)[-1]) if "fake-" in auth else None
+
+    def products(self, shop_id):
+        bases = id_bases(shop_id)
+        for k in range(1, self.skus + 1):
+            price = 200 + (k * 7919) % 4800
+            yield {
+                "k": k,
+                "product_id": bases["product_base"] + k,
+                "offer_id": f"BN{shop_id}-{k}",
+                "fbo_sku": bases["fbo_sku_base"] + k,
+                "fbs_sku": bases["fbs_sku_base"] + k,
+                "name": f"Товар {k}",
+                "price": price,
+                "archived": k % 20 == 7,
+                "visible": k % 10 != 3,
+            }
+
+    def dates(self, date_from, date_to):
+        """Дни периода, за которые есть данные"""
+        first = max(date_from, self.end_date - timedelta(days=self.days - 1))
+        last = min(date_to, self.end_date)
+        return [first + timedelta(days=d) for d in range((last - first).days + 1)]
+
+    def limit(self, requested, maximum):
+        limit = min(int(requested or maximum), maximum)
+        return min(limit, self.page_size) if self.page_size else limit
+
+    # Seller API: товары и остатки
+
+    def product_list(self, shop_id, query, data):
+        products = list(self.products(shop_id))
+        offset = int(data.get("last_id") or 0)
+        limit = self.limit(data.get("limit"), LIMIT_PRODUCTS)
+        page = products[offset : offset + limit]
+        return {
+            "result": {
+                "items": [
+                    {
+                        "product_id": p["product_id"],
+                        "offer_id": p["offer_id"],
+                        "is_fbo_visible": p["visible"],
+                        "is_fbs_visible": p["visible"],
+                        "archived": p["archived"],
+                        "is_discounted": False,
+                    }
+                    for p in page
+                ],
+                "total": len(products),
+                "last_id": str(offset + len(page)) if page else "",
+            }
+        }
+
+    def selected_products(self, shop_id, product_ids):
+        product_ids = {int(i) for i in product_ids or []}
+        return [
+            p
+            for p in self.products(shop_id)
+            if not product_ids or p["product_id"] in product_ids
+        ]
+
+    def product_info(self, shop_id, query, data):
+        items = []
+        for p in self.selected_products(shop_id, data.get("product_id")):
+            k = p["k"]
+            created_at = datetime.combine(
+                self.end_date - timedelta(days=365), datetime.min.time()
+            )
+            items.append(
+                {
+                    "id": p["product_id"],
+                    "name": p["name"],
+                    "offer_id": p["offer_id"],
+                    "barcode": f"460{p['product_id']}",
+                    "category_id": 17030000 + k % 50,
+                    "created_at": created_at.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                    "updated_at": f"{self.end_date.isoformat()}T00:00:00.000000Z",
+                    "images": [
+                        f"https://cdn.example.com/{k}/{i}" for i in range(1, 2 + k % 9)
+                    ],
+                    "images360": ["360"] if k % 4 == 0 else [],
+                    "primary_image": f"https://cdn.example.com/{k}/1",
+                    "color_image": "",
+                    "marketing_price": f"{p['price']:.2f}",
+                    "min_price": f"{p['price'] * 0.8:.2f}",
+                    "old_price": f"{p['price'] * 1.2:.2f}",
+                    "price": f"{p['price']:.2f}",
+                    "buybox_price": "",
+                    "currency_code": "RUB",
+                    "sources": [
+                        {"is_enabled": True, "sku": p["fbo_sku"], "source": "fbo"},
+                        {"is_enabled": True, "sku": p["fbs_sku"], "source": "fbs"},
+                    ],
+                    "fbo_sku": p["fbo_sku"],
+                    "fbs_sku": p["fbs_sku"],
+                    "stocks": {
+                        "coming": 0,
+                        "present": int(rnd(self.seed, "stock", p["product_id"]) * 200),
+                        "reserved": 0,
+                    },
+                    "state": "",
+                    "status": {
+                        "state": "price_sent",
+                        "state_name": "Продается",
+                        "is_failed": False,
+                        "is_created": True,
+                    },
+                    "visible": p["visible"],
+                    "visibility_details": {
+                        "has_price": True,
+                        "has_stock": p["visible"],
+                        "active_product": p["visible"],
+                    },
+                    "price_index": f"{0.8 + rnd(self.seed, 'pi', k) * 0.6:.2f}",
+                    "commissions": [
+                        {
+                            "sale_schema": schema,
+                            "percent": 8 + k % 12,
+                            "value": round(p["price"] * (8 + k % 12) / 100, 2),
+                            "min_value": 0,
+                            "delivery_amount": 45,
+                            "return_amount": 25,
+                        }
+                        for schema in ("fbo", "fbs")
+                    ],
+                    "volume_weight": round(0.2 + rnd(self.seed, "vw", k) * 5, 2),
+                    "is_prepayment": False,
+                    "is_prepayment_allowed": True,
+                    "vat": "0.0",
+                }
+            )
+        return {"result": {"items": items}}
+
+    def product_prices(self, shop_id, query, data):
+        product_ids = data.get("filter", {}).get("product_id")
+        products = self.selected_products(shop_id, product_ids)
+        offset = int(data.get("last_id") or 0)
+        limit = self.limit(data.get("limit"), LIMIT_PRODUCTS)
+        page = products[offset : offset + limit]
+        return {
+            "result": {
+                "items": [
+                    {
+                        "product_id": p["product_id"],
+                        "offer_id": p["offer_id"],
+                        "price": {
+                            "price": f"{p['price']:.2f}",
+                            "old_price": f"{p['price'] * 1.2:.2f}",
+                            "marketing_price": f"{p['price']:.2f}",
+                            "marketing_seller_price": f"{p['price']:.2f}",
+                            "min_price": f"{p['price'] * 0.8:.2f}",
+                            "currency_code": "RUB",
+                            "vat": "0.0",
+                        },
+                        "price_index": f"{0.8 + rnd(self.seed, 'pi', p['k']) * 0.6:.2f}",
+                        "commissions": {
+                            "sales_percent": 8 + p["k"] % 12,
+                            "fbo_fulfillment_amount": 25,
+                            "fbo_direct_flow_trans_max_amount": 15 + p["k"] % 30,
+                            "fbo_deliv_to_customer_amount": 45,
+                            "fbo_return_flow_amount": 25,
+                            "fbo_return_flow_trans_max_amount": 15 + p["k"] % 30,
+                            "fbs_first_mile_max_amount": 20,
+                            "fbs_direct_flow_trans_max_amount": 20 + p["k"] % 30,
+                            "fbs_deliv_to_customer_amount": 45,
+                            "fbs_return_flow_amount": 25,
+                            "fbs_return_flow_trans_max_amount": 20 + p["k"] % 30,
+                        },
+                        "marketing_actions": {
+                            "actions": [
+                                {"title": f"Акция {i}", "discount_value": "10"}
+                                for i in range(p["k"] % 3)
+                            ],
+                            "current_period_from": None,
+                            "current_period_to": None,
+                            "ozon_actions_exist": p["k"] % 3 > 0,
+                        },
+                        "volume_weight": round(
+                            0.2 + rnd(self.seed, "vw", p["k"]) * 5, 2
+                        ),
+                    }
+                    for p in page
+                ],
+                "total": len(products),
+                "last_id": str(offset + len(page)) if page else "",
+            }
+        }
+
+    def product_attributes(self, shop_id, query, data):
+        product_ids = data.get("filter", {}).get("product_id")
+        products = self.selected_products(shop_id, product_ids)
+        offset = int(data.get("last_id") or 0)
+        limit = self.limit(data.get("limit"), LIMIT_PRODUCTS)
+        page = products[offset : offset + limit]
+        return {
+            "result": [
+                {
+                    "id": p["product_id"],
+                    "offer_id": p["offer_id"],
+                    "name": p["name"],
+                    "barcode": f"460{p['product_id']}",
+                    "category_id": 17030000 + p["k"] % 50,
+                    "height": 100,
+                    "depth": 200,
+                    "width": 150,
+                    "dimension_unit": "mm",
+                    "weight": 500 + p["k"] % 1000,
+                    "weight_unit": "g",
+                    "images": [
+                        {
+                            "file_name": f"https://cdn.example.com/{p['k']}/{i}",
+                            "default": i == 1,
+                            "index": i - 1,
+                        }
+                        for i in range(1, 2 + p["k"] % 9)
+                    ],
+                    "images360": [],
+                    "pdf_list": [],
+                    "attributes": [
+                        {
+                            "attribute_id": 85,
+                            "complex_id": 0,
+                            "values": [{"dictionary_value_id": 0, "value": "Бренд"}],
+                        }
+                    ],
+                    "complex_attributes": [],
+                    "color_image": "",
+                    "rich_content": "{}" if p["k"] % 3 == 0 else None,
+                }
+                for p in page
+            ],
+            "total": len(products),
+            "last_id": str(offset + len(page)) if page else "",
+        }
+
+    def product_stocks(self, shop_id, query, data):
+        products = list(self.products(shop_id))
+        offset = int(data.get("last_id") or 0)
+        limit = self.limit(data.get("limit"), LIMIT_PRODUCTS)
+        page = products[offset : offset + limit]
+        today = self.end_date.isoformat()
+        return {
+            "result": {
+                "items": [
+                    {
+                        "product_id": p["product_id"],
+                        "offer_id": p["offer_id"],
+                        "stocks": [
+                            {
+                                "type": type_,
+                                "present": int(
+                                    rnd(
+                                        self.seed,
+                                        "present",
+                                        p["product_id"],
+                                        type_,
+                                        today,
+                                    )
+                                    * 200
+                                ),
+                                "reserved": int(
+                                    rnd(
+                                        self.seed,
+                                        "reserved",
+                                        p["product_id"],
+                                        type_,
+                                        today,
+                                    )
+                                    * 10
+                                ),
+                            }
+                            for type_ in ("fbo", "fbs")
+                        ],
+                    }
+                    for p in page
+                ],
+                "total": len(products),
+                "last_id": str(offset + len(page)) if page else "",
+            }
+        }
+
+    def warehouse_stocks(self, shop_id, query, data):
+        rows = []
+        today = self.end_date.isoformat()
+        for p in self.products(shop_id):
+            for n, warehouse in enumerate(WAREHOUSES, 1):
+                if (p["product_id"] + n) % 3:
+                    continue
+                free = int(rnd(self.seed, "wh", p["product_id"], n, today) * 100)
+                rows.append(
+                    {
+                        "sku": p["fbo_sku"],
+                        "item_code": p["offer_id"],
+                        "item_name": p["name"],
+                        "free_to_sell_amount": free,
+                        "promised_amount": 0,
+                        "reserved_amount": free // 20,
+                        "warehouse_name": warehouse.upper(),
+                    }
+                )
+        offset = int(data.get("offset") or 0)
+        limit = self.limit(data.get("limit"), LIMIT_WAREHOUSE_STOCKS)
+        return {"result": {"rows": rows[offset : offset + limit]}}
+
+    # Seller API: аналитика, финансы, заказы
+
+    def analytics(self, shop_id, query, data):
+        date_from = date.fromisoformat(data["date_from"][:10])
+        date_to = date.fromisoformat(data["date_to"][:10])
+        metrics = data.get("metrics") or ["hits_view"]
+        days = self.dates(date_from, date_to)
+        products = list(self.products(shop_id))
+
+        offset = int(data.get("offset") or 0)
+        limit = self.limit(data.get("limit"), LIMIT_ANALYTICS)
+        rows = []
+        # строки SKU x день без построения всей таблицы
+        for num in range(offset, min(offset + limit, len(days) * len(products))):
+            day, p = days[num // len(products)], products[num % len(products)]
+            views = (
+                rnd(self.seed, "views", p["product_id"], day)
+                * 100
+                * (1 + p["product_id"] % 7)
+            )
+            rows.append(
+                {
+                    "dimensions": [
+                        {"id": str(p["fbo_sku"]), "name": p["name"]},
+                        {"id": day.isoformat(), "name": ""},
+                    ],
+                    "metrics": [
+                        round(views * ANALYTICS_METRICS.get(m, 0.1), 2)
+                        if m in ("adv_sum_all", "position_category")
+                        else int(views * ANALYTICS_METRICS.get(m, 0.1))
+                        for m in metrics
+                    ],
+                }
+            )
+        return {
+            "result": {"data": rows, "totals": [0 for m in metrics]},
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    def transactions(self, shop_id, query, data):
+        period = data.get("filter", {}).get("date", {})
+        date_from = datetime.fromisoformat(period["from"][:10]).date()
+        date_to = datetime.fromisoformat(period["to"][:10]).date()
+        days = set(self.dates(date_from, date_to))
+
+        operations = []
+        for o in self.orders(shop_id, "FBO"):
+            operation_date = o["created_at"].date() + timedelta(days=2)
+            if o["status"] != "delivered" or operation_date not in days:
+                continue
+            revenue = sum(float(p["price"]) * p["quantity"] for p in o["products"])
+            commission = round(revenue * 0.1, 2)
+            operations.append(
+                {
+                    "operation_id": o["order_id"] * 10 + 1,
+                    "operation_type": "OperationAgentDeliveredToCustomer",
+                    "operation_date": f"{operation_date} 00:00:00",
+                    "operation_type_name": "Доставка покупателю",
+                    "delivery_charge": 0,
+                    "return_delivery_charge": 0,
+                    "accruals_for_sale": revenue,
+                    "sale_commission": -commission,
+                    "amount": round(revenue - commission - 40 * len(o["products"]), 2),
+                    "type": "orders",
+                    "posting": {
+                        "delivery_schema": "FBO",
+                        "order_date": o["created_at"].strftime("%Y-%m-%d %H:%M:%S"),
+                        "posting_number": o["posting_number"],
+                        "warehouse_id": 0,
+                    },
+                    "items": [
+                        {"name": p["name"], "sku": p["sku"]} for p in o["products"]
+                    ],
+                    "services": [
+                        {
+                            "name": "MarketplaceServiceItemDirectFlowLogistic",
+                            "price": -40,
+                        }
+                        for p in o["products"]
+                    ],
+                }
+            )
+
+        bases = id_bases(shop_id)
+        for g in range(1, self.skus * self.days // 10 + 1):
+            operation_date = self.end_date - timedelta(days=g % self.days)
+            if operation_date not in days:
+                continue
+            operations.append(
+                {
+                    "operation_id": bases["operation_base"] + g,
+                    "operation_type": "OperationMarketplaceServicePremiumCashback"
+                    if g % 2 == 0
+                    else "MarketplaceSellerInstallmentOperation",
+                    "operation_date": f"{operation_date} 00:00:00",
+                    "operation_type_name": "Премиум" if g % 2 == 0 else "Рассрочка",
+                    "delivery_charge": 0,
+                    "return_delivery_charge": 0,
+                    "accruals_for_sale": 0,
+                    "sale_commission": 0,
+                    "amount": -round(rnd(self.seed, "service", shop_id, g) * 100, 2),
+                    "type": "services",
+                    "posting": {
+                        "delivery_schema": "",
+                        "order_date": "",
+                        "posting_number": "",
+                        "warehouse_id": 0,
+                    },
+                    "items": [],
+                    "services": [],
+                }
+            )
+        operations.sort(key=lambda o: (o["operation_date"], o["operation_id"]))
+
+        page_size = self.limit(data.get("page_size"), LIMIT_TRANSACTIONS)
+        page = int(data.get("page") or 1)
+        return {
+            "result": {
+                "operations": operations[(page - 1) * page_size : page * page_size],
+                "page_count": max(1, -(-len(operations) // page_size)),
+                "row_count": len(operations),
+            }
+        }
+
+    def orders(self, shop_id, type_):
+        """Заказы магазина, как у bench_generate, кэшируются"""
+        key = (shop_id, type_)
+        if key in self._orders:
+            return self._orders[key]
+
+        bases = id_bases(shop_id)
+        products = list(self.products(shop_id))
+        count = int(self.skus * self.days * ORDERS_PER_SKU)
+        orders = []
+        if type_ == "FBS":
+            count //= 10
+        for g in range(1, count + 1):
+            created_at = datetime.combine(
+                self.end_date - timedelta(days=g % self.days), datetime.min.time()
+            )
+            if type_ == "FBO":
+                created_at += timedelta(minutes=g * 7 % 1440)
+                order_id = bases["order_base"] + g
+                prefix, items = "BN", 1 + (order_id % 5 == 0) + (order_id % 15 == 0)
+                status = (
+                    "cancelled"
+                    if g % 20 == 0
+                    else "delivering"
+                    if created_at.date() > self.end_date - timedelta(days=3)
+                    else "delivered"
+                )
+            else:
+                order_id = bases["order_base"] + 50000000 + g
+                prefix, items = "FS", 1
+                status = "cancelled" if g % 20 == 0 else "delivered"
+
+            order_products = []
+            for i in range(1, items + 1):
+                step = i * 104729 if type_ == "FBO" else 0
+                p = products[(order_id * 7919 + step) % self.skus]
+                order_products.append(
+                    {
+                        "sku": p["fbo_sku" if type_ == "FBO" else "fbs_sku"],
+                        "name": p["name"],
+                        "offer_id": p["offer_id"],
+                        "quantity": 2 if (order_id + i) % 7 == 0 else 1,
+                        "price": f"{p['price']:.2f}",
+                        "digital_codes": [],
+                        "currency_code": "RUB",
+                    }
+                )
+            orders.append(
+                {
+                    "order_id": order_id,
+                    "order_number": f"{prefix}{shop_id}-{g}",
+                    "posting_number": f"{prefix}{shop_id}-{g}-1",
+                    "status": status,
+                    "cancel_reason_id": 0,
+                    "created_at": created_at,
+                    "in_process_at": created_at + timedelta(hours=1),
+                    "products": order_products,
+                    "analytics_data": {
+                        "region": REGIONS[g % len(REGIONS)],
+                        "city": REGIONS[g % len(REGIONS)],
+                        "delivery_type": "Courier" if g % 3 == 0 else "PVZ",
+                        "is_premium": g % 50 == 0,
+                        "payment_type_group_name": "Карты оплаты",
+                        "warehouse_id": 1 + g % len(WAREHOUSES),
+                        "warehouse_name": WAREHOUSES[g % len(WAREHOUSES)].upper(),
+                        "is_legal": False,
+                    },
+                }
+            )
+        orders.sort(key=lambda o: o["created_at"])
+        with self._lock:
+            self._orders[key] = orders
+        return orders
+
+    def filtered_postings(self, shop_id, type_, data):
+        period = data.get("filter", {})
+        since = datetime.fromisoformat(period["since"][:19])
+        to = datetime.fromisoformat(period["to"][:19])
+        status = period.get("status")
+        postings = [
+            o
+            for o in self.orders(shop_id, type_)
+            if since <= o["created_at"] <= to and (not status or o["status"] == status)
+        ]
+        if data.get("dir", "ASC").upper() == "DESC":
+            postings.reverse()
+        return postings
+
+    def posting(self, o, data):
+        posting = {
+            **o,
+            "created_at": o["created_at"].strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "in_process_at": o["in_process_at"].strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "additional_data": [],
+        }
+        if not data.get("with", {}).get("analytics_data"):
+            posting["analytics_data"] = None
+        if data.get("with", {}).get("financial_data"):
+            posting["financial_data"] = {
+                "products": [
+                    {
+                        "product_id": p["sku"],
+                        "price": float(p["price"]),
+                        "old_price": round(float(p["price"]) * 1.2, 2),
+                        "client_price": "",
+                        "quantity": p["quantity"],
+                        "payout": round(float(p["price"]) * 0.9, 2),
+                        "commission_amount": round(float(p["price"]) * 0.1, 2),
+                        "commission_percent": 10,
+                        "total_discount_value": 0,
+                        "total_discount_percent": 0,
+                        "actions": [],
+                        "picking": None,
+                        "item_services": {
+                            "marketplace_service_item_fulfillment": -round(
+                                float(p["price"]) * 0.05, 2
+                            ),
+                            "marketplace_service_item_direct_flow_trans": -15,
+                            "marketplace_service_item_deliv_to_customer": -round(
+                                float(p["price"]) * 0.04, 2
+                            ),
+                        },
+                    }
+                    for p in o["products"]
+                ],
+                "posting_services": {},
+            }
+        return posting
+
+    def fbo_list(self, shop_id, query, data):
+        postings = self.filtered_postings(shop_id, "FBO", data)
+        offset = int(data.get("offset") or 0)
+        limit = self.limit(data.get("limit"), LIMIT_POSTINGS)
+        return {
+            "result": [self.posting(o, data) for o in postings[offset : offset + limit]]
+        }
+
+    def fbs_list(self, shop_id, query, data):
+        postings = self.filtered_postings(shop_id, "FBS", data)
+        offset = int(data.get("offset") or 0)
+        limit = self.limit(data.get("limit"), LIMIT_POSTINGS)
+        return {
+            "result": {
+                "postings": [
+                    self.posting(o, data) for o in postings[offset : offset + limit]
+                ],
+                "has_next": offset + limit < len(postings),
+            }
+        }
+
+    # Performance API
+
+    def token(self, shop_id, query, data):
+        return {
+            "access_token": f"fake-{shop_id}",
+            "expires_in": 1800,
+            "token_type": "Bearer",
+        }
+
+    def campaign_rows(self, shop_id):
+        base = id_bases(shop_id)["campaign_base"]
+        created_at = f"{self.end_date - timedelta(days=400)}T00:00:00.000000Z"
+        for c in range(1, max(1, self.skus // CAMPAIGN_SIZE) + 1):
+            yield {
+                "id": str(base + c),
+                "title": f"Кампания {c}",
+                "state": "CAMPAIGN_STATE_RUNNING"
+                if c % 10 < 7
+                else "CAMPAIGN_STATE_INACTIVE",
+                "advObjectType": "SEARCH_PROMO" if c % 5 == 0 else "SKU",
+                "fromDate": "",
+                "toDate": "",
+                "dailyBudget": "0",
+                "budget": "0",
+                "placement": ["PLACEMENT_INVALID"],
+                "createdAt": created_at,
+                "updatedAt": f"{self.end_date}T00:00:00.000000Z",
+                "productAutopilotStrategy": "NO_AUTO_STRATEGY",
+                "productCampaignMode": "PRODUCT_CAMPAIGN_MODE_AUTO",
+            }
+
+    def campaign_skus(self, shop_id, campaign_id):
+        campaigns = max(1, self.skus // CAMPAIGN_SIZE)
+        offset = int(campaign_id) - id_bases(shop_id)["campaign_base"] - 1
+        return [
+            p
+            for p in self.products(shop_id)
+            if (p["product_id"] - id_bases(shop_id)["product_base"]) % campaigns
+            == offset
+        ]
+
+    def campaigns(self, shop_id, query, data):
+        campaigns = list(self.campaign_rows(shop_id))
+        if query.get("campaignIds"):
+            ids = set(query["campaignIds"].split(","))
+            campaigns = [c for c in campaigns if c["id"] in ids]
+        return {"list": campaigns, "total": str(len(campaigns))}
+
+    def campaign_objects(self, shop_id, query, data, campaign_id):
+        return {
+            "list": [
+                {"id": str(p["fbo_sku"])}
+                for p in self.campaign_skus(shop_id, campaign_id)
+            ]
+        }
+
+    def campaign_products(self, shop_id, query, data, campaign_id):
+        products = self.campaign_skus(shop_id, campaign_id)
+        page, page_size = int(query.get("page", 1)), int(query.get("pageSize", 100))
+        return {
+            "products": [
+                {
+                    "sku": str(p["fbo_sku"]),
+                    "bid": str(int(rnd(self.seed, "bid", p["product_id"]) * 50000000)),
+                    "title": p["name"],
+                    "stopWords": [],
+                }
+                for p in products[(page - 1) * page_size : page * page_size]
+            ]
+        }
+
+    def search_promo_products(self, shop_id, query, data):
+        products = [
+            p
+            for c in self.campaign_rows(shop_id)
+            if c["advObjectType"] == "SEARCH_PROMO"
+            for p in self.campaign_skus(shop_id, c["id"])
+        ]
+        page, page_size = int(data.get("page", 1)), int(data.get("pageSize", 100))
+        return {
+            "products": [
+                {
+                    "sku": str(p["fbo_sku"]),
+                    "bid": "5.00",
+                    "bidPrice": f"{p['price'] * 0.05:.2f}",
+                    "price": f"{p['price']:.2f}",
+                    "title": p["name"],
+                    "visibilityIndex": str(
+                        1 + int(rnd(self.seed, "vis", p["product_id"]) * 5)
+                    ),
+                    "views": "0",
+                    "clicks": "0",
+                    "orders": "0",
+                }
+                for p in products[(page - 1) * page_size : page * page_size]
+            ],
+            "total": str(len(products)),
+        }
+
+    def campaign_daily(self, shop_id, query, data):
+        date_from = date.fromisoformat(query.get("dateFrom", str(self.end_date)))
+        date_to = date.fromisoformat(query.get("dateTo", str(self.end_date)))
+        campaigns = list(self.campaign_rows(shop_id))
+        if query.get("campaignIds"):
+            ids = set(query["campaignIds"].split(","))
+            campaigns = [c for c in campaigns if c["id"] in ids]
+        rows = []
+        for day in self.dates(date_from, date_to):
+            for c in campaigns:
+                views = int(rnd(self.seed, "daily", c["id"], day) * 20000)
+                rows.append(
+                    {
+                        "id": c["id"],
+                        "title": c["title"],
+                        "date": day.isoformat(),
+                        "views": str(views),
+                        "clicks": str(views // 20),
+                        "moneySpent": f"{views * 0.3:.2f}".replace(".", ","),
+                        "avgBid": "6,00",
+                        "orders": str(views // 200),
+                        "ordersMoney": f"{views // 200 * 1000:.2f}".replace(".", ","),
+                    }
+                )
+        return {"rows": rows}
+
+    def report_request(self, shop_id, query, data):
+        """Отчет статистики: одновременно готовится один отчет клиента"""
+        now = time.monotonic()
+        with self._lock:
+            for report in self._reports.values():
+                if (
+                    report["shop_id"] == shop_id
+                    and now - report["started"] < self.report_delay
+                ):
+                    return 429, {"error": "Too many requests: report is in progress"}
+            report_uuid = str(uuid.uuid4())
+            self._reports[report_uuid] = {
+                "shop_id": shop_id,
+                "started": now,
+                "created_at": datetime.utcnow(),
+                "request": data,
+            }
+        return {"UUID": report_uuid, "vendor": False}
+
+    def report_state(self, report):
+        elapsed = time.monotonic() - report["started"]
+        if elapsed >= self.report_delay:
+            return "OK"
+        return "IN_PROGRESS" if elapsed >= self.report_delay / 2 else "NOT_STARTED"
+
+    def report_check(self, shop_id, query, data, report_uuid):
+        report = self._reports.get(report_uuid)
+        if report is None or report["shop_id"] != shop_id:
+            return 404, {"error": "Report not found"}
+        state = self.report_state(report)
+        return 200, {
+            "UUID": report_uuid,
+            "state": state,
+            "createdAt": report["created_at"].strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "updatedAt": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "request": {
+                "campaigns": report["request"].get("campaigns", []),
+                "dateFrom": report["request"].get("dateFrom"),
+                "dateTo": report["request"].get("dateTo"),
+                "groupBy": report["request"].get("groupBy", "DATE"),
+            },
+            "error": "",
+            "link": f"/api/client/statistics/report?UUID={report_uuid}"
+            if state == "OK"
+            else "",
+            "kind": "STATS",
+        }
+
+    def report_list(self, shop_id, query, data):
+        return {
+            "items": [
+                self.report_check(shop_id, query, data, report_uuid)[1]
+                for report_uuid, report in list(self._reports.items())
+                if report["shop_id"] == shop_id
+            ],
+        }
+
+    def report_download(self, shop_id, query, data):
+        report = self._reports.get(query.get("UUID", ""))
+        if (
+            report is None
+            or report["shop_id"] != shop_id
+            or self.report_state(report) != "OK"
+        ):
+            return 404, {"error": "Report not found"}
+        request = report["request"]
+        date_from = date.fromisoformat(request["dateFrom"][:10])
+        date_to = date.fromisoformat(request["dateTo"][:10])
+        types = {c["id"]: c["advObjectType"] for c in self.campaign_rows(shop_id)}
+
+        result = {}
+        for campaign_id in request.get("campaigns", []):
+            campaign_id = str(campaign_id)
+            rows = []
+            for day in self.dates(date_from, date_to):
+                for p in self.campaign_skus(shop_id, campaign_id):
+                    if (p["product_id"] + day.toordinal()) % 5 == 0:
+                        continue
+                    views = int(
+                        rnd(self.seed, "report", campaign_id, p["product_id"], day)
+                        * 1000
+                    )
+                    row = {
+                        "date": day.strftime("%d.%m.%Y"),
+                        "sku": str(p["fbo_sku"]),
+                        "title": p["name"],
+                        "price": f"{p['price']:.2f}".replace(".", ","),
+                        "views": str(views),
+                        "clicks": str(views // 20),
+                        "moneySpent": f"{views * 0.3:.2f}".replace(".", ","),
+                        "orders": str(views // 200),
+                        "ordersMoney": f"{views // 200 * p['price']:.2f}".replace(
+                            ".", ","
+                        ),
+                    }
+                    if types.get(campaign_id) == "SEARCH_PROMO":
+                        row.update(
+                            {
+                                "orderId": f"{campaign_id}{p['k']}{day:%m%d}",
+                                "orderNumber": f"{campaign_id}-{p['k']}-{day:%m%d}",
+                                "ozonId": str(p["fbo_sku"]),
+                                "ozonIdAdvSku": str(p["fbo_sku"]),
+                                "salePrice": f"{p['price']:.2f}".replace(".", ","),
+                                "bidValue": "5,00",
+                                "quantity": "1",
+                            }
+                        )
+                    else:
+                        row["page"] = (
+                            "search"
+                            if (p["product_id"] + day.toordinal()) % 2
+                            else "category"
+                        )
+                        row["condition"] = ""
+                    rows.append(row)
+            result[campaign_id] = {
+                "title": f"Кампания {campaign_id}",
+                "report": {"rows": rows, "totals": {}},
+            }
+        return result
+
+
+def count_items(data):
+    """Число строк в ответе для задержки latency_per_item"""
+    if isinstance(data, dict):
+        for key in (
+            "result",
+            "items",
+            "rows",
+            "list",
+            "products",
+            "operations",
+            "postings",
+            "data",
+        ):
+            if key in data:
+                value = data[key]
+                return len(value) if isinstance(value, list) else count_items(value)
+        return sum(
+            len(v["report"]["rows"])
+            for v in data.values()
+            if isinstance(v, dict) and isinstance(v.get("report"), dict)
+        )
+    return len(data) if isinstance(data, list) else 0
+
+
+def canonical_body(body):
+    if not body:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body.decode("utf-8", errors="replace")
+
+
+def redact(body):
+    if isinstance(body, dict):
+        return {
+            k: "***" if k in ("client_secret", "api_key") else redact(v)
+            for k, v in body.items()
+        }
+    return body
+
+
+def leading_int(value):
+    match = re.match(r"\d+", str(value or ""))
+    return int(match.group()) if match else None
+
+
+class FakeOzonHandler(BaseHTTPRequestHandler):
+    fake = None  # FakeOzon, задается в serve()
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def handle_request(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            status, headers, payload = self.fake.handle(
+                self.command, self.path, self.headers, body
+            )
+        except Exception as e:
+            logger.exception("%s %s: %s", self.command, self.path, e)
+            status, headers = 500, {"Content-Type": "application/json"}
+            payload = json.dumps({"code": 13, "message": str(e)}).encode()
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+def serve(fake, host="127.0.0.1", port=8090):
+    """HTTP-сервер поддельного API, запускается serve_forever()
+
+    :param fake: FakeOzon
+    :param host:
+    :param port: 0 - свободный порт
+    :return: ThreadingHTTPServer
+    """
+    handler = type("Handler", (FakeOzonHandler,), {"fake": fake})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
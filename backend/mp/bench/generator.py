@@ -0,0 +1,605 @@
+import json
+import logging
+import os
+import re
+from datetime import date
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+
+from api.helpers import execute_sql, Update_Daily, Update_Parsed, Update_Ledger
+from api.models import (
+    Daily,
+    Ledger,
+    ParsedFBO,
+    ParsedFBOProduct,
+    ParsedProduct,
+    ParsedTransaction,
+)
+from mp.helpers import update_shop_stats
+from mp.helpers.shop_stats import install_shop_stats_triggers
+from mp.helpers.selfbuy import match_selfbuys, update_selfbuys
+from mp.models import Shop
+from .schema import OZON_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+BENCH_USER = "bench"
+BENCH_SHOP_PREFIX = "bench-"
+DATASET_FILE = settings.TMP_DIR / "bench" / "dataset.json"
+
+SCALES = {
+    "small": {"shops": 2, "skus": 100, "days": 30},
+    "medium": {"shops": 4, "skus": 1000, "days": 90},
+    "large": {"shops": 10, "skus": 2000, "days": 180},
+}
+
+# кластеры складов, как в отчете по товарам
+WAREHOUSES = [
+    "horug",
+    "horug_bulky",
+    "new_riga",
+    "kzn",
+    "rnd",
+    "spb",
+    "ekb",
+    "tvr",
+    "tvr_rfc",
+    "exp",
+    "klg",
+    "smr",
+    "nsk",
+    "krr",
+    "hbr",
+]
+REGIONS = ["Москва", "Санкт-Петербург", "Казань", "Екатеринбург", "Новосибирск"]
+
+# заказов FBO в день на один SKU, каждый 5-й заказ из 2 товаров, каждый 15-й - из 3
+ORDERS_PER_SKU = 0.3
+# товаров в одной рекламной кампании
+CAMPAIGN_SIZE = 50
+
+OZON_TABLES = [
+    "mp_ozon_product",
+    "mp_ozon_sku_offer",
+    "mp_ozon_stock",
+    "mp_ozon_warehousestock",
+    "mp_ozon_analytics",
+    "mp_ozon_fbo",
+    "mp_ozon_fbo_product",
+    "mp_ozon_fbs",
+    "mp_ozon_fbs_product",
+    "mp_ozon_transaction",
+    "mp_ozon_campaign",
+    "mp_ozon_campaignproduct",
+    "mp_ozon_campaignproduct_history",
+    "mp_ozon_statisticscampaignproduct",
+    "mp_ozon_statisticscampaign",
+    "mp_ozon_report",
+]
+
+# производные таблицы проекта, пересчитываются после генерации
+DERIVED_MODELS = [
+    Daily,
+    Ledger,
+    ParsedFBO,
+    ParsedFBOProduct,
+    ParsedProduct,
+    ParsedTransaction,
+]
+
+CLEAR_SQL = """
+DELETE FROM mp_ozon_statisticscampaignproduct WHERE campaign_id IN (
+    SELECT id FROM mp_ozon_campaign WHERE shop_id = %(shop_id)s);
+DELETE FROM mp_ozon_statisticscampaign WHERE campaign_id IN (
+    SELECT id FROM mp_ozon_campaign WHERE shop_id = %(shop_id)s);
+DELETE FROM mp_ozon_campaignproduct_history WHERE campaign_id IN (
+    SELECT id FROM mp_ozon_campaign WHERE shop_id = %(shop_id)s);
+DELETE FROM mp_ozon_campaignproduct WHERE campaign_id IN (
+    SELECT id FROM mp_ozon_campaign WHERE shop_id = %(shop_id)s);
+DELETE FROM mp_ozon_campaign WHERE shop_id = %(shop_id)s;
+DELETE FROM mp_ozon_report WHERE shop_id = %(shop_id)s;
+DELETE FROM mp_ozon_transaction WHERE shop_id = %(shop_id)s;
+DELETE FROM mp_ozon_fbo_product WHERE order_id IN (
+    SELECT id FROM mp_ozon_fbo WHERE shop_id = %(shop_id)s);
+DELETE FROM mp_ozon_fbo WHERE shop_id = %(shop_id)s;
+DELETE FROM mp_ozon_fbs_product WHERE order_id IN (
+    SELECT id FROM mp_ozon_fbs WHERE shop_id = %(shop_id)s);
+DELETE FROM mp_ozon_fbs WHERE shop_id = %(shop_id)s;
+DELETE FROM mp_ozon_analytics WHERE shop_id = %(shop_id)s;
+DELETE FROM mp_ozon_warehousestock WHERE shop_id = %(shop_id)s;
+DELETE FROM mp_ozon_stock WHERE shop_id = %(shop_id)s;
+DELETE FROM mp_ozon_sku_offer WHERE product_id IN (
+    SELECT id FROM mp_ozon_product WHERE shop_id = %(shop_id)s);
+DELETE FROM mp_ozon_product WHERE shop_id = %(shop_id)s;
+"""
+
+# Значения, которые должны совпадать в разных таблицах (цена, состав заказа),
+# считаются от номера строки. Остальные - rnd(ключ строки, номер поля): хеш ключа
+# с seed в [0, 1). В отличие от random() не зависит от порядка чтения строк,
+# поэтому повторная генерация дает те же данные.
+GENERATE_SQL = {
+    "products": """
+        INSERT INTO mp_ozon_product (
+            id, shop_id, offer_id, fbo_sku, fbs_sku, name, state, visible,
+            price_index, min_price, marketing_price, images, images360, marketing_actions,
+            commissions, volume_weight, rich_content, primary_image, created_at, updated_at
+        )
+        SELECT
+            %(product_base)s + k,
+            %(shop_id)s,
+            'BN' || %(shop_id)s || '-' || k,
+            %(fbo_sku_base)s + k,
+            %(fbs_sku_base)s + k,
+            'Товар ' || k,
+            CASE WHEN k %% 20 = 7 THEN 'ARCHIVED' ELSE 'processed' END,
+            k %% 10 <> 3,
+            round((0.8 + rnd(k, 1) * 0.6)::numeric, 2),
+            (200 + (k * 7919) %% 4800) * 0.8,
+            200 + (k * 7919) %% 4800,
+            (SELECT json_agg('https://cdn.example.com/' || k || '/' || i)
+                FROM generate_series(1, 1 + k %% 9) i)::text,
+            CASE WHEN k %% 4 = 0 THEN '["360"]' ELSE '[]' END,
+            json_build_object('actions', (SELECT COALESCE(json_agg(i), '[]')
+                FROM generate_series(1, k %% 3) i))::text,
+            json_build_object(
+                'sales_percent', 8 + k %% 12,
+                'fbo_fulfillment_amount', 25,
+                'fbo_direct_flow_trans_max_amount', 15 + k %% 30,
+                'fbo_deliv_to_customer_amount', 45,
+                'fbo_return_flow_amount', 25,
+                'fbo_return_flow_trans_max_amount', 15 + k %% 30,
+                'fbs_first_mile_max_amount', 20,
+                'fbs_direct_flow_trans_max_amount', 20 + k %% 30,
+                'fbs_deliv_to_customer_amount', 45,
+                'fbs_return_flow_amount', 25,
+                'fbs_return_flow_trans_max_amount', 20 + k %% 30
+            )::text,
+            round((0.2 + rnd(k, 2) * 5)::numeric, 2),
+            CASE WHEN k %% 3 = 0 THEN '{}' END,
+            'https://cdn.example.com/' || k || '/1',
+            %(end_date)s::date - 365,
+            %(end_date)s::date
+        FROM generate_series(1, %(skus)s) k;
+
+        INSERT INTO mp_ozon_sku_offer (sku, type, offer_id, product_id)
+        SELECT fbo_sku, 'fbo', offer_id, id FROM mp_ozon_product WHERE shop_id = %(shop_id)s
+        UNION ALL
+        SELECT fbs_sku, 'fbs', offer_id, id FROM mp_ozon_product WHERE shop_id = %(shop_id)s
+        UNION ALL
+        SELECT %(discounted_sku_base)s + id - %(product_base)s, 'discounted', offer_id, id
+        FROM mp_ozon_product
+        WHERE shop_id = %(shop_id)s AND (id - %(product_base)s) %% 20 = 0;
+    """,
+    "stocks": """
+        INSERT INTO mp_ozon_stock (shop_id, product_id, date, type, present, reserved)
+        SELECT
+            %(shop_id)s, mop.id, %(end_date)s::date - d, t.type,
+            floor(rnd(mop.id * 20 + d * 2 + (t.type = 'fbs')::int, 3) * 200)::int,
+            floor(rnd(mop.id * 20 + d * 2 + (t.type = 'fbs')::int, 4) * 10)::int
+        FROM mp_ozon_product mop, generate_series(0, 6) d, (VALUES ('fbo'), ('fbs')) t(type)
+        WHERE mop.shop_id = %(shop_id)s;
+
+        INSERT INTO mp_ozon_warehousestock (shop_id, sku, offer_id, date, warehouse, discounted, for_sale)
+        SELECT
+            %(shop_id)s, mop.fbo_sku, mop.offer_id, %(end_date)s::date - d, w.name, false,
+            floor(rnd(mop.id * 1000 + d * 20 + w.n, 5) * 100)::int
+        FROM mp_ozon_product mop, generate_series(0, 6) d,
+            unnest(%(warehouses)s::text[]) WITH ORDINALITY w(name, n)
+        WHERE mop.shop_id = %(shop_id)s AND (mop.id + w.n) %% 3 = 0
+        UNION ALL
+        SELECT
+            %(shop_id)s, moso.sku, moso.offer_id, %(end_date)s::date - d, 'horug', true,
+            1 + floor(rnd(moso.sku * 10 + d, 6) * 3)::int
+        FROM mp_ozon_sku_offer moso
+        INNER JOIN mp_ozon_product mop ON mop.id = moso.product_id, generate_series(0, 6) d
+        WHERE mop.shop_id = %(shop_id)s AND moso.type = 'discounted';
+    """,
+    "analytics": """
+        INSERT INTO mp_ozon_analytics (
+            shop_id, sku, date, session_view, session_view_pdp, session_view_search,
+            hits_tocart, hits_tocart_pdp, hits_tocart_search, hits_view, hits_view_pdp,
+            hits_view_search, returns, cancellations, delivered_units, ordered_units, revenue,
+            adv_sum_all, adv_view_all, adv_view_pdp, adv_view_search_category, postings,
+            postings_premium, position_category
+        )
+        SELECT
+            %(shop_id)s, v.sku, v.date, v.views, v.views * 6 / 10, v.views * 4 / 10,
+            v.tocart, v.tocart / 2, v.tocart / 2, v.views * 3, v.views * 2, v.views,
+            v.ordered / 10, v.ordered / 8, v.ordered * 9 / 10, v.ordered, v.ordered * v.price,
+            round((v.views * 0.05)::numeric, 2), v.views / 5, v.views / 10, v.views / 10,
+            v.ordered, v.ordered / 20, round((1 + rnd(v.key, 7) * 500)::numeric, 2)
+        FROM (
+            SELECT
+                mop.fbo_sku as sku,
+                %(end_date)s::date - d as date,
+                mop.marketing_price as price,
+                mop.id * 1000 + d as key,
+                floor(rnd(mop.id * 1000 + d, 8) * 100 * (1 + mop.id %% 7))::int as views,
+                floor(rnd(mop.id * 1000 + d, 9) * 20)::int as tocart,
+                floor(power(rnd(mop.id * 1000 + d, 10), 3) * 10)::int as ordered
+            FROM mp_ozon_product mop, generate_series(0, %(days)s - 1) d
+            WHERE mop.shop_id = %(shop_id)s
+        ) v;
+    """,
+    "orders": """
+        INSERT INTO mp_ozon_fbo (
+            shop_id, order_id, order_number, posting_number, status, created_at,
+            in_process_at, analytics_data
+        )
+        SELECT
+            %(shop_id)s,
+            %(order_base)s + g,
+            'BN' || %(shop_id)s || '-' || g,
+            'BN' || %(shop_id)s || '-' || g || '-1',
+            CASE WHEN g %% 20 = 0 THEN 'cancelled'
+                WHEN created_at > %(end_date)s::date - 3 THEN 'delivering'
+                ELSE 'delivered' END,
+            created_at,
+            created_at + interval '1 hour',
+            json_build_object(
+                'region', (%(regions)s::text[])[1 + g %% %(regions_cnt)s],
+                'city', (%(regions)s::text[])[1 + g %% %(regions_cnt)s],
+                'delivery_type', CASE WHEN g %% 3 = 0 THEN 'Courier' ELSE 'PVZ' END,
+                'warehouse_name', upper((%(warehouses)s::text[])[1 + g %% %(warehouses_cnt)s])
+            )::text
+        FROM (
+            SELECT g, %(end_date)s::date - (g %% %(days)s) * interval '1 day'
+                + (g * 7 %% 1440) * interval '1 minute' as created_at
+            FROM generate_series(1, %(orders)s) g
+        ) o;
+
+        INSERT INTO mp_ozon_fbo_product (
+            order_id, product_id, ozon_order_id, sku, offer_id, name, quantity, price,
+            commission_amount, item_services
+        )
+        SELECT
+            mof.id, mop.id, mof.order_id, mop.fbo_sku, mop.offer_id, mop.name,
+            CASE WHEN (mof.order_id + i) %% 7 = 0 THEN 2 ELSE 1 END,
+            mop.marketing_price,
+            round(mop.marketing_price * (8 + (mop.id - %(product_base)s) %% 12) / 100, 2),
+            json_build_object(
+                'marketplace_service_item_fulfillment', -round(mop.marketing_price * 0.05, 2),
+                'marketplace_service_item_direct_flow_trans', -15,
+                'marketplace_service_item_deliv_to_customer', -round(mop.marketing_price * 0.04, 2)
+            )::text
+        FROM mp_ozon_fbo mof
+        CROSS JOIN LATERAL generate_series(
+            1, 1 + (mof.order_id %% 5 = 0)::int + (mof.order_id %% 15 = 0)::int) i
+        INNER JOIN mp_ozon_product mop
+            ON mop.id = %(product_base)s + (mof.order_id * 7919 + i * 104729) %% %(skus)s + 1
+        WHERE mof.shop_id = %(shop_id)s;
+
+        INSERT INTO mp_ozon_fbs (
+            shop_id, order_id, order_number, posting_number, status, created_at,
+            in_process_at, analytics_data
+        )
+        SELECT
+            %(shop_id)s, %(order_base)s + 50000000 + g, 'FS' || %(shop_id)s || '-' || g,
+            'FS' || %(shop_id)s || '-' || g || '-1',
+            CASE WHEN g %% 20 = 0 THEN 'cancelled' ELSE 'delivered' END,
+            %(end_date)s::date - (g %% %(days)s) * interval '1 day',
+            %(end_date)s::date - (g %% %(days)s) * interval '1 day', '{}'
+        FROM generate_series(1, %(orders)s / 10) g;
+
+        INSERT INTO mp_ozon_fbs_product (
+            order_id, product_id, ozon_order_id, sku, offer_id, name, quantity, price,
+            commission_amount, item_services
+        )
+        SELECT
+            mof.id, mop.id, mof.order_id, mop.fbs_sku, mop.offer_id, mop.name, 1,
+            mop.marketing_price, round(mop.marketing_price * 0.1, 2), '{}'
+        FROM mp_ozon_fbs mof
+        INNER JOIN mp_ozon_product mop
+            ON mop.id = %(product_base)s + (mof.order_id * 7919) %% %(skus)s + 1
+        WHERE mof.shop_id = %(shop_id)s;
+    """,
+    "transactions": """
+        INSERT INTO mp_ozon_transaction (
+            shop_id, operation_id, operation_type, operation_type_name, operation_date,
+            posting_number, type, sku, sku_cnt, items, services, accruals_for_sale,
+            sale_commission, services_amount, amount
+        )
+        SELECT
+            mof.shop_id, mof.order_id * 10 + 1, 'OperationAgentDeliveredToCustomer',
+            'Доставка покупателю', mof.created_at + interval '2 day', mof.posting_number,
+            'orders', p.sku, p.cnt, p.items, '[]', p.revenue, -p.commission, -40 * p.cnt,
+            p.revenue - p.commission - 40 * p.cnt
+        FROM mp_ozon_fbo mof
+        INNER JOIN LATERAL (
+            SELECT
+                MIN(mofp.sku) as sku,
+                COUNT(*) as cnt,
+                json_agg(json_build_object('name', mofp.name, 'sku', mofp.sku))::text as items,
+                SUM(mofp.quantity * mofp.price) as revenue,
+                SUM(mofp.quantity * mofp.commission_amount) as commission
+            FROM mp_ozon_fbo_product mofp
+            WHERE mofp.order_id = mof.id
+        ) p ON true
+        WHERE mof.shop_id = %(shop_id)s AND mof.status = 'delivered'
+            AND mof.created_at + interval '2 day' <= %(end_date)s::date + 1;
+
+        INSERT INTO mp_ozon_transaction (
+            shop_id, operation_id, operation_type, operation_type_name, operation_date,
+            posting_number, type, sku, sku_cnt, items, services, accruals_for_sale,
+            sale_commission, services_amount, amount
+        )
+        SELECT
+            %(shop_id)s, %(operation_base)s + g,
+            CASE WHEN g %% 2 = 0 THEN 'OperationMarketplaceServicePremiumCashback'
+                ELSE 'MarketplaceSellerInstallmentOperation' END,
+            CASE WHEN g %% 2 = 0 THEN 'Премиум' ELSE 'Рассрочка' END,
+            %(end_date)s::date - (g %% %(days)s),
+            NULL, 'services', %(fbo_sku_base)s + g %% %(skus)s + 1, 0, '[]', '[]', 0, 0, 0,
+            -round((rnd(g, 11) * 100)::numeric, 2)
+        FROM generate_series(1, %(skus)s * %(days)s / 10) g;
+
+        INSERT INTO mp_ozon_transaction (
+            shop_id, operation_id, operation_type, operation_type_name, operation_date,
+            posting_number, type, sku, sku_cnt, items, services, accruals_for_sale,
+            sale_commission, services_amount, amount
+        )
+        SELECT
+            %(shop_id)s, %(operation_base)s + 1000000 + g, 'OperationLackWriteOff',
+            'Компенсация', %(end_date)s::date - (g %% %(days)s), NULL, 'compensation',
+            %(fbo_sku_base)s + g %% %(skus)s + 1, 0,
+            json_build_array(
+                json_build_object('name', 'Товар ' || (g %% %(skus)s + 1),
+                    'sku', %(fbo_sku_base)s + g %% %(skus)s + 1)
+            )::text,
+            '[]', 0, 0, 0, round((rnd(g, 12) * 1000)::numeric, 2)
+        FROM generate_series(1, %(skus)s * %(days)s / 50) g;
+    """,
+    "campaigns": """
+        INSERT INTO mp_ozon_campaign (id, shop_id, title, state, adv_type, created_at, updated_at)
+        SELECT
+            %(campaign_base)s + c, %(shop_id)s, 'Кампания ' || c,
+            CASE WHEN c %% 10 < 7 THEN 'CAMPAIGN_STATE_RUNNING' ELSE 'CAMPAIGN_STATE_INACTIVE' END,
+            CASE WHEN c %% 5 = 0 THEN 'SEARCH_PROMO' ELSE 'SKU' END,
+            %(end_date)s::date - 400, %(end_date)s::date
+        FROM generate_series(1, %(campaigns)s) c;
+
+        INSERT INTO mp_ozon_campaignproduct (campaign_id, product_id, sku, bid)
+        SELECT
+            %(campaign_base)s + 1 + (mop.id - %(product_base)s) %% %(campaigns)s,
+            mop.id, mop.fbo_sku, round((5 + rnd(mop.id, 13) * 50)::numeric, 2)
+        FROM mp_ozon_product mop
+        WHERE mop.shop_id = %(shop_id)s;
+
+        INSERT INTO mp_ozon_campaignproduct_history (date, product_id, campaign_id, bid, visibility_idx)
+        SELECT
+            %(end_date)s::date - d, mocp.product_id, mocp.campaign_id,
+            round((500 + rnd(mocp.product_id * 1000 + d, 14) * 5000)::numeric, 0),
+            1 + floor(rnd(mocp.product_id * 1000 + d, 15) * 5)::int
+        FROM mp_ozon_campaignproduct mocp
+        INNER JOIN mp_ozon_campaign moc ON moc.id = mocp.campaign_id,
+            generate_series(0, %(days)s - 1) d
+        WHERE moc.shop_id = %(shop_id)s;
+
+        INSERT INTO mp_ozon_statisticscampaignproduct (
+            campaign_id, dt, sku, page, condition, price, views, clicks, expense, orders, revenue
+        )
+        SELECT
+            s.campaign_id, s.dt, s.sku, s.page, '', s.price, s.views, s.views / 20,
+            round((s.views * 0.3)::numeric, 2), s.views / 200, s.views / 200 * s.price
+        FROM (
+            SELECT
+                mocp.campaign_id,
+                %(end_date)s::date - d as dt,
+                mocp.sku,
+                CASE WHEN (mocp.product_id + d) %% 2 = 0 THEN 'search' ELSE 'category' END as page,
+                mop.marketing_price as price,
+                floor(rnd(mocp.product_id * 1000 + d, 16) * 1000)::int as views
+            FROM mp_ozon_campaignproduct mocp
+            INNER JOIN mp_ozon_campaign moc ON moc.id = mocp.campaign_id
+            INNER JOIN mp_ozon_product mop ON mop.id = mocp.product_id,
+                generate_series(0, %(days)s - 1) d
+            WHERE moc.shop_id = %(shop_id)s AND (mocp.product_id + d) %% 5 <> 0
+        ) s;
+
+        INSERT INTO mp_ozon_statisticscampaign (campaign_id, dt, views, clicks, expense)
+        SELECT mos.campaign_id, mos.dt, SUM(mos.views), SUM(mos.clicks), SUM(mos.expense)
+        FROM mp_ozon_statisticscampaignproduct mos
+        INNER JOIN mp_ozon_campaign moc ON moc.id = mos.campaign_id
+        WHERE moc.shop_id = %(shop_id)s
+        GROUP BY mos.campaign_id, mos.dt;
+
+        INSERT INTO mp_ozon_report (shop_id, uuid, state, conditions, response, is_parsed)
+        SELECT
+            %(shop_id)s, md5(%(shop_id)s || '-' || r)::uuid,
+            (ARRAY['OK', 'OK', 'OK', 'NOT_STARTED', 'ERROR'])[1 + r %% 5], '{}', '', r %% 5 < 3
+        FROM generate_series(1, %(days)s) r;
+    """,
+}
+
+
+RND_RE = re.compile(r"\brnd\(([^;]+?), (\d+)\)")
+
+
+class DatasetGenerator(object):
+    """Синтетические данные Ozon для замеров запросов
+
+    Магазины bench-N пользователя bench создаются один раз и при повторной
+    генерации только очищаются, поэтому ID магазинов и всех строк стабильны.
+    При одинаковых параметрах (включая end_date и seed) данные совпадают.
+    """
+
+    def __init__(self, shops, skus, days, end_date=None, seed=1):
+        self.shops = shops
+        self.skus = skus
+        self.days = days
+        self.end_date = end_date or date.today()
+        self.seed = seed
+
+    @classmethod
+    def from_scale(cls, scale, **kwargs):
+        return cls(**{**SCALES[scale], **kwargs})
+
+    def generate(self, create_schema=False):
+        if create_schema:
+            execute_sql(OZON_SCHEMA)
+            install_shop_stats_triggers()
+
+        shops = self.get_shops()
+        for num, shop in enumerate(shops):
+            with transaction.atomic():
+                self.generate_shop(shop, num)
+            logger.info(
+                "%s: сгенерированы данные, %s SKU за %s дней",
+                shop,
+                self.skus,
+                self.days,
+            )
+
+        execute_sql("ANALYZE;")
+        self.save_dataset(shops)
+        return shops
+
+    def get_shops(self):
+        user = get_user_model().objects.filter(username=BENCH_USER).first()
+        if user is None:
+            user = get_user_model().objects.create_user(
+                BENCH_USER, f"{BENCH_USER}@example.com", None
+            )
+            user.is_staff = True
+            user.save()
+
+        shops = []
+        for num in range(1, self.shops + 1):
+            shop, _ = Shop.objects.get_or_create(
+                user=user,
+                name=f"{BENCH_SHOP_PREFIX}{num}",
+                defaults={"shop_token": "ozon", "is_active": True},
+            )
+            shops.append(shop)
+        # лишние магазины от прошлой генерации большего размера
+        for shop in Shop.objects.filter(user=user).exclude(
+            pk__in=[s.pk for s in shops]
+        ):
+            execute_sql(CLEAR_SQL, {"shop_id": shop.pk})
+            shop.delete()
+        return shops
+
+    def params(self, shop):
+        return {
+            "shop_id": shop.pk,
+            "skus": self.skus,
+            "days": self.days,
+            "orders": int(self.skus * self.days * ORDERS_PER_SKU),
+            "campaigns": max(1, self.skus // CAMPAIGN_SIZE),
+            "end_date": self.end_date,
+            **id_bases(shop.pk),
+            "warehouses": WAREHOUSES,
+            "warehouses_cnt": len(WAREHOUSES),
+            "regions": REGIONS,
+            "regions_cnt": len(REGIONS),
+        }
+
+    def generate_shop(self, shop, num):
+        """Данные одного магазина и производные таблицы
+
+        :param shop:
+        :param num: порядковый номер магазина для seed
+        :return:
+        """
+        params = self.params(shop)
+        execute_sql(CLEAR_SQL, params)
+        shop.selfbuy_set.all().delete()
+        for model in DERIVED_MODELS:
+            model.objects.filter(shop=shop).delete()
+
+        params["seed"] = self.seed * 1000 + num
+        for name, sql in GENERATE_SQL.items():
+            execute_sql(rnd_sql(sql), params)
+
+        # каждый 200-й заказ - самовыкуп
+        execute_sql(
+            """
+            INSERT INTO mp_selfbuy ("order", shop_id, created_at, updated_at)
+            SELECT order_number, shop_id, NOW(), NOW()
+            FROM mp_ozon_fbo
+            WHERE shop_id = %(shop_id)s AND order_id %% 200 = 0
+            """,
+            params,
+        )
+
+        shop_params = {"shop_id": shop.pk}
+        Update_Parsed.products(shop_params)
+        Update_Parsed.orders(shop_params)
+        Update_Parsed.transactions(shop_params)
+        Update_Ledger.postings(shop_params)
+        match_selfbuys(shop)
+        update_selfbuys(shop)
+        Update_Daily.stocks(shop_params)
+        Update_Daily.transactions(shop_params)
+        Update_Daily.orders(shop_params)
+        Update_Daily.campaigns(shop_params)
+        update_shop_stats(shop, force=True)
+
+    def save_dataset(self, shops):
+        """Параметры и объем данных для сравнения замеров
+
+        :param shops:
+        :return:
+        """
+        dataset = {
+            "shops": self.shops,
+            "skus": self.skus,
+            "days": self.days,
+            "end_date": self.end_date.isoformat(),
+            "seed": self.seed,
+            "shop_ids": [shop.pk for shop in shops],
+            "rows": table_counts(),
+        }
+        DATASET_FILE.parent.mkdir(parents=True, exist_ok=True)
+        DATASET_FILE.write_text(json.dumps(dataset, ensure_ascii=False, indent=2))
+        return dataset
+
+
+def id_bases(shop_id):
+    """Начала диапазонов ID магазина, общие с поддельным API Ozon
+
+    :param shop_id:
+    :return:
+    """
+    return {
+        "product_base": 9000000000 + shop_id * 1000000,
+        # SKU в api_daily - integer
+        "fbo_sku_base": 1000000000 + shop_id * 100000,
+        "fbs_sku_base": 1500000000 + shop_id * 100000,
+        "discounted_sku_base": 2000000000 + shop_id * 100000,
+        "order_base": shop_id * 100000000,
+        "operation_base": 5000000000000 + shop_id * 10000000,
+        "campaign_base": shop_id * 10000,
+    }
+
+
+def rnd_sql(sql):
+    """Подставляем вместо rnd(key, n) псевдослучайное число [0, 1) от ключа строки"""
+    return RND_RE.sub(
+        r"((hashint8extended((\1)::bigint, %(seed)s * 100 + \2) & 2147483647)"
+        r"::float8 / 2147483648)",
+        sql,
+    )
+
+
+def is_production_db():
+    """База задана через DATABASE_URL (Heroku) - генерация только с --force"""
+    return bool(os.environ.get("DATABASE_URL"))
+
+
+def table_counts():
+    """Оценка числа строк в таблицах Ozon по статистике PostgreSQL"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname, reltuples::bigint FROM pg_class WHERE relname = ANY(%s)",
+            [OZON_TABLES],
+        )
+        return dict(cursor.fetchall())
+
+
+def load_dataset():
+    if not DATASET_FILE.exists():
+        return None
+    return json.loads(DATASET_FILE.read_text())
@@ -0,0 +1,119 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+PROJECT_DIR = settings.BASE_DIR.parent
+
+# точки входа: импорты процесса до готовности обрабатывать запросы и задачи
+ENTRY_POINTS = {
+    # gunicorn/uvicorn: приложение ASGI и URLconf, который Django грузит на первом запросе
+    "web": (
+        "from ka_space.asgi import application\n"
+        "from django.urls import get_resolver\n"
+        "get_resolver().url_patterns\n"
+    ),
+    # celery worker: Django из fixup Celery, затем модули задач
+    "worker": (
+        "from ka_space.celery import app\n"
+        "app.loader.init_worker()\n"
+        "app.loader.import_default_modules()\n"
+        "app.finalize(auto=True)\n"
+    ),
+    # manage.py <command> --help: загрузка Django и модуля команды без выполнения
+    "command": (
+        "import sys\n"
+        "from django.core.management import execute_from_command_line\n"
+        "try:\n"
+        "    execute_from_command_line(['manage.py', sys.argv[1], '--help'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+    ),
+}
+DEFAULT_COMMAND = "request_campaign_report"
+
+
+def run_entry(name, importtime=False, command=DEFAULT_COMMAND):
+    """Запуск точки входа в отдельном интерпретаторе
+
+    :param name: web, worker, command
+    :param importtime: с -X importtime
+    :param command: команда manage.py для command
+    :return: (секунды, stderr)
+    """
+    args = [sys.executable]
+    if importtime:
+        args += ["-X", "importtime"]
+    args += ["-c", ENTRY_POINTS[name]]
+    if name == "command":
+        args.append(command)
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": "ka_space.settings"}
+    start = time.perf_counter()
+    result = subprocess.run(
+        args, cwd=PROJECT_DIR, env=env, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode:
+        raise RuntimeError(f"{name}: {result.stderr.strip().splitlines()[-1:]}")
+    return elapsed, result.stderr
+
+
+def parse_importtime(stderr):
+    """Строки -X importtime: self и cumulative в мкс, вложенность - отступом
+
+    :param stderr:
+    :return: [(модуль, self, cumulative, верхнего уровня)]
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:") :].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        rows.append(
+            (
+                name.strip(),
+                int(parts[0]),
+                int(parts[1]),
+                not name.startswith("  "),
+            )
+        )
+    return rows
+
+
+def profile_entry(name, repeat=5, top=15, command=DEFAULT_COMMAND):
+    """Время запуска точки входа и импорты по пакетам
+
+    Время - медиана repeat запусков без -X importtime, включая запуск
+    интерпретатора. Разбивка по пакетам - по отдельному запуску с -X importtime.
+
+    :param name: web, worker, command
+    :param repeat:
+    :param top: пакетов в разбивке
+    :param command: команда manage.py для command
+    :return: результат для mp.bench.runner.save_results
+    """
+    timings = [run_entry(name, command=command)[0] for i in range(repeat)]
+    rows = parse_importtime(run_entry(name, importtime=True, command=command)[1])
+
+    packages = defaultdict(int)
+    for module, self_us, cumulative_us, is_top in rows:
+        packages[module.split(".")[0]] += self_us
+    return {
+        "case": f"startup.{name}",
+        "median": statistics.median(timings),
+        "min": min(timings),
+        "rows": len(rows),
+        "imports_ms": round(sum(r[2] for r in rows if r[3]) / 1000, 1),
+        "packages": {
+            package: round(us / 1000, 1)
+            for package, us in sorted(packages.items(), key=lambda p: -p[1])[:top]
+        },
+        "error": "",
+    }
@@ -0,0 +1,291 @@
+import importlib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from django.db import connection
+from django.utils import timezone
+
+from mp.helpers import KEY_TYPE_OZON, KEY_TYPE_OZON_PERFORMANCE
+from mp.models import APIKey
+from .fake_ozon import FakeOzon, serve, SELLER_URL, PERFORMANCE_URL
+from .runner import git_commit
+
+logger = logging.getLogger(__name__)
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    from mp_ozon.models import Report
+except ImportError:
+    Report = None
+
+OZON_HOSTS = {urlsplit(SELLER_URL).netloc, urlsplit(PERFORMANCE_URL).netloc}
+
+# задачи загрузки в порядке зависимостей: товары до остатков, кампании до отчетов
+INGEST_TASKS = [
+    "update_products",
+    "update_stocks",
+    "update_analytics",
+    "update_transactions",
+    "update_orders",
+    "update_campaigns",
+    "update_campaign_statistics",
+    "create_campaign_report",
+    "check_campaign_report",
+]
+PERFORMANCE_TASKS = {
+    "update_campaigns",
+    "update_campaign_statistics",
+    "create_campaign_report",
+    "check_campaign_report",
+}
+
+
+class IngestStats(object):
+    """Время запросов к API и к базе за время задачи"""
+
+    def __init__(self):
+        self.api_time = 0
+        self.api_requests = 0
+        self.api_errors = 0
+        self.db_time = 0
+        self.db_queries = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def add_api(self, elapsed, status):
+        with self._lock:
+            self.api_time += elapsed
+            self.api_requests += 1
+            if status is None or status >= 400:
+                self.api_errors += 1
+
+
+@contextmanager
+def redirect_ozon(url, stats):
+    """Запросы к api-seller.ozon.ru и api-performance.ozon.ru уходят на url
+
+    Перехватывается отправка запроса в requests и httpx (синхронный клиент),
+    поэтому клиент API менять не нужно. Время запросов копится в stats.
+
+    :param url: адрес поддельного API: http://127.0.0.1:8090
+    :param stats: IngestStats
+    :return:
+    """
+    target = urlsplit(url)
+
+    def rewrite(request_url):
+        parts = urlsplit(str(request_url))
+        if parts.netloc not in OZON_HOSTS:
+            return None
+        return urlunsplit((target.scheme, target.netloc) + tuple(parts[2:]))
+
+    requests_send = requests.adapters.HTTPAdapter.send
+
+    def send_requests(adapter, request, **kwargs):
+        new_url = rewrite(request.url)
+        if new_url is None:
+            return requests_send(adapter, request, **kwargs)
+        request.url = new_url
+        start, status = time.perf_counter(), None
+        try:
+            response = requests_send(adapter, request, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            stats.add_api(time.perf_counter() - start, status)
+
+    patches = [(requests.adapters.HTTPAdapter, "send", send_requests)]
+
+    if httpx is not None:
+        httpx_handle = httpx.HTTPTransport.handle_request
+
+        def handle_httpx(transport, request):
+            new_url = rewrite(request.url)
+            if new_url is None:
+                return httpx_handle(transport, request)
+            request.url = httpx.URL(new_url)
+            request.headers["Host"] = target.netloc
+            start, status = time.perf_counter(), None
+            try:
+                response = httpx_handle(transport, request)
+                status = response.status_code
+                return response
+            finally:
+                stats.add_api(time.perf_counter() - start, status)
+
+        patches.append((httpx.HTTPTransport, "handle_request", handle_httpx))
+
+    originals = [(cls, name, getattr(cls, name)) for cls, name, _ in patches]
+    for cls, name, func in patches:
+        setattr(cls, name, func)
+    try:
+        yield stats
+    finally:
+        for cls, name, func in originals:
+            setattr(cls, name, func)
+
+
+@contextmanager
+def db_timer(stats):
+    """Время запросов к базе и число измененных строк (INSERT/UPDATE/DELETE)
+
+    :param stats: IngestStats
+    :return:
+    """
+
+    def wrapper(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stats.db_time += time.perf_counter() - start
+            stats.db_queries += 1
+            rowcount = getattr(context["cursor"], "rowcount", -1)
+            if rowcount > 0 and sql.lstrip()[:6].upper() in (
+                "INSERT",
+                "UPDATE",
+                "DELETE",
+            ):
+                stats.rows += rowcount
+
+    with connection.execute_wrapper(wrapper):
+        yield stats
+
+
+def get_api_keys(shop):
+    """Ключи магазина для поддельного API: Client-Id начинается с ID магазина
+
+    :param shop:
+    :return: ключи Seller API и Performance API
+    """
+    keys = {}
+    for key_type, client_id in (
+        (KEY_TYPE_OZON, str(shop.pk)),
+        (KEY_TYPE_OZON_PERFORMANCE, f"{shop.pk}-bench@advertising.performance.ozon.ru"),
+    ):
+        key, _ = APIKey.objects.get_or_create(
+            shop=shop,
+            client_id=client_id,
+            defaults={"type": key_type, "name": "bench", "client_secret": "bench"},
+        )
+        key.is_active = True
+        key.disabled_till = timezone.now() - timedelta(minutes=1)
+        key.save()
+        keys[key_type] = key
+    return keys
+
+
+def run_task(name, apikey, days):
+    from mp.tasks import TASKS
+
+    # задача из своего модуля: атрибут пакета после прямого импорта модуля
+    # (update_stocks импортирует update_products) - модуль, а не задача
+    module = importlib.import_module(f"mp.tasks.{TASKS[name]}")
+    result = getattr(module, name)(apikey_id=apikey.pk, days=days)
+    if isinstance(result, dict) and "❌FAILED" in result:
+        return result["❌FAILED"]
+    return ""
+
+
+def run_reports(apikey, days, check_interval, max_checks):
+    """Очередь отчетов рекламы до конца: запрос, проверка состояния, скачивание
+
+    :param apikey:
+    :param days:
+    :param check_interval: секунд между проверками
+    :param max_checks:
+    :return: ошибка
+    """
+    for num in range(max_checks):
+        error = run_task("check_campaign_report", apikey, days)
+        if error:
+            return error
+        if not Report.objects.filter(shop=apikey.shop, is_parsed=False).exists():
+            return ""
+        time.sleep(check_interval)
+    return f"Отчеты не готовы после {max_checks} проверок"
+
+
+def run_ingest(
+    shop,
+    names=None,
+    url=None,
+    fake=None,
+    days=30,
+    check_interval=1,
+    max_checks=60,
+):
+    """Задачи загрузки магазина целиком против поддельного API
+
+    :param shop:
+    :param names: задачи, по умолчанию все INGEST_TASKS
+    :param url: адрес запущенного поддельного API, иначе сервер поднимается в потоке
+    :param fake: FakeOzon для сервера в потоке
+    :param days: параметр days задач
+    :param check_interval:
+    :param max_checks:
+    :return: список результатов
+    """
+    server = None
+    if url is None:
+        server = serve(fake or FakeOzon(), port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    keys = get_api_keys(shop)
+    commit, dirty = git_commit()
+    results = []
+    try:
+        for name in names or INGEST_TASKS:
+            apikey = keys[
+                KEY_TYPE_OZON_PERFORMANCE
+                if name in PERFORMANCE_TASKS
+                else KEY_TYPE_OZON
+            ]
+            stats = IngestStats()
+            start = time.perf_counter()
+            try:
+                with redirect_ozon(url, stats), db_timer(stats):
+                    if name == "check_campaign_report":
+                        error = run_reports(apikey, days, check_interval, max_checks)
+                    else:
+                        error = run_task(name, apikey, days)
+            except Exception as e:
+                logger.exception("%s: %s", name, e)
+                error = f"{type(e).__name__}: {e}"
+            wall = time.perf_counter() - start
+
+            results.append(
+                {
+                    "case": f"ingest.{name}",
+                    "scale": "",
+                    "median": wall,
+                    "min": wall,
+                    "api_time": stats.api_time,
+                    "api_requests": stats.api_requests,
+                    "api_errors": stats.api_errors,
+                    "db_time": stats.db_time,
+                    "db_queries": stats.db_queries,
+                    "rows": stats.rows,
+                    "rows_per_sec": stats.rows / wall if wall else 0,
+                    "error": error,
+                    "commit": commit,
+                    "dirty": dirty,
+                    "dataset": {"shop_id": shop.pk, "days": days},
+                    "created_at": datetime.now().isoformat(timespec="seconds"),
+                }
+            )
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    return results
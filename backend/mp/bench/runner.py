@@ -0,0 +1,410 @@
+import json
+import logging
+import resource
+import statistics
+import subprocess
+import time
+import threading
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+
+from api import views as api_views
+from api.helpers import (
+    fetch_raw_sql,
+    Update_Daily,
+    Update_Parsed,
+    Update_Ledger,
+    Update_Rollup,
+)
+from api.helpers.export import export_file
+from api.renderers import FastJSONRenderer
+from ka_space.views import DashboardView
+from mp.helpers import update_shop_stats, estimate_shop_stats
+from mp.helpers.report_stream import iter_report_batches, report_line
+from mp.models import Shop
+from .generator import BENCH_USER, load_dataset
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pandas
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pandas = None
+
+RESULTS_FILE = settings.TMP_DIR / "bench" / "results.jsonl"
+RENDER_ROWS = 10000
+REPORT_CAMPAIGNS = 10
+
+# отчеты API: запрос строится тем же query(), что и в представлении
+API_CASES = {
+    "api.analytics.60d": (api_views.AnalyticsListView, {"days": 60}),
+    "api.analytics.180d": (api_views.AnalyticsListView, {"days": 180}),
+    "api.analytics.180d.week": (
+        api_views.AnalyticsListView,
+        {"days": 180, "granularity": "week"},
+    ),
+    "api.analytics.180d.month": (
+        api_views.AnalyticsListView,
+        {"days": 180, "granularity": "month"},
+    ),
+    "api.advertizing.60d": (api_views.AdvertizingStatisticsListView, {"days": 60}),
+    "api.advertizing.180d": (api_views.AdvertizingStatisticsListView, {"days": 180}),
+    "api.advertizing.180d.week": (
+        api_views.AdvertizingStatisticsListView,
+        {"days": 180, "granularity": "week"},
+    ),
+    "api.transactions.60d": (api_views.TransactionsListView, {"days": 60}),
+    "api.transactions.180d": (api_views.TransactionsListView, {"days": 180}),
+    "api.products": (api_views.ProductsListView, {}),
+}
+
+
+class BenchContext(object):
+    """Пользователь и магазины синтетического набора данных"""
+
+    def __init__(self):
+        self.dataset = load_dataset() or {}
+        self.user = get_user_model().objects.get(username=BENCH_USER)
+        self.shops = list(Shop.objects.filter(user=self.user).order_by("pk"))
+        self.shop = self.shops[0]
+        self.factory = RequestFactory()
+        self.cache = {}
+
+    def request(self, path="/", data=None):
+        request = self.factory.get(path, data or {})
+        request.user = self.user
+        return request
+
+
+def api_case(view_class, data):
+    def run(context):
+        request = context.request(data=data)
+        shop_ids = api_views.get_shop_ids(context.user, request.GET)
+        sql, params = view_class().query(request, shop_ids)
+        return len(fetch_raw_sql(sql, params))
+
+    return run
+
+
+def export_case(report, fmt, data):
+    """Выгрузка отчета целиком и загрузка в pandas: размер ответа и время
+
+    json - строки отчета в JSON, как в API (без замены . на ,), parquet и arrow -
+    выгрузка ExportView.
+    """
+
+    def run(context):
+        if pandas is None:
+            raise RuntimeError("Для замера выгрузки нужны pandas и pyarrow")
+        request = context.request(data=data)
+        shop_ids = api_views.get_shop_ids(context.user, request.GET)
+        sql, params = api_views.export_query(
+            api_views.EXPORT_VIEWS[report], request.GET, shop_ids
+        )
+        if fmt == "json":
+            body = JSONRenderer().render({"items": fetch_raw_sql(sql, params)})
+            frame = pandas.DataFrame(json.loads(body)["items"])
+        else:
+            file, rows = export_file(sql, params, fmt)
+            with file:
+                body = file.read()
+            if fmt == "parquet":
+                table = pyarrow.parquet.read_table(BytesIO(body))
+            else:
+                table = pyarrow.ipc.open_stream(body).read_all()
+            frame = table.to_pandas()
+        return {"rows": len(frame), "bytes": len(body)}
+
+    return run
+
+
+def render_case(renderer):
+    """Ответ отчета аналитики из RENDER_ROWS строк в JSON с запятой в Decimal
+
+    drf - прежний путь: замена . на , отдельным проходом по строкам и JSONRenderer,
+    fast - FastJSONRenderer, замена при кодировании. NULL заменяет на 0 запрос
+    отчета (comma_columns). Время - на RENDER_ROWS строк.
+    """
+
+    def run(context):
+        if "render_rows" not in context.cache:
+            request = context.request(data={"days": 180, "limit": RENDER_ROWS})
+            shop_ids = api_views.get_shop_ids(context.user, request.GET)
+            view = api_views.AnalyticsListView()
+            sql, params = view.query(request, shop_ids)
+            rows = fetch_raw_sql(sql, params)
+            context.cache["render_rows"] = (rows * (RENDER_ROWS // len(rows) + 1))[
+                :RENDER_ROWS
+            ]
+            context.cache["render_view"] = view
+        rows = [dict(r) for r in context.cache["render_rows"]]
+
+        if renderer == "drf":
+            for r in rows:
+                for f, value in r.items():
+                    if isinstance(value, Decimal):
+                        r[f] = str(value).replace(".", ",")
+            body = JSONRenderer().render({"result": {"items": rows}})
+        else:
+            body = FastJSONRenderer().render(
+                {"result": {"items": rows}},
+                renderer_context={"view": context.cache["render_view"]},
+            )
+        return {"rows": len(rows), "bytes": len(body)}
+
+    return run
+
+
+def report_chunks(size_mb, chunk_size=64 * 1024):
+    """Синтетический отчет рекламных кампаний в JSON размером size_mb, по частям
+
+    Формат как у скачивания отчета (mp.bench.fake_ozon.report_download), строки
+    генерируются на лету и целиком в памяти не собираются.
+    """
+    rows_per_campaign = size_mb * 1024 * 1024 // 230 // REPORT_CAMPAIGNS + 1
+    buf = [b"{"]
+    size = 1
+    for c in range(REPORT_CAMPAIGNS):
+        campaign = f'"{10000 + c}": {{"title": "Кампания {c}", "report": {{"rows": ['
+        buf.append((", " if c else "").encode() + campaign.encode())
+        for i in range(rows_per_campaign):
+            day = date(2026, 1, 1) + timedelta(days=i % 60)
+            row = {
+                "date": day.strftime("%d.%m.%Y"),
+                "sku": str(1000000000 + i // 60),
+                "title": f"Товар {i // 60}",
+                "price": f"{100 + i % 900},00",
+                "views": str(i % 1000),
+                "clicks": str(i % 50),
+                "moneySpent": f"{i % 1000 * 0.3:.2f}".replace(".", ","),
+                "orders": str(i % 5),
+                "ordersMoney": f"{i % 5 * 100:.2f}".replace(".", ","),
+                "page": "search" if i % 2 else "category",
+                "condition": "",
+            }
+            line = (", " if i else "") + json.dumps(row, ensure_ascii=False)
+            buf.append(line.encode())
+            size += len(buf[-1])
+            if size >= chunk_size:
+                yield b"".join(buf)
+                buf, size = [], 0
+        buf.append(b'], "totals": {}}}')
+    buf.append(b"}")
+    yield b"".join(buf)
+
+
+class PeakRSS(object):
+    """Пиковый прирост RSS процесса за время замера, опрос /proc/self/statm
+
+    В отличие от tracemalloc не замедляет замер. Не на Linux - None.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = None
+
+    def rss(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * resource.getpagesize()
+        except (OSError, ValueError):
+            return None
+
+    def watch(self):
+        while not self._stop.wait(self.interval):
+            rss = self.rss()
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss - self._start)
+
+    def __enter__(self):
+        self._start = self.rss()
+        if self._start is not None:
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self.watch, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._start is not None:
+            self._stop.set()
+            self._thread.join()
+
+
+def report_case(mode, size_mb):
+    """Разбор скачанного отчета size_mb Мб: время и прирост памяти процесса
+
+    stream - по частям, пачками по REPORT_BATCH_ROWS строк, full - прежний путь:
+    ответ целиком, json.loads и все строки в памяти. Запись в БД не замеряется.
+    """
+
+    def run(context):
+        with PeakRSS() as memory:
+            rows = 0
+            if mode == "stream":
+                for type_, lines in iter_report_batches(report_chunks(size_mb)):
+                    rows += len(lines)
+            else:
+                body = b"".join(report_chunks(size_mb))
+                result = json.loads(body)
+                lines = [
+                    report_line(campaign_id, row)
+                    for campaign_id, data in result.items()
+                    for row in data["report"]["rows"]
+                ]
+                rows = len(lines)
+                del body, result, lines
+        peak_mb = memory.peak and round(memory.peak / 1024 / 1024, 1)
+        return {"rows": rows, "peak_mb": peak_mb}
+
+    return run
+
+
+def shop_case(func):
+    def run(context):
+        return func({"shop_id": context.shop.pk})
+
+    return run
+
+
+def dashboard_case(data):
+    def run(context):
+        return len(DashboardView.as_view()(context.request(data=data)).content)
+
+    return run
+
+
+CASES = {
+    **{name: api_case(*case) for name, case in API_CASES.items()},
+    "daily.stocks": shop_case(Update_Daily.stocks),
+    "daily.transactions": shop_case(Update_Daily.transactions),
+    "daily.orders": shop_case(Update_Daily.orders),
+    "daily.campaigns": shop_case(Update_Daily.campaigns),
+    "rollup.analytics": shop_case(Update_Rollup.analytics),
+    "rollup.daily": shop_case(Update_Rollup.daily),
+    "rollup.advertizing": shop_case(Update_Rollup.advertizing),
+    "parsed.orders": shop_case(Update_Parsed.orders),
+    "parsed.transactions": shop_case(Update_Parsed.transactions),
+    "parsed.products": shop_case(Update_Parsed.products),
+    "ledger.postings": shop_case(Update_Ledger.postings),
+    "shop_stats.update": lambda context: update_shop_stats(context.shop, force=True),
+    "shop_stats.estimate": lambda context: len(estimate_shop_stats()),
+    "render.drf": render_case("drf"),
+    "render.fast": render_case("fast"),
+    "report.full.30mb": report_case("full", 30),
+    "report.stream.30mb": report_case("stream", 30),
+    "report.stream.300mb": report_case("stream", 300),
+    "dashboard": dashboard_case({}),
+    "dashboard.approx": dashboard_case({"approx": 1}),
+    **{
+        f"export.{report}.{fmt}": export_case(report, fmt, {"days": 180})
+        for report in api_views.EXPORT_VIEWS
+        for fmt in ("json", "parquet", "arrow")
+    },
+}
+
+
+def run_cases(names=None, repeat=3, scale=""):
+    """Замер запросов на текущем наборе данных
+
+    Первый прогон прогревает кеш PostgreSQL и не учитывается, если повторов больше одного.
+
+    :param names: префиксы названий замеров, по умолчанию все
+    :param repeat:
+    :param scale: название размера набора для записи результата
+    :return: список результатов
+    """
+    context = BenchContext()
+    commit, dirty = git_commit()
+    results = []
+    for name, case in CASES.items():
+        if names and not any(name.startswith(n) for n in names):
+            continue
+
+        timings, rows, error = [], None, ""
+        extra = {}
+        for num in range(repeat + (1 if repeat > 1 else 0)):
+            start = time.perf_counter()
+            try:
+                rows = case(context)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                logger.warning("%s: %s", name, error)
+                break
+            if repeat == 1 or num > 0:
+                timings.append(time.perf_counter() - start)
+            if isinstance(rows, dict):
+                # замер вернул строки и дополнительные показатели
+                extra = rows
+                rows = extra.pop("rows", None)
+
+        results.append(
+            {
+                "case": name,
+                "scale": scale,
+                "median": statistics.median(timings) if timings else None,
+                "min": min(timings) if timings else None,
+                "rows": rows if isinstance(rows, int) else None,
+                **extra,
+                "error": error,
+                "commit": commit,
+                "dirty": dirty,
+                "dataset": {
+                    k: context.dataset.get(k) for k in ("shops", "skus", "days", "seed")
+                },
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+            }
+        )
+    return results
+
+
+def save_results(results):
+    RESULTS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(RESULTS_FILE, "a") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+def load_results(commit):
+    """Последние сохраненные замеры коммита
+
+    :param commit: хеш или его начало
+    :return: словарь (scale, case) => результат
+    """
+    results = {}
+    if not RESULTS_FILE.exists():
+        return results
+    with open(RESULTS_FILE) as f:
+        for line in f:
+            result = json.loads(line)
+            if result["commit"].startswith(commit):
+                results[(result["scale"], result["case"])] = result
+    return results
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+        dirty = bool(
+            subprocess.run(
+                ["git", "status", "--porcelain", "--untracked-files=no"],
+                capture_output=True,
+                text=True,
+                cwd=settings.BASE_DIR,
+            ).stdout.strip()
+        )
+    except OSError:
+        return "", False
+    return commit, dirty
@@ -0,0 +1,48 @@
+# Таблицы mp_ozon для локальных замеров без пакета mp_ozon.
+# Только колонки, которые используются запросами этого проекта.
+OZON_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mp_ozon_product (
+  id bigint PRIMARY KEY, shop_id bigint REFERENCES mp_shop(id) ON DELETE CASCADE, offer_id varchar(64), fbo_sku bigint, fbs_sku bigint,
+  name varchar(512), state varchar(64), visible boolean DEFAULT true, price_index numeric(20,4), min_price numeric(20,4),
+  marketing_price numeric(20,4), images text, images360 text, marketing_actions text, commissions text,
+  volume_weight numeric(20,4), rich_content text, youtube varchar(256), video_review varchar(256), primary_image varchar(512),
+  created_at timestamptz, updated_at timestamptz);
+CREATE INDEX IF NOT EXISTS mp_ozon_product_shop ON mp_ozon_product(shop_id);
+CREATE TABLE IF NOT EXISTS mp_ozon_sku_offer (id bigserial PRIMARY KEY, sku bigint, type varchar(16), offer_id varchar(64), product_id bigint REFERENCES mp_ozon_product(id) ON DELETE CASCADE, UNIQUE (sku, product_id));
+CREATE TABLE IF NOT EXISTS mp_ozon_productlost (id bigserial PRIMARY KEY, sku bigint, offer_id varchar(64), shop_id bigint, type varchar(16));
+CREATE TABLE IF NOT EXISTS mp_ozon_stock (id bigserial PRIMARY KEY, shop_id bigint, product_id bigint, date date, type varchar(8), present int, reserved int, UNIQUE (product_id, date, type));
+CREATE TABLE IF NOT EXISTS mp_ozon_warehousestock (id bigserial PRIMARY KEY, shop_id bigint, sku bigint, offer_id varchar(64), date date, warehouse varchar(64), discounted boolean DEFAULT false, for_sale int, UNIQUE (shop_id, sku, date, warehouse));
+CREATE TABLE IF NOT EXISTS mp_ozon_analytics (id bigserial PRIMARY KEY, shop_id bigint, sku bigint, date date,
+  session_view int DEFAULT 0, session_view_pdp int DEFAULT 0, session_view_search int DEFAULT 0, hits_tocart int DEFAULT 0, hits_tocart_pdp int DEFAULT 0,
+  hits_tocart_search int DEFAULT 0, hits_view int DEFAULT 0, hits_view_pdp int DEFAULT 0, hits_view_search int DEFAULT 0, returns int DEFAULT 0,
+  cancellations int DEFAULT 0, delivered_units int DEFAULT 0, ordered_units int DEFAULT 0, revenue numeric(20,4) DEFAULT 0, adv_sum_all numeric(20,4) DEFAULT 0,
+  adv_view_all int DEFAULT 0, adv_view_pdp int DEFAULT 0, adv_view_search_category int DEFAULT 0, postings int DEFAULT 0, postings_premium int DEFAULT 0,
+  position_category numeric(20,4) DEFAULT 0, UNIQUE (shop_id, date, sku));
+CREATE TABLE IF NOT EXISTS mp_ozon_campaign (id bigint PRIMARY KEY, shop_id bigint, title varchar(256), state varchar(64), adv_type varchar(64), created_at timestamptz, updated_at timestamptz);
+CREATE TABLE IF NOT EXISTS mp_ozon_campaignproduct (id bigserial PRIMARY KEY, campaign_id bigint, product_id bigint, sku bigint, bid numeric(20,4));
+CREATE TABLE IF NOT EXISTS mp_ozon_campaignproduct_history (id bigserial PRIMARY KEY, date date, product_id bigint, campaign_id bigint, bid numeric(20,4), visibility_idx int, UNIQUE (date, product_id, campaign_id));
+CREATE TABLE IF NOT EXISTS mp_ozon_statisticscampaignproduct (id bigserial PRIMARY KEY, campaign_id bigint, dt date, sku bigint, page varchar(128), condition varchar(128),
+  price numeric(20,4) DEFAULT 0, views int DEFAULT 0, clicks int DEFAULT 0, expense numeric(20,4) DEFAULT 0, orders int DEFAULT 0, revenue numeric(20,4) DEFAULT 0,
+  created_at timestamptz DEFAULT now(), updated_at timestamptz DEFAULT now(), UNIQUE (campaign_id, dt, sku, page, condition));
+CREATE TABLE IF NOT EXISTS mp_ozon_statisticscampaignorder (id bigserial PRIMARY KEY, campaign_id bigint, dt date, order_id varchar(64), order_number varchar(64), sale_product_sku bigint,
+  price numeric(20,4) DEFAULT 0, count int DEFAULT 0, rate_amount numeric(20,4) DEFAULT 0, created_at timestamptz DEFAULT now(), updated_at timestamptz DEFAULT now());
+CREATE TABLE IF NOT EXISTS mp_ozon_statisticscampaign (id bigserial PRIMARY KEY, campaign_id bigint, dt date, views int DEFAULT 0, clicks int DEFAULT 0, expense numeric(20,4) DEFAULT 0, UNIQUE (dt, campaign_id));
+CREATE TABLE IF NOT EXISTS mp_ozon_report (id bigserial PRIMARY KEY, shop_id bigint, uuid uuid, state varchar(32), conditions text, response text, is_parsed boolean DEFAULT false, created_at timestamptz DEFAULT now(), updated_at timestamptz DEFAULT now());
+CREATE TABLE IF NOT EXISTS mp_ozon_transaction (id bigserial PRIMARY KEY, shop_id bigint, operation_id bigint, operation_type varchar(128), operation_type_name varchar(256),
+  operation_date timestamptz, posting_number varchar(64), type varchar(32), sku bigint DEFAULT 0, sku_cnt int DEFAULT 0, items text, services text,
+  accruals_for_sale numeric(20,4) DEFAULT 0, sale_commission numeric(20,4) DEFAULT 0, services_amount numeric(20,4) DEFAULT 0, amount numeric(20,4) DEFAULT 0, UNIQUE (shop_id, operation_id));
+CREATE TABLE IF NOT EXISTS mp_ozon_fbo (id bigserial PRIMARY KEY, shop_id bigint, order_id bigint, order_number varchar(64), posting_number varchar(64), status varchar(64),
+  created_at timestamptz, in_process_at timestamptz, analytics_data text, UNIQUE (shop_id, order_id, posting_number));
+CREATE TABLE IF NOT EXISTS mp_ozon_fbo_product (id bigserial PRIMARY KEY, order_id bigint REFERENCES mp_ozon_fbo(id) ON DELETE CASCADE, product_id bigint, ozon_order_id bigint, sku bigint, offer_id varchar(64), name varchar(512),
+  quantity int DEFAULT 0, price numeric(20,4) DEFAULT 0, commission_amount numeric(20,4) DEFAULT 0, item_services text);
+CREATE TABLE IF NOT EXISTS mp_ozon_fbs (id bigserial PRIMARY KEY, shop_id bigint, order_id bigint, order_number varchar(64), posting_number varchar(64), status varchar(64),
+  created_at timestamptz, in_process_at timestamptz, analytics_data text, UNIQUE (shop_id, order_id, posting_number));
+CREATE TABLE IF NOT EXISTS mp_ozon_fbs_product (id bigserial PRIMARY KEY, order_id bigint REFERENCES mp_ozon_fbs(id) ON DELETE CASCADE, product_id bigint, ozon_order_id bigint, sku bigint, offer_id varchar(64), name varchar(512),
+  quantity int DEFAULT 0, price numeric(20,4) DEFAULT 0, commission_amount numeric(20,4) DEFAULT 0, item_services text);
+CREATE INDEX IF NOT EXISTS mp_ozon_transaction_shop_date ON mp_ozon_transaction (shop_id, operation_date);
+CREATE INDEX IF NOT EXISTS mp_ozon_transaction_posting ON mp_ozon_transaction (shop_id, posting_number);
+CREATE INDEX IF NOT EXISTS mp_ozon_fbo_product_order ON mp_ozon_fbo_product (order_id);
+CREATE INDEX IF NOT EXISTS mp_ozon_fbs_product_order ON mp_ozon_fbs_product (order_id);
+CREATE INDEX IF NOT EXISTS mp_ozon_analytics_sku ON mp_ozon_analytics (sku);
+CREATE INDEX IF NOT EXISTS mp_ozon_statisticscampaignproduct_dt ON mp_ozon_statisticscampaignproduct (dt);
+"""
@@ -91,7 +91,12 @@ def chunks(l, n):
 
 
 def bulk_insert_update(
-    data=[], key_fields=[], changed_or_skip_func=None, cls=None, shop=None
+    data=[],
+    key_fields=[],
+    changed_or_skip_func=None,
+    cls=None,
+    shop=None,
+    changed_keys=None,
 ):
     keys = {k: set(str(r[k]) for r in data) for k in key_fields}
     filter_existing = {
@@ -144,7 +149,7 @@ def bulk_insert_update(
                 if callable(changed_or_skip_func):
                     changed, skip = changed_or_skip_func(changed, obj, attr, value)
                     if skip:
-                        print(f"Skip update {obj}")
+                        logger.debug("Skip update %s", obj)
                         skip_update = True
 
                 if changed:
@@ -162,9 +167,28 @@ def bulk_insert_update(
         if existing_objs and update_fields:
             update_result = cls.objects.bulk_update(updates, update_fields)
 
+    if changed_keys is not None:
+        # ключи добавленных и измененных строк
+        changed_keys.extend(create_data.keys())
+        changed_keys.extend(
+            tuple([str(getattr(obj, k)) for k in key_fields]) for obj in updates
+        )
+
     return (
         f"Получено {len(id_rows)} "
         f"/ Найдено {len(existing_objs)} и обновлено {update_result} "
         f"/ Изменения в полях {update_fields} "
         f"/ Добавлено {len(create_data)} "
     )
+
+
+from .shop_stats import update_shop_stats, estimate_shop_stats, shop_stats_estimate
+from .selfbuy import (
+    match_selfbuys,
+    update_selfbuys,
+    selfbuy_dates,
+    refresh_selfbuy_days,
+    read_selfbuy_orders,
+    import_selfbuys,
+    ErrorSelfbuyImport,
+)
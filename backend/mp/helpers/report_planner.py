@@ -0,0 +1,176 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+import json
+import logging
+
+from api.helpers import execute_sql, fetch_raw_sql
+from mp.models import CampaignReportDay
+
+logger = logging.getLogger(__name__)
+
+# статистика дня в отчетах Озона меняется еще несколько дней
+REPORT_FINAL_DAYS = 3
+# незавершенный день повторно запрашивается не чаще
+REPORT_REFRESH_HOURS = 3
+
+
+def needed_cells(shop, date_from, date_to, campaign_ids):
+    """Дни кампаний, которые нужно запросить в отчетах
+
+    Кампания-день нужна, если в дневной статистике (mp_ozon_statisticscampaign)
+    есть показы, клики или расход. Для дней после последней загруженной
+    дневной статистики берутся campaign_ids - работающие и недавно измененные
+    кампании. Не запрашиваются дни, загруженные окончательно (отчет создан
+    через REPORT_FINAL_DAYS дней и позже) или недавно, в последние
+    REPORT_REFRESH_HOURS часов.
+
+    :param shop:
+    :param date_from:
+    :param date_to:
+    :param campaign_ids: кампании для дней без дневной статистики
+    :return: {campaign_id: set(дни)}
+    """
+    sql = f"""
+    WITH shop_stats AS (
+        SELECT mos.campaign_id, mos.dt, mos.views, mos.clicks, mos.expense
+        FROM mp_ozon_statisticscampaign mos
+        INNER JOIN mp_ozon_campaign moc ON moc.id = mos.campaign_id
+        WHERE moc.shop_id = %(shop_id)s
+    ), known AS (
+        SELECT MAX(dt) as dt FROM shop_stats
+    ), active AS (
+        SELECT s.campaign_id, s.dt as date
+        FROM shop_stats s
+        WHERE s.dt BETWEEN %(date_from)s AND %(date_to)s
+            AND (s.views > 0 OR s.clicks > 0 OR s.expense > 0)
+        UNION
+        SELECT c.campaign_id, d::date
+        FROM unnest(%(campaign_ids)s::bigint[]) c(campaign_id),
+            generate_series(%(date_from)s::date, %(date_to)s::date, interval '1 day') d,
+            known
+        WHERE known.dt IS NULL OR d::date > known.dt
+    )
+    SELECT a.campaign_id, a.date
+    FROM active a
+    LEFT JOIN {CampaignReportDay._meta.db_table} l
+        ON l.campaign_id = a.campaign_id AND l.date = a.date
+    WHERE l.id IS NULL OR (
+        l.loaded_at < a.date + interval '{REPORT_FINAL_DAYS} days'
+        AND l.loaded_at < NOW() - interval '{REPORT_REFRESH_HOURS} hours'
+    )
+    """
+    rows = fetch_raw_sql(
+        sql,
+        {
+            "shop_id": shop.pk,
+            "date_from": date_from,
+            "date_to": date_to,
+            "campaign_ids": list(campaign_ids),
+        },
+        as_dict=False,
+    )
+    cells = defaultdict(set)
+    for campaign_id, day in rows:
+        cells[campaign_id].add(day)
+    return cells
+
+
+def report_cells(conditions):
+    """Дни кампаний из условий запроса отчета
+
+    :param conditions: условия запроса (Report.conditions)
+    :return: [(campaign_id, день)]
+    """
+    params = json.loads(conditions or "{}").get("params", {})
+    if not params.get("dateFrom") or not params.get("dateTo"):
+        return []
+    date_from = datetime.strptime(params["dateFrom"], "%Y-%m-%d").date()
+    date_to = datetime.strptime(params["dateTo"], "%Y-%m-%d").date()
+    days = [
+        date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)
+    ]
+    return [(int(c), d) for c in params.get("campaigns", []) for d in days]
+
+
+def remove_queued(cells, reports):
+    """Убираем дни кампаний, которые уже есть в запросах отчетов в очереди
+
+    :param cells: {campaign_id: set(дни)}
+    :param reports: необработанные отчеты
+    :return: cells без дней из очереди
+    """
+    for r in reports:
+        for campaign_id, day in report_cells(r.conditions):
+            if campaign_id in cells:
+                cells[campaign_id].discard(day)
+    return {c: days for c, days in cells.items() if days}
+
+
+def plan_reports(cells, limit_campaigns, limit_days):
+    """Минимальный набор запросов отчетов для дней кампаний
+
+    Дни делятся на окна не длиннее limit_days, от новых к старым: окно
+    начинается с самого нового незакрытого дня (жадное покрытие отрезками,
+    минимальное число окон). Кампании окна делятся по limit_campaigns, период
+    запроса сужается до дней кампаний запроса. Дни между нужными днями
+    запрашиваются в том же отчете - это не увеличивает число запросов.
+
+    :param cells: {campaign_id: set(дни)}
+    :param limit_campaigns: кампаний в одном отчете
+    :param limit_days: (dateTo - dateFrom).days одного отчета, не больше
+    :return: [(campaign_ids, date_from, date_to)] от новых к старым
+    """
+    days = sorted({d for ds in cells.values() for d in ds}, reverse=True)
+    plan = []
+    while days:
+        date_to = days[0]
+        date_from = date_to - timedelta(days=limit_days)
+        window = {
+            c: [d for d in ds if date_from <= d <= date_to] for c, ds in cells.items()
+        }
+        # кампании с близкими днями попадают в один запрос
+        campaigns = sorted(
+            (c for c, ds in window.items() if ds),
+            key=lambda c: (min(window[c]), max(window[c]), c),
+        )
+        for i in range(0, len(campaigns), limit_campaigns):
+            ids = campaigns[i : i + limit_campaigns]
+            plan.append(
+                (
+                    ids,
+                    min(min(window[c]) for c in ids),
+                    max(max(window[c]) for c in ids),
+                )
+            )
+        days = [d for d in days if d < date_from]
+    return plan
+
+
+def save_loaded_cells(shop, report):
+    """Отмечаем дни кампаний загруженного отчета
+
+    :param shop:
+    :param report: загруженный отчет
+    :return:
+    """
+    cells = report_cells(report.conditions)
+    if not cells:
+        return
+    sql = f"""
+    INSERT INTO {CampaignReportDay._meta.db_table} (shop_id, campaign_id, date, loaded_at)
+    (
+        SELECT %(shop_id)s, c.campaign_id, c.date, %(loaded_at)s
+        FROM unnest(%(campaign_ids)s::bigint[], %(dates)s::date[]) c(campaign_id, date)
+        ORDER BY c.campaign_id, c.date
+    ) ON CONFLICT (campaign_id, date) DO UPDATE SET
+        loaded_at = GREATEST({CampaignReportDay._meta.db_table}.loaded_at, excluded.loaded_at);
+    """
+    execute_sql(
+        sql,
+        {
+            "shop_id": shop.pk,
+            "campaign_ids": [c for c, d in cells],
+            "dates": [d for c, d in cells],
+            "loaded_at": report.created_at,
+        },
+    )
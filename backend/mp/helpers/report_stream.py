@@ -0,0 +1,478 @@
+import codecs
+from contextlib import contextmanager
+import csv
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import zipfile
+
+import requests
+from django.core.cache import cache
+
+from mp.helpers.tracing import span, STAGE_API
+
+logger = logging.getLogger(__name__)
+
+PERFORMANCE_URL = "https://api-performance.ozon.ru"
+REPORT_CHUNK_SIZE = 64 * 1024
+REPORT_BATCH_ROWS = 5000
+REPORT_TIMEOUT = 60 * 5
+# токен Performance API живет 30 минут, обновляем заранее
+TOKEN_EXPIRE_MARGIN = 60
+
+REPORT_TYPE_SKU = "SKU"
+REPORT_TYPE_SEARCH_PROMO = "SEARCH_PROMO"
+# строка без orderId и sku - тип кампании не определен
+REPORT_TYPE_UNKNOWN = None
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_ZIP = "application/zip"
+# архив больше этого размера пишется во временный файл на диске
+REPORT_SPOOL_SIZE = 32 * 1024 * 1024
+# колонки CSV в архиве отчета - ключи строк JSON-отчета
+CSV_COLUMNS = {
+    "Дата": "date",
+    "SKU": "sku",
+    "Sku": "sku",
+    "Название товара": "title",
+    "Наименование товара": "title",
+    "Цена товара, ₽": "price",
+    "Цена товара, руб.": "price",
+    "Показы": "views",
+    "Клики": "clicks",
+    "Расход, ₽": "moneySpent",
+    "Расход, ₽, с НДС": "moneySpent",
+    "Расход, руб.": "moneySpent",
+    "Заказы": "orders",
+    "Заказы, шт.": "orders",
+    "Выручка, ₽": "ordersMoney",
+    "Выручка, руб.": "ordersMoney",
+    "Страница показа": "page",
+    "Условие показа": "condition",
+    "ID заказа": "orderId",
+    "Номер заказа": "orderNumber",
+    "Ozon ID": "ozonId",
+    "Ozon ID продвигаемого товара": "ozonIdAdvSku",
+    "Цена продажи": "salePrice",
+    "Цена продажи, ₽": "salePrice",
+    "Количество": "quantity",
+    "Ставка, ₽": "bidValue",
+    "Стоимость, ₽": "bidValue",
+}
+
+WHITESPACE = " \t\n\r"
+NUMBER_CHARS = "0123456789+-.eE"
+
+
+class ErrorReportStream(Exception):
+    pass
+
+
+class ErrorReportNotFound(ErrorReportStream):
+    pass
+
+
+try:
+    from mp_ozon.errors import ErrorLocked, ErrorRateLimit, ErrorRequest
+except ImportError:
+    # без mp_ozon (bench) ошибки скачивания - ErrorReportStream
+    ErrorLocked = ErrorRateLimit = ErrorRequest = ErrorReportStream
+
+
+class JSONStream(object):
+    """Чтение JSON по частям: структура разбирается по символам, значения -
+    json.JSONDecoder.raw_decode, в памяти только непрочитанный остаток буфера
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Следующая часть в буфер, прочитанное начало буфера отбрасывается
+
+        :return: False, если данные закончились
+        """
+        if self.eof:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self._decoder.decode(b"", final=True)
+        else:
+            text = self._decoder.decode(chunk)
+        self.buf = self.buf[self.pos :] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Следующий символ после пробелов, "" - конец данных"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ErrorReportStream(
+                f"Ожидается {char!r}, получено {self.buf[self.pos : self.pos + 20]!r}"
+            )
+        self.pos += 1
+
+    def value(self):
+        """Следующее значение целиком: строка, число, объект или массив"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # число в конце буфера может продолжаться в следующей части,
+            # в том числе после "1." или "1e", которые читаются как 1
+            if (
+                not self.eof
+                and (end == len(self.buf) or self.buf[end] in NUMBER_CHARS)
+                and self.fill()
+            ):
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """Ключи объекта, значение читает вызывающий код"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def items(self):
+        """Элементы массива по одному"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return
+
+
+def iter_report_rows(chunks, content_type=CONTENT_TYPE_JSON):
+    """Строки отчета рекламных кампаний по типу ответа
+
+    application/json - iter_json_rows, application/zip - iter_zip_rows,
+    другой тип - ErrorReportStream.
+
+    :param chunks: части ответа, bytes
+    :param content_type: заголовок Content-Type ответа
+    :return: генератор (campaign_id, строка)
+    """
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type == CONTENT_TYPE_JSON:
+        return iter_json_rows(chunks)
+    if media_type == CONTENT_TYPE_ZIP:
+        return iter_zip_rows(chunks)
+    raise ErrorReportStream(f"Неизвестный формат отчета: {content_type!r}")
+
+
+def iter_json_rows(chunks):
+    """Строки отчета рекламных кампаний из JSON по частям
+
+    Формат: {"<campaign_id>": {"title": ..., "report": {"rows": [...], "totals": {}}}}.
+    Строки читаются по одной, прочие поля пропускаются.
+
+    :param chunks: части ответа, bytes
+    :return: генератор (campaign_id, строка)
+    """
+    stream = JSONStream(chunks)
+    for campaign_id in stream.members():
+        if stream.peek() != "{":
+            stream.value()
+            continue
+        for key in stream.members():
+            if key != "report" or stream.peek() != "{":
+                stream.value()
+                continue
+            for report_key in stream.members():
+                if report_key != "rows" or stream.peek() != "[":
+                    stream.value()
+                    continue
+                for row in stream.items():
+                    yield campaign_id, row
+    if stream.peek() != "":
+        raise ErrorReportStream("Лишние данные после отчета")
+
+
+def iter_zip_rows(chunks):
+    """Строки отчета рекламных кампаний из ZIP-архива с CSV на каждую кампанию
+
+    Архив читается с конца, поэтому сначала записывается во временный файл
+    (в памяти до REPORT_SPOOL_SIZE). CSV читаются по строке, см. iter_csv_rows.
+
+    :param chunks: части ответа, bytes
+    :return: генератор (campaign_id, строка)
+    """
+    with tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_SIZE) as file:
+        for chunk in chunks:
+            file.write(chunk)
+        file.seek(0)
+        try:
+            archive = zipfile.ZipFile(file)
+        except zipfile.BadZipFile as e:
+            raise ErrorReportStream(f"Архив отчета не читается: {e}")
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as entry:
+                    text = io.TextIOWrapper(entry, encoding="utf-8-sig", newline="")
+                    yield from iter_csv_rows(text, info.filename)
+
+
+def iter_csv_rows(text, filename):
+    """Строки CSV кампании из архива отчета
+
+    Номер кампании - первое число в имени файла. Строки до заголовка
+    (название кампании, период) пропускаются, заголовок - первая строка
+    с колонкой "Дата". Колонки переводятся в ключи JSON-отчета (CSV_COLUMNS),
+    строки без даты (итоги) пропускаются.
+
+    :param text: CSV, разделитель ";"
+    :param filename: имя файла в архиве
+    :return: генератор (campaign_id, строка)
+    """
+    found = re.search(r"\d+", os.path.basename(filename))
+    if found is None:
+        raise ErrorReportStream(f"Нет номера кампании в имени файла {filename}")
+    campaign_id = found.group()
+
+    header = None
+    for values in csv.reader(text, delimiter=";"):
+        values = [v.strip() for v in values]
+        if header is None:
+            if "Дата" in values or "date" in values:
+                header = [CSV_COLUMNS.get(v, v) for v in values]
+            continue
+        row = dict(zip(header, values))
+        if not re.fullmatch(r"\d{2}\.\d{2}\.\d{4}", row.get("date", "")):
+            continue
+        yield campaign_id, row
+    if header is None:
+        raise ErrorReportStream(f"Нет заголовка в {filename}")
+
+
+@lru_cache(maxsize=1024)
+def report_date(value):
+    return datetime.strptime(value, "%d.%m.%Y").date()
+
+
+def to_decimal(value):
+    if value in (None, ""):
+        return Decimal(0)
+    try:
+        return Decimal(str(value).replace(" ", "").replace(",", "."))
+    except InvalidOperation:
+        return Decimal(0)
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return int(to_decimal(value))
+
+
+def report_line(campaign_id, row):
+    """Строка отчета в поля статистики
+
+    Строки с orderId - заказы продвижения в поиске (StatisticsCampaignOrder),
+    с sku - статистика товаров (StatisticsCampaignProduct), остальные -
+    REPORT_TYPE_UNKNOWN с исходной строкой и campaign_id.
+
+    :param campaign_id:
+    :param row: строка отчета
+    :return: (тип, строка для записи)
+    """
+    if "orderId" not in row and "sku" not in row:
+        return REPORT_TYPE_UNKNOWN, dict(row, campaign_id=campaign_id)
+    dt = report_date(row["date"])
+    if "orderId" in row:
+        return REPORT_TYPE_SEARCH_PROMO, {
+            "campaign_id": int(campaign_id),
+            "dt": dt,
+            "order_id": row["orderId"],
+            "order_number": row.get("orderNumber"),
+            "sale_product_sku": to_int(row.get("ozonId")),
+            "price": to_decimal(row.get("salePrice")),
+            "count": to_int(row.get("quantity")),
+            "rate_amount": to_decimal(row.get("bidValue")),
+        }
+    return REPORT_TYPE_SKU, {
+        "campaign_id": int(campaign_id),
+        "dt": dt,
+        "sku": to_int(row.get("sku")),
+        "page": row.get("page", "Трафареты"),
+        "condition": row.get("condition", "Трафареты"),
+        "price": to_decimal(row.get("price")),
+        "views": to_int(row.get("views")),
+        "clicks": to_int(row.get("clicks")),
+        "expense": to_decimal(row.get("moneySpent")),
+        "orders": to_int(row.get("orders")),
+        "revenue": to_decimal(row.get("ordersMoney")),
+    }
+
+
+def iter_report_batches(
+    chunks, content_type=CONTENT_TYPE_JSON, batch_rows=REPORT_BATCH_ROWS
+):
+    """Строки отчета пачками по типу
+
+    :param chunks: части ответа, bytes
+    :param content_type: заголовок Content-Type ответа
+    :param batch_rows: строк в пачке
+    :return: генератор (тип, строки)
+    """
+    batches = {}
+    for campaign_id, row in iter_report_rows(chunks, content_type):
+        type_, line = report_line(campaign_id, row)
+        batch = batches.setdefault(type_, [])
+        batch.append(line)
+        if len(batch) >= batch_rows:
+            yield type_, batch
+            batches[type_] = []
+    for type_, batch in batches.items():
+        if batch:
+            yield type_, batch
+
+
+def check_response(response, report_uuid=None):
+    """Ошибки ответа Performance API - исключения клиента mp_ozon
+
+    429 - ErrorRateLimit, 423 - ErrorLocked: задача отключает ключ на время.
+
+    :param response:
+    :param report_uuid: 404 для отчета - ErrorReportNotFound
+    :return:
+    """
+    status = response.status_code
+    if status < 400:
+        return
+    if status == 404 and report_uuid is not None:
+        raise ErrorReportNotFound(f"Отчет {report_uuid} не найден")
+    message = f"{status} {response.url}"
+    if status == 429:
+        raise ErrorRateLimit(message)
+    if status == 423:
+        raise ErrorLocked(message)
+    raise ErrorRequest(message)
+
+
+def token_cache_key(apikey):
+    return f"performance_token_{apikey.pk}_{apikey.client_id}"
+
+
+def performance_token(apikey, refresh=False):
+    """Токен Performance API ключа, один на все отчеты, пока не истек
+
+    :param apikey:
+    :param refresh: получить новый токен (прежний отклонен)
+    :return:
+    """
+    key = token_cache_key(apikey)
+    token = None if refresh else cache.get(key)
+    if token is not None:
+        return token
+
+    response = requests.post(
+        f"{PERFORMANCE_URL}/api/client/token",
+        json={
+            "client_id": apikey.client_id,
+            "client_secret": apikey.client_secret,
+            "grant_type": "client_credentials",
+        },
+        timeout=30,
+    )
+    check_response(response)
+    data = response.json()
+    token = data["access_token"]
+    expires_in = int(data.get("expires_in") or 0) - TOKEN_EXPIRE_MARGIN
+    if expires_in > 0:
+        cache.set(key, token, expires_in)
+    return token
+
+
+def request_report(apikey, report_uuid, refresh=False):
+    return requests.get(
+        f"{PERFORMANCE_URL}/api/client/statistics/report",
+        params={"UUID": str(report_uuid)},
+        headers={"Authorization": f"Bearer {performance_token(apikey, refresh)}"},
+        stream=True,
+        timeout=REPORT_TIMEOUT,
+    )
+
+
+def traced_chunks(chunks):
+    """Чтение частей ответа - этап api задачи
+
+    :param chunks:
+    :return: генератор частей
+    """
+    chunks = iter(chunks)
+    while True:
+        with span(STAGE_API):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+@contextmanager
+def report_download(apikey, report_uuid):
+    """Скачивание готового отчета по частям, без загрузки ответа в память
+
+    Токен берется из кеша, отклоненный токен (401) обновляется один раз.
+    Запрос и чтение частей - этап api задачи.
+
+    :param apikey: ключ Performance API
+    :param report_uuid:
+    :return: Content-Type ответа и генератор частей ответа, bytes
+    """
+    with span(STAGE_API):
+        response = request_report(apikey, report_uuid)
+        if response.status_code == 401:
+            response.close()
+            response = request_report(apikey, report_uuid, refresh=True)
+    try:
+        check_response(response, report_uuid)
+        yield response.headers.get("Content-Type", ""), traced_chunks(
+            response.iter_content(chunk_size=REPORT_CHUNK_SIZE)
+        )
+    finally:
+        response.close()
@@ -0,0 +1,233 @@
+import csv
+import io
+import logging
+
+from api.helpers import execute_sql, fetch_raw_sql, Update_Daily, Update_Rollup
+from api.helpers.cache import bump_shop_version
+from mp.models import Selfbuy, SelfbuyMatch
+
+logger = logging.getLogger(__name__)
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+
+def match_selfbuys(shop=None, selfbuy_ids=None, orders=None, rematch=False):
+    """Находим отправления FBO для самовыкупов
+
+    Номер самовыкупа сравнивается отдельно с номером заказа и с номером
+    отправления, каждое сравнение идет по своему индексу. Уже найденные
+    совпадения не меняются.
+
+    :param shop: магазин, без магазина - все самовыкупы
+    :param selfbuy_ids: только эти самовыкупы
+    :param orders: только самовыкупы с этими номерами (загруженные заказы)
+    :param rematch: удалить прежние совпадения самовыкупов selfbuy_ids
+    :return:
+    """
+    where = ["TRUE"]
+    if shop is not None:
+        where.append("ms.shop_id = %(shop_id)s")
+    if selfbuy_ids is not None:
+        where.append("ms.id = ANY(%(selfbuy_ids)s)")
+    if orders is not None:
+        where.append('ms."order" = ANY(%(orders)s)')
+    params = {
+        "shop_id": shop.pk if shop is not None else None,
+        "selfbuy_ids": list(selfbuy_ids or []),
+        "orders": list(orders or []),
+    }
+
+    sql = ""
+    if rematch and selfbuy_ids is not None:
+        sql += f"""
+        DELETE FROM {SelfbuyMatch._meta.db_table}
+        WHERE selfbuy_id = ANY(%(selfbuy_ids)s);
+        """
+    sql += f"""
+    INSERT INTO {SelfbuyMatch._meta.db_table}
+    (selfbuy_id, fbo_id, order_date, shop_id, created_at)
+    (
+        SELECT ms.id, mof.id, DATE(mof.created_at), ms.shop_id, NOW()
+        FROM {Selfbuy._meta.db_table} ms
+        INNER JOIN mp_ozon_fbo mof ON mof.shop_id = ms.shop_id AND mof.order_number = ms."order"
+        WHERE {' AND '.join(where)}
+        UNION
+        SELECT ms.id, mof.id, DATE(mof.created_at), ms.shop_id, NOW()
+        FROM {Selfbuy._meta.db_table} ms
+        INNER JOIN mp_ozon_fbo mof ON mof.shop_id = ms.shop_id AND mof.posting_number = ms."order"
+        WHERE {' AND '.join(where)}
+    ) ON CONFLICT (selfbuy_id, fbo_id) DO NOTHING;
+    """
+    execute_sql(sql, params)
+
+
+def update_selfbuys(shop, selfbuy_ids=None):
+    """Обновляем самовыкупы из заказов
+
+    Обрабатываются только незавершенные самовыкупы с найденными отправлениями.
+
+    FIXME Реализовано только для FBO
+
+    :param shop:
+    :param selfbuy_ids: только эти самовыкупы
+    :return:
+    """
+    sql = f"""
+            UPDATE {Selfbuy._meta.db_table} SET
+                dt_buy = sub.in_process_at,
+                dt_take = sub.operation_date,
+                offer_id = sub.offer_id,
+                name = sub.name,
+                status = sub.status
+            FROM (
+                SELECT
+                    m.selfbuy_id,
+                    mof.in_process_at,
+                    mot.operation_date,
+                    mofp.offer_id,
+                    mofp.name,
+                    mof.status
+                FROM {SelfbuyMatch._meta.db_table} m
+                INNER JOIN {Selfbuy._meta.db_table} ms ON ms.id = m.selfbuy_id
+                INNER JOIN mp_ozon_fbo mof ON mof.id = m.fbo_id
+                INNER JOIN mp_ozon_fbo_product mofp ON mofp.order_id = mof.id
+                LEFT JOIN mp_ozon_transaction mot ON mof.shop_id = mot.shop_id
+                    AND mot.posting_number = mof.posting_number
+                WHERE m.shop_id = %(shop_id)s AND ms.dt_take IS NULL
+                    {'AND m.selfbuy_id = ANY(%(selfbuy_ids)s)' if selfbuy_ids is not None else ''}
+            ) sub
+            WHERE {Selfbuy._meta.db_table}.id = sub.selfbuy_id
+            """
+    execute_sql(
+        sql,
+        {
+            "shop_id": shop.id,
+            "selfbuy_ids": list(selfbuy_ids or []),
+        },
+    )
+
+
+def selfbuy_dates(selfbuy_ids):
+    """Дни заказов, найденных для самовыкупов
+
+    :param selfbuy_ids:
+    :return: дни
+    """
+    return list(
+        SelfbuyMatch.objects.filter(selfbuy_id__in=selfbuy_ids)
+        .values_list("order_date", flat=True)
+        .distinct()
+    )
+
+
+def refresh_selfbuy_days(shop, dates):
+    """Пересчет самовыкупов в daily-статистике и итогах за дни dates
+
+    Версия данных магазина меняется всегда: самовыкупы изменились.
+
+    :param shop:
+    :param dates: дни заказов самовыкупов до и после изменения
+    :return:
+    """
+    dates = sorted(set(dates))
+    if dates:
+        changed = Update_Daily.orders(params={"shop_id": shop.pk, "dates": dates})
+        Update_Rollup.daily_changed(shop.pk, changed)
+    bump_shop_version(shop.pk)
+
+
+def read_selfbuy_orders(file, filename=""):
+    """Номера заказов из файла CSV или XLSX
+
+    Берется первая колонка, строка заголовка (не похожая на номер) пропускается.
+
+    :param file: бинарный файл
+    :param filename: имя файла для определения формата
+    :return: список номеров без повторов
+    """
+    if filename.lower().endswith(".xlsx"):
+        if openpyxl is None:
+            raise ErrorSelfbuyImport("Для загрузки XLSX нужен пакет openpyxl")
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        rows = (
+            row[0] if row else None
+            for row in workbook.active.iter_rows(values_only=True)
+        )
+    else:
+        content = file.read()
+        if isinstance(content, bytes):
+            content = content.decode("utf-8-sig")
+        try:
+            dialect = csv.Sniffer().sniff(content[:1024], delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel  # одна колонка без разделителей
+        rows = (
+            row[0] if row else None for row in csv.reader(io.StringIO(content), dialect)
+        )
+
+    orders = []
+    for num, value in enumerate(rows):
+        value = str(value).strip() if value is not None else ""
+        if value.endswith(".0"):
+            value = value[:-2]  # числа из Excel
+        if not value or (num == 0 and not any(c.isdigit() for c in value)):
+            continue
+        orders.append(value)
+
+    return list(dict.fromkeys(orders))
+
+
+def import_selfbuys(shop, orders):
+    """Массовая загрузка самовыкупов
+
+    Новые номера вставляются одним запросом, существующие пропускаются.
+    Совпадения с заказами ищутся сразу для всех загруженных номеров, daily-статистика
+    пересчитывается только за дни найденных заказов.
+
+    :param shop:
+    :param orders: номера заказов или отправлений
+    :return: словарь с количеством загруженных, новых и найденных самовыкупов
+    """
+    orders = list(dict.fromkeys(str(o).strip() for o in orders if str(o).strip()))
+    if not orders:
+        return {"total": 0, "created": 0, "matched": 0}
+
+    # вставленные строки считаем по RETURNING: номер мог добавить параллельный запрос
+    created = fetch_raw_sql(
+        f"""
+        INSERT INTO {Selfbuy._meta.db_table} ("order", shop_id, created_at, updated_at)
+        (SELECT o, %(shop_id)s, NOW(), NOW() FROM unnest(%(orders)s::varchar[]) o)
+        ON CONFLICT (shop_id, "order") DO NOTHING
+        RETURNING id
+        """,
+        {"shop_id": shop.pk, "orders": orders},
+        as_dict=False,
+    )
+
+    selfbuy_ids = list(
+        Selfbuy.objects.filter(shop=shop, order__in=orders).values_list("id", flat=True)
+    )
+    match_selfbuys(shop, selfbuy_ids=selfbuy_ids)
+    update_selfbuys(shop, selfbuy_ids=selfbuy_ids)
+
+    dates = selfbuy_dates(selfbuy_ids)
+    if dates:
+        refresh_selfbuy_days(shop, dates)
+
+    result = {
+        "total": len(orders),
+        "created": len(created),
+        "matched": SelfbuyMatch.objects.filter(selfbuy_id__in=selfbuy_ids)
+        .values("selfbuy_id")
+        .distinct()
+        .count(),
+    }
+    logger.info("%s: Загружены самовыкупы %s", shop, result)
+    return result
+
+
+class ErrorSelfbuyImport(Exception):
+    pass
@@ -0,0 +1,304 @@
+import logging
+
+from django.db import connection
+
+from api.helpers import execute_sql, fetch_raw_sql
+from mp.models import ShopStats
+
+logger = logging.getLogger(__name__)
+
+# точный подсчет строк магазина по индексу shop_id
+SHOP_STATS_SQL = {
+    "products": "SELECT COUNT(*) FROM mp_ozon_product WHERE shop_id = %(shop_id)s",
+    "analytics": "SELECT COUNT(*) FROM mp_ozon_analytics WHERE shop_id = %(shop_id)s",
+    "campaigns": "SELECT COUNT(*) FROM mp_ozon_campaign WHERE shop_id = %(shop_id)s",
+    "advert": """
+        SELECT COUNT(*)
+        FROM mp_ozon_statisticscampaignproduct mos
+        INNER JOIN mp_ozon_campaign moc ON mos.campaign_id = moc.id
+        WHERE moc.shop_id = %(shop_id)s
+    """,
+    "reports": """
+        SELECT COALESCE(jsonb_object_agg(r.state, r.cnt), '{}'::jsonb)
+        FROM (
+            SELECT COALESCE(state, 'NEW') as state, COUNT(*) as cnt
+            FROM mp_ozon_report
+            WHERE shop_id = %(shop_id)s
+            GROUP BY state
+        ) r
+    """,
+    "transactions": "SELECT COUNT(*) FROM mp_ozon_transaction WHERE shop_id = %(shop_id)s",
+    "fbo": "SELECT COUNT(*) FROM mp_ozon_fbo WHERE shop_id = %(shop_id)s",
+    "fbs": "SELECT COUNT(*) FROM mp_ozon_fbs WHERE shop_id = %(shop_id)s",
+}
+
+# счетчики, которые ведут триггеры: таблица и запрос shop_id измененных строк,
+# changed_rows - строки оператора (transition table)
+SHOP_STATS_TRIGGERS = {
+    "products": ("mp_ozon_product", ""),
+    "analytics": ("mp_ozon_analytics", ""),
+    "campaigns": ("mp_ozon_campaign", ""),
+    "advert": (
+        "mp_ozon_statisticscampaignproduct",
+        "SELECT moc.shop_id FROM changed_rows r "
+        "INNER JOIN mp_ozon_campaign moc ON moc.id = r.campaign_id",
+    ),
+    "transactions": ("mp_ozon_transaction", ""),
+    "fbo": ("mp_ozon_fbo", ""),
+    "fbs": ("mp_ozon_fbs", ""),
+}
+SHOP_STATS_REPORTS_TABLE = "mp_ozon_report"
+
+# %% - для execute_sql с параметрами
+SHOP_STATS_FUNCTIONS_SQL = f"""
+CREATE OR REPLACE FUNCTION mp_shopstats_count() RETURNS trigger AS $$
+DECLARE
+    shop_rows text := COALESCE(NULLIF(TG_ARGV[1], ''), 'SELECT shop_id FROM changed_rows');
+BEGIN
+    EXECUTE format(
+        'UPDATE {ShopStats._meta.db_table} s SET %%1$I = s.%%1$I + d.cnt * %%2$s, updated_at = NOW()
+        FROM (SELECT r.shop_id, COUNT(*) as cnt FROM (%%3$s) r GROUP BY r.shop_id) d
+        WHERE s.shop_id = d.shop_id AND s.%%1$I IS NOT NULL',
+        TG_ARGV[0], CASE WHEN TG_OP = 'DELETE' THEN -1 ELSE 1 END, shop_rows
+    );
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION mp_shopstats_truncate() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format(
+        'UPDATE {ShopStats._meta.db_table} SET %%1$I = NULL, updated_at = NOW() WHERE %%1$I IS NOT NULL',
+        TG_ARGV[0]
+    );
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION mp_shopstats_reports() RETURNS trigger AS $$
+BEGIN
+    UPDATE {ShopStats._meta.db_table} s SET
+        reports = ({SHOP_STATS_SQL["reports"].replace("%(shop_id)s", "s.shop_id")}),
+        updated_at = NOW()
+    WHERE s.shop_id IN (SELECT shop_id FROM changed_rows) AND s.reports IS NOT NULL;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+# таблицы для приблизительной оценки по статистике планировщика
+SHOP_STATS_ESTIMATE_TABLES = {
+    "products": "mp_ozon_product",
+    "analytics": "mp_ozon_analytics",
+    "campaigns": "mp_ozon_campaign",
+    "transactions": "mp_ozon_transaction",
+    "fbo": "mp_ozon_fbo",
+    "fbs": "mp_ozon_fbs",
+}
+
+
+def shop_stats_tables():
+    """Таблицы со счетчиками ShopStats: таблица => счетчик
+
+    :return:
+    """
+    tables = {table: field for field, (table, _) in SHOP_STATS_TRIGGERS.items()}
+    tables[SHOP_STATS_REPORTS_TABLE] = "reports"
+    return tables
+
+
+def install_shop_stats_triggers():
+    """Триггеры, которые ведут счетчики ShopStats при записи в таблицы mp_ozon_*
+
+    Триггеры на оператор: вставка прибавляет, удаление вычитает число строк
+    оператора по магазинам, состояния отчетов пересчитываются для магазинов
+    измененных строк. Счетчики без значения (еще не посчитанные) не меняются,
+    TRUNCATE сбрасывает счетчик таблицы, задачи посчитают его заново.
+    Таблицы, которых еще нет, пропускаются с предупреждением - после их
+    создания триггеры ставит check_shop_stats_triggers.
+
+    :return: таблицы с триггерами
+    """
+    tables = set(connection.introspection.table_names())
+    sql = [SHOP_STATS_FUNCTIONS_SQL]
+    installed = []
+    for table, field in shop_stats_tables().items():
+        if table not in tables:
+            logger.warning(
+                "Счетчик ShopStats %s: нет таблицы %s, триггеры не установлены",
+                field,
+                table,
+            )
+            continue
+        sql.append(
+            f"""
+            DROP TRIGGER IF EXISTS mp_shopstats_truncate ON {table};
+            CREATE TRIGGER mp_shopstats_truncate AFTER TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION mp_shopstats_truncate('{field}');
+            """
+        )
+
+    for field, (table, shop_rows) in SHOP_STATS_TRIGGERS.items():
+        if table not in tables:
+            continue
+        for op, rows in (("INSERT", "NEW"), ("DELETE", "OLD")):
+            name = f"mp_shopstats_{op.lower()}"
+            sql.append(
+                f"""
+                DROP TRIGGER IF EXISTS {name} ON {table};
+                CREATE TRIGGER {name} AFTER {op} ON {table}
+                REFERENCING {rows} TABLE AS changed_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION mp_shopstats_count('{field}', '{shop_rows}');
+                """
+            )
+        installed.append(table)
+    if SHOP_STATS_REPORTS_TABLE in tables:
+        for op, rows in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            name = f"mp_shopstats_{op.lower()}"
+            sql.append(
+                f"""
+                DROP TRIGGER IF EXISTS {name} ON {SHOP_STATS_REPORTS_TABLE};
+                CREATE TRIGGER {name} AFTER {op} ON {SHOP_STATS_REPORTS_TABLE}
+                REFERENCING {rows} TABLE AS changed_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION mp_shopstats_reports();
+                """
+            )
+        installed.append(SHOP_STATS_REPORTS_TABLE)
+    execute_sql("".join(sql))
+    return installed
+
+
+def check_shop_stats_triggers():
+    """Ставим триггеры на таблицы счетчиков, где их нет
+
+    Таблицы mp_ozon_* могут появиться или быть пересозданы после установки
+    триггеров, тогда счетчики расходятся с данными. Для таких таблиц триггеры
+    ставятся заново, а счетчики сбрасываются - задачи посчитают их COUNT(*),
+    дашборд до этого показывает оценку. Запускается периодически
+    (manage.py update_shop_stats --check).
+
+    :return: счетчики, для которых установлены триггеры
+    """
+    sql = """
+    SELECT c.relname
+    FROM pg_trigger t
+    INNER JOIN pg_class c ON c.oid = t.tgrelid
+    WHERE t.tgname = 'mp_shopstats_truncate'
+        AND c.relnamespace = current_schema()::regnamespace
+    """
+    triggered = {row[0] for row in fetch_raw_sql(sql, as_dict=False)}
+    tables = set(connection.introspection.table_names())
+    fields = [
+        field
+        for table, field in shop_stats_tables().items()
+        if table in tables and table not in triggered
+    ]
+    if not fields:
+        return []
+
+    logger.warning("Счетчики ShopStats без триггеров: %s", ", ".join(fields))
+    install_shop_stats_triggers()
+    ShopStats.objects.update(**{field: None for field in fields})
+    return fields
+
+
+def update_shop_stats(shop, *fields, force=False):
+    """Считаем счетчики магазина в ShopStats
+
+    Счетчики ведут триггеры (install_shop_stats_triggers), задачи синхронизации
+    вызывают функцию после записи данных только для первого подсчета: COUNT(*)
+    выполняется для счетчиков без значения. force пересчитывает все указанные
+    счетчики (manage.py update_shop_stats).
+
+    :param shop:
+    :param fields: счетчики из SHOP_STATS_SQL, по умолчанию все
+    :param force: пересчитать и посчитанные счетчики
+    :return:
+    """
+    fields = [f for f in (fields or SHOP_STATS_SQL.keys()) if f in SHOP_STATS_SQL]
+    if not force:
+        stats = ShopStats.objects.filter(shop=shop).values(*fields).first() or {}
+        fields = [f for f in fields if stats.get(f) is None]
+    if not fields:
+        return
+
+    sql = f"""
+    INSERT INTO {ShopStats._meta.db_table}
+    (shop_id, {', '.join(fields)}, updated_at)
+    VALUES (
+        %(shop_id)s,
+        {', '.join(f'({SHOP_STATS_SQL[f]})' for f in fields)},
+        NOW()
+    ) ON CONFLICT (shop_id) DO UPDATE SET
+        {', '.join(f'{f} = excluded.{f}' for f in fields)},
+        updated_at = excluded.updated_at;
+    """
+    execute_sql(sql, {"shop_id": shop.pk})
+    logger.debug("%s: Обновлена статистика магазина %s", shop, fields)
+
+
+def estimate_shop_stats():
+    """Приблизительное количество строк магазинов по pg_class и pg_stats
+
+    Общее число строк таблицы берется из pg_class.reltuples, доля магазина -
+    из самых частых значений shop_id в pg_stats, остаток делится поровну между
+    прочими магазинами. Данные актуальны на момент последнего ANALYZE.
+
+    :return: словарь shop_id => {счетчик: количество}
+    """
+    sql = """
+    SELECT
+        c.relname,
+        c.reltuples,
+        s.null_frac,
+        s.n_distinct,
+        s.most_common_vals::text as most_common_vals,
+        s.most_common_freqs
+    FROM pg_class c
+    LEFT JOIN pg_stats s ON s.tablename = c.relname AND s.attname = 'shop_id'
+        AND s.schemaname = current_schema()
+    WHERE c.relkind = 'r' AND c.relname IN %(tables)s
+        AND c.relnamespace = current_schema()::regnamespace
+    """
+    rows = fetch_raw_sql(sql, {"tables": tuple(SHOP_STATS_ESTIMATE_TABLES.values())})
+    tables = {row["relname"]: row for row in rows}
+
+    result = {}
+    for field, table in SHOP_STATS_ESTIMATE_TABLES.items():
+        row = tables.get(table)
+        if row is None or row["reltuples"] <= 0:
+            continue
+
+        total = row["reltuples"]
+        values = [
+            int(v)
+            for v in (row["most_common_vals"] or "{}").strip("{}").split(",")
+            if v
+        ]
+        freqs = row["most_common_freqs"] or []
+        for shop_id, freq in zip(values, freqs):
+            result.setdefault(shop_id, {})[field] = round(total * freq)
+
+        # магазины вне списка частых значений получают равную долю остатка
+        n_distinct = row["n_distinct"] or 0
+        distinct = n_distinct if n_distinct > 0 else -n_distinct * total
+        others = distinct - len(values)
+        rest = 1 - sum(freqs) - (row["null_frac"] or 0)
+        result.setdefault(None, {})[field] = (
+            round(total * rest / others) if others > 0 and rest > 0 else 0
+        )
+
+    return result
+
+
+def shop_stats_estimate(estimates, shop_id, field):
+    """Оценка счетчика магазина из результата estimate_shop_stats
+
+    :param estimates:
+    :param shop_id:
+    :param field:
+    :return:
+    """
+    if field in estimates.get(shop_id, {}):
+        return estimates[shop_id][field]
+    return estimates.get(None, {}).get(field)
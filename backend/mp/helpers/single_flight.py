@@ -0,0 +1,162 @@
+from collections import defaultdict
+from datetime import date, datetime
+import functools
+import json
+import logging
+import threading
+
+from celery import current_app
+
+from api.helpers.cache import bump_shop_version
+from ka_space.helpers import Locking, ErrorIsLocked
+from mp.models import APIKey
+
+logger = logging.getLogger(__name__)
+
+LEASE_EXPIRE = 60 * 15  # без продления аренда истекает, если worker упал
+HEARTBEAT_INTERVAL = LEASE_EXPIRE / 3
+FOLLOWUP_EXPIRE = 60 * 60 * 6  # повтор ждет завершения текущей задачи
+
+# этап: задачи с общей арендой, повтор каждой задачи хранится отдельно
+STAGE_TASKS = defaultdict(set)
+
+
+class Heartbeat(threading.Thread):
+    """Продление аренды, пока выполняется задача"""
+
+    def __init__(self, lock, interval=HEARTBEAT_INTERVAL):
+        super().__init__(daemon=True)
+        self.lock = lock
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                if not self.lock.extend():
+                    logger.warning(f"{self.lock.flag_locked}: аренда потеряна")
+                    return
+            except Exception as e:
+                logger.error(f"{self.lock.flag_locked}: аренда не продлена: {e}")
+
+    def stop(self):
+        self.stopped.set()
+
+
+def get_shop_id(kwargs):
+    if kwargs.get("shop_id"):
+        return kwargs["shop_id"]
+    if kwargs.get("apikey_id") is None:
+        return None
+    return (
+        APIKey.objects.filter(pk=kwargs["apikey_id"])
+        .values_list("shop_id", flat=True)
+        .first()
+    )
+
+
+def encode_kwargs(value):
+    """Даты аргументов повтора сохраняются с типом, остальное - только JSON"""
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    raise TypeError(f"{type(value).__name__} не сохраняется в повторе задачи")
+
+
+def decode_kwargs(value):
+    if "__datetime__" in value:
+        return datetime.fromisoformat(value["__datetime__"])
+    if "__date__" in value:
+        return date.fromisoformat(value["__date__"])
+    return value
+
+
+def dump_followup(kwargs):
+    return json.dumps(kwargs, default=encode_kwargs)
+
+
+def load_followup(data):
+    return json.loads(data, object_hook=decode_kwargs)
+
+
+def single_flight(stage, expire=LEASE_EXPIRE):
+    """Одна задача этапа на магазин: аренда task_{stage}_{shop_id} в Redis
+
+    Повторный вызов, пока задача выполняется, не ждет: первый повтор
+    запоминается и ставится в очередь после завершения текущей задачи,
+    остальные объединяются с ним. Задачи одного этапа делят аренду,
+    повтор запоминается для каждой задачи отдельно. Аренда продлевается каждые expire / 3 сек.
+    Вызов с lock_timeout (загрузка истории) ждет аренду до lock_timeout сек,
+    вызов с followup=False (синхронно из другой задачи) пропускается без повтора.
+    После выполнения меняется версия данных магазина (ETag отчетов API).
+
+    Ставится под декоратором @app.task, над trace_task.
+
+    :param stage: products, stocks, orders, ...
+    :param expire: время жизни аренды без продления, сек
+    :return:
+    """
+
+    def decorator(func):
+        task_name = f"{func.__module__}.{func.__name__}"
+        STAGE_TASKS[stage].add(task_name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            shop_id = get_shop_id(kwargs)
+            if shop_id is None:
+                return func(*args, **kwargs)
+
+            lock = Locking(f"task_{stage}_{shop_id}", timeout=0, expire=expire)
+            followup = f"{lock.flag_locked}_followup_{task_name}"
+            lock_timeout = kwargs.pop("lock_timeout", 0)
+            followup_allowed = kwargs.pop("followup", True)
+            try:
+                lock.acquire(timeout=lock_timeout)
+            except ErrorIsLocked:
+                if lock_timeout or not followup_allowed:
+                    return {"❌FAILED": f"{shop_id} {stage} Locked. Skip."}
+                queued = lock.redis.set(
+                    followup,
+                    dump_followup(kwargs),
+                    nx=True,
+                    ex=FOLLOWUP_EXPIRE,
+                )
+                msg = "queued after the running task" if queued else "coalesced"
+                logger.info(f"{task_name} shop={shop_id}: {msg}")
+                return {"❌FAILED": f"{shop_id} {stage} Locked. {msg.capitalize()}."}
+
+            heartbeat = Heartbeat(lock, interval=expire / 3)
+            heartbeat.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                heartbeat.stop()
+                # данные магазина могли измениться - новые ETag отчетов
+                bump_shop_version(shop_id)
+                lock.release()
+                requeue_followups(lock, stage)
+
+        return wrapper
+
+    return decorator
+
+
+def requeue_followups(lock, stage):
+    """Постановка в очередь повторов всех задач этапа после снятия аренды
+
+    :param lock: аренда этапа магазина
+    :param stage:
+    :return:
+    """
+    names = sorted(STAGE_TASKS[stage])
+    keys = [f"{lock.flag_locked}_followup_{name}" for name in names]
+    pipe = lock.redis.pipeline()
+    for key in keys:
+        pipe.get(key)
+    pipe.delete(*keys)
+    *queued, _ = pipe.execute()
+    for name, data in zip(names, queued):
+        if data:
+            current_app.tasks[name].apply_async(kwargs=load_followup(data))
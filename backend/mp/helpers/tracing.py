@@ -0,0 +1,279 @@
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connection
+from django.utils import timezone
+
+from ka_space.metrics import metric, push_metrics
+from mp.models import APIKey, TaskRun
+
+logger = logging.getLogger(__name__)
+
+# этапы задач загрузки
+STAGE_API = "api"  # запросы к API маркетплейса
+STAGE_NORMALIZE = "normalize"  # разбор ответа и сравнение с БД в Python
+STAGE_DB_READ = "db_read"
+STAGE_DB_WRITE = "db_write"
+STAGE_DAILY = "daily"  # Update_Daily
+STAGE_DERIVED = "derived"  # Update_Parsed, Update_Ledger, самовыкупы, статистика
+STAGE_SUBTASK = "subtask"  # вложенная задача, например товары в update_stocks
+# запросы внутри этих этапов относятся к этапу, остальные - к db_read/db_write
+DB_STAGES = (STAGE_DB_READ, STAGE_DB_WRITE, STAGE_DAILY, STAGE_DERIVED)
+
+TASK_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+TASK_DURATION = metric(
+    "Histogram",
+    "ka_task_duration_seconds",
+    "Время выполнения задачи загрузки",
+    ["task", "status"],
+    buckets=TASK_BUCKETS,
+)
+STAGE_SECONDS = metric(
+    "Histogram",
+    "ka_task_stage_seconds",
+    "Время этапа задачи без вложенных этапов",
+    ["task", "stage"],
+    buckets=(0.01, 0.1, 0.5) + TASK_BUCKETS,
+)
+STAGE_ROWS = metric(
+    "Counter",
+    "ka_task_stage_rows",
+    "Строки, обработанные на этапе задачи",
+    ["task", "stage"],
+)
+TASK_DB_SECONDS = metric(
+    "Histogram",
+    "ka_task_db_seconds",
+    "Время всех запросов к БД за задачу",
+    ["task"],
+    buckets=(0.01, 0.1, 0.5) + TASK_BUCKETS,
+)
+
+_current = ContextVar("task_trace", default=None)
+
+
+class TaskTrace(object):
+    """Этапы одного выполнения задачи
+
+    Время этапа считается без вложенных этапов. Запросы к БД вне этапов
+    DB_STAGES записываются как вложенные этапы db_read (SELECT) и db_write,
+    оставшееся время задачи - normalize (разбор и сравнение данных в Python).
+    db_time - время всех запросов задачи.
+    """
+
+    def __init__(self, task, shop_id=None):
+        self.task = task
+        self.shop_id = shop_id
+        self.started_at = timezone.now()
+        self.start = time.perf_counter()
+        self.spans = {}  # этап => {"seconds", "rows", "calls"}
+        self.stack = []  # открытые этапы: [этап, время вложенных этапов]
+        self.db_time = 0
+        self.db_queries = 0
+
+    def enter(self, stage):
+        self.stack.append([stage, 0])
+        return time.perf_counter()
+
+    def exit(self, start, rows=None):
+        elapsed = time.perf_counter() - start
+        stage, nested = self.stack.pop()
+        if self.stack:
+            self.stack[-1][1] += elapsed
+
+        data = self.spans.setdefault(stage, {"seconds": 0, "rows": 0, "calls": 0})
+        data["seconds"] += elapsed - nested
+        data["calls"] += 1
+        if rows:
+            data["rows"] += rows
+        STAGE_SECONDS.labels(self.task, stage).observe(elapsed - nested)
+        if rows:
+            STAGE_ROWS.labels(self.task, stage).inc(rows)
+
+    @property
+    def stage(self):
+        return self.stack[-1][0] if self.stack else None
+
+    @property
+    def rows(self):
+        """Строки, полученные из API"""
+        return self.spans.get(STAGE_API, {}).get("rows", 0)
+
+    def summary(self, duration):
+        spans = " ".join(
+            f"{stage} {data['seconds']:.2f}s/{data['rows']}"
+            for stage, data in sorted(
+                self.spans.items(), key=lambda item: -item[1]["seconds"]
+            )
+        )
+        return (
+            f"{self.task} shop={self.shop_id} {duration:.2f}s "
+            f"(БД {self.db_time:.2f}s, {self.db_queries} запр.) {spans}"
+        )
+
+
+class Span(object):
+    def __init__(self, rows=None):
+        self.rows = rows
+
+
+@contextmanager
+def span(stage, rows=None):
+    """Этап задачи: время и число строк
+
+    ```
+    with span(STAGE_API) as s:
+        data = api.transactions(...)
+        s.rows = len(data)
+    ```
+    Вне задачи с trace_task ничего не записывает.
+
+    :param stage:
+    :param rows: число строк, можно задать позже через s.rows
+    :return: Span
+    """
+    current = _current.get()
+    s = Span(rows)
+    if current is None:
+        yield s
+        return
+
+    start = current.enter(stage)
+    try:
+        yield s
+    finally:
+        current.exit(start, s.rows)
+
+
+def current_trace():
+    return _current.get()
+
+
+class TracedApi(object):
+    """Клиент API, каждый вызов метода - этап api, строки - длина ответа"""
+
+    def __init__(self, api):
+        self._api = api
+
+    def __getattr__(self, name):
+        attr = getattr(self._api, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            with span(STAGE_API) as s:
+                result = attr(*args, **kwargs)
+                if isinstance(result, (list, dict)):
+                    s.rows = len(result)
+            return result
+
+        return call
+
+
+def trace_task(func):
+    """Трассировка задачи: этапы span(), время БД, история в TaskRun и метрики
+
+    Ставится под декоратором @app.task. Магазин определяется по apikey_id.
+
+    :param func:
+    :return:
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        parent = _current.get()
+        trace = TaskTrace(func.__name__)
+        if parent is not None:
+            # вложенная задача - отдельный этап родителя и отдельная запись
+            with span(STAGE_SUBTASK):
+                return _run(trace, func, args, kwargs)
+        return _run(trace, func, args, kwargs)
+
+    return wrapper
+
+
+def _run(trace, func, args, kwargs):
+    def db_wrapper(execute, sql, params, many, context):
+        stage = trace.stage
+        if stage in DB_STAGES:
+            query_start = None
+        elif sql.lstrip()[:6].upper() == "SELECT":
+            query_start = trace.enter(STAGE_DB_READ)
+        else:
+            query_start = trace.enter(STAGE_DB_WRITE)
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            trace.db_time += time.perf_counter() - start
+            trace.db_queries += 1
+            if query_start is not None:
+                trace.exit(query_start, max(context["cursor"].rowcount, 0))
+
+    token = _current.set(trace)
+    status, result = "error", None
+    try:
+        with connection.execute_wrapper(db_wrapper):
+            result = func(*args, **kwargs)
+        status = (
+            "failed" if isinstance(result, dict) and "❌FAILED" in result else "success"
+        )
+        return result
+    except Exception as e:
+        result = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        save_trace(trace, status, result, kwargs.get("apikey_id"))
+        if _current.get() is None:
+            push_metrics()
+
+
+def save_trace(trace, status, result, apikey_id=None):
+    """Метрики и запись TaskRun, ошибки записи не прерывают задачу
+
+    :param trace:
+    :param status: success, failed, error
+    :param result: результат задачи
+    :param apikey_id:
+    :return:
+    """
+    duration = time.perf_counter() - trace.start
+    # время вне этапов и запросов к БД - разбор и сравнение данных в Python
+    other = duration - sum(data["seconds"] for data in trace.spans.values())
+    if other > 0:
+        trace.spans.setdefault(STAGE_NORMALIZE, {"seconds": 0, "rows": 0, "calls": 0})[
+            "seconds"
+        ] += other
+    TASK_DURATION.labels(trace.task, status).observe(duration)
+    TASK_DB_SECONDS.labels(trace.task).observe(trace.db_time)
+    logger.info("%s: %s", status, trace.summary(duration))
+
+    try:
+        if trace.shop_id is None and apikey_id is not None:
+            trace.shop_id = (
+                APIKey.objects.filter(pk=apikey_id)
+                .values_list("shop_id", flat=True)
+                .first()
+            )
+        TaskRun.objects.create(
+            task=trace.task,
+            shop_id=trace.shop_id,
+            status=status,
+            started_at=trace.started_at,
+            duration=duration,
+            db_time=trace.db_time,
+            db_queries=trace.db_queries,
+            api_time=trace.spans.get(STAGE_API, {}).get("seconds", 0),
+            rows=trace.rows,
+            spans=trace.spans,
+            result=str(result or "")[:1000],
+        )
+    except Exception as e:
+        logger.error("%s: история выполнения не сохранена: %s", trace.task, e)
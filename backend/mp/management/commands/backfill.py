@@ -0,0 +1,80 @@
+import logging
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from mp.helpers import get_keys, KEY_TYPE_OZON, MP_KEYS
+from mp.models import Backfill
+from mp.tasks import start_backfill
+from mp.tasks.backfill import BACKFILL_TASKS
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Start, resume and show chunked history loads (backfill queue)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shop_id", type=int, default=0)
+        parser.add_argument(
+            "--task", action="append", choices=list(BACKFILL_TASKS), default=[]
+        )
+        parser.add_argument("--days", type=int, default=180)
+        parser.add_argument("--period_days", type=int, default=None)
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Продолжить незавершенные загрузки с последнего периода",
+        )
+        parser.add_argument(
+            "--stalled",
+            type=int,
+            default=60,
+            help="Минут без обновления, после которых running считается прерванной",
+        )
+
+    def handle(self, *args, **options):
+        if options["resume"]:
+            self.resume(options)
+        elif options["task"]:
+            self.start(options)
+
+        backfills = Backfill.objects.select_related("shop")
+        if options["shop_id"]:
+            backfills = backfills.filter(shop_id=options["shop_id"])
+        for backfill in backfills[:50]:
+            self.stdout.write(
+                f"{backfill.shop} {backfill.task} {backfill.date_from}..{backfill.date_to}: "
+                f"{backfill.status} {backfill.progress:.0%} {backfill.error}"
+            )
+
+    def start(self, options):
+        for mp in MP_KEYS:
+            for apikey in get_keys(
+                mp, key_type=KEY_TYPE_OZON, shop_id=options["shop_id"]
+            ):
+                for task in options["task"]:
+                    backfill = start_backfill(
+                        apikey,
+                        task,
+                        days=options["days"],
+                        period_days=options["period_days"],
+                    )
+                    self.stdout.write(
+                        self.style.SUCCESS(f"Загрузка поставлена: {backfill}")
+                    )
+
+    def resume(self, options):
+        stalled_at = timezone.now() - timedelta(minutes=options["stalled"])
+        backfills = Backfill.objects.filter(status__in=["pending", "failed"]) | (
+            Backfill.objects.filter(status="running", updated_at__lt=stalled_at)
+        )
+        if options["shop_id"]:
+            backfills = backfills.filter(shop_id=options["shop_id"])
+        if options["task"]:
+            backfills = backfills.filter(task__in=options["task"])
+
+        for backfill in backfills.select_related("apikey"):
+            start_backfill(backfill.apikey, backfill.task)
+            self.stdout.write(self.style.SUCCESS(f"Загрузка продолжена: {backfill}"))
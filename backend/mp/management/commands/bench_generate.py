@@ -0,0 +1,48 @@
+import logging
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mp.bench import DatasetGenerator, SCALES, is_production_db
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic Ozon data for query benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", choices=SCALES.keys(), default="small")
+        parser.add_argument("--shops", type=int, default=None)
+        parser.add_argument("--skus", type=int, default=None)
+        parser.add_argument("--days", type=int, default=None)
+        parser.add_argument("--end_date", type=date.fromisoformat, default=None)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument(
+            "--create_schema",
+            action="store_true",
+            help="создать таблицы mp_ozon, если пакет mp_ozon не установлен",
+        )
+        parser.add_argument("--force", action="store_true", help="для DATABASE_URL")
+
+    def handle(self, *args, **options):
+        if is_production_db() and not options["force"]:
+            raise CommandError(
+                "База из DATABASE_URL: генерация данных только с --force"
+            )
+
+        generator = DatasetGenerator.from_scale(
+            options["scale"],
+            **{
+                k: options[k]
+                for k in ("shops", "skus", "days", "end_date", "seed")
+                if options[k] is not None
+            },
+        )
+        shops = generator.generate(create_schema=options["create_schema"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Данные сгенерированы: {len(shops)} магазинов, {generator.skus} SKU, "
+                f"{generator.days} дней."
+            )
+        )
@@ -0,0 +1,90 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mp.bench import load_dataset, is_production_db
+from mp.bench.fake_ozon import FakeOzon
+from mp.bench.ingest import INGEST_TASKS, run_ingest
+from mp.bench.runner import save_results
+from mp.models import Shop
+from .fake_ozon import add_fake_arguments, fake_options
+
+logger = logging.getLogger(__name__)
+
+try:
+    import mp_ozon.api
+except ImportError:
+    mp_ozon = None
+
+
+class Command(BaseCommand):
+    """Задачи загрузки Ozon целиком против поддельного API
+
+    Без --url поддельный API поднимается в этом же процессе с параметрами
+    команды fake_ozon. Для магазина создаются ключи, которые поддельный API
+    связывает с данными bench_generate.
+    ```
+    python manage.py bench_ingest --task update_orders --days 30 --latency 80
+    python manage.py bench_ingest --url http://127.0.0.1:8090
+    ```
+    """
+
+    help = "Run Ozon ingest tasks end to end against the fake API"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shop_id", type=int, default=None)
+        parser.add_argument(
+            "--task", action="append", choices=INGEST_TASKS, help="можно несколько"
+        )
+        parser.add_argument("--days", type=int, default=30)
+        parser.add_argument("--url", default=None, help="запущенный fake_ozon")
+        parser.add_argument("--check_interval", type=float, default=1)
+        parser.add_argument("--max_checks", type=int, default=60)
+        parser.add_argument("--no_save", action="store_true")
+        parser.add_argument("--force", action="store_true", help="для DATABASE_URL")
+        # поддельный API в этом процессе, размер данных - как у bench_generate
+        add_fake_arguments(parser)
+
+    def handle(self, *args, **options):
+        if mp_ozon is None:
+            raise CommandError(
+                "Пакет mp_ozon не установлен, задачи загрузки недоступны"
+            )
+        if is_production_db() and not options["force"]:
+            raise CommandError("База из DATABASE_URL: замеры только с --force")
+
+        dataset = load_dataset() or {}
+        shop_id = options["shop_id"] or (dataset.get("shop_ids") or [None])[0]
+        if shop_id is None:
+            raise CommandError("Нет данных, сначала bench_generate или --shop_id")
+        shop = Shop.objects.get(pk=shop_id)
+
+        results = run_ingest(
+            shop,
+            names=options.get("task"),
+            url=options["url"],
+            fake=FakeOzon(**fake_options(options)),
+            days=options["days"],
+            check_interval=options["check_interval"],
+            max_checks=options["max_checks"],
+        )
+        if not options["no_save"]:
+            save_results(results)
+
+        self.stdout.write(f"\n{shop}: загрузка за {options['days']} дней")
+        for result in results:
+            self.stdout.write(_format(result))
+
+
+def _format(result):
+    line = (
+        f"{result['case']:<34} {result['median']:>8.2f}s"
+        f"  API {result['api_time']:.2f}s / {result['api_requests']} запр."
+        f"  БД {result['db_time']:.2f}s / {result['db_queries']} запр."
+        f"  {result['rows']} строк, {result['rows_per_sec']:.0f} строк/с"
+    )
+    if result["api_errors"]:
+        line += f"  ошибок API {result['api_errors']}"
+    if result["error"]:
+        line += f"\n{'':<34} ошибка: {result['error']}"
+    return line
@@ -0,0 +1,79 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mp.bench import DatasetGenerator, SCALES, load_dataset, is_production_db
+from mp.bench.runner import run_cases, save_results, load_results
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Time API queries and aggregations on the synthetic dataset"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale",
+            action="append",
+            choices=SCALES.keys(),
+            help="сгенерировать данные этого размера перед замером, можно несколько",
+        )
+        parser.add_argument("--case", action="append", help="префикс названия замера")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--compare", default="", help="коммит для сравнения")
+        parser.add_argument("--no_save", action="store_true")
+        parser.add_argument("--force", action="store_true", help="для DATABASE_URL")
+
+    def handle(self, *args, **options):
+        scales = options.get("scale") or [None]
+        if scales != [None] and is_production_db() and not options["force"]:
+            raise CommandError(
+                "База из DATABASE_URL: генерация данных только с --force"
+            )
+        baseline = load_results(options["compare"]) if options["compare"] else {}
+
+        for scale in scales:
+            if scale is not None:
+                self.stdout.write(f"Генерация данных {scale}...")
+                DatasetGenerator.from_scale(scale).generate()
+            dataset = load_dataset()
+            if dataset is None:
+                raise CommandError("Нет данных, сначала bench_generate")
+            scale = scale or _scale_name(dataset)
+
+            results = run_cases(options.get("case"), options["repeat"], scale)
+            if not options["no_save"]:
+                save_results(results)
+
+            self.stdout.write(
+                f"\n{scale}: {dataset['shops']} магазинов, {dataset['skus']} SKU, "
+                f"{dataset['days']} дней"
+            )
+            for result in results:
+                self.stdout.write(
+                    _format(result, baseline.get((scale, result["case"])))
+                )
+
+
+def _scale_name(dataset):
+    for name, scale in SCALES.items():
+        if all(dataset.get(k) == v for k, v in scale.items()):
+            return name
+    return f"{dataset['shops']}x{dataset['skus']}x{dataset['days']}"
+
+
+def _format(result, base=None):
+    if result["error"]:
+        return f"{result['case']:<24} ошибка: {result['error']}"
+
+    line = (
+        f"{result['case']:<24} {result['median'] * 1000:>10.1f} ms"
+        f" (min {result['min'] * 1000:.1f}) rows {result['rows']}"
+    )
+    if result.get("bytes") is not None:
+        line += f" {result['bytes'] / 1024:.0f} KB"
+    if result.get("peak_mb") is not None:
+        line += f" peak {result['peak_mb']} MB"
+    if base and base.get("median"):
+        line += f"  {result['median'] / base['median']:.2f}x к {base['commit'][:8]}"
+    return line
@@ -4,16 +4,24 @@ import subprocess
 from django.core.management.base import BaseCommand
 from django.utils import autoreload
 
+# как worker и backfill в Procfile: история новых ключей не занимает worker обновлений
+WORKERS = [
+    "celery -A ka_space worker -Q sync -n sync@%h --loglevel=debug --concurrency=2",
+    "celery -A ka_space worker -Q backfill -n backfill@%h --loglevel=debug "
+    "--concurrency=1 --prefetch-multiplier=1",
+]
+
 
 def restart_celery():
-    cmd = 'pkill -f "celery worker"'
-    subprocess.call(shlex.split(cmd))
-    cmd = "celery -A ka_space worker --loglevel=debug --concurrency=2"
+    cmd = 'pkill -f "celery -A ka_space worker"'
     subprocess.call(shlex.split(cmd))
+    workers = [subprocess.Popen(shlex.split(worker)) for worker in WORKERS]
+    for worker in workers:
+        worker.wait()
 
 
 class Command(BaseCommand):
     def handle(self, *args, **options):
-        print("Starting celery worker with autoreload...")
+        print("Starting celery workers sync and backfill with autoreload...")
 
         autoreload.run_with_reloader(restart_celery)
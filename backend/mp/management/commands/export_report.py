@@ -0,0 +1,53 @@
+import logging
+import shutil
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+
+from api.helpers.export import EXPORT_FORMATS, ErrorExport, export_file
+from api.views import EXPORT_VIEWS, export_query
+from mp.models import Shop
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Export analytics, advertizing or transactions report to Parquet or Arrow"
+
+    def add_arguments(self, parser):
+        parser.add_argument("report", choices=list(EXPORT_VIEWS))
+        parser.add_argument("file")
+        parser.add_argument("--output", choices=list(EXPORT_FORMATS), default=None)
+        parser.add_argument("--shop_id", type=int, action="append", default=[])
+        parser.add_argument("--columns", default="")
+        parser.add_argument("--date_from", default="")
+        parser.add_argument("--date_to", default="")
+        parser.add_argument("--days", type=int, default=None)
+
+    def handle(self, *args, **options):
+        fmt = options["output"] or (
+            "arrow" if options["file"].endswith((".arrow", ".arrows")) else "parquet"
+        )
+        shops = Shop.objects.filter(is_active=True)
+        if options["shop_id"]:
+            shops = shops.filter(pk__in=options["shop_id"])
+        shop_ids = tuple(shops.values_list("pk", flat=True))
+        if not shop_ids:
+            raise CommandError("Магазины не найдены")
+
+        data = QueryDict(mutable=True)
+        for key in ("columns", "date_from", "date_to", "days"):
+            if options[key]:
+                data[key] = options[key]
+
+        try:
+            sql, params = export_query(EXPORT_VIEWS[options["report"]], data, shop_ids)
+            file, rows = export_file(sql, params, fmt)
+        except (ErrorExport, ValueError) as e:
+            raise CommandError(e)
+
+        with file, open(options["file"], "wb") as f:
+            shutil.copyfileobj(file, f)
+        self.stdout.write(
+            self.style.SUCCESS(f"Выгружено {rows} строк в {options['file']} ({fmt}).")
+        )
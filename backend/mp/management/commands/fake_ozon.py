@@ -0,0 +1,130 @@
+import logging
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from mp.bench import SCALES, load_dataset
+from mp.bench.fake_ozon import FakeOzon, serve
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Поддельный API Ozon (Seller и Performance) для замеров задач загрузки
+
+    Синтетические данные размером с набор bench_generate:
+    ```
+    python manage.py fake_ozon --port 8090 --latency 50 --throttle_rate 0.05
+    ```
+
+    Запись ответов настоящего API и воспроизведение:
+    ```
+    python manage.py fake_ozon --record tmp/ozon_cassettes
+    python manage.py fake_ozon --replay tmp/ozon_cassettes --latency 100
+    ```
+    """
+
+    help = "Local fake Ozon Seller/Performance API with record and replay"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8090)
+        parser.add_argument(
+            "--scale",
+            choices=SCALES.keys(),
+            default=None,
+            help="размер данных, по умолчанию как у последнего bench_generate",
+        )
+        parser.add_argument("--skus", type=int, default=None)
+        parser.add_argument("--days", type=int, default=None)
+        parser.add_argument("--end_date", type=date.fromisoformat, default=None)
+        parser.add_argument("--seed", type=int, default=None)
+        add_fake_arguments(parser)
+
+    def handle(self, *args, **options):
+        fake = FakeOzon(**fake_options(options))
+        server = serve(fake, options["host"], options["port"])
+        mode = (
+            f"запись в {options['record']}"
+            if options["record"]
+            else f"воспроизведение из {options['replay']}"
+            if options["replay"]
+            else f"синтетические данные {fake.skus} SKU за {fake.days} дней"
+        )
+        self.stdout.write(
+            f"Поддельный API Ozon: http://{options['host']}:{server.server_address[1]} ({mode})"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Запросов: {fake.stats}")
+
+
+def add_fake_arguments(parser):
+    """Поведение поддельного API: страницы, задержки, ошибки, запись"""
+    parser.add_argument("--page_size", type=int, default=None)
+    parser.add_argument("--latency", type=float, default=0, help="мс на ответ")
+    parser.add_argument(
+        "--latency_per_item", type=float, default=0, help="мс на строку"
+    )
+    parser.add_argument("--jitter", type=float, default=0, help="мс, случайная добавка")
+    parser.add_argument("--error_rate", type=float, default=0, help="доля ответов 5xx")
+    parser.add_argument(
+        "--throttle_rate", type=float, default=0, help="доля ответов 429"
+    )
+    parser.add_argument(
+        "--rps", type=int, default=0, help="лимит запросов клиента в секунду"
+    )
+    parser.add_argument(
+        "--report_delay", type=float, default=2, help="секунд до готовности отчета"
+    )
+    parser.add_argument("--record", default=None, help="каталог для записи ответов")
+    parser.add_argument("--replay", default=None, help="каталог записанных ответов")
+    parser.add_argument(
+        "--no_fallback",
+        action="store_true",
+        help="при воспроизведении отвечать 404 на незаписанные запросы",
+    )
+
+
+def fake_options(options):
+    """Параметры FakeOzon: размер из --scale, последнего набора bench_generate или small
+
+    :param options: параметры команды
+    :return:
+    """
+    dataset = load_dataset() or {}
+    if options.get("scale"):
+        dataset = SCALES[options["scale"]]
+    size = {
+        "skus": dataset.get("skus", SCALES["small"]["skus"]),
+        "days": dataset.get("days", SCALES["small"]["days"]),
+        "seed": dataset.get("seed", 1),
+        "end_date": date.fromisoformat(dataset["end_date"])
+        if dataset.get("end_date")
+        else None,
+    }
+    size.update({k: options[k] for k in size if options.get(k) is not None})
+    return {
+        **size,
+        **{
+            k: options[k]
+            for k in (
+                "page_size",
+                "latency",
+                "latency_per_item",
+                "jitter",
+                "error_rate",
+                "throttle_rate",
+                "rps",
+                "report_delay",
+            )
+            if options.get(k) is not None
+        },
+        "record_dir": options.get("record"),
+        "replay_dir": options.get("replay"),
+        "fallback": not options.get("no_fallback"),
+    }
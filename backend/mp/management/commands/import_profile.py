@@ -0,0 +1,72 @@
+import logging
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from mp.bench.imports import ENTRY_POINTS, DEFAULT_COMMAND, profile_entry
+from mp.bench.runner import save_results, load_results, git_commit
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Время запуска процессов и импорты по пакетам (python -X importtime)
+
+    Точки входа: web (ASGI и URLconf), worker (Celery с модулями задач),
+    command (manage.py <команда> --help).
+    ```
+    python manage.py import_profile
+    python manage.py import_profile --entry command --command update_stocks --top 30
+    python manage.py import_profile --compare 658e36d
+    ```
+    """
+
+    help = "Profile import time of web, worker and management command startup"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entry", action="append", choices=ENTRY_POINTS.keys())
+        parser.add_argument("--command", default=DEFAULT_COMMAND)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--top", type=int, default=15, help="пакетов в разбивке")
+        parser.add_argument("--compare", default="", help="коммит для сравнения")
+        parser.add_argument("--no_save", action="store_true")
+
+    def handle(self, *args, **options):
+        baseline = load_results(options["compare"]) if options["compare"] else {}
+        commit, dirty = git_commit()
+
+        results = []
+        for name in options.get("entry") or ENTRY_POINTS.keys():
+            try:
+                result = profile_entry(
+                    name, options["repeat"], options["top"], options["command"]
+                )
+            except RuntimeError as e:
+                self.stdout.write(f"startup.{name:<16} ошибка: {e}")
+                continue
+            result.update(
+                {
+                    "scale": "startup",
+                    "commit": commit,
+                    "dirty": dirty,
+                    "created_at": datetime.now().isoformat(timespec="seconds"),
+                }
+            )
+            results.append(result)
+
+            line = (
+                f"{result['case']:<24} {result['median'] * 1000:>10.1f} ms"
+                f" (min {result['min'] * 1000:.1f}) импорты {result['imports_ms']} ms"
+                f", модулей {result['rows']}"
+            )
+            base = baseline.get(("startup", result["case"]))
+            if base and base.get("median"):
+                line += (
+                    f"  {result['median'] / base['median']:.2f}x к {base['commit'][:8]}"
+                )
+            self.stdout.write(line)
+            for package, ms in result["packages"].items():
+                self.stdout.write(f"    {package:<32} {ms:>8.1f} ms")
+
+        if not options["no_save"]:
+            save_results(results)
@@ -0,0 +1,36 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mp.helpers import read_selfbuy_orders, import_selfbuys, ErrorSelfbuyImport
+from mp.models import Shop
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Import selfbuy order numbers from CSV/XLSX"
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", type=str)
+        parser.add_argument("--shop_id", type=int, required=True)
+
+    def handle(self, *args, **options):
+        try:
+            shop = Shop.objects.get(pk=options["shop_id"])
+        except Shop.DoesNotExist:
+            raise CommandError(f"Магазин {options['shop_id']} не найден")
+
+        try:
+            with open(options["file"], "rb") as f:
+                orders = read_selfbuy_orders(f, options["file"])
+        except (OSError, ErrorSelfbuyImport) as ex:
+            raise CommandError(ex)
+
+        result = import_selfbuys(shop, orders)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{shop}: загружено {result['total']}, новых {result['created']}, "
+                f"найдено заказов {result['matched']}"
+            )
+        )
@@ -0,0 +1,82 @@
+import asyncio
+import statistics
+import time
+
+import httpx
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Concurrent load test of API reports, compares WSGI and ASGI servers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("servers", nargs="+", help="http://127.0.0.1:8001 ...")
+        parser.add_argument(
+            "--path",
+            action="append",
+            help="отчет с параметрами, можно несколько: /api/analytics/?days=180",
+        )
+        parser.add_argument("--token", default="", help="токен API пользователя")
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument("--requests", type=int, default=50)
+        parser.add_argument("--timeout", type=float, default=300)
+
+    def handle(self, *args, **options):
+        paths = options.get("path") or ["/api/transactions/?days=180"]
+        for server in options["servers"]:
+            result = asyncio.run(self.run(server.rstrip("/"), paths, options))
+            self.stdout.write(
+                f"{server}: {result['requests']} запросов за {result['total']:.2f}s, "
+                f"{result['rps']:.2f} req/s, p50 {result['p50']:.2f}s, "
+                f"p95 {result['p95']:.2f}s, max {result['max']:.2f}s, "
+                f"ошибок {result['errors']}"
+            )
+
+    async def run(self, server, paths, options):
+        """Запросы по кругу по отчетам, не больше concurrency одновременно
+
+        :param server:
+        :param paths:
+        :param options:
+        :return: пропускная способность и задержки
+        """
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        headers = {"Authorization": f"Token {options['token']}"}
+        timings = []
+        errors = 0
+
+        async def fetch(client, path):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    r = await client.get(server + path, headers=headers)
+                    if r.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                timings.append(time.perf_counter() - start)
+
+        async with httpx.AsyncClient(
+            timeout=options["timeout"],
+            limits=httpx.Limits(max_connections=options["concurrency"]),
+        ) as client:
+            start = time.perf_counter()
+            await asyncio.gather(
+                *[
+                    fetch(client, paths[num % len(paths)])
+                    for num in range(options["requests"])
+                ]
+            )
+            total = time.perf_counter() - start
+
+        timings.sort()
+        return {
+            "requests": len(timings),
+            "total": total,
+            "rps": len(timings) / total,
+            "p50": statistics.median(timings),
+            "p95": timings[int(len(timings) * 0.95) - 1],
+            "max": timings[-1],
+            "errors": errors,
+        }
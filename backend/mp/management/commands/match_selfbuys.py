@@ -0,0 +1,32 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from mp.helpers import match_selfbuys
+from mp.models import Shop
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Поиск отправлений FBO для уже созданных самовыкупов
+
+    Новые самовыкупы и загруженные заказы сопоставляются при записи, команда
+    нужна для самовыкупов, созданных до появления SelfbuyMatch.
+    """
+
+    help = "Match existing selfbuys with FBO postings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shop_id", type=int, default=0)
+
+    def handle(self, *args, **options):
+        shops = Shop.objects.all()
+        if options.get("shop_id"):
+            shops = shops.filter(pk=options["shop_id"])
+
+        for shop in shops:
+            match_selfbuys(shop)
+            self.stdout.write(f"Найдены заказы самовыкупов магазина {shop}")
+
+        self.stdout.write(self.style.SUCCESS("Самовыкупы сопоставлены."))
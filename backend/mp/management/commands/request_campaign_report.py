@@ -4,7 +4,6 @@ from django.core.management.base import BaseCommand
 
 from mp.helpers import get_keys, KEY_TYPE_OZON_PERFORMANCE, MP_KEYS
 from mp.tasks import create_campaign_report, check_campaign_report
-from mp_ozon.models import Report
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +32,8 @@ class Command(BaseCommand):
         parser.add_argument("--shop_id", type=int, default=0)
 
     def handle(self, *args, **options):
+        from mp_ozon.models import Report
+
         for mp in MP_KEYS:
             apikeys = get_keys(
                 mp,
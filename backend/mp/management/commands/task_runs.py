@@ -0,0 +1,98 @@
+import logging
+import statistics
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from mp.models import TaskRun
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Command(BaseCommand):
+    help = "Task run history: stage split, regressions and the slowest shops"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7)
+        parser.add_argument("--task", action="append", default=[])
+        parser.add_argument("--top", type=int, default=5)
+        parser.add_argument(
+            "--clean", type=int, default=0, help="Удалить записи старше N дней"
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        if options["clean"]:
+            deleted, _ = TaskRun.objects.filter(
+                started_at__lt=now - timedelta(days=options["clean"])
+            ).delete()
+            self.stdout.write(self.style.SUCCESS(f"Удалено записей: {deleted}"))
+            return
+
+        days = timedelta(days=options["days"])
+        runs = TaskRun.objects.filter(started_at__gte=now - days * 2)
+        if options["task"]:
+            runs = runs.filter(task__in=options["task"])
+
+        current, previous = {}, {}
+        for run in runs.select_related("shop").order_by("task", "started_at"):
+            period = current if run.started_at >= now - days else previous
+            period.setdefault(run.task, []).append(run)
+
+        for task, task_runs in sorted(current.items()):
+            durations = [run.duration for run in task_runs]
+            median = statistics.median(durations)
+            before = [run.duration for run in previous.get(task, [])]
+            change = (
+                f"{median / statistics.median(before):.2f}x к прошлому периоду"
+                if before and statistics.median(before)
+                else "нет прошлого периода"
+            )
+            errors = sum(run.status != "success" for run in task_runs)
+            self.stdout.write(
+                self.style.MIGRATE_HEADING(
+                    f"{task}: {len(task_runs)} запусков, ошибок {errors}, "
+                    f"медиана {median:.1f}s, p95 {percentile(durations, 0.95):.1f}s, "
+                    f"{change}"
+                )
+            )
+
+            # доля этапов во времени задачи
+            stages = {}
+            for run in task_runs:
+                for stage, data in run.spans.items():
+                    stages[stage] = stages.get(stage, 0) + data["seconds"]
+            total = sum(stages.values()) or 1
+            self.stdout.write(
+                "  этапы: "
+                + ", ".join(
+                    f"{stage} {seconds / total:.0%}"
+                    for stage, seconds in sorted(stages.items(), key=lambda i: -i[1])
+                )
+            )
+
+            shops = {}
+            for run in task_runs:
+                shops.setdefault(run.shop, []).append(run)
+            slowest = sorted(
+                shops.items(),
+                key=lambda item: -statistics.median(run.duration for run in item[1]),
+            )[: options["top"]]
+            for shop, shop_runs in slowest:
+                rows = sum(run.rows for run in shop_runs)
+                duration = sum(run.duration for run in shop_runs)
+                self.stdout.write(
+                    f"  {shop}: медиана "
+                    f"{statistics.median(run.duration for run in shop_runs):.1f}s, "
+                    f"API {sum(run.api_time for run in shop_runs) / duration:.0%}, "
+                    f"БД {sum(run.db_time for run in shop_runs) / duration:.0%}, "
+                    f"{rows / duration:.0f} строк/с"
+                )
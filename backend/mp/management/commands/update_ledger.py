@@ -0,0 +1,32 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from api.helpers import Update_Ledger
+from mp.models import Shop
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Полный пересчет api_ledger по загруженным транзакциям и отправлениям
+
+    Строки собираются из разобранных JSON-полей, поэтому для загруженной ранее
+    истории сначала выполняется manage.py update_parsed.
+    """
+
+    help = "Recalculate transaction report rows from loaded transactions and postings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shop_id", type=int, default=0)
+
+    def handle(self, *args, **options):
+        shops = Shop.objects.all()
+        if options.get("shop_id"):
+            shops = shops.filter(pk=options["shop_id"])
+
+        for shop in shops:
+            Update_Ledger.postings(params={"shop_id": shop.pk})
+            self.stdout.write(f"Обновлены строки отчета магазина {shop}")
+
+        self.stdout.write(self.style.SUCCESS("Отчет по транзакциям пересчитан."))
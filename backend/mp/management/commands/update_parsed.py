@@ -0,0 +1,35 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from api.helpers import Update_Parsed
+from mp.models import Shop
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Разбор JSON-полей уже загруженных данных mp_ozon
+
+    Задачи синхронизации разбирают только записанные строки, команда заполняет
+    таблицы api_parsed* для загруженной ранее истории.
+    """
+
+    help = "Parse JSON fields of loaded orders, transactions and products"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shop_id", type=int, default=0)
+
+    def handle(self, *args, **options):
+        shops = Shop.objects.all()
+        if options.get("shop_id"):
+            shops = shops.filter(pk=options["shop_id"])
+
+        for shop in shops:
+            params = {"shop_id": shop.pk}
+            Update_Parsed.orders(params=params)
+            Update_Parsed.transactions(params=params)
+            Update_Parsed.products(params=params)
+            self.stdout.write(f"Разобраны данные магазина {shop}")
+
+        self.stdout.write(self.style.SUCCESS("JSON-поля разобраны."))
@@ -0,0 +1,43 @@
+import logging
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+
+from api.helpers import Update_Rollup
+from api.helpers.cache import bump_shop_version
+from mp.models import Shop
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Recalculate weekly and monthly rollups of analytics, daily and advertizing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shop_id", type=int, default=0)
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=0,
+            help="Пересчитать периоды за последние N дней (по умолчанию вся история)",
+        )
+
+    def handle(self, *args, **options):
+        shops = Shop.objects.all()
+        if options.get("shop_id"):
+            shops = shops.filter(pk=options["shop_id"])
+
+        params = {}
+        if options["days"]:
+            params["date_from"] = date.today() - timedelta(days=options["days"])
+            params["date_to"] = date.today()
+
+        for shop in shops:
+            params["shop_id"] = shop.pk
+            Update_Rollup.analytics(params=params)
+            Update_Rollup.daily(params=params)
+            Update_Rollup.advertizing(params=params)
+            bump_shop_version(shop.pk)
+            self.stdout.write(f"Обновлены итоги магазина {shop}")
+
+        self.stdout.write(self.style.SUCCESS("Недельные и месячные итоги пересчитаны."))
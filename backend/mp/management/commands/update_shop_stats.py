@@ -0,0 +1,52 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from mp.helpers import update_shop_stats
+from mp.helpers.shop_stats import (
+    install_shop_stats_triggers,
+    check_shop_stats_triggers,
+)
+from mp.models import Shop
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Триггеры счетчиков и полный пересчет ShopStats
+
+    Нужен после создания таблиц mp_ozon_* и для проверки расхождений.
+    С --check только ставит триггеры на таблицы, где их нет, и сбрасывает
+    их счетчики - запускается периодически.
+    """
+
+    help = "Recalculate shop row counters for dashboards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shop_id", type=int, default=0)
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Установить недостающие триггеры без полного пересчета",
+        )
+
+    def handle(self, *args, **options):
+        if options["check"]:
+            fields = check_shop_stats_triggers()
+            self.stdout.write(
+                f"Установлены триггеры счетчиков: {', '.join(fields) or 'нет'}"
+            )
+            return
+
+        tables = install_shop_stats_triggers()
+        self.stdout.write(f"Триггеры счетчиков: {', '.join(tables) or 'нет таблиц'}")
+
+        shops = Shop.objects.all()
+        if options.get("shop_id"):
+            shops = shops.filter(pk=options["shop_id"])
+
+        for shop in shops:
+            update_shop_stats(shop, force=True)
+            self.stdout.write(f"Обновлена статистика магазина {shop}")
+
+        self.stdout.write(self.style.SUCCESS("Статистика магазинов пересчитана."))
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.2 on 2026-10-19 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mp", "0011_selfbuy_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ShopStats",
+            fields=[
+                (
+                    "shop",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="mp.shop",
+                    ),
+                ),
+                ("products", models.IntegerField(null=True)),
+                ("analytics", models.IntegerField(null=True)),
+                ("campaigns", models.IntegerField(null=True)),
+                ("advert", models.IntegerField(null=True)),
+                ("reports", models.JSONField(null=True)),
+                ("transactions", models.IntegerField(null=True)),
+                ("fbo", models.IntegerField(null=True)),
+                ("fbs", models.IntegerField(null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
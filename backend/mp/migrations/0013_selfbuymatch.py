@@ -0,0 +1,80 @@
+# Generated by Django 4.1.2 on 2026-10-19 13:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_fbo_indexes(apps, schema_editor):
+    """Индексы номеров заказов FBO для поиска самовыкупов
+
+    Индексы строятся CONCURRENTLY, без блокировки записи в mp_ozon_fbo, поэтому
+    миграция выполняется вне транзакции. Совпадения для уже созданных
+    самовыкупов находит manage.py match_selfbuys.
+    """
+    if "mp_ozon_fbo" not in schema_editor.connection.introspection.table_names():
+        return
+
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS mp_ozon_fbo_shop_order_number "
+        "ON mp_ozon_fbo (shop_id, order_number)"
+    )
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS mp_ozon_fbo_shop_posting_number "
+        "ON mp_ozon_fbo (shop_id, posting_number)"
+    )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("mp", "0012_shopstats"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SelfbuyMatch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("fbo_id", models.BigIntegerField()),
+                ("order_date", models.DateField(null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "selfbuy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="matches",
+                        to="mp.selfbuy",
+                    ),
+                ),
+                (
+                    "shop",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="mp.shop",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="selfbuymatch",
+            index=models.Index(
+                fields=["shop", "order_date"], name="mp_selfbuym_shop_id_89f75e_idx"
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="selfbuymatch",
+            unique_together={("selfbuy", "fbo_id")},
+        ),
+        migrations.RunPython(create_fbo_indexes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.1.2 on 2026-10-19 13:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mp", "0013_selfbuymatch"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TaskRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("task", models.CharField(max_length=64)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("success", "Success"),
+                            ("failed", "Failed"),
+                            ("error", "Error"),
+                        ],
+                        max_length=16,
+                    ),
+                ),
+                ("started_at", models.DateTimeField()),
+                ("duration", models.FloatField()),
+                ("api_time", models.FloatField(default=0)),
+                ("db_time", models.FloatField(default=0)),
+                ("db_queries", models.IntegerField(default=0)),
+                ("rows", models.IntegerField(default=0)),
+                ("spans", models.JSONField(default=dict)),
+                ("result", models.TextField(blank=True)),
+                (
+                    "shop",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="mp.shop",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-started_at"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="taskrun",
+            index=models.Index(
+                fields=["task", "started_at"], name="mp_taskrun_task_49a796_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="taskrun",
+            index=models.Index(
+                fields=["shop", "task", "started_at"],
+                name="mp_taskrun_shop_id_6589c2_idx",
+            ),
+        ),
+    ]
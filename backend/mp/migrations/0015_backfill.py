@@ -0,0 +1,74 @@
+# Generated by Django 4.1.2 on 2026-10-19 13:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mp", "0014_taskrun"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Backfill",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("task", models.CharField(max_length=64)),
+                ("date_from", models.DateField()),
+                ("date_to", models.DateField()),
+                ("period_days", models.IntegerField(default=30)),
+                ("done_till", models.DateField(blank=True, null=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=16,
+                    ),
+                ),
+                ("attempts", models.IntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "apikey",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="mp.apikey"
+                    ),
+                ),
+                (
+                    "shop",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="mp.shop",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="backfill",
+            index=models.Index(
+                fields=["apikey", "task", "status"],
+                name="mp_backfill_apikey__16f790_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.1.2 on 2026-10-19 14:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mp", "0015_backfill"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CampaignReportDay",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("campaign_id", models.BigIntegerField()),
+                ("date", models.DateField()),
+                ("loaded_at", models.DateTimeField()),
+                (
+                    "shop",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="mp.shop"
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="campaignreportday",
+            index=models.Index(
+                fields=["shop", "date"], name="mp_campaign_shop_id_5d9ab4_idx"
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="campaignreportday",
+            unique_together={("campaign_id", "date")},
+        ),
+    ]
@@ -96,4 +96,173 @@ class Selfbuy(models.Model):
         if self.pk is not None:
             self.updated_at = timezone.now()
 
+        # отложенный импорт: mp.helpers импортирует модели
+        from mp.helpers import (
+            match_selfbuys,
+            update_selfbuys,
+            selfbuy_dates,
+            refresh_selfbuy_days,
+        )
+
+        # дни прежних совпадений тоже пересчитываются: номер мог измениться
+        dates = selfbuy_dates([self.pk]) if self.pk is not None else []
         super().save(*args, **kwargs)
+
+        match_selfbuys(self.shop, selfbuy_ids=[self.pk], rematch=True)
+        if self.shop is not None:
+            update_selfbuys(self.shop, selfbuy_ids=[self.pk])
+            refresh_selfbuy_days(self.shop, dates + selfbuy_dates([self.pk]))
+
+    def delete(self, *args, **kwargs):
+        from mp.helpers import selfbuy_dates, refresh_selfbuy_days
+
+        # совпадения удаляются каскадом вместе с самовыкупом
+        dates = selfbuy_dates([self.pk])
+        result = super().delete(*args, **kwargs)
+        if self.shop is not None:
+            refresh_selfbuy_days(self.shop, dates)
+        return result
+
+
+class SelfbuyMatch(models.Model):
+    """
+    Отправление FBO, найденное для самовыкупа по номеру заказа или отправления.
+    Заполняется при сохранении самовыкупа и при загрузке заказов.
+    """
+
+    selfbuy = models.ForeignKey(
+        Selfbuy, on_delete=models.CASCADE, related_name="matches"
+    )
+    fbo_id = models.BigIntegerField()
+    order_date = models.DateField(null=True)
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = (("selfbuy", "fbo_id"),)
+        indexes = [models.Index(fields=["shop", "order_date"])]
+
+    def __str__(self):
+        return f"{self.selfbuy} / {self.fbo_id}"
+
+
+class ShopStats(models.Model):
+    """
+    Количество строк данных магазина, обновляется задачами синхронизации.
+    Пустое значение - данные еще не посчитаны.
+    """
+
+    shop = models.OneToOneField(
+        Shop, on_delete=models.CASCADE, primary_key=True, related_name="stats"
+    )
+    products = models.IntegerField(null=True)
+    analytics = models.IntegerField(null=True)
+    campaigns = models.IntegerField(null=True)
+    advert = models.IntegerField(null=True)
+    reports = models.JSONField(null=True)
+    transactions = models.IntegerField(null=True)
+    fbo = models.IntegerField(null=True)
+    fbs = models.IntegerField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.shop} / {self.updated_at}"
+
+
+class TaskRun(models.Model):
+    """
+    История выполнения задач загрузки: время этапов (spans) и строк на этапе,
+    время API и БД. Пишется декоратором trace_task.
+    """
+
+    STATUSES = (
+        ("success", "Success"),
+        ("failed", "Failed"),
+        ("error", "Error"),
+    )
+
+    task = models.CharField(max_length=64)
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, null=True)
+    status = models.CharField(max_length=16, choices=STATUSES)
+    started_at = models.DateTimeField()
+    duration = models.FloatField()
+    api_time = models.FloatField(default=0)
+    db_time = models.FloatField(default=0)
+    db_queries = models.IntegerField(default=0)
+    rows = models.IntegerField(default=0)
+    spans = models.JSONField(default=dict)
+    result = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ["-started_at"]
+        indexes = [
+            models.Index(fields=["task", "started_at"]),
+            models.Index(fields=["shop", "task", "started_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.task} / {self.shop_id} / {self.started_at:%Y-%m-%d %H:%M} / {self.duration:.1f}s"
+
+
+class Backfill(models.Model):
+    """
+    Загрузка истории магазина по периодам, от новых к старым. Каждый период -
+    отдельная задача в очереди backfill, после периода сохраняется done_till,
+    поэтому после сбоя загрузка продолжается со следующего периода.
+    """
+
+    STATUSES = (
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+
+    task = models.CharField(max_length=64)
+    apikey = models.ForeignKey(APIKey, on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, null=True)
+    date_from = models.DateField()
+    date_to = models.DateField()
+    period_days = models.IntegerField(default=30)
+    done_till = models.DateField(null=True, blank=True)  # загружено с done_till
+    status = models.CharField(max_length=16, choices=STATUSES, default="pending")
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [models.Index(fields=["apikey", "task", "status"])]
+
+    def __str__(self):
+        return f"{self.task} / {self.shop_id} / {self.date_from}..{self.date_to} / {self.status}"
+
+    @property
+    def progress(self):
+        """Доля загруженных дней"""
+        total = (self.date_to - self.date_from).days + 1
+        if self.done_till is None:
+            return 0
+        return ((self.date_to - self.done_till).days + 1) / total
+
+
+class CampaignReportDay(models.Model):
+    """
+    День рекламной кампании, загруженный из отчета. loaded_at - время создания
+    запроса отчета: день, загруженный через REPORT_FINAL_DAYS и позже, больше
+    не запрашивается (см. mp.helpers.report_planner).
+    """
+
+    campaign_id = models.BigIntegerField()
+    date = models.DateField()
+    loaded_at = models.DateTimeField()
+
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ["campaign_id", "date"]
+        indexes = [models.Index(fields=["shop", "date"])]
+
+    def __str__(self):
+        return f"{self.campaign_id} / {self.date} / {self.loaded_at:%Y-%m-%d %H:%M}"
@@ -1,9 +1,46 @@
-from .update_products import update_products
-from .update_stocks import update_stocks
-from .update_analytics import update_analytics
-from .update_transactions import update_transactions
-from .update_orders import update_orders
-from .update_campaigns import update_campaigns
-from .update_campaign_statistics import update_campaign_statistics
-from .create_campaign_report import create_campaign_report
-from .check_campaign_report import check_campaign_report
+import importlib
+import sys
+import types
+
+# задача: модуль пакета. Модуль импортируется при первом обращении к задаче,
+# команде manage.py или view не нужны модули и клиенты API остальных задач
+TASKS = {
+    "update_products": "update_products",
+    "update_stocks": "update_stocks",
+    "update_analytics": "update_analytics",
+    "update_transactions": "update_transactions",
+    "update_orders": "update_orders",
+    "update_campaigns": "update_campaigns",
+    "update_campaign_statistics": "update_campaign_statistics",
+    "create_campaign_report": "create_campaign_report",
+    "check_campaign_report": "check_campaign_report",
+    "run_backfill": "backfill",
+    "start_backfill": "backfill",
+}
+# модули задач для регистрации в worker (ka_space.celery)
+TASK_MODULES = sorted({f"{__name__}.{module}" for module in TASKS.values()})
+
+__all__ = list(TASKS)
+
+
+class LazyTasks(types.ModuleType):
+    """Пакет задач с импортом модулей по первому обращению
+
+    Модуль, импортированный напрямую (worker по TASK_MODULES), остается
+    атрибутом пакета, поэтому модули задач импортируют друг друга явно:
+    from .update_products import update_products.
+    """
+
+    def __getattr__(self, name):
+        if name not in TASKS:
+            raise AttributeError(f"module {self.__name__!r} has no attribute {name!r}")
+        module = importlib.import_module(f"{self.__name__}.{TASKS[name]}")
+        value = getattr(module, name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(TASKS))
+
+
+sys.modules[__name__].__class__ = LazyTasks
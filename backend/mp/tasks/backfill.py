@@ -0,0 +1,171 @@
+from datetime import date, timedelta
+import logging
+
+from ka_space.celery import app
+from ka_space.helpers import Locking, ErrorIsLocked
+from mp.models import Backfill
+from .update_analytics import update_analytics
+from .update_orders import update_orders
+from .update_transactions import update_transactions
+
+logger = logging.getLogger(__name__)
+
+# задачи загрузки истории: дней в периоде, транзакции загружаются по месяцам
+BACKFILL_TASKS = {
+    "update_analytics": {"task": update_analytics, "period_days": 30},
+    "update_transactions": {"task": update_transactions, "period_days": 31},
+    "update_orders": {"task": update_orders, "period_days": 30},
+}
+BACKFILL_MONTHLY = {"update_transactions"}
+BACKFILL_MAX_ATTEMPTS = 5
+BACKFILL_RETRY_DELAY = 60 * 5  # умножается на номер попытки
+BACKFILL_LOCK_EXPIRE = 60 * 60 * 2
+# ожидание задачи обновления того же этапа магазина
+BACKFILL_LEASE_TIMEOUT = 60 * 30
+
+
+def start_backfill(apikey, task, days=180, period_days=None, countdown=0):
+    """Загрузка истории магазина по периодам в очереди backfill
+
+    Незавершенная загрузка той же задачи по ключу продолжается, а не создается заново.
+
+    :param apikey:
+    :param task: название задачи из BACKFILL_TASKS
+    :param days: дней истории
+    :param period_days: дней в одной задаче
+    :param countdown: задержка первого периода, сек
+    :return: Backfill
+    """
+    if task not in BACKFILL_TASKS:
+        raise ValueError(f"Загрузка истории для {task} не поддерживается")
+
+    backfill = (
+        Backfill.objects.filter(apikey=apikey, task=task).exclude(status="done").first()
+    )
+    if backfill is None:
+        date_to = date.today()
+        backfill = Backfill.objects.create(
+            task=task,
+            apikey=apikey,
+            shop_id=apikey.shop_id,
+            date_from=date_to - timedelta(days=days - 1),
+            date_to=date_to,
+            period_days=period_days or BACKFILL_TASKS[task]["period_days"],
+        )
+    else:
+        backfill.status = "pending"
+        backfill.attempts = 0
+        backfill.save(update_fields=["status", "attempts", "updated_at"])
+
+    run_backfill.apply_async(kwargs={"backfill_id": backfill.pk}, countdown=countdown)
+    return backfill
+
+
+def next_period(backfill):
+    """Следующий период после done_till, от новых дат к старым
+
+    :param backfill:
+    :return: (date_from, date_to) или None, если история загружена
+    """
+    date_to = (
+        backfill.date_to
+        if backfill.done_till is None
+        else backfill.done_till - timedelta(days=1)
+    )
+    if date_to < backfill.date_from:
+        return None
+
+    if backfill.task in BACKFILL_MONTHLY:
+        date_from = date_to.replace(day=1)
+    else:
+        date_from = date_to - timedelta(days=backfill.period_days - 1)
+    return max(date_from, backfill.date_from), date_to
+
+
+@app.task(acks_late=True)
+def run_backfill(backfill_id=None):
+    """Один период загрузки истории, затем ставится следующий
+
+    Задача загрузки выполняется синхронно в worker'е очереди backfill, периоды
+    одной загрузки идут последовательно: повторная постановка той же загрузки
+    пропускается, пока период выполняется. Пересчет daily-статистики - только
+    после последнего периода.
+
+    :param backfill_id:
+    :return:
+    """
+    try:
+        backfill = Backfill.objects.get(pk=backfill_id)
+    except Backfill.DoesNotExist:
+        return {"❌FAILED": f"Загрузка истории {backfill_id} не найдена"}
+
+    if backfill.status == "done":
+        return {"SUCCESS": f"{backfill}"}
+
+    lock = Locking(f"backfill_{backfill.pk}", timeout=0, expire=BACKFILL_LOCK_EXPIRE)
+    try:
+        lock.acquire()
+    except ErrorIsLocked:
+        return {"❌FAILED": f"{backfill} Locked. Skip."}
+    try:
+        return backfill_period(backfill)
+    finally:
+        lock.release()
+
+
+def backfill_period(backfill):
+    """Загрузка следующего периода и постановка задачи на следующий
+
+    :param backfill:
+    :return: результат задачи
+    """
+    backfill.refresh_from_db()
+    period = next_period(backfill)
+    if period is None:
+        backfill.status = "done"
+        backfill.save(update_fields=["status", "updated_at"])
+        return {"SUCCESS": f"{backfill}"}
+
+    date_from, date_to = period
+    is_last = date_from <= backfill.date_from
+    backfill.status = "running"
+    backfill.save(update_fields=["status", "updated_at"])
+
+    task = BACKFILL_TASKS[backfill.task]["task"]
+    try:
+        result = task(
+            apikey_id=backfill.apikey_id,
+            shop_id=backfill.shop_id,
+            days=(date_to - date_from).days + 1,
+            date_to=date_to,
+            refresh=is_last,
+            lock_timeout=BACKFILL_LEASE_TIMEOUT,
+        )
+        error = result.get("❌FAILED") if isinstance(result, dict) else None
+    except Exception as ex:
+        logger.exception(f"{backfill}: {ex}")
+        error = f"{type(ex).__name__}: {ex}"
+
+    if error:
+        backfill.attempts += 1
+        backfill.error = str(error)[:1000]
+        backfill.status = "failed"
+        backfill.save(update_fields=["attempts", "error", "status", "updated_at"])
+        if backfill.attempts < BACKFILL_MAX_ATTEMPTS:
+            # повтор того же периода, загруженные периоды не повторяются
+            run_backfill.apply_async(
+                kwargs={"backfill_id": backfill.pk},
+                countdown=BACKFILL_RETRY_DELAY * backfill.attempts,
+            )
+        logger.warning(f"{backfill} {date_from}..{date_to}: {error}")
+        return {"❌FAILED": f"{backfill} {date_from}..{date_to}: {error}"}
+
+    backfill.done_till = date_from
+    backfill.attempts = 0
+    backfill.error = ""
+    backfill.status = "done" if is_last else "pending"
+    backfill.save()
+    if not is_last:
+        run_backfill.apply_async(kwargs={"backfill_id": backfill.pk})
+
+    return {"SUCCESS": f"{backfill} {date_from}..{date_to}"}
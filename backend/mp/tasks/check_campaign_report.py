@@ -2,10 +2,27 @@ from datetime import datetime, timedelta
 import json
 import logging
 
-from django.db import connection
+from django.utils import timezone
 
 from ka_space.celery import app
-from mp.helpers import get_key
+from api.helpers import execute_sql, Update_Rollup
+from mp.helpers import get_key, update_shop_stats, bulk_insert_update
+from mp.helpers.report_stream import (
+    report_download,
+    iter_report_batches,
+    ErrorReportNotFound,
+    REPORT_TYPE_SKU,
+    REPORT_TYPE_SEARCH_PROMO,
+)
+from mp.helpers.report_planner import save_loaded_cells
+from mp.helpers.single_flight import single_flight
+from mp.helpers.tracing import (
+    trace_task,
+    TracedApi,
+    span,
+    STAGE_DERIVED,
+    STAGE_DB_WRITE,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -13,11 +30,9 @@ try:
     from mp_ozon.models import (
         Report,
         StatisticsCampaignOrder,
-        StatisticsCampaignProduct,
     )
     from mp_ozon.api import ApiPerformance, LIMIT_DAYS, LIMIT_CAMPAIGNS
     from mp_ozon.errors import (
-        ErrorRequest404,
         ErrorLocked,
         ErrorRequest,
         ErrorRateLimit,
@@ -27,8 +42,24 @@ except:
 
 DISABLE_APIKEY_MINUTES = 15
 
+STATISTICS_PRODUCT_FIELDS = [
+    "campaign_id",
+    "dt",
+    "sku",
+    "page",
+    "condition",
+    "price",
+    "views",
+    "clicks",
+    "expense",
+    "orders",
+    "revenue",
+]
+
 
 @app.task
+@single_flight("campaign_reports")
+@trace_task
 def check_campaign_report(*args, apikey_id=None, **kwargs):
     """Проверка отчетов статистики рекламных кампаний
 
@@ -45,68 +76,90 @@ def check_campaign_report(*args, apikey_id=None, **kwargs):
     apikey = get_key(apikey_id)
 
     try:
-        api = ApiPerformance(apikey.client_id, apikey.client_secret, shop=apikey.shop)
-        check_queue(api, apikey.shop)
+        api = TracedApi(
+            ApiPerformance(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        )
+        dates = check_queue(api, apikey.shop, apikey)
     except ErrorLocked:
         # отключаем ключ на несколько минут
-        apikey.disabled_till = datetime.now() + timedelta(
+        apikey.disabled_till = timezone.now() + timedelta(
             minutes=DISABLE_APIKEY_MINUTES
         )
+        apikey.save(update_fields=["disabled_till"])
         return {"❌FAILED": f"{apikey.shop} Locked. Skip."}
     except ErrorRateLimit as ex:
         # отключаем ключ на несколько минут
-        apikey.disabled_till = datetime.now() + timedelta(
+        apikey.disabled_till = timezone.now() + timedelta(
             minutes=DISABLE_APIKEY_MINUTES
         )
+        apikey.save(update_fields=["disabled_till"])
         return {"❌FAILED": f"Error: {ex}"}
     except Exception as ex:
         msg = f"Shop: {apikey.shop} Error: {ex}"
         logger.exception(msg)
         return {"❌FAILED": msg}
 
+    with span(STAGE_DERIVED):
+        if dates:
+            # недельные и месячные итоги за дни загруженных отчетов
+            Update_Rollup.advertizing(
+                params={
+                    "shop_id": apikey.shop.pk,
+                    "date_from": min(dates),
+                    "date_to": max(dates),
+                }
+            )
+        update_shop_stats(apikey.shop, "advert", "reports")
+
     return {"SUCCESS": f"{apikey.shop}"}
 
 
-def check_queue(api, shop):
+def check_queue(api, shop, apikey):
+    """Отправка, проверка и загрузка отчетов магазина
+
+    :param api:
+    :param shop:
+    :param apikey: ключ для скачивания отчетов
+    :return: первый и последний день загруженных отчетов
+    """
     report_sent = False
+    dates = []
     reports = Report.objects.filter(shop=shop, is_parsed=False).order_by(
         "uuid", "-updated_at"
     )[:5]
     for r in reports:
-        logger.debug(f"Report: {r} ReportSent: {report_sent}")
+        logger.debug("Report: %s ReportSent: %s", r, report_sent)
         if r.uuid is not None and r.state == "OK":
             # Отчет готов, скачиваем
-            logger.debug(f"Download Report: {r}")
+            logger.debug("Download Report: %s", r)
+            loaded = True
             try:
-                result = api.report_campaigns_download(uuid=str(r.uuid))
-            except ErrorRequest404:
+                rows = load_report(apikey, r.uuid)
+                logger.debug("Report %s: %s rows", r.uuid, rows)
+            except ErrorReportNotFound:
                 # Отчет не найден
-                result = {}
+                loaded = False
                 r.state = "FAIL"
 
-            for type_, lines in result.items():
-                if type_ == "SKU":
-                    statistics_product(lines)
-                elif type_ == "SEARCH_PROMO":
-                    statistics_order(lines)
-                elif len(lines):
-                    # показываем структуру первого элемента
-                    logger.info(
-                        f"Отчет: {r.uuid} от {r.created_at}\n "
-                        f"Conditions: {r.conditions} Response: {r.response}"
-                    )
-                    logger.error(f"{shop} Неизвестный тип рекламной кампании: {type_}")
+            params = json.loads(r.conditions or "{}").get("params", {})
+            if loaded:
+                save_loaded_cells(shop, r)
+            if loaded and params.get("dateFrom") and params.get("dateTo"):
+                dates += [
+                    datetime.strptime(params["dateFrom"], "%Y-%m-%d").date(),
+                    datetime.strptime(params["dateTo"], "%Y-%m-%d").date(),
+                ]
 
             r.is_parsed = True
             r.save()
         elif r.state == "ERROR":
             # Отчет закончен с ошибкой
-            logger.debug(f"Close Report with Error")
+            logger.debug("Close Report with Error")
             r.is_parsed = True
             r.save()
         elif r.uuid is not None:
             # Отчет отправлен, проверяем состояние
-            logger.debug(f"Check Report: {r}")
+            logger.debug("Check Report: %s", r)
             result = api.report_campaigns_check(uuid=str(r.uuid))
 
             r.response = json.dumps(result)
@@ -123,7 +176,7 @@ def check_queue(api, shop):
                 r.delete()
                 continue
 
-            logger.debug(f"Try to send report: {r}")
+            logger.debug("Try to send report: %s", r)
             result = api.report_campaigns_request(**cond)
 
             if "error" in result:
@@ -133,68 +186,113 @@ def check_queue(api, shop):
                 r.uuid = result["UUID"]
                 r.save()
 
+    return dates
+
+
+def load_report(apikey, report_uuid):
+    """Скачиваем отчет по частям и записываем строки пачками
+
+    В памяти только текущая пачка строк и часть ответа, независимо от
+    размера отчета. Строки кампаний неизвестного типа не записываются.
+
+    :param apikey:
+    :param report_uuid:
+    :return: число записанных строк отчета
+    """
+    total = 0
+    unknown = False
+    with report_download(apikey, report_uuid) as (content_type, chunks):
+        for type_, lines in iter_report_batches(chunks, content_type):
+            if type_ not in (REPORT_TYPE_SKU, REPORT_TYPE_SEARCH_PROMO):
+                if not unknown:
+                    # показываем структуру первого элемента
+                    logger.error(
+                        "%s Неизвестный тип рекламной кампании %s, отчет %s: %s",
+                        apikey.shop,
+                        lines[0]["campaign_id"],
+                        report_uuid,
+                        sorted(lines[0]),
+                    )
+                unknown = True
+                continue
+            with span(STAGE_DB_WRITE) as s:
+                if type_ == REPORT_TYPE_SKU:
+                    statistics_product(lines)
+                else:
+                    # итоги заказов только за дни кампаний из пачки
+                    update_product_statistics(statistics_order(lines))
+                s.rows = len(lines)
+            total += len(lines)
+
+    return total
+
 
 def statistics_product(lines):
-    """Разбираем историю открутки товаров в рекламных кампаниях и сохраняем
+    """Сохраняем пачку истории открутки товаров в рекламных кампаниях
 
-    :param lines:
+    :param lines: строки отчета (см. mp.helpers.report_stream.report_line)
     :return:
     """
-    model_fields = [
-        str(f).split(".")[-1] for f in StatisticsCampaignProduct._meta.get_fields()
-    ]
-    for l in lines:
-        obj, created = StatisticsCampaignProduct.objects.get_or_create(
-            **{
-                "campaign_id": l["campaign_id"],
-                "dt": l["dt"],
-                "sku": l["sku"],
-                "page": l.get("page", "Трафареты"),
-                "condition": l.get("condition", "Трафареты"),
-            }
-        )
-        for attr, value in {k: v for k, v in l.items() if k in model_fields}.items():
-            if str(getattr(obj, attr)) != str(value):
-                setattr(obj, attr, value)
-        obj.save()
+    # в одном INSERT ... ON CONFLICT ключ не должен повторяться
+    rows = {
+        (l["campaign_id"], l["dt"], l["sku"], l["page"], l["condition"]): l
+        for l in lines
+    }
+    params = {f: [r[f] for r in rows.values()] for f in STATISTICS_PRODUCT_FIELDS}
+    sql = f"""
+    INSERT INTO mp_ozon_statisticscampaignproduct AS mos
+    ({', '.join(STATISTICS_PRODUCT_FIELDS)}, created_at, updated_at)
+    (
+        SELECT {', '.join(f'r.{f}' for f in STATISTICS_PRODUCT_FIELDS)}, NOW(), NOW()
+        FROM unnest(
+            %(campaign_id)s::bigint[], %(dt)s::date[], %(sku)s::bigint[],
+            %(page)s::text[], %(condition)s::text[], %(price)s::numeric[],
+            %(views)s::int[], %(clicks)s::int[], %(expense)s::numeric[],
+            %(orders)s::int[], %(revenue)s::numeric[]
+        ) r({', '.join(STATISTICS_PRODUCT_FIELDS)})
+        ORDER BY r.campaign_id, r.dt, r.sku
+    ) ON CONFLICT (campaign_id, dt, sku, page, condition) DO UPDATE SET
+        price = excluded.price,
+        views = excluded.views,
+        clicks = excluded.clicks,
+        expense = excluded.expense,
+        orders = excluded.orders,
+        revenue = excluded.revenue,
+        updated_at = NOW()
+    WHERE (mos.price, mos.views, mos.clicks, mos.expense, mos.orders, mos.revenue)
+        IS DISTINCT FROM (excluded.price, excluded.views, excluded.clicks,
+                          excluded.expense, excluded.orders, excluded.revenue);
+    """
+    execute_sql(sql, params)
 
 
 def statistics_order(lines):
-    """Разбираем историю заказов из рекламных кампаний и сохраняем
+    """Сохраняем пачку истории заказов из рекламных кампаний
 
-    :param lines:
-    :return:
+    :param lines: строки отчета (см. mp.helpers.report_stream.report_line)
+    :return: пары (кампания, день) заказов пачки
     """
-    model_fields = [
-        str(f).split(".")[-1] for f in StatisticsCampaignOrder._meta.get_fields()
-    ]
-
-    campaign_ids = set()
-    for l in lines:
-        campaign_ids.add(l["campaign_id"])
-        try:
-            obj, created = StatisticsCampaignOrder.objects.get_or_create(
-                **{
-                    "order_id": l["order_id"],
-                    "sale_product_sku": l["sale_product_sku"],
-                    "campaign_id": l["campaign_id"],
-                }
-            )
-        except StatisticsCampaignOrder.MultipleObjectsReturned as ex:
-            logger.exception(
-                f"Error: {ex} Remove orders of campaign {l['campaign_id']}."
-            )
-            continue
-        for attr, value in {k: v for k, v in l.items() if k in model_fields}.items():
-            if str(getattr(obj, attr)) != str(value):
-                setattr(obj, attr, value)
-        obj.save()
+    msg = bulk_insert_update(
+        data=lines,
+        key_fields=["order_id", "sale_product_sku", "campaign_id"],
+        cls=StatisticsCampaignOrder,
+    )
+    logger.debug("Заказы продвижения в поиске: %s", msg)
+    return {(l["campaign_id"], l["dt"]) for l in lines}
+
 
-    if campaign_ids:
-        update_product_statistics(campaign_ids)
+def update_product_statistics(campaign_days):
+    """Итоги заказов продвижения в поиске в статистике товаров
 
+    Пересчитываются только переданные дни кампаний, поэтому время не растет
+    с длительностью кампании.
 
-def update_product_statistics(campaign_ids):
+    :param campaign_days: пары (campaign_id, dt)
+    :return:
+    """
+    if not campaign_days:
+        return
+    campaign_days = sorted(campaign_days)
     sql = """
     -- добавляем статистику по заказам артикула из статистики заказов 
     INSERT INTO mp_ozon_statisticscampaignproduct 
@@ -208,19 +306,32 @@ def update_product_statistics(campaign_ids):
             SUM(moo.count * moo.price) as revenue, moo.campaign_id,
             'Продвижение', 'SEARCH_PROMO', NOW(), NOW()
         FROM mp_ozon_statisticscampaignorder moo
-        WHERE moo.campaign_id in %(campaign_ids)s
+        INNER JOIN unnest(%(campaign_ids)s::bigint[], %(dts)s::date[]) cd(campaign_id, dt)
+            ON cd.campaign_id = moo.campaign_id AND cd.dt = moo.dt
         GROUP BY moo.dt, moo.sale_product_sku, moo.campaign_id
     ) ON CONFLICT (campaign_id, dt, sku, page, condition) DO UPDATE SET 
         price = excluded.price, 
         expense = excluded.expense,
         orders = excluded.orders,
         revenue = excluded.revenue,
-        updated_at = NOW();
+        updated_at = NOW()
+    WHERE (mp_ozon_statisticscampaignproduct.price,
+           mp_ozon_statisticscampaignproduct.expense,
+           mp_ozon_statisticscampaignproduct.orders,
+           mp_ozon_statisticscampaignproduct.revenue)
+        IS DISTINCT FROM (excluded.price, excluded.expense, excluded.orders, excluded.revenue);
     """
-    with connection.cursor() as cursor:
-        cursor.execute(sql, {"campaign_ids": tuple(campaign_ids)})
+    execute_sql(
+        sql,
+        {
+            "campaign_ids": [c for c, dt in campaign_days],
+            "dts": [dt for c, dt in campaign_days],
+        },
+    )
 
-    logger.debug(f"Статистика продвижения в поиске обновлена для {campaign_ids}.")
+    logger.debug(
+        f"Статистика продвижения в поиске обновлена за {len(campaign_days)} дней кампаний."
+    )
 
 
 def is_correct_report(conditions):
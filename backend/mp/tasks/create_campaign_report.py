@@ -1,12 +1,15 @@
 from datetime import datetime, timedelta, date
 import json
 import logging
-import math
 
 from django.db.models import Q
 
 from ka_space.celery import app
-from mp.helpers import get_key, chunks
+from mp.models import CampaignReportDay
+from mp.helpers import get_key, update_shop_stats
+from mp.helpers.report_planner import needed_cells, remove_queued, plan_reports
+from mp.helpers.single_flight import single_flight
+from mp.helpers.tracing import trace_task, TracedApi, span, STAGE_DERIVED
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +27,8 @@ MAX_STATISTICS_PERIOD = 60
 
 
 @app.task
+@single_flight("campaign_reports")
+@trace_task
 def create_campaign_report(*args, apikey_id=None, **kwargs):
     """Создание запросов отчетов для обновления статистики рекламных кампаний
 
@@ -42,9 +47,13 @@ def create_campaign_report(*args, apikey_id=None, **kwargs):
     apikey = get_key(apikey_id)
 
     try:
-        api = ApiPerformance(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        api = TracedApi(
+            ApiPerformance(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        )
         new_report(apikey.shop, api, days=kwargs.get("days", 1))
         remove_old_report(apikey.shop)
+        with span(STAGE_DERIVED):
+            update_shop_stats(apikey.shop, "reports")
 
     except Exception as ex:
         msg = f"Shop: {apikey.shop} Error: {ex}"
@@ -57,18 +66,21 @@ def create_campaign_report(*args, apikey_id=None, **kwargs):
 def new_report(shop, api, days=1):
     """Создаем новые запросы отчетов
 
-    FIXME Запрашивать отчеты только для актуальных кампаний, которые работают или попадают в диапазон
+    Запрашиваются только нужные дни кампаний (см. mp.helpers.report_planner):
+    с показами, кликами или расходом в дневной статистике, еще не загруженные
+    окончательно и не стоящие в очереди. Дни кампаний собираются в минимальное
+    число запросов с учетом LIMIT_CAMPAIGNS и LIMIT_DAYS.
 
     :param shop:
     :param api:
     :param days:
-    :return:
+    :return: число новых запросов
     """
     # обрезаем историю получения статистики
     days = days if days < MAX_STATISTICS_PERIOD else MAX_STATISTICS_PERIOD
 
     if days < 5:
-        # обновляем только активные рекламные кампании
+        # дни без дневной статистики - только активные рекламные кампании
         q = Campaign.objects.filter(
             Q(shop=shop)
             & (
@@ -79,35 +91,44 @@ def new_report(shop, api, days=1):
     else:
         q = Campaign.objects.filter(shop=shop).values_list("id", flat=True)
 
-    campaign_ids = sorted(list(q))
-    if campaign_ids:
-        date_to = date.today()
-        days_max = days if days < LIMIT_DAYS else LIMIT_DAYS
-        for period_offset in range(math.ceil(days / days_max)):
-            date_from = date_to - timedelta(days=days_max)
-
-            for ids in chunks(campaign_ids, LIMIT_CAMPAIGNS):
-                report = api.report_campaigns_create(
-                    dt=date_to, days=days_max, campaign_ids=ids
-                )
-
-                obj, created = Report.objects.get_or_create(
-                    **{
-                        "conditions": json.dumps(report, sort_keys=True),
-                        "is_parsed": False,
-                        "shop": shop,
-                    }
-                )
-                if created:
-                    logger.debug(f"Отчет поставлен в очередь: {report}")
-
-            # смещаем конечную дату диапазона, смещение на 1 день игнорируем
-            date_to = date_from
-    else:
-        logger.debug(f"{shop}: Рекламные кампании не найдены")
+    date_to = date.today()
+    cells = needed_cells(shop, date_to - timedelta(days=days), date_to, q)
+    queued = Report.objects.filter(shop=shop, is_parsed=False).exclude(state="ERROR")
+    cells = remove_queued(cells, queued)
+    if not cells:
+        logger.debug(f"{shop}: Нет дней рекламных кампаний для новых отчетов")
+        return 0
+
+    total = 0
+    for ids, date_from, date_to in plan_reports(cells, LIMIT_CAMPAIGNS, LIMIT_DAYS):
+        report = api.report_campaigns_create(
+            dt=date_to, days=(date_to - date_from).days, campaign_ids=ids
+        )
+
+        obj, created = Report.objects.get_or_create(
+            **{
+                "conditions": json.dumps(report, sort_keys=True),
+                "is_parsed": False,
+                "shop": shop,
+            }
+        )
+        if created:
+            total += 1
+            logger.debug("Отчет поставлен в очередь: %s", report)
+
+    logger.info(
+        f"{shop}: Новых запросов отчетов {total}, "
+        f"дней кампаний {sum(len(ds) for ds in cells.values())}"
+    )
+    return total
 
 
 def remove_old_report(shop):
     remove_date = datetime.now() - timedelta(days=REPORT_OLD_DAYS)
     result = Report.objects.filter(shop=shop, created_at__lte=remove_date).delete()
     logger.debug(f"{shop}: Удалено {result} устаревших отчетов")
+
+    # дни кампаний старше периода статистики планировщику не нужны
+    CampaignReportDay.objects.filter(
+        shop=shop, date__lt=date.today() - timedelta(days=MAX_STATISTICS_PERIOD)
+    ).delete()
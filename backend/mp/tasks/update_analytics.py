@@ -9,7 +9,17 @@ from django.db.utils import IntegrityError
 from django.db.models import Q
 
 from ka_space.celery import app
-from mp.helpers import get_key, SLOW_TASK_TIMEOUT, bulk_insert_update, chunks
+from api.helpers import Update_Rollup
+from api.helpers.changelog import log_changes
+from mp.helpers import (
+    get_key,
+    SLOW_TASK_TIMEOUT,
+    bulk_insert_update,
+    chunks,
+    update_shop_stats,
+)
+from mp.helpers.single_flight import single_flight
+from mp.helpers.tracing import trace_task, TracedApi, span, STAGE_DERIVED
 
 logger = logging.getLogger(__name__)
 
@@ -23,12 +33,15 @@ except:
 
 
 @app.task(bind=True)
+@single_flight("analytics")
+@trace_task
 def update_analytics(self, *args, apikey_id=None, **kwargs):
     """Обновление аналитики магазина
 
     :param args:
     :param apikey:
-    :param kwargs:
+    :param kwargs: days, days_step, date_to - конец периода загрузки истории,
+        refresh - пересчет статистики магазина (по умолчанию True)
     :return:
     """
     if apikey_id is None:
@@ -39,13 +52,16 @@ def update_analytics(self, *args, apikey_id=None, **kwargs):
     apikey = get_key(apikey_id)
 
     try:
-        api = ApiOzon(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        api = TracedApi(
+            ApiOzon(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        )
         api_analytics(
             apikey.shop,
             api,
             days=kwargs.get("days", 1),
             days_step=kwargs.get("days_step"),
             task=self,
+            date_to=kwargs.get("date_to"),
         )
     except ErrorRateLimit as ex:
         return {"❌FAILED": f"{ex}"}
@@ -61,10 +77,24 @@ def update_analytics(self, *args, apikey_id=None, **kwargs):
             logger.exception(msg)
         return {"❌FAILED": msg}
 
+    # недельные и месячные итоги за загруженные дни
+    date_to = kwargs.get("date_to") or date.today()
+    with span(STAGE_DERIVED):
+        Update_Rollup.analytics(
+            params={
+                "shop_id": apikey.shop.pk,
+                "date_from": date_to - timedelta(days=kwargs.get("days", 1)),
+                "date_to": date_to,
+            }
+        )
+    if kwargs.get("refresh", True):
+        with span(STAGE_DERIVED):
+            update_shop_stats(apikey.shop, "analytics")
+
     return {"SUCCESS": f"{apikey.shop}"}
 
 
-def api_analytics(shop, api, days=1, days_step=None, task=None):
+def api_analytics(shop, api, days=1, days_step=None, task=None, date_to=None):
     """
 
     :param shop:
@@ -72,6 +102,7 @@ def api_analytics(shop, api, days=1, days_step=None, task=None):
     :param days: всего дней
     :param days_step: дней за раз
     :param task:
+    :param date_to: последний день, по умолчанию сегодня
     :return:
     """
     start_at = datetime.now()
@@ -85,8 +116,9 @@ def api_analytics(shop, api, days=1, days_step=None, task=None):
 
     total_rows = 0
     total_periods = math.ceil(days / days_max)
+    last_date = date_to or date.today()
     for num, metrics in enumerate(chunks(METRICS, API_LIMIT_METRICS)):
-        date_to = date.today()
+        date_to = last_date
         for period_offset in range(total_periods):
             date_from = date_to - timedelta(days=days_max)
 
@@ -122,10 +154,13 @@ def analytics2db(data, shop):
     :param shop:
     :return:
     """
+    changed = []
     msg = bulk_insert_update(
         data=data,
         key_fields=["date", "sku"],
         cls=Analytics,
         shop=shop,
+        changed_keys=changed,
     )
+    log_changes(shop.pk, "analytics", {date_ for date_, sku in changed})
     logger.info(f"{shop} {msg}")
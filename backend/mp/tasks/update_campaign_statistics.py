@@ -6,7 +6,9 @@ from django.db.models import Q
 
 from ka_space.celery import app
 from mp.helpers import get_key, bulk_insert_update
-from . import update_campaigns
+from mp.helpers.single_flight import single_flight
+from mp.helpers.tracing import trace_task, TracedApi
+from .update_campaigns import update_campaigns
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +21,8 @@ except:
 
 
 @app.task
+@single_flight("campaign_statistics")
+@trace_task
 def update_campaign_statistics(*args, apikey_id=None, **kwargs):
     """Обновление статистики рекламных кампаний магазина
 
@@ -37,10 +41,12 @@ def update_campaign_statistics(*args, apikey_id=None, **kwargs):
         return {"❌FAILED": f"{apikey.shop}: Товары не найдены"}
 
     # обновление рекламных кампаний в текущей задаче, синхронно, не откладывая
-    update_campaigns(apikey_id=apikey_id)
+    update_campaigns(apikey_id=apikey_id, followup=False)
 
     try:
-        api = ApiPerformance(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        api = TracedApi(
+            ApiPerformance(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        )
         api_campaign_statistics(apikey.shop, api, days=kwargs.get("days", 1))
     except ErrorLocked:
         return {"❌FAILED": f"{apikey.shop} Locked. Skip."}
@@ -6,8 +6,10 @@ from django.db.utils import IntegrityError
 from django.db.models import Q
 
 from ka_space.celery import app
-from api.helpers import Update_Daily
-from mp.helpers import get_key
+from api.helpers import Update_Daily, Update_Rollup
+from mp.helpers import get_key, update_shop_stats
+from mp.helpers.single_flight import single_flight
+from mp.helpers.tracing import trace_task, TracedApi, span, STAGE_DAILY, STAGE_DERIVED
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +27,8 @@ except:
 
 
 @app.task
+@single_flight("campaigns")
+@trace_task
 def update_campaigns(*args, apikey_id=None, **kwargs):
     """Обновление рекламных кампаний магазина
 
@@ -43,7 +47,9 @@ def update_campaigns(*args, apikey_id=None, **kwargs):
     apikey = get_key(apikey_id)
 
     try:
-        api = ApiPerformance(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        api = TracedApi(
+            ApiPerformance(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        )
         api_campaigns(apikey.shop, api)
     except ErrorLocked:
         return {"❌FAILED": f"{apikey.shop} Locked. Skip."}
@@ -53,7 +59,11 @@ def update_campaigns(*args, apikey_id=None, **kwargs):
         return {"❌FAILED": msg}
 
     # обновление daily-статистики
-    Update_Daily.campaigns(params={"shop_id": apikey.shop.pk})
+    with span(STAGE_DAILY):
+        dates = Update_Daily.campaigns(params={"shop_id": apikey.shop.pk})
+        Update_Rollup.daily_changed(apikey.shop.pk, dates)
+    with span(STAGE_DERIVED):
+        update_shop_stats(apikey.shop, "campaigns")
 
     return {"SUCCESS": f"{apikey.shop}"}
 
@@ -97,7 +107,7 @@ def api_campaigns(shop, api):
                 setattr(campaign, attr, value)
         if changed_fields:
             campaign.save()
-            logger.debug(f"{campaign} Изменено: {changed_fields}")
+            logger.debug("%s Изменено: %s", campaign, changed_fields)
 
         if campaign.state != "CAMPAIGN_STATE_RUNNING":
             # пропускаем выключенные кампании
@@ -129,7 +139,10 @@ def api_campaigns(shop, api):
             if len(changed_fields):
                 campaign_product.save()
                 logger.debug(
-                    f"{campaign} Добавлен товар: {campaign_product} Изменено: {changed_fields}"
+                    "%s Добавлен товар: %s Изменено: %s",
+                    campaign,
+                    campaign_product,
+                    changed_fields,
                 )
 
             # обновляем историю рекламных настроек товара
@@ -154,12 +167,14 @@ def api_campaigns(shop, api):
                 history.bid = p["bid"]
                 history.visibility_idx = p["visibility_idx"]
                 history.save()
-                logger.debug(f"{campaign} Обновлена история товара: {campaign_product}")
+                logger.debug(
+                    "%s Обновлена история товара: %s", campaign, campaign_product
+                )
 
         CampaignProduct.objects.filter(campaign=campaign).exclude(
             sku__in=[p["sku"] for p in linked_products]
         ).delete()
-        logger.debug(f"{campaign} Удалены старые связи товаров")
+        logger.debug("%s Удалены старые связи товаров", campaign)
 
     logger.info(
         f"{shop} Рекламные кампании. Обновлено {len(campaigns)} строк. Прошло {datetime.now() - start_at}"
@@ -8,8 +8,23 @@ from django.db.models import Q, Min
 from django.db import transaction
 
 from ka_space.celery import app
-from api.helpers import execute_sql, Update_Daily
-from mp.helpers import get_key, bulk_insert_update, chunks
+from api.helpers import (
+    execute_sql,
+    Update_Daily,
+    Update_Rollup,
+    Update_Parsed,
+    Update_Ledger,
+)
+from mp.helpers import (
+    get_key,
+    bulk_insert_update,
+    chunks,
+    update_shop_stats,
+    match_selfbuys,
+    update_selfbuys,
+)
+from mp.helpers.single_flight import single_flight
+from mp.helpers.tracing import trace_task, TracedApi, span, STAGE_DAILY, STAGE_DERIVED
 
 logger = logging.getLogger(__name__)
 
@@ -25,12 +40,15 @@ ORDER_CHUNK_SIZE = 3000
 
 
 @app.task
+@single_flight("orders")
+@trace_task
 def update_orders(*args, apikey_id=None, **kwargs):
     """Обновление FBO и FBS
 
     :param args:
     :param apikey:
-    :param kwargs:
+    :param kwargs: days, date_to - конец периода загрузки истории,
+        refresh - пересчет daily-статистики и самовыкупов (по умолчанию True)
     :return:
     """
     if apikey_id is None:
@@ -41,9 +59,18 @@ def update_orders(*args, apikey_id=None, **kwargs):
     apikey = get_key(apikey_id)
 
     try:
-        api = ApiOzon(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        api = TracedApi(
+            ApiOzon(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        )
         for model in [FBO, FBS]:
-            api_orders(apikey.shop, api, days=kwargs.get("days", 1), model=model)
+            api_orders(
+                apikey.shop,
+                api,
+                days=kwargs.get("days", 1),
+                model=model,
+                date_to=kwargs.get("date_to"),
+                refresh=kwargs.get("refresh", True),
+            )
     except ErrorBadApiKey as ex:
         apikey.is_active = False
         apikey.save()
@@ -56,27 +83,47 @@ def update_orders(*args, apikey_id=None, **kwargs):
         return {"❌FAILED": msg}
 
     # обновление daily-статистики
-    Update_Daily.orders(params={"shop_id": apikey.shop.pk})
+    if kwargs.get("refresh", True):
+        with span(STAGE_DAILY):
+            dates = Update_Daily.orders(params={"shop_id": apikey.shop.pk})
+            Update_Rollup.daily_changed(apikey.shop.pk, dates)
+        with span(STAGE_DERIVED):
+            update_shop_stats(apikey.shop, "fbo", "fbs")
 
     return {"result": f"{apikey.shop} Success"}
 
 
-def api_orders(shop, api, days=1, model=None):
+def api_orders(shop, api, days=1, model=None, date_to=None, refresh=True):
+    """Заказы FBO или FBS
+
+    Без date_to период расширяется до самого старого незавершенного заказа.
+
+    :param shop:
+    :param api:
+    :param days:
+    :param model: FBO, FBS
+    :param date_to: последний день периода загрузки истории
+    :param refresh: пересчет самовыкупов
+    :return:
+    """
     start_at = datetime.now()
 
-    # получаем минимальную дату незавершенного заказа
-    q = model.objects.filter(Q(shop=shop) & ~Q(status__in=["delivered", "cancelled"]))
-    check_min_date = q.aggregate(Min("created_at"))["created_at__min"]
-    if check_min_date is None:
-        # for empty table
-        days = 360
-    else:
-        days_ago = (start_at.date() - check_min_date.date()).days
-        days_ago = days_ago if days_ago < API_LIMIT_DAYS else API_LIMIT_DAYS
-        days = max(days, days_ago)
+    if date_to is None:
+        # получаем минимальную дату незавершенного заказа
+        q = model.objects.filter(
+            Q(shop=shop) & ~Q(status__in=["delivered", "cancelled"])
+        )
+        check_min_date = q.aggregate(Min("created_at"))["created_at__min"]
+        if check_min_date is None:
+            # for empty table
+            days = 360
+        else:
+            days_ago = (start_at.date() - check_min_date.date()).days
+            days_ago = days_ago if days_ago < API_LIMIT_DAYS else API_LIMIT_DAYS
+            days = max(days, days_ago)
+        date_to = date.today()
 
     total_rows = 0
-    date_to = date.today()
     days_max = days if days < API_LIMIT_DAYS else API_LIMIT_DAYS
     for period_offset in range(math.ceil(days / days_max)):
         date_from = date_to - timedelta(days=days_max)
@@ -97,8 +144,9 @@ def api_orders(shop, api, days=1, model=None):
         # смещаем конечную дату диапазона, смещение на 1 день игнорируем
         date_to = date_from
 
-    if model.__name__ == "FBO":
-        update_selfbuys(shop)
+    if model is FBO and refresh:
+        with span(STAGE_DERIVED):
+            update_selfbuys(shop)
     logger.debug(
         f"{shop} {model.__name__} Заказы обновлены: {total_rows} строк. Прошло {datetime.now() - start_at}"
     )
@@ -112,9 +160,9 @@ def orders2db(orders, shop, model):
     :param model:
     :return:
     """
-    if model.__name__ == "FBO":
+    if model is FBO:
         op_model = FBO_Product
-    elif model.__name__ == "FBS":
+    elif model is FBS:
         op_model = FBS_Product
 
     msg = bulk_insert_update(
@@ -138,6 +186,7 @@ def orders2db(orders, shop, model):
         }
 
     op_model_fields = [str(f).split(".")[-1] for f in op_model._meta.get_fields()]
+    deleted_ids = []
     for o in orders:
         order = existing_objs[tuple([str(o[k]) for k in key_fields])]
 
@@ -179,52 +228,28 @@ def orders2db(orders, shop, model):
             if changed_fields:
                 obj.save()
 
-        op_model.objects.filter(order=order).exclude(
+        to_delete = op_model.objects.filter(order=order).exclude(
             sku__in=[p["sku"] for p in o["products"]]
-        ).delete()
-
-
-def update_selfbuys(shop):
-    """Обновляем самовыкупы из заказов
-
-    FIXME Реализовано только для FBO
+        )
+        deleted_ids += to_delete.values_list("id", flat=True)
+        to_delete.delete()
+
+    if model is FBO:
+        # разбираем JSON-поля и связываем загруженные заказы с транзакциями
+        params = {"shop_id": shop.pk, "posting_numbers": list(keys["posting_number"])}
+        with span(STAGE_DERIVED):
+            Update_Parsed.orders(params=params)
+            Update_Parsed.remove(
+                params={"shop_id": shop.pk, "fbo_product_ids": deleted_ids}
+            )
+            Update_Ledger.postings(params=params)
 
-    :param shop:
-    :return:
-    """
-    # обновляем самовыкупы
-    sql = """
-            UPDATE mp_selfbuy SET
-                dt_buy = sub.in_process_at,
-                dt_take = sub.operation_date,
-                offer_id = sub.offer_id,
-                name = sub.name,
-                status = sub.status
-            FROM (
-                SELECT 
-                    mof.order_number, 
-                    mof.posting_number, 
-                    mof.in_process_at, 
-                    mot.operation_date, 
-                    mofp.offer_id, 
-                    mofp.name, 
-                    mof.status,
-                    mof.shop_id 
-                FROM mp_ozon_fbo mof 
-                INNER JOIN mp_ozon_fbo_product mofp ON mofp.order_id = mof.id
-                LEFT JOIN mp_ozon_transaction mot ON mof.shop_id = mot.shop_id 
-                    AND mot.posting_number = mof.posting_number
-                WHERE mof.shop_id = %(shop_id)s
-            ) sub
-            WHERE dt_take IS NULL AND sub.shop_id = mp_selfbuy.shop_id 
-                AND (sub.order_number = "order" OR sub.posting_number = "order")
-            """
-    execute_sql(
-        sql,
-        {
-            "shop_id": shop.id,
-        },
-    )
+            # самовыкупы, совпавшие с номерами загруженных заказов и отправлений
+            match_selfbuys(
+                shop,
+                orders=keys["posting_number"]
+                | {str(o["order_number"]) for o in orders if o.get("order_number")},
+            )
 
 
 def get_product(params=None):
@@ -5,7 +5,10 @@ import logging
 from pprint import pprint
 
 from ka_space.celery import app
-from mp.helpers import get_key, chunks
+from api.helpers import Update_Parsed, Update_Ledger, Update_SkuOffer
+from mp.helpers import get_key, chunks, update_shop_stats
+from mp.helpers.single_flight import single_flight
+from mp.helpers.tracing import trace_task, TracedApi, span, STAGE_DERIVED
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +20,8 @@ except:
 
 
 @app.task
+@single_flight("products")
+@trace_task
 def update_products(*args, apikey_id=None, **kwargs):
     """Обновление товаров магазина
 
@@ -34,7 +39,7 @@ def update_products(*args, apikey_id=None, **kwargs):
 
     apikey = get_key(apikey_id)
 
-    api = ApiOzon(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+    api = TracedApi(ApiOzon(apikey.client_id, apikey.client_secret, shop=apikey.shop))
     products = api.products()
 
     product_ids = [p["product_id"] for p in products]
@@ -50,6 +55,7 @@ def update_products(*args, apikey_id=None, **kwargs):
 
     product_model_fields = [str(f).split(".")[-1] for f in Product._meta.get_fields()]
     total = 0
+    changed_ids = []
     for p in products:
         changed_fields = []
         product, created = Product.objects.get_or_create(**{"id": p["id"]})
@@ -95,15 +101,31 @@ def update_products(*args, apikey_id=None, **kwargs):
         if len(changed_fields):
             total += 1
             product.save()
-            logger.debug(f"{product} Изменено: {changed_fields}")
+            changed_ids.append(product.pk)
+            logger.debug("%s Изменено: %s", product, changed_fields)
 
     # удаление товаров
     to_delete = Product.objects.filter(shop=apikey.shop).exclude(
         id__in=[p["id"] for p in products]
     )
-    if len(to_delete):
+    deleted_ids = list(to_delete.values_list("id", flat=True))
+    if deleted_ids:
         to_delete.delete()
+        with span(STAGE_DERIVED):
+            Update_Parsed.remove(
+                params={"shop_id": apikey.shop.pk, "product_ids": deleted_ids}
+            )
+
+    # разбираем JSON-поля измененных товаров, обновляем SKU х Артикул и артикулы в отчетах
+    if changed_ids:
+        params = {"shop_id": apikey.shop.pk, "product_ids": changed_ids}
+        with span(STAGE_DERIVED):
+            Update_Parsed.products(params=params)
+            Update_SkuOffer.products(params=params)
+            Update_Ledger.offers(params=params)
+    with span(STAGE_DERIVED):
+        update_shop_stats(apikey.shop, "products")
 
-    msg = f"Обновление {total} товаров / Удалено {len(to_delete)} товаров"
+    msg = f"Обновление {total} товаров / Удалено {len(deleted_ids)} товаров"
     logger.info(f"{apikey.shop}: {msg}")
     return msg
@@ -5,9 +5,11 @@ from django.db import connection
 from django.db.utils import IntegrityError
 
 from ka_space.celery import app
-from api.helpers import execute_sql, Update_Daily
+from api.helpers import Update_Daily, Update_Rollup, Update_SkuOffer
 from mp.helpers import get_key
-from . import update_products
+from mp.helpers.single_flight import single_flight
+from mp.helpers.tracing import trace_task, TracedApi, span, STAGE_DAILY, STAGE_DERIVED
+from .update_products import update_products
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +22,8 @@ except:
 
 
 @app.task
+@single_flight("stocks")
+@trace_task
 def update_stocks(*args, apikey_id=None, **kwargs):
     """Обновление складских остатков
 
@@ -34,14 +38,16 @@ def update_stocks(*args, apikey_id=None, **kwargs):
         return {"❌FAILED": msg}
 
     # обновление товаров в текущей задаче, синхронно, не откладывая
-    result_products = update_products(apikey_id=apikey_id)
+    result_products = update_products(apikey_id=apikey_id, followup=False)
 
     apikey = get_key(apikey_id)
 
     cnt = Product.objects.filter(shop=apikey.shop).count()
     result_stocks = ""
     if cnt:
-        api = ApiOzon(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        api = TracedApi(
+            ApiOzon(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        )
         try:
             result_stocks = api_stocks(apikey.shop, api)
         except Exception as ex:
@@ -59,10 +65,13 @@ def update_stocks(*args, apikey_id=None, **kwargs):
         )
 
     # обновление daily-статистики
-    Update_Daily.stocks(params={"shop_id": apikey.shop.pk})
+    with span(STAGE_DAILY):
+        dates = Update_Daily.stocks(params={"shop_id": apikey.shop.pk})
+        Update_Rollup.daily_changed(apikey.shop.pk, dates)
 
-    # заполнение таблицы SKU х Артикул для корректного сопоставления товаров
-    update_sku_offer(apikey.shop)
+    # удаляем из отсутствующих товаров найденные в SKU х Артикул
+    with span(STAGE_DERIVED):
+        Update_SkuOffer.lost(params={"shop_id": apikey.shop.pk})
 
     return {
         "SUCCESS": f"{apikey.shop} {result_products} / {result_stocks} / {result_wh_stocks}"
@@ -102,7 +111,7 @@ def api_stocks(shop, api):
         if changed_fields:
             total += 1
             obj.save()
-            logger.debug(f"Изменен остаток: {obj} {changed_fields}")
+            logger.debug("Изменен остаток: %s %s", obj, changed_fields)
 
     msg = f"Обновлено {total} строк складских остатков"
     logger.info(f"{shop}: {msg}")
@@ -123,6 +132,7 @@ def warehouse_stocks_to_db(stocks, shop):
     model_fields = [str(f).split(".")[-1] for f in WarehouseStock._meta.get_fields()]
     stock_model_key = ["sku", "date", "warehouse"]
     total = 0
+    discounted_offers = set()
     for s in stocks:
         obj, created = WarehouseStock.objects.get_or_create(
             **{
@@ -145,101 +155,15 @@ def warehouse_stocks_to_db(stocks, shop):
         if changed_fields:
             total += 1
             obj.save()
-            logger.debug(f"Изменен остаток: {obj} Поля: {changed_fields}")
-
-    return total
+            logger.debug("Изменен остаток: %s Поля: %s", obj, changed_fields)
+            if obj.discounted and {"offer_id", "discounted"} & set(changed_fields):
+                discounted_offers.add(obj.offer_id)
 
+    # SKU новых и измененных уцененных товаров в таблицу SKU х Артикул
+    if discounted_offers:
+        with span(STAGE_DERIVED):
+            Update_SkuOffer.products(
+                params={"shop_id": shop.pk, "offer_ids": sorted(discounted_offers)}
+            )
 
-def update_sku_offer(shop):
-    """Обновление артикулов товаров
-
-    :param shop:
-    :return:
-    """
-    sql = """
-        INSERT INTO mp_ozon_sku_offer  
-        (sku, type, offer_id, product_id)
-        (
-            SELECT 
-            DISTINCT mow.sku, 'discounted' AS type, mow.offer_id, mop.id AS product_id
-            FROM mp_ozon_warehousestock mow 
-            INNER JOIN mp_ozon_product mop ON mow.offer_id = mop.offer_id
-            WHERE mow.discounted = true AND mow.shop_id = %(shop_id)s
-            ORDER BY mow.offer_id
-        ) ON CONFLICT (sku, product_id) DO NOTHING;
-    """
-    execute_sql(
-        sql,
-        {
-            "shop_id": shop.pk,
-        },
-    )
-    logger.debug(f"{shop}: Обновлены SKU и артикулы уцененных товаров")
-
-    sql = """
-        INSERT INTO mp_ozon_sku_offer  
-        (sku, type, offer_id, product_id)
-        (
-            SELECT 
-            DISTINCT fbo_sku, 'fbo' as type, mop.offer_id, mop.id as product_id
-            FROM mp_ozon_product mop 
-            WHERE mop.shop_id = %(shop_id)s
-            ORDER BY mop.offer_id
-        ) ON CONFLICT (sku, product_id) DO UPDATE SET 
-            type = excluded.type;
-    """
-    execute_sql(
-        sql,
-        {
-            "shop_id": shop.pk,
-        },
-    )
-    logger.debug(f"{shop}: Обновлены SKU и артикулы FBO товаров")
-
-    sql = """
-        INSERT INTO mp_ozon_sku_offer  
-        (sku, type, offer_id, product_id)
-        (
-            SELECT 
-            DISTINCT fbs_sku, 'fbs' as type, mop.offer_id, mop.id as product_id
-            FROM mp_ozon_product mop 
-            WHERE mop.shop_id = %(shop_id)s
-            ORDER BY mop.offer_id
-        ) ON CONFLICT (sku, product_id) DO UPDATE SET 
-            type = excluded.type;
-    """
-    execute_sql(
-        sql,
-        {
-            "shop_id": shop.pk,
-        },
-    )
-    logger.debug(f"{shop}: Обновлены SKU и артикулы FBS товаров")
-
-    sql = """
-        UPDATE mp_ozon_sku_offer moso SET
-        offer_id = mop.offer_id
-        FROM mp_ozon_product mop
-        WHERE mop.id = moso.product_id AND mop.shop_id = %(shop_id)s AND moso.offer_id != mop.offer_id;
-    """
-    execute_sql(
-        sql,
-        {
-            "shop_id": shop.pk,
-        },
-    )
-    logger.debug(f"{shop}: Обновлены артикулы товаров")
-
-    # Remove Lost Products
-    sql = """
-        DELETE FROM mp_ozon_productlost WHERE sku IN (SELECT sku FROM mp_ozon_sku_offer WHERE shop_id = %(shop_id)s);
-    """
-    execute_sql(
-        sql,
-        {
-            "shop_id": shop.pk,
-        },
-    )
-    logger.debug(f"{shop}: Удалены товары, отсутствующие на Озоне")
-
-    return
+    return total
@@ -5,8 +5,16 @@ import logging
 import math
 
 from ka_space.celery import app
-from api.helpers import Update_Daily
-from mp.helpers import get_key, chunks, SLOW_TASK_TIMEOUT, bulk_insert_update
+from api.helpers import Update_Daily, Update_Rollup, Update_Parsed, Update_Ledger
+from mp.helpers import (
+    get_key,
+    chunks,
+    SLOW_TASK_TIMEOUT,
+    bulk_insert_update,
+    update_shop_stats,
+)
+from mp.helpers.single_flight import single_flight
+from mp.helpers.tracing import trace_task, TracedApi, span, STAGE_DAILY, STAGE_DERIVED
 
 logger = logging.getLogger(__name__)
 
@@ -22,12 +30,15 @@ TRANSACTION_CHUNK_SIZE = 5000
 
 
 @app.task
+@single_flight("transactions")
+@trace_task
 def update_transactions(*args, apikey_id=None, **kwargs):
     """Обновление товаров магазина
 
     :param args:
     :param apikey:
-    :param kwargs:
+    :param kwargs: days, date_to - конец периода загрузки истории,
+        refresh - пересчет daily-статистики (по умолчанию True)
     :return:
     """
     if apikey_id is None:
@@ -38,8 +49,12 @@ def update_transactions(*args, apikey_id=None, **kwargs):
     apikey = get_key(apikey_id)
 
     try:
-        api = ApiOzon(apikey.client_id, apikey.client_secret, shop=apikey.shop)
-        result = api_transactions(apikey.shop, api, days=kwargs.get("days", 1))
+        api = TracedApi(
+            ApiOzon(apikey.client_id, apikey.client_secret, shop=apikey.shop)
+        )
+        result = api_transactions(
+            apikey.shop, api, days=kwargs.get("days", 1), date_to=kwargs.get("date_to")
+        )
     except ErrorBadApiKey as ex:
         apikey.is_active = False
         apikey.save()
@@ -52,18 +67,42 @@ def update_transactions(*args, apikey_id=None, **kwargs):
         return {"❌FAILED": msg}
 
     # обновление daily-статистики
-    Update_Daily.transactions(params={"shop_id": apikey.shop.pk})
+    if kwargs.get("refresh", True):
+        with span(STAGE_DAILY):
+            dates = Update_Daily.transactions(params={"shop_id": apikey.shop.pk})
+            Update_Rollup.daily_changed(apikey.shop.pk, dates)
+        with span(STAGE_DERIVED):
+            update_shop_stats(apikey.shop, "transactions")
 
     return {"SUCCESS": f"{apikey.shop} {result}"}
 
 
-def api_transactions(shop, api, days=1):
+def api_transactions(shop, api, days=1, date_to=None):
+    """Транзакции по месяцам, от последнего к первым
+
+    :param shop:
+    :param api:
+    :param days: дней, без date_to повторяются также предыдущий месяц
+    :param date_to: последний день периода загрузки истории, месяцы с date_to - days
+    :return:
+    """
     start_at = datetime.now()
 
     total_rows = 0
-    date_to = date(start_at.year, start_at.month + 1, 1) - timedelta(days=1)
+    if date_to is None:
+        date_to = start_at.date()
+        periods = math.ceil(days / 30) + 1
+    else:
+        first_date = date_to - timedelta(days=max(days - 1, 0))
+        periods = (
+            (date_to.year - first_date.year) * 12 + date_to.month - first_date.month + 1
+        )
+    # последний день месяца
+    date_to = (date_to.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(
+        days=1
+    )
 
-    for period_offset in range(math.ceil(days / 30) + 1):
+    for period_offset in range(periods):
         date_from = date(date_to.year, date_to.month, 1)
 
         data = api.transactions(date_from=date_from, date_to=date_to)
@@ -113,3 +152,19 @@ def transactions2db(data, shop):
         shop=shop,
     )
     logger.info(f"{shop} {msg}")
+
+    # разбираем JSON-поля и связываем загруженные транзакции с отправлениями
+    operation_ids = [r["operation_id"] for r in data]
+    with span(STAGE_DERIVED):
+        Update_Parsed.transactions(
+            params={"shop_id": shop.pk, "operation_ids": operation_ids}
+        )
+        Update_Ledger.postings(
+            params={
+                "shop_id": shop.pk,
+                "operation_ids": operation_ids,
+                "posting_numbers": list(
+                    {r["posting_number"] for r in data if r.get("posting_number")}
+                ),
+            }
+        )
@@ -1,3 +1,592 @@
-from django.test import TestCase
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+import io
+import json
+import logging
+from types import SimpleNamespace
+from unittest import mock
+import zipfile
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+import requests
+
+from ka_space import metrics
+from api.helpers import execute_sql, fetch_raw_sql
+from ka_space.helpers import SAMPLED, Locking, SampledDebugFilter
+from mp.bench.schema import OZON_SCHEMA
+from mp.helpers import bulk_insert_update, single_flight as sf, update_shop_stats
+from mp.helpers import report_stream as rs
+from mp.helpers.report_planner import (
+    plan_reports,
+    remove_queued,
+    report_cells,
+    save_loaded_cells,
+)
+from mp.helpers.shop_stats import check_shop_stats_triggers
+from mp.models import CampaignReportDay, Selfbuy, Shop, ShopStats
+from mp.tasks.check_campaign_report import update_product_statistics
+
+
+class SingleFlightTest(SimpleTestCase):
+    shop_id = 999001
+
+    def setUp(self):
+        self.calls = []
+        self.inner = {}
+
+        @sf.single_flight("test_stage")
+        def create_report(**kwargs):
+            self.calls.append(("create", kwargs))
+            if "inner" in self.inner:
+                self.inner.pop("inner")()
+            return "create"
+
+        @sf.single_flight("test_stage")
+        def check_report(**kwargs):
+            self.calls.append(("check", kwargs))
+            return "check"
+
+        self.create_report = create_report
+        self.check_report = check_report
+        self.lock = Locking(f"task_test_stage_{self.shop_id}")
+        self.clear()
+
+    def tearDown(self):
+        self.clear()
+        sf.STAGE_TASKS.pop("test_stage", None)
+
+    def clear(self):
+        keys = self.lock.redis.keys(f"{self.lock.flag_locked}*")
+        if keys:
+            self.lock.redis.delete(*keys)
+
+    def test_followup_per_task(self):
+        # пока выполняется create, повторы check и create запоминаются отдельно
+        def inner():
+            self.assertIn(
+                "Queued", self.check_report(shop_id=self.shop_id, report=1)["❌FAILED"]
+            )
+            self.assertIn(
+                "Queued", self.create_report(shop_id=self.shop_id, days=3)["❌FAILED"]
+            )
+            self.assertIn(
+                "Coalesced", self.create_report(shop_id=self.shop_id)["❌FAILED"]
+            )
+
+        self.inner["inner"] = inner
+        tasks = {name: mock.Mock() for name in sf.STAGE_TASKS["test_stage"]}
+        with mock.patch.object(sf, "current_app") as app:
+            app.tasks = tasks
+            self.assertEqual(self.create_report(shop_id=self.shop_id), "create")
+
+        queued = {
+            name.rsplit(".", 1)[1]: task.apply_async.call_args.kwargs["kwargs"]
+            for name, task in tasks.items()
+        }
+        self.assertEqual(
+            queued,
+            {
+                "create_report": {"shop_id": self.shop_id, "days": 3},
+                "check_report": {"shop_id": self.shop_id, "report": 1},
+            },
+        )
+        self.assertFalse(self.lock.redis.keys(f"{self.lock.flag_locked}*"))
+
+    def test_followup_kwargs(self):
+        kwargs = {
+            "date_to": date(2022, 10, 1),
+            "since": datetime(2022, 10, 1, 12, 30),
+            "days": 3,
+        }
+        self.assertEqual(sf.load_followup(sf.dump_followup(kwargs)), kwargs)
+        with self.assertRaises(TypeError):
+            sf.dump_followup({"shop": object()})
+
+    def test_skip_without_followup(self):
+        self.lock.acquire(timeout=0)
+        try:
+            result = self.check_report(shop_id=self.shop_id, followup=False)
+        finally:
+            self.lock.release()
+        self.assertIn("Skip", result["❌FAILED"])
+        self.assertEqual(self.calls, [])
+        self.assertFalse(self.lock.redis.keys(f"{self.lock.flag_locked}_followup*"))
+
+
+class BulkInsertUpdateTest(TestCase):
+    def setUp(self):
+        self.shop = Shop.objects.create(shop_token="ozon", name="test")
+
+    def load(self, data):
+        changed = []
+        msg = bulk_insert_update(
+            data=data,
+            key_fields=["order"],
+            cls=Selfbuy,
+            shop=self.shop,
+            changed_keys=changed,
+        )
+        return msg, sorted(changed)
+
+    def test_insert_update(self):
+        rows = [
+            {"order": "1-1", "dt_buy": date(2022, 10, 1), "name": "A", "extra": 1},
+            {"order": "1-2", "dt_buy": date(2022, 10, 2), "name": "B"},
+        ]
+        msg, changed = self.load(rows)
+        self.assertIn("Добавлено 2", msg)
+        self.assertEqual(changed, [("1-1",), ("1-2",)])
+
+        # существующая строка изменена, вторая без изменений, третья новая
+        rows = [
+            {"order": "1-1", "dt_buy": "2022-10-01", "name": "A2"},
+            {"order": "1-2", "dt_buy": "2022-10-02", "name": "B"},
+            {"order": "1-3", "dt_buy": "2022-10-03", "name": "C"},
+        ]
+        msg, changed = self.load(rows)
+        self.assertIn("Найдено 2 и обновлено 1", msg)
+        self.assertIn("Добавлено 1", msg)
+        self.assertEqual(changed, [("1-1",), ("1-3",)])
+        self.assertEqual(
+            dict(Selfbuy.objects.filter(shop=self.shop).values_list("order", "name")),
+            {"1-1": "A2", "1-2": "B", "1-3": "C"},
+        )
+
+        msg, changed = self.load(rows)
+        self.assertIn("обновлено 0", msg)
+        self.assertEqual(changed, [])
+
+
+REPORT = {
+    "101": {
+        "title": "Кампания 101",
+        "report": {
+            "rows": [
+                {
+                    "date": "01.10.2022",
+                    "sku": "1001",
+                    "page": "Поиск",
+                    "condition": "Трафареты",
+                    "price": "1 234,50",
+                    "views": "15",
+                    "clicks": "2",
+                    "moneySpent": "12,34",
+                    "orders": "1",
+                    "ordersMoney": "1234,50",
+                },
+                {
+                    "date": "02.10.2022",
+                    "orderId": "55",
+                    "orderNumber": "0123-0001",
+                    "ozonId": "1001",
+                    "salePrice": "999,9",
+                    "quantity": "2",
+                    "bidValue": "10",
+                },
+            ],
+            "totals": {"views": "15"},
+        },
+    },
+    "102": {"title": "Пустая", "report": {"rows": [], "totals": {}}},
+}
+
+
+def report_chunks(size):
+    data = json.dumps(REPORT, ensure_ascii=False, indent=1).encode()
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+class ReportStreamTest(SimpleTestCase):
+    def test_rows_any_chunks(self):
+        # границы частей внутри чисел, строк и многобайтовых символов
+        expected = [("101", row) for row in REPORT["101"]["report"]["rows"]]
+        for size in (1, 2, 3, 7, 64, 10**6):
+            self.assertEqual(list(rs.iter_report_rows(report_chunks(size))), expected)
+
+    def test_json_stream(self):
+        stream = rs.JSONStream([b'{"a": [1, 2', b"3, {}], ", b'"b": 1.', b"5}"])
+        result = {}
+        for key in stream.members():
+            result[key] = list(stream.items()) if key == "a" else stream.value()
+        self.assertEqual(result, {"a": [1, 23, {}], "b": 1.5})
+        self.assertEqual(stream.peek(), "")
+
+    def test_bad_report(self):
+        with self.assertRaises(rs.ErrorReportStream):
+            list(rs.iter_report_rows([b'{"1": {"report": {"rows": [1}}}']))
+        with self.assertRaises(rs.ErrorReportStream):
+            list(rs.iter_report_rows([b"{} []"]))
+
+    def test_content_type(self):
+        body = json.dumps(REPORT).encode()
+        rows = list(rs.iter_report_rows([body], "application/json; charset=utf-8"))
+        self.assertEqual(rows, list(rs.iter_report_rows(report_chunks(5))))
+        with self.assertRaises(rs.ErrorReportStream):
+            rs.iter_report_rows([body], "text/html")
+        with self.assertRaises(rs.ErrorReportStream):
+            list(rs.iter_report_rows([b"not a zip"], "application/zip"))
+
+    def test_zip(self):
+        header = "Дата;SKU;Название товара;Цена товара, ₽;Показы;Клики;Расход, ₽"
+        products = "\n".join(
+            [
+                "Кампания по продвижению товаров № 101, период 01.10.2022-02.10.2022",
+                header + ";Заказы;Выручка, ₽;Страница показа",
+                "01.10.2022;1001;Товар; 1 234,50;15;2;12,34;1;1234,50;Поиск",
+                "Всего;;;;15;2;12,34;1;1234,50;",
+            ]
+        )
+        orders = "\n".join(
+            [
+                "Дата;ID заказа;Номер заказа;Ozon ID;Цена продажи;Количество;Ставка, ₽",
+                "02.10.2022;55;0123-0001;1001;999,9;2;10",
+            ]
+        )
+        file = io.BytesIO()
+        with zipfile.ZipFile(file, "w") as archive:
+            archive.writestr("101_01.10.2022-02.10.2022.csv", "\ufeff" + products)
+            archive.writestr("report/102.csv", orders)
+        body = file.getvalue()
+        chunks = [body[i : i + 100] for i in range(0, len(body), 100)]
+
+        batches = list(rs.iter_report_batches(chunks, "application/zip"))
+        self.assertEqual(
+            [(type_, [l["campaign_id"] for l in lines]) for type_, lines in batches],
+            [(rs.REPORT_TYPE_SKU, [101]), (rs.REPORT_TYPE_SEARCH_PROMO, [102])],
+        )
+        product, order = batches[0][1][0], batches[1][1][0]
+        self.assertEqual(
+            (product["sku"], product["price"], product["expense"], product["page"]),
+            (1001, Decimal("1234.50"), Decimal("12.34"), "Поиск"),
+        )
+        self.assertEqual(
+            (order["order_id"], order["price"], order["count"]),
+            ("55", Decimal("999.9"), 2),
+        )
+
+    def test_unknown_type(self):
+        row = {"date": "01.10.2022", "views": "1"}
+        self.assertEqual(
+            rs.report_line("101", row),
+            (
+                rs.REPORT_TYPE_UNKNOWN,
+                {"date": "01.10.2022", "views": "1", "campaign_id": "101"},
+            ),
+        )
+
+    def test_report_lines(self):
+        batches = list(rs.iter_report_batches(report_chunks(5), batch_rows=1))
+        self.assertEqual(
+            batches,
+            [
+                (
+                    rs.REPORT_TYPE_SKU,
+                    [
+                        {
+                            "campaign_id": 101,
+                            "dt": date(2022, 10, 1),
+                            "sku": 1001,
+                            "page": "Поиск",
+                            "condition": "Трафареты",
+                            "price": Decimal("1234.50"),
+                            "views": 15,
+                            "clicks": 2,
+                            "expense": Decimal("12.34"),
+                            "orders": 1,
+                            "revenue": Decimal("1234.50"),
+                        }
+                    ],
+                ),
+                (
+                    rs.REPORT_TYPE_SEARCH_PROMO,
+                    [
+                        {
+                            "campaign_id": 101,
+                            "dt": date(2022, 10, 2),
+                            "order_id": "55",
+                            "order_number": "0123-0001",
+                            "sale_product_sku": 1001,
+                            "price": Decimal("999.9"),
+                            "count": 2,
+                            "rate_amount": Decimal("10"),
+                        }
+                    ],
+                ),
+            ],
+        )
+
+
+def api_response(
+    status,
+    content=b"",
+    url="https://api-performance.ozon.ru/x",
+    content_type="application/json",
+):
+    response = requests.Response()
+    response.status_code = status
+    response.raw = io.BytesIO(content)
+    response.url = url
+    response.headers["Content-Type"] = content_type
+    return response
+
+
+class ReportDownloadTest(SimpleTestCase):
+    apikey = mock.Mock(pk=999001, client_id="999001-perf", client_secret="s")
+
+    def setUp(self):
+        cache.delete(rs.token_cache_key(self.apikey))
+
+    def tearDown(self):
+        cache.delete(rs.token_cache_key(self.apikey))
+
+    def token(self, token="t1"):
+        return api_response(
+            200, json.dumps({"access_token": token, "expires_in": 1800}).encode()
+        )
+
+    def test_errors(self):
+        for status, error in [
+            (429, rs.ErrorRateLimit),
+            (423, rs.ErrorLocked),
+            (500, rs.ErrorRequest),
+        ]:
+            with self.assertRaises(error):
+                rs.check_response(api_response(status), "uuid")
+        with self.assertRaises(rs.ErrorReportNotFound):
+            rs.check_response(api_response(404), "uuid")
+        rs.check_response(api_response(200), "uuid")
+
+    def test_download(self):
+        body = json.dumps(REPORT).encode()
+        with mock.patch.object(rs.requests, "post") as post, mock.patch.object(
+            rs.requests, "get"
+        ) as get:
+            post.side_effect = [self.token("t1"), self.token("t2")]
+            get.side_effect = [
+                api_response(200, body),
+                api_response(401),
+                api_response(200, body),
+                api_response(429),
+            ]
+            for _ in range(2):
+                with rs.report_download(self.apikey, "uuid") as (content_type, chunks):
+                    self.assertEqual(content_type, "application/json")
+                    self.assertEqual(b"".join(chunks), body)
+            with self.assertRaises(rs.ErrorRateLimit):
+                with rs.report_download(self.apikey, "uuid"):
+                    pass
+
+        # токен из кеша, после 401 получен новый
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(
+            [c.kwargs["headers"]["Authorization"] for c in get.call_args_list],
+            ["Bearer t1", "Bearer t1", "Bearer t2", "Bearer t2"],
+        )
+
+
+def report_request(campaigns, date_from, date_to, created_at=None):
+    conditions = {
+        "params": {
+            "campaigns": [str(c) for c in campaigns],
+            "dateFrom": str(date_from),
+            "dateTo": str(date_to),
+        }
+    }
+    return SimpleNamespace(conditions=json.dumps(conditions), created_at=created_at)
+
+
+class ReportPlannerTest(SimpleTestCase):
+    def days(self, first, last):
+        return {date(2022, 10, d) for d in range(first, last + 1)}
+
+    def check_plan(self, cells, plan, limit_campaigns, limit_days):
+        covered = set()
+        for ids, date_from, date_to in plan:
+            self.assertLessEqual(len(ids), limit_campaigns)
+            self.assertLessEqual((date_to - date_from).days, limit_days)
+            covered |= {
+                (c, d)
+                for c in ids
+                for d in cells.get(c, ())
+                if date_from <= d <= date_to
+            }
+        self.assertEqual(covered, {(c, d) for c, ds in cells.items() for d in ds})
+
+    def test_plan_windows(self):
+        cells = {
+            1: self.days(1, 20),
+            2: self.days(18, 20),
+            3: {date(2022, 10, 2)},
+        }
+        plan = plan_reports(cells, limit_campaigns=10, limit_days=9)
+        self.check_plan(cells, plan, 10, 9)
+        # 20 дней - два окна по 10 дней, от новых к старым
+        self.assertEqual(
+            plan,
+            [
+                ([1, 2], date(2022, 10, 11), date(2022, 10, 20)),
+                ([1, 3], date(2022, 10, 1), date(2022, 10, 10)),
+            ],
+        )
+
+    def test_plan_campaign_limit(self):
+        cells = {c: self.days(c % 5 + 1, c % 5 + 3) for c in range(1, 12)}
+        plan = plan_reports(cells, limit_campaigns=4, limit_days=30)
+        self.check_plan(cells, plan, 4, 30)
+        self.assertEqual(len(plan), 3)
+        # период запроса сужен до дней кампаний запроса
+        for ids, date_from, date_to in plan:
+            self.assertEqual(date_from, min(min(cells[c]) for c in ids))
+            self.assertEqual(date_to, max(max(cells[c]) for c in ids))
+        self.assertEqual(plan_reports({}, 4, 30), [])
+
+    def test_remove_queued(self):
+        self.assertEqual(
+            report_cells(
+                report_request([7], date(2022, 10, 1), date(2022, 10, 2)).conditions
+            ),
+            [(7, date(2022, 10, 1)), (7, date(2022, 10, 2))],
+        )
+        self.assertEqual(report_cells(None), [])
+        cells = {1: self.days(1, 5), 2: self.days(1, 2), 3: self.days(1, 1)}
+        queued = [
+            report_request([1, 2], date(2022, 10, 1), date(2022, 10, 3)),
+            report_request([9], date(2022, 10, 1), date(2022, 10, 5)),
+        ]
+        self.assertEqual(
+            remove_queued(cells, queued), {1: self.days(4, 5), 3: self.days(1, 1)}
+        )
+
+
+class LoadedCellsTest(TestCase):
+    def test_save_loaded_cells(self):
+        shop = Shop.objects.create(shop_token="ozon", name="test")
+        created = datetime(2022, 10, 5, tzinfo=timezone.utc)
+        for created_at in [created, created - timedelta(days=1)]:
+            save_loaded_cells(
+                shop,
+                report_request(
+                    [1, 2], date(2022, 10, 1), date(2022, 10, 2), created_at
+                ),
+            )
+        # более старый отчет не сдвигает время загрузки назад
+        self.assertEqual(
+            sorted(
+                CampaignReportDay.objects.filter(shop=shop).values_list(
+                    "campaign_id", "date", "loaded_at"
+                )
+            ),
+            [(c, date(2022, 10, d), created) for c in (1, 2) for d in (1, 2)],
+        )
+
+
+class PushMetricsTest(SimpleTestCase):
+    def test_push(self):
+        if metrics.prometheus_client is None:
+            self.skipTest("prometheus_client не установлен")
+        push = mock.patch.object(metrics.prometheus_client, "push_to_gateway")
+        with push as push_to_gateway, mock.patch.dict(
+            "os.environ", {"DYNO": "worker.1"}
+        ):
+            metrics.push_metrics()
+            push_to_gateway.assert_not_called()
+
+            with override_settings(PROMETHEUS_PUSHGATEWAY="pushgateway:9091"):
+                metrics.push_metrics()
+                push_to_gateway.side_effect = OSError("connection refused")
+                metrics.push_metrics()  # ошибка отправки не прерывает задачу
+
+        args, kwargs = push_to_gateway.call_args
+        self.assertEqual(args, ("pushgateway:9091",))
+        self.assertEqual(kwargs["job"], "celery")
+        self.assertTrue(kwargs["grouping_key"]["instance"].startswith("worker.1"))
+        self.assertEqual(push_to_gateway.call_count, 2)
+
+
+class SampledDebugFilterTest(SimpleTestCase):
+    def test_sampled(self):
+        logger = logging.getLogger("api.helpers.db")
+        record = logger.makeRecord(
+            logger.name, logging.DEBUG, "", 0, "SELECT 1", (), None
+        )
+        sampled = logger.makeRecord(
+            logger.name, logging.DEBUG, "", 0, "SELECT 1", (), None, extra=SAMPLED
+        )
+        info = logger.makeRecord(logger.name, logging.INFO, "", 0, "ok", (), None)
+
+        sample = SampledDebugFilter(rate=0)
+        self.assertFalse(sample.filter(record))
+        # отобрано sample_debug до формирования сообщения - второй раз не отбирается
+        self.assertTrue(sample.filter(sampled))
+        self.assertTrue(sample.filter(info))
+
+
+class ShopStatsTriggersTest(TestCase):
+    def test_check_triggers(self):
+        # таблицы mp_ozon без пакета mp_ozon, откатываются вместе с тестом
+        execute_sql(OZON_SCHEMA)
+        shop = Shop.objects.create(shop_token="ozon", name="stats")
+        execute_sql(
+            "INSERT INTO mp_ozon_product (id, shop_id) VALUES (920001, %(shop_id)s)",
+            {"shop_id": shop.pk},
+        )
+
+        self.assertIn("products", check_shop_stats_triggers())
+        self.assertEqual(check_shop_stats_triggers(), [])
+
+        update_shop_stats(shop, "products")
+        execute_sql(
+            "INSERT INTO mp_ozon_product (id, shop_id) VALUES (920002, %(shop_id)s)",
+            {"shop_id": shop.pk},
+        )
+        self.assertEqual(ShopStats.objects.get(shop=shop).products, 2)
+
+        # TRUNCATE не вызывает триггеры строк - счетчик сбрасывается
+        execute_sql("TRUNCATE mp_ozon_product CASCADE")
+        self.assertIsNone(ShopStats.objects.get(shop=shop).products)
+
+
+class ProductStatisticsTest(TestCase):
+    def state(self):
+        return fetch_raw_sql(
+            """
+            SELECT campaign_id, dt, sku, orders, revenue
+            FROM mp_ozon_statisticscampaignproduct
+            ORDER BY campaign_id, dt, sku
+            """,
+            as_dict=False,
+        )
+
+    def test_campaign_day(self):
+        # таблицы mp_ozon без пакета mp_ozon, откатываются вместе с тестом
+        execute_sql(OZON_SCHEMA)
+        day1, day2 = date(2022, 10, 1), date(2022, 10, 2)
+        execute_sql(
+            """
+            INSERT INTO mp_ozon_statisticscampaignorder
+                (campaign_id, dt, order_id, sale_product_sku, price, count, rate_amount)
+            VALUES (1, %(day1)s, 'a', 101, 100, 1, 5),
+                   (1, %(day1)s, 'b', 101, 200, 2, 5),
+                   (1, %(day2)s, 'c', 101, 100, 1, 5),
+                   (2, %(day1)s, 'd', 101, 100, 3, 5);
+            """,
+            {"day1": day1, "day2": day2},
+        )
+        update_product_statistics({(1, day1), (1, day2), (2, day1)})
+        before = self.state()
+        self.assertEqual(
+            before,
+            [
+                (1, day1, 101, 3, Decimal("500.0000")),
+                (1, day2, 101, 1, Decimal("100.0000")),
+                (2, day1, 101, 3, Decimal("300.0000")),
+            ],
+        )
+
+        # новые заказы во всех днях, пересчитывается только (1, day1)
+        execute_sql("UPDATE mp_ozon_statisticscampaignorder SET count = count + 1")
+        update_product_statistics({(1, day1)})
+        after = self.state()
+        self.assertEqual(after[0], (1, day1, 101, 5, Decimal("800.0000")))
+        self.assertEqual(after[1:], before[1:])
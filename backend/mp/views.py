@@ -1,17 +1,11 @@
+from django.conf import settings
 from django.views import View
 from django.shortcuts import render, redirect, reverse, HttpResponseRedirect
 from django.contrib import messages
 
 from .models import Shop, APIKey, Selfbuy
 from .forms import ShopForm, APIKeyForm, SelfbuyForm
-from .tasks import (
-    create_campaign_report,
-    update_stocks,
-    update_analytics,
-    update_campaign_statistics,
-    update_orders,
-    update_transactions,
-)
+from . import tasks
 
 TITLES = {
     "shop": {
@@ -209,36 +203,32 @@ class APIKeyFormView(View):
                     extra_tags="success",
                 )
                 if apikey.type == "ozon":
-                    update_stocks.delay(apikey_id=apikey.pk, shop_id=apikey.shop_id)
-                    update_analytics.s(
-                        apikey_id=apikey.pk, days=180, shop_id=apikey.shop_id
-                    ).apply_async(
-                        countdown=60
-                    )  # через минуту
-
-                    update_transactions.s(
-                        apikey_id=apikey.pk, days=180, shop_id=apikey.shop_id
-                    ).apply_async(
-                        countdown=120
-                    )  # через две минуты
-
-                    update_orders.s(
-                        apikey_id=apikey.pk, days=180, shop_id=apikey.shop_id
-                    ).apply_async(
-                        countdown=180
-                    )  # через три минуты
+                    tasks.update_stocks.delay(
+                        apikey_id=apikey.pk, shop_id=apikey.shop_id
+                    )
+                    # история за 180 дней по периодам в очереди backfill,
+                    # не задерживая обновления других магазинов
+                    tasks.start_backfill(
+                        apikey, "update_analytics", days=180, countdown=60
+                    )
+                    tasks.start_backfill(
+                        apikey, "update_transactions", days=180, countdown=120
+                    )
+                    tasks.start_backfill(
+                        apikey, "update_orders", days=180, countdown=180
+                    )
 
                 elif apikey.type == "performance":
-                    update_campaign_statistics.s(
+                    tasks.update_campaign_statistics.s(
                         apikey_id=apikey.pk, days=180, shop_id=apikey.shop_id
                     ).apply_async(
-                        countdown=60
+                        queue=settings.CELERY_BACKFILL_QUEUE, countdown=60
                     )  # через 1 минуты обновляем кампании
 
-                    create_campaign_report.s(
+                    tasks.create_campaign_report.s(
                         apikey_id=apikey.pk, days=60, shop_id=apikey.shop_id
                     ).apply_async(
-                        countdown=120
+                        queue=settings.CELERY_BACKFILL_QUEUE, countdown=120
                     )  # через 2 минуты создаем отчеты
 
             return HttpResponseRedirect(reverse("apikeys"))
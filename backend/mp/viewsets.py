@@ -1,7 +1,10 @@
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import filters, status, viewsets
 from rest_framework.response import Response
 
+from .helpers import read_selfbuy_orders, import_selfbuys, ErrorSelfbuyImport
 from .models import Shop, APIKey, Selfbuy
 from .serlializers import ShopSerializer, SelfbuySerializer, APIKeySerializer
 
@@ -84,3 +87,39 @@ class SelfbuyViewSet(viewsets.ModelViewSet):
         serializer.save()
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="import",
+        parser_classes=[MultiPartParser],
+    )
+    def import_file(self, request, *args, **kwargs):
+        """Загрузка самовыкупов из файла CSV/XLSX
+
+        Параметры POST:
+        * shop - ID магазина
+        * file - файл с номерами заказов или отправлений в первой колонке
+        """
+        shops = Shop.objects.all()
+        if not request.user.is_superuser:
+            shops = shops.filter(user=request.user)
+        try:
+            shop = shops.get(id=request.data.get("shop"))
+        except (Shop.DoesNotExist, ValueError):
+            return Response(
+                {"Error": "Shop not found."}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        file = request.FILES.get("file")
+        if file is None:
+            return Response(
+                {"Error": "File not found."}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            orders = read_selfbuy_orders(file, file.name)
+        except (ErrorSelfbuyImport, UnicodeDecodeError) as ex:
+            return Response({"Error": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(import_selfbuys(shop, orders), status=status.HTTP_201_CREATED)